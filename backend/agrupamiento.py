@@ -0,0 +1,79 @@
+"""
+Agrupamiento (clusters) de clientes del mapa por zoom.
+
+Grilla fija en píxeles Web Mercator: a cada zoom, cada tesela de 256 px se divide en celdas de
+RADIO_CLUSTER_PX y los clientes de una misma celda forman un cluster con su cantidad, ventas,
+desglose por estado, centroide y bbox. La grilla está alineada con las teselas, así que los
+clusters de /mapa/rutas y de /tiles/{z}/{x}/{y}.mvt coinciden y un cluster nunca queda partido
+entre dos teselas.
+
+Por debajo de MAPA_ZOOM_CLIENTES se devuelven clusters; desde ese zoom, clientes individuales.
+
+Variables de entorno:
+- MAPA_ZOOM_CLIENTES: primer zoom con clientes individuales (por defecto 13)
+- MAPA_RADIO_CLUSTER_PX: lado de la celda en píxeles de una tesela de 256 (por defecto 64)
+"""
+
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from teselas_mvt import latitud_a_tesela, longitud_a_tesela
+
+ZOOM_CLIENTES = int(os.getenv("MAPA_ZOOM_CLIENTES", "13"))
+RADIO_CLUSTER_PX = int(os.getenv("MAPA_RADIO_CLUSTER_PX", "64"))
+TAMANO_TESELA_PX = 256
+
+# (longitud, latitud, estado, ventas, cliente_id)
+PuntoCliente = Tuple[float, float, str, float, Any]
+
+
+def agrupa_en_zoom(zoom: Optional[int]) -> bool:
+    """True si a este zoom se devuelven clusters en lugar de clientes individuales"""
+    return zoom is not None and zoom < ZOOM_CLIENTES
+
+
+def celda(lng: float, lat: float, zoom: int) -> Tuple[int, int]:
+    """Celda de la grilla global del zoom que contiene el punto"""
+    n = 2 ** zoom
+    escala = TAMANO_TESELA_PX / RADIO_CLUSTER_PX
+    return int(longitud_a_tesela(lng, n) * escala), int(latitud_a_tesela(lat, n) * escala)
+
+
+def agrupar_clientes(puntos: Iterable[PuntoCliente], zoom: int) -> List[Dict[str, Any]]:
+    """Clusters de los puntos en la grilla del zoom, ordenados por celda:
+    {id, longitud, latitud (centroide), cantidad, ventas, estados {estado: cantidad}, bbox,
+    cliente_id (sólo si el cluster tiene un único cliente)}"""
+    celdas: Dict[Tuple[int, int], Dict[str, Any]] = {}
+    for lng, lat, estado, ventas, cliente_id in puntos:
+        clave = celda(lng, lat, zoom)
+        grupo = celdas.get(clave)
+        if grupo is None:
+            grupo = celdas[clave] = {
+                "suma_lng": 0.0, "suma_lat": 0.0, "cantidad": 0, "ventas": 0.0, "estados": {},
+                "bbox": [lng, lat, lng, lat], "cliente_id": cliente_id
+            }
+        grupo["suma_lng"] += lng
+        grupo["suma_lat"] += lat
+        grupo["cantidad"] += 1
+        grupo["ventas"] += ventas
+        grupo["estados"][estado] = grupo["estados"].get(estado, 0) + 1
+        bbox = grupo["bbox"]
+        bbox[0], bbox[1] = min(bbox[0], lng), min(bbox[1], lat)
+        bbox[2], bbox[3] = max(bbox[2], lng), max(bbox[3], lat)
+
+    clusters = []
+    for (cx, cy), grupo in sorted(celdas.items()):
+        cantidad = grupo["cantidad"]
+        cluster = {
+            "id": f"{zoom}/{cx}/{cy}",
+            "longitud": round(grupo["suma_lng"] / cantidad, 6),
+            "latitud": round(grupo["suma_lat"] / cantidad, 6),
+            "cantidad": cantidad,
+            "ventas": round(grupo["ventas"], 2),
+            "estados": grupo["estados"],
+            "bbox": [round(v, 6) for v in grupo["bbox"]]
+        }
+        if cantidad == 1:
+            cluster["cliente_id"] = grupo["cliente_id"]
+        clusters.append(cluster)
+    return clusters
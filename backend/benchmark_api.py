@@ -0,0 +1,222 @@
+"""
+Benchmark de carga de la API: latencias p50/p95/p99 y throughput por endpoint y concurrencia.
+
+Corre contra una API levantada (uvicorn main:app), normalmente sobre una base llenada con
+generar_datos.py. Cada escenario se ejecuta con cada nivel de concurrencia: N hilos, cada uno con
+su propia conexión HTTP keep-alive, pidiendo las URLs del escenario durante --duracion segundos
+(después de --calentamiento segundos que no se miden). Se cuentan todos los requests iniciados
+dentro de la ventana y el throughput usa el tiempo real hasta que termina el último.
+
+Escenarios:
+- /mapa/rutas para cada período (dia, semana, mes, año), compacto y completo
+- /ventas_por_zona_comparar (dia, semana, mes)
+- /route_detail/{id}/ventas rotando entre route_detail reales (tomados de /mapa/rutas)
+- /vendedores/ultima_ubicacion
+
+/mapa/rutas tiene cache de respuestas: con --limpiar-cache se vacía entre el calentamiento y la
+medición (la primera respuesta medida es MISS y el resto HIT). El reporte incluye el % de HIT
+(header X-Cache).
+
+Uso (desde backend/):
+    python benchmark_api.py --url http://localhost:8000 --concurrencia 1,8,32 --duracion 15
+    python benchmark_api.py --solo mapa --concurrencia 4 --guardar resultados.json
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import math
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlsplit
+
+
+def percentil(ordenados: List[float], p: float) -> float:
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    if not ordenados:
+        return 0.0
+    indice = max(0, min(len(ordenados) - 1, math.ceil(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+class Cliente:
+    """Conexión HTTP keep-alive de un hilo; se reabre si el servidor la cierra"""
+
+    def __init__(self, base: str, timeout: float):
+        partes = urlsplit(base)
+        self.host = partes.hostname
+        self.port = partes.port or (443 if partes.scheme == "https" else 80)
+        self.https = partes.scheme == "https"
+        self.prefijo = partes.path.rstrip("/")
+        self.timeout = timeout
+        self._conexion = None
+
+    def _conectar(self):
+        clase = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+        self._conexion = clase(self.host, self.port, timeout=self.timeout)
+
+    def pedir(self, metodo: str, ruta: str) -> Tuple[int, bytes, Dict[str, str]]:
+        for intento in range(2):
+            if self._conexion is None:
+                self._conectar()
+            try:
+                self._conexion.request(metodo, self.prefijo + ruta, headers={"Accept-Encoding": "identity"})
+                respuesta = self._conexion.getresponse()
+                cuerpo = respuesta.read()
+                return respuesta.status, cuerpo, {k.lower(): v for k, v in respuesta.getheaders()}
+            except (http.client.HTTPException, ConnectionError):
+                self.cerrar()
+                if intento:
+                    raise
+        raise RuntimeError("inalcanzable")
+
+    def cerrar(self):
+        if self._conexion is not None:
+            self._conexion.close()
+            self._conexion = None
+
+
+def escenarios(cliente: Cliente, solo: Optional[str]) -> List[Tuple[str, List[str]]]:
+    """(nombre, urls que se piden rotando) de cada escenario"""
+    lista: List[Tuple[str, List[str]]] = []
+    for periodo in ("dia", "semana", "mes", "año"):
+        for compact in (False, True):
+            lista.append((f"mapa_rutas {periodo}{' compact' if compact else ''}",
+                          [f"/mapa/rutas?periodo={quote(periodo)}{'&compact=true' if compact else ''}"]))
+    for periodo in ("dia", "semana", "mes"):
+        lista.append((f"ventas_por_zona_comparar {periodo}", [f"/ventas_por_zona_comparar?periodo={quote(periodo)}"]))
+
+    # route_detail reales: los visitados de la última semana
+    estado, cuerpo, _ = cliente.pedir("GET", "/mapa/rutas?periodo=semana")
+    rd_ids: List[int] = []
+    if estado == 200:
+        for ruta in json.loads(cuerpo).get("rutas", []):
+            # cliente_id es el route_detail_id en la respuesta de /mapa/rutas
+            rd_ids.extend(c["cliente_id"] for c in ruta.get("clientes", []) if c.get("visitado") and c.get("cliente_id"))
+    if rd_ids:
+        paso = max(1, len(rd_ids) // 500)
+        lista.append(("route_detail_ventas", [f"/route_detail/{i}/ventas" for i in rd_ids[::paso][:500]]))
+    else:
+        print("⚠️ Sin route_detail en la última semana: se omite /route_detail/{id}/ventas")
+    lista.append(("vendedores_ultima_ubicacion", ["/vendedores/ultima_ubicacion"]))
+
+    if solo:
+        lista = [e for e in lista if solo in e[0]]
+    return lista
+
+
+def _ejecutar(base: str, urls: List[str], concurrencia: int, segundos: float, timeout: float) -> Dict[str, Any]:
+    """N hilos pidiendo las urls en rotación; cuenta todos los requests iniciados antes de `segundos`"""
+    latencias: List[float] = []
+    totales = {"bytes": 0, "errores": 0, "hits": 0}
+    lock = threading.Lock()
+    contador = itertools.count()
+    inicio = time.perf_counter()
+    fin = inicio + segundos
+
+    def trabajador():
+        cliente = Cliente(base, timeout)
+        propias: List[float] = []
+        parciales = {"bytes": 0, "errores": 0, "hits": 0}
+        try:
+            while time.perf_counter() < fin:
+                url = urls[next(contador) % len(urls)]
+                t0 = time.perf_counter()
+                try:
+                    estado, cuerpo, headers = cliente.pedir("GET", url)
+                    ok = estado < 400
+                except Exception:
+                    ok, cuerpo, headers = False, b"", {}
+                if ok:
+                    propias.append((time.perf_counter() - t0) * 1000)
+                    parciales["bytes"] += len(cuerpo)
+                    parciales["hits"] += headers.get("x-cache") == "HIT"
+                else:
+                    parciales["errores"] += 1
+        finally:
+            cliente.cerrar()
+            with lock:
+                latencias.extend(propias)
+                for clave, valor in parciales.items():
+                    totales[clave] += valor
+
+    hilos = [threading.Thread(target=trabajador, daemon=True) for _ in range(concurrencia)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    # Los requests lentos pueden terminar después de `fin`: el throughput usa el tiempo real
+    return dict(totales, latencias=sorted(latencias), segundos=time.perf_counter() - inicio)
+
+
+def medir(base: str, urls: List[str], concurrencia: int, duracion: float, calentamiento: float,
+          timeout: float, antes_de_medir=None) -> Dict[str, Any]:
+    """Calentamiento (descartado), `antes_de_medir()` (p. ej. vaciar el cache) y medición"""
+    if calentamiento > 0:
+        _ejecutar(base, urls, concurrencia, calentamiento, timeout)
+    if antes_de_medir is not None:
+        antes_de_medir()
+    r = _ejecutar(base, urls, concurrencia, duracion, timeout)
+    latencias = r["latencias"]
+    cantidad = len(latencias)
+    return {
+        "concurrencia": concurrencia,
+        "requests": cantidad,
+        "errores": r["errores"],
+        "segundos": round(r["segundos"], 2),
+        "throughput_rps": round(cantidad / r["segundos"], 2),
+        "p50_ms": round(percentil(latencias, 50), 2),
+        "p95_ms": round(percentil(latencias, 95), 2),
+        "p99_ms": round(percentil(latencias, 99), 2),
+        "max_ms": round(latencias[-1], 2) if latencias else 0.0,
+        "bytes_promedio": int(r["bytes"] / cantidad) if cantidad else 0,
+        "cache_hit_pct": round(100 * r["hits"] / cantidad, 1) if cantidad else 0.0
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de carga de la API de rutas")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrencia", default="1,8,32", help="Niveles separados por coma")
+    parser.add_argument("--duracion", type=float, default=15.0, help="Segundos medidos por escenario y nivel")
+    parser.add_argument("--calentamiento", type=float, default=2.0, help="Segundos iniciales que no se miden")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--solo", help="Sólo escenarios cuyo nombre contiene este texto")
+    parser.add_argument("--limpiar-cache", action="store_true", help="DELETE /cache/mapa antes de cada medición")
+    parser.add_argument("--guardar", help="Archivo JSON con los resultados")
+    args = parser.parse_args()
+
+    niveles = [int(n) for n in args.concurrencia.split(",") if n.strip()]
+    control = Cliente(args.url, args.timeout)
+    try:
+        lista = escenarios(control, args.solo)
+    except (OSError, http.client.HTTPException) as e:
+        print(f"❌ No se pudo conectar a {args.url}: {e}")
+        return 1
+
+    resultados = []
+    print(f"{'escenario':<34} {'conc':>4} {'req':>7} {'err':>4} {'req/s':>8} {'p50':>9} {'p95':>9} {'p99':>9} {'KB':>8} {'hit%':>5}")
+    for nombre, urls in lista:
+        for concurrencia in niveles:
+            vaciar = (lambda: control.pedir("DELETE", "/cache/mapa")) if args.limpiar_cache else None
+            r = medir(args.url, urls, concurrencia, args.duracion, args.calentamiento, args.timeout, vaciar)
+            r["escenario"] = nombre
+            resultados.append(r)
+            print(f"{nombre:<34} {concurrencia:>4} {r['requests']:>7} {r['errores']:>4} {r['throughput_rps']:>8.1f} "
+                  f"{r['p50_ms']:>7.1f}ms {r['p95_ms']:>7.1f}ms {r['p99_ms']:>7.1f}ms "
+                  f"{r['bytes_promedio'] / 1024:>8.1f} {r['cache_hit_pct']:>5.1f}")
+    control.cerrar()
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as archivo:
+            json.dump({"url": args.url, "duracion": args.duracion, "resultados": resultados}, archivo,
+                      ensure_ascii=False, indent=1)
+        print(f"💾 Resultados guardados en {args.guardar}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,178 @@
+"""
+Benchmark de serialización JSON de una respuesta tipo /mapa/rutas.
+
+Arma en memoria un payload con la forma de la respuesta completa (rutas con clientes,
+event_begin/event_end con datetime, secuencia_pasos, ruta_linea, KPIs con Decimal y date) y
+mide, para el mismo payload:
+- stdlib: jsonable_encoder + json.dumps (lo que hace el JSONResponse por defecto de FastAPI)
+- rapido: serializacion.serializar_json (orjson si está instalado)
+
+Verifica que ambos JSON decodifiquen a lo mismo y reporta mediana / mínimo de --repeticiones.
+No necesita base de datos. Determinístico para una misma --semilla.
+
+Uso (desde backend/):
+    python benchmark_serializacion.py --clientes 50000
+    python benchmark_serializacion.py --clientes 50000 --repeticiones 10 --guardar serializacion.json
+"""
+
+import argparse
+import json
+import random
+import statistics
+import sys
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from typing import Any, Callable, Dict, List
+
+from serializacion import serializar_json, serializar_json_stdlib, serializacion_disponible
+
+ESTADOS = ("no_visitado", "visitado_exitoso", "visitado_sin_venta", "visita_no_planificada")
+CLIENTES_POR_RUTA = 40
+
+
+def _evento(fecha: datetime, lat: float, lng: float) -> Dict[str, Any]:
+    return {
+        "event_date": fecha,
+        "latitude": Decimal(f"{lat:.8f}"),
+        "longitude": Decimal(f"{lng:.8f}"),
+        "comments": None,
+        "distance_event_customer": Decimal("12.50")
+    }
+
+
+def generar_payload(clientes: int, semilla: int) -> Dict[str, Any]:
+    """Respuesta de /mapa/rutas (sin compact) con `clientes` clientes en rutas de CLIENTES_POR_RUTA"""
+    azar = random.Random(semilla)
+    rutas: List[Dict[str, Any]] = []
+    dia_base = date(2025, 9, 1)
+    for route_id in range(1, clientes // CLIENTES_POR_RUTA + 2):
+        cantidad = min(CLIENTES_POR_RUTA, clientes - (route_id - 1) * CLIENTES_POR_RUTA)
+        if cantidad <= 0:
+            break
+        dia = dia_base + timedelta(days=route_id % 30)
+        inicio = datetime(dia.year, dia.month, dia.day, 8, 0)
+        lat0, lng0 = azar.uniform(-26.5, -22.5), azar.uniform(-58.0, -54.8)
+        lista_clientes, pasos = [], []
+        for i in range(cantidad):
+            lat, lng = lat0 + azar.uniform(-0.05, 0.05), lng0 + azar.uniform(-0.05, 0.05)
+            visitado = azar.random() < 0.7
+            ventas = round(azar.uniform(0, 900000), 2) if visitado else 0.0
+            cliente = {
+                "cliente_id": route_id * 100 + i,
+                "codigo": f"C{route_id:05d}-{i:03d}",
+                "nombre": f"Cliente {route_id:05d}-{i:03d}",
+                "latitud": lat,
+                "longitud": lng,
+                "sequence": i + 1,
+                "visit_sequence": i + 1 if visitado else None,
+                "visitado": visitado,
+                "planificado": True,
+                "visita_positiva": ventas > 0,
+                "ventas": ventas,
+                "pedidos": ventas,
+                "recibos": 0.0,
+                "estado": ESTADOS[1 if ventas > 0 else 2] if visitado else ESTADOS[0],
+                "kpis": {
+                    "venta_promedio": Decimal(f"{azar.uniform(0, 500000):.2f}"),
+                    "ultima_compra": dia - timedelta(days=azar.randint(1, 60)),
+                    "frecuencia_dias": azar.randint(1, 30),
+                    "tendencia": "estable"
+                } if visitado else {}
+            }
+            if visitado:
+                llegada = inicio + timedelta(minutes=15 * i)
+                cliente["event_begin"] = _evento(llegada, lat, lng)
+                cliente["event_end"] = _evento(llegada + timedelta(minutes=9), lat, lng)
+                pasos.append({
+                    "paso_numero": len(pasos) + 1,
+                    "cliente_id": cliente["cliente_id"],
+                    "codigo": cliente["codigo"],
+                    "nombre": cliente["nombre"],
+                    "coordenadas": [lng, lat],
+                    "event_begin": cliente["event_begin"],
+                    "event_end": cliente["event_end"],
+                    "visit_sequence": i + 1,
+                    "ventas": ventas,
+                    "pedidos": ventas,
+                    "recibos": 0.0,
+                    "estado": cliente["estado"],
+                    "es_planificado": True,
+                    "distancia_desde_anterior": round(azar.uniform(0, 3), 2),
+                    "tiempo_estimado_minutos": azar.randint(5, 20)
+                })
+            lista_clientes.append(cliente)
+        rutas.append({
+            "route_id": route_id,
+            "vendedor_id": route_id % 100 + 1,
+            "vendedor": f"Vendedor {route_id % 100 + 1:03d}",
+            "fecha": dia,
+            "zona_code": f"Z{route_id % 40:02d}",
+            "clientes": lista_clientes,
+            "ruta_linea": [p["coordenadas"] for p in pasos],
+            "secuencia_pasos": pasos,
+            "total_puntos_ruta": cantidad,
+            "clientes_visitados_validos": len(pasos),
+            "distancia_total_estimada": round(sum(p["distancia_desde_anterior"] for p in pasos), 2),
+            "tiempo_total_estimado": sum(p["tiempo_estimado_minutos"] for p in pasos)
+        })
+    return {
+        "rutas": rutas,
+        "zonas": [],
+        "estadisticas_mapa": {"total_rutas": len(rutas), "total_clientes": clientes}
+    }
+
+
+def medir(funcion: Callable[[Any], bytes], payload: Any, repeticiones: int) -> Dict[str, Any]:
+    tiempos = []
+    contenido = b""
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        contenido = funcion(payload)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    return {
+        "mediana_ms": round(statistics.median(tiempos), 1),
+        "minimo_ms": round(min(tiempos), 1),
+        "bytes": len(contenido),
+        "contenido": contenido
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark de serialización JSON de /mapa/rutas")
+    parser.add_argument("--clientes", type=int, default=50000)
+    parser.add_argument("--repeticiones", type=int, default=5)
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--guardar", help="Archivo JSON con los resultados")
+    args = parser.parse_args()
+
+    print(f"🧪 Generando payload con {args.clientes} clientes...")
+    payload = generar_payload(args.clientes, args.semilla)
+    print(f"🔧 Serializador rápido: {serializacion_disponible()}")
+
+    stdlib = medir(serializar_json_stdlib, payload, args.repeticiones)
+    rapido = medir(serializar_json, payload, args.repeticiones)
+    if json.loads(stdlib.pop("contenido")) != json.loads(rapido.pop("contenido")):
+        print("❌ Los dos serializadores no producen el mismo JSON")
+        return 1
+
+    ahorro = stdlib["mediana_ms"] - rapido["mediana_ms"]
+    factor = stdlib["mediana_ms"] / rapido["mediana_ms"] if rapido["mediana_ms"] else 0.0
+    print(f"{'serializador':<14} {'mediana':>10} {'mínimo':>10} {'MB':>8}")
+    for nombre, r in (("stdlib", stdlib), ("rapido", rapido)):
+        print(f"{nombre:<14} {r['mediana_ms']:>8.1f}ms {r['minimo_ms']:>8.1f}ms {r['bytes'] / 1024 / 1024:>8.2f}")
+    print(f"✅ Ahorro por respuesta: {ahorro:.1f} ms ({factor:.1f}x)")
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as archivo:
+            json.dump({
+                "clientes": args.clientes, "repeticiones": args.repeticiones,
+                "serializador": serializacion_disponible(), "stdlib": stdlib, "rapido": rapido,
+                "ahorro_ms": round(ahorro, 1), "factor": round(factor, 2)
+            }, archivo, ensure_ascii=False, indent=1)
+        print(f"💾 Resultados guardados en {args.guardar}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
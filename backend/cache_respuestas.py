@@ -0,0 +1,230 @@
+"""
+Cache de respuestas ya serializadas (bytes) para endpoints pesados como /mapa/rutas y las
+teselas vectoriales de /tiles/{z}/{x}/{y}.mvt.
+
+- Backend en memoria con LRU acotado por cantidad de entradas y por bytes totales.
+- Backend Redis opcional (CACHE_REDIS_URL), compartido entre procesos/réplicas.
+  Si el paquete `redis` no está instalado o Redis no responde, se usa la memoria.
+- Métricas de hits/misses/evictions para evaluar el tamaño y los TTL.
+
+Variables de entorno:
+- CACHE_MAPA_MAX_ENTRADAS (por defecto 256)
+- CACHE_MAPA_MAX_MB (por defecto 256)
+- CACHE_MAPA_TTL_HISTORICO: segundos para rangos que terminan antes de hoy (por defecto 43200)
+- CACHE_MAPA_TTL_ACTUAL: segundos para rangos que incluyen hoy (por defecto 60)
+- CACHE_TESELAS_MAX_ENTRADAS (por defecto 4096), CACHE_TESELAS_MAX_MB (por defecto 128):
+  las teselas usan los mismos TTL que /mapa/rutas
+- CACHE_REDIS_URL: p. ej. redis://localhost:6379/0 (opcional)
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from registro import obtener_logger
+
+try:
+    import redis.asyncio as redis_async
+except ImportError:  # dependencia opcional
+    redis_async = None
+
+log = obtener_logger("cache")
+
+
+class CacheMemoriaLRU:
+    """LRU en memoria con expiración por entrada, acotado por entradas y por bytes"""
+
+    def __init__(self, max_entradas: int = 256, max_bytes: int = 256 * 1024 * 1024):
+        self.max_entradas = max_entradas
+        self.max_bytes = max_bytes
+        self._datos: "OrderedDict[str, tuple]" = OrderedDict()  # clave -> (expira_en, contenido)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.expiradas = 0
+
+    def obtener(self, clave: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._datos.get(clave)
+            if item is None:
+                return None
+            expira_en, contenido = item
+            if expira_en <= time.monotonic():
+                self._quitar(clave)
+                self.expiradas += 1
+                return None
+            self._datos.move_to_end(clave)
+            return contenido
+
+    def guardar(self, clave: str, contenido: bytes, ttl: float):
+        if len(contenido) > self.max_bytes:
+            return
+        with self._lock:
+            if clave in self._datos:
+                self._quitar(clave)
+            self._datos[clave] = (time.monotonic() + ttl, contenido)
+            self._bytes += len(contenido)
+            while self._datos and (len(self._datos) > self.max_entradas or self._bytes > self.max_bytes):
+                clave_vieja = next(iter(self._datos))
+                self._quitar(clave_vieja)
+                self.evictions += 1
+
+    def _quitar(self, clave: str):
+        _, contenido = self._datos.pop(clave)
+        self._bytes -= len(contenido)
+
+    def limpiar(self, prefijo: str = "") -> int:
+        with self._lock:
+            claves = [c for c in self._datos if c.startswith(prefijo)]
+            for clave in claves:
+                self._quitar(clave)
+            return len(claves)
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entradas": len(self._datos),
+                "bytes": self._bytes,
+                "max_entradas": self.max_entradas,
+                "max_bytes": self.max_bytes,
+                "evictions": self.evictions,
+                "expiradas": self.expiradas
+            }
+
+
+class CacheRespuestas:
+    """Fachada del cache: memoria LRU local + Redis opcional, con métricas y single-flight
+    (requests concurrentes con la misma clave calculan la respuesta una sola vez)"""
+
+    def __init__(self, nombre: str, memoria: CacheMemoriaLRU, redis_url: Optional[str] = None):
+        self.nombre = nombre
+        self.memoria = memoria
+        self._redis = None
+        if redis_url:
+            if redis_async is None:
+                log.warning("CACHE_REDIS_URL definido pero el paquete 'redis' no está instalado; cache '%s' solo en memoria", nombre)
+            else:
+                self._redis = redis_async.from_url(redis_url)
+        self._en_vuelo: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.hits_redis = 0
+        self.errores_redis = 0
+
+    def _clave_redis(self, clave: str) -> str:
+        return f"cache:{self.nombre}:{clave}"
+
+    async def obtener(self, clave: str) -> Optional[bytes]:
+        contenido = self.memoria.obtener(clave)
+        if contenido is not None:
+            self.hits += 1
+            return contenido
+        if self._redis is not None:
+            try:
+                contenido = await self._redis.get(self._clave_redis(clave))
+                if contenido is not None:
+                    ttl = await self._redis.ttl(self._clave_redis(clave))
+                    if ttl and ttl > 0:
+                        self.memoria.guardar(clave, contenido, ttl)
+                    self.hits += 1
+                    self.hits_redis += 1
+                    return contenido
+            except Exception as e:
+                self.errores_redis += 1
+                log.warning("Error leyendo cache Redis '%s': %s", self.nombre, e)
+        self.misses += 1
+        return None
+
+    async def guardar(self, clave: str, contenido: bytes, ttl: float):
+        self.memoria.guardar(clave, contenido, ttl)
+        if self._redis is not None:
+            try:
+                await self._redis.set(self._clave_redis(clave), contenido, ex=max(int(ttl), 1))
+            except Exception as e:
+                self.errores_redis += 1
+                log.warning("Error escribiendo cache Redis '%s': %s", self.nombre, e)
+
+    async def obtener_o_calcular(self, clave: str, ttl: float,
+                                 calcular: Callable[[], Awaitable[bytes]]) -> tuple:
+        """Devuelve (contenido, hit). En un miss ejecuta `calcular` una sola vez por clave
+        aunque lleguen varios requests iguales al mismo tiempo."""
+        contenido = await self.obtener(clave)
+        if contenido is not None:
+            return contenido, True
+
+        en_vuelo = self._en_vuelo.get(clave)
+        if en_vuelo is not None:
+            return await asyncio.shield(en_vuelo), True
+
+        futuro = asyncio.get_running_loop().create_future()
+        self._en_vuelo[clave] = futuro
+        try:
+            contenido = await calcular()
+            await self.guardar(clave, contenido, ttl)
+            futuro.set_result(contenido)
+            return contenido, False
+        except BaseException as e:
+            futuro.set_exception(e)
+            # Evitar el warning de "exception never retrieved" si nadie estaba esperando
+            futuro.exception()
+            raise
+        finally:
+            self._en_vuelo.pop(clave, None)
+
+    async def limpiar(self) -> int:
+        eliminadas = self.memoria.limpiar()
+        if self._redis is not None:
+            try:
+                async for clave in self._redis.scan_iter(match=self._clave_redis("*")):
+                    await self._redis.delete(clave)
+            except Exception as e:
+                self.errores_redis += 1
+                log.warning("Error limpiando cache Redis '%s': %s", self.nombre, e)
+        return eliminadas
+
+    def estadisticas(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "nombre": self.nombre,
+            "backend": "memoria+redis" if self._redis is not None else "memoria",
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "hits_redis": self.hits_redis,
+            "errores_redis": self.errores_redis,
+            "en_vuelo": len(self._en_vuelo),
+            "memoria": self.memoria.estadisticas()
+        }
+
+
+def clave_desde_parametros(parametros: Dict[str, Any]) -> str:
+    """Hash estable de un dict de parámetros ya normalizados"""
+    texto = json.dumps(parametros, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+
+cache_mapa = CacheRespuestas(
+    "mapa_rutas",
+    CacheMemoriaLRU(
+        max_entradas=int(os.getenv("CACHE_MAPA_MAX_ENTRADAS", "256")),
+        max_bytes=int(float(os.getenv("CACHE_MAPA_MAX_MB", "256")) * 1024 * 1024)
+    ),
+    redis_url=os.getenv("CACHE_REDIS_URL")
+)
+
+cache_teselas = CacheRespuestas(
+    "teselas",
+    CacheMemoriaLRU(
+        max_entradas=int(os.getenv("CACHE_TESELAS_MAX_ENTRADAS", "4096")),
+        max_bytes=int(float(os.getenv("CACHE_TESELAS_MAX_MB", "128")) * 1024 * 1024)
+    ),
+    redis_url=os.getenv("CACHE_REDIS_URL")
+)
+
+TTL_MAPA_HISTORICO = float(os.getenv("CACHE_MAPA_TTL_HISTORICO", "43200"))
+TTL_MAPA_ACTUAL = float(os.getenv("CACHE_MAPA_TTL_ACTUAL", "60"))
@@ -0,0 +1,304 @@
+"""
+Compresión de respuestas (gzip / brotli) y validadores ETag para requests condicionales.
+
+- MiddlewareETag: para las rutas indicadas (plantillas como /route_detail/{route_detail_id}/ventas)
+  acumula el cuerpo de las respuestas GET 200, le pone como ETag un hash del contenido y, si el
+  cliente manda un If-None-Match que coincide, responde 304 sin cuerpo. Agrega
+  `Cache-Control: no-cache` para que el navegador revalide siempre en lugar de adivinar una
+  expiración: volver a pedir una vista histórica que no cambió cuesta sólo el 304.
+- MiddlewareCompresion: negocia Accept-Encoding (br si el paquete `brotli` está instalado,
+  si no gzip) y comprime los tipos de texto / JSON / MessagePack / MVT a partir de un tamaño
+  mínimo. Las respuestas en streaming (NDJSON) se comprimen por bloque con flush para que el
+  cliente siga recibiendo las rutas a medida que salen; text/event-stream no se comprime.
+  Con un ETag fuerte el resultado se guarda en un LRU por (codificación, ETag), así la misma
+  vista pedida por otro cliente no se vuelve a comprimir; el ETag pasa a débil (W/) porque la
+  representación comprimida no es idéntica byte a byte. Los 304 de esas rutas llevan el mismo
+  ETag débil y `Vary: Accept-Encoding` que el 200 (MiddlewareETag les deja el Content-Type).
+
+Hash y compresión de cuerpos grandes corren en el threadpool para no frenar el event loop.
+
+Variables de entorno:
+- COMPRESION_MIN_BYTES: tamaño mínimo a comprimir (por defecto 1024)
+- COMPRESION_NIVEL_GZIP (por defecto 6), COMPRESION_CALIDAD_BROTLI (por defecto 4)
+- COMPRESION_CACHE_MB: LRU de respuestas ya comprimidas (por defecto 64, 0 lo desactiva)
+"""
+
+import hashlib
+import os
+import zlib
+from typing import Iterable, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+from cache_respuestas import CacheMemoriaLRU
+
+try:
+    import brotli
+except ImportError:  # dependencia opcional: sin ella sólo gzip
+    brotli = None
+
+COMPRESION_MIN_BYTES = int(os.getenv("COMPRESION_MIN_BYTES", "1024"))
+NIVEL_GZIP = int(os.getenv("COMPRESION_NIVEL_GZIP", "6"))
+CALIDAD_BROTLI = int(os.getenv("COMPRESION_CALIDAD_BROTLI", "4"))
+CACHE_COMPRIMIDOS_MB = float(os.getenv("COMPRESION_CACHE_MB", "64"))
+TTL_COMPRIMIDOS = 3600.0
+# A partir de este tamaño el hash y la compresión van al threadpool
+BYTES_EN_HILO = 256 * 1024
+
+TIPOS_COMPRIMIBLES = (
+    "application/json", "application/x-ndjson", "application/x-msgpack",
+    "application/vnd.mapbox-vector-tile", "application/javascript", "text/"
+)
+TIPOS_NO_COMPRIMIBLES = ("text/event-stream",)
+
+cache_comprimidos = CacheMemoriaLRU(max_entradas=1024, max_bytes=int(CACHE_COMPRIMIDOS_MB * 1024 * 1024))
+
+
+def etag_de(contenido: bytes) -> str:
+    """ETag fuerte: hash del cuerpo de la respuesta"""
+    return '"' + hashlib.blake2b(contenido, digest_size=16).hexdigest() + '"'
+
+
+def coincide_etag(if_none_match: Optional[str], etag: str) -> bool:
+    """Comparación débil de If-None-Match (lista separada por comas, '*' o W/"...")"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    valor = etag[2:] if etag.startswith("W/") else etag
+    for candidato in if_none_match.split(","):
+        candidato = candidato.strip()
+        if candidato.startswith("W/"):
+            candidato = candidato[2:]
+        if candidato == valor:
+            return True
+    return False
+
+
+def elegir_codificacion(accept_encoding: str) -> Optional[str]:
+    """'br', 'gzip' o None según Accept-Encoding (respeta q=0)"""
+    aceptadas = {}
+    for parte in accept_encoding.split(","):
+        nombre, _, parametros = parte.strip().partition(";")
+        calidad = 1.0
+        parametros = parametros.strip()
+        if parametros.startswith("q="):
+            try:
+                calidad = float(parametros[2:])
+            except ValueError:
+                calidad = 0.0
+        if nombre:
+            aceptadas[nombre.strip().lower()] = calidad
+    comodin = aceptadas.get("*", 0.0)
+    if brotli is not None and aceptadas.get("br", comodin) > 0:
+        return "br"
+    if aceptadas.get("gzip", comodin) > 0:
+        return "gzip"
+    return None
+
+
+def comprimir(contenido: bytes, codificacion: str) -> bytes:
+    if codificacion == "br":
+        return brotli.compress(contenido, quality=CALIDAD_BROTLI)
+    compresor = zlib.compressobj(NIVEL_GZIP, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compresor.compress(contenido) + compresor.flush()
+
+
+class _CompresorIncremental:
+    """Compresión por bloques con flush, para respuestas en streaming"""
+
+    def __init__(self, codificacion: str):
+        if codificacion == "br":
+            self._br = brotli.Compressor(quality=CALIDAD_BROTLI)
+        else:
+            self._br = None
+            self._gzip = zlib.compressobj(NIVEL_GZIP, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def bloque(self, datos: bytes) -> bytes:
+        if self._br is not None:
+            return self._br.process(datos) + self._br.flush()
+        return self._gzip.compress(datos) + self._gzip.flush(zlib.Z_SYNC_FLUSH)
+
+    def fin(self) -> bytes:
+        if self._br is not None:
+            return self._br.finish()
+        return self._gzip.flush()
+
+
+def _encabezado(headers: Iterable[Tuple[bytes, bytes]], nombre: bytes) -> Optional[str]:
+    for clave, valor in headers:
+        if clave.lower() == nombre:
+            return valor.decode("latin-1")
+    return None
+
+
+def _sin_encabezados(headers: Iterable[Tuple[bytes, bytes]], nombres: Tuple[bytes, ...]) -> List[Tuple[bytes, bytes]]:
+    return [(clave, valor) for clave, valor in headers if clave.lower() not in nombres]
+
+
+def _etag_debil(headers: List[Tuple[bytes, bytes]]) -> List[Tuple[bytes, bytes]]:
+    etag = _encabezado(headers, b"etag")
+    if etag is None or etag.startswith("W/"):
+        return headers
+    return _sin_encabezados(headers, (b"etag",)) + [(b"etag", ("W/" + etag).encode("latin-1"))]
+
+
+def _agregar_vary(headers: List[Tuple[bytes, bytes]]) -> List[Tuple[bytes, bytes]]:
+    vary = _encabezado(headers, b"vary")
+    if vary is None:
+        return headers + [(b"vary", b"Accept-Encoding")]
+    if "accept-encoding" in vary.lower():
+        return headers
+    return _sin_encabezados(headers, (b"vary",)) + [(b"vary", (vary + ", Accept-Encoding").encode("latin-1"))]
+
+
+async def _en_hilo_si_grande(funcion, contenido: bytes, *args):
+    if len(contenido) >= BYTES_EN_HILO:
+        return await run_in_threadpool(funcion, contenido, *args)
+    return funcion(contenido, *args)
+
+
+class MiddlewareETag:
+    """ETag por hash del contenido + If-None-Match → 304 en las rutas indicadas"""
+
+    def __init__(self, app, rutas: Iterable[str]):
+        self.app = app
+        self.rutas = frozenset(rutas)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("method") not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+
+        inicio = {}
+        partes: List[bytes] = []
+        estado = {"acumulando": False}
+
+        async def send_con_etag(mensaje):
+            if mensaje["type"] == "http.response.start":
+                ruta = scope.get("route")
+                estado["acumulando"] = (
+                    mensaje["status"] == 200
+                    and getattr(ruta, "path", None) in self.rutas
+                    and _encabezado(mensaje.get("headers", []), b"etag") is None
+                )
+                if estado["acumulando"]:
+                    inicio.update(mensaje)
+                    return
+                await send(mensaje)
+                return
+            if not estado["acumulando"]:
+                await send(mensaje)
+                return
+            partes.append(mensaje.get("body", b""))
+            if mensaje.get("more_body", False):
+                return
+
+            contenido = b"".join(partes)
+            etag = await _en_hilo_si_grande(etag_de, contenido)
+            headers = _sin_encabezados(inicio.get("headers", []), (b"cache-control",))
+            headers += [(b"etag", etag.encode("latin-1")), (b"cache-control", b"no-cache")]
+            if_none_match = _encabezado(scope.get("headers", []), b"if-none-match")
+            if coincide_etag(if_none_match, etag):
+                # Content-Type se queda: MiddlewareCompresion lo usa para dar al 304 los headers del 200
+                headers = _sin_encabezados(headers, (b"content-length",))
+                await send({"type": "http.response.start", "status": 304, "headers": headers})
+                await send({"type": "http.response.body", "body": b""})
+                return
+            await send({**inicio, "headers": headers})
+            await send({"type": "http.response.body", "body": contenido})
+
+        await self.app(scope, receive, send_con_etag)
+
+
+class MiddlewareCompresion:
+    """gzip / brotli según Accept-Encoding para respuestas comprimibles de al menos `minimo_bytes`"""
+
+    def __init__(self, app, minimo_bytes: int = COMPRESION_MIN_BYTES):
+        self.app = app
+        self.minimo_bytes = minimo_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        codificacion = elegir_codificacion(_encabezado(scope.get("headers", []), b"accept-encoding") or "")
+        if codificacion is None:
+            await self.app(scope, receive, send)
+            return
+
+        inicio = {}
+        estado = {"modo": None, "compresor": None}  # modo: None (aún sin cuerpo), "pasar", "completo", "stream"
+
+        def comprimible(mensaje) -> bool:
+            """Tipo comprimible sin Content-Encoding; un 304 cuenta si su 200 se habría comprimido"""
+            headers = mensaje.get("headers", [])
+            tipo = (_encabezado(headers, b"content-type") or "").lower()
+            return (
+                mensaje["status"] != 204
+                and _encabezado(headers, b"content-encoding") is None
+                and tipo.startswith(TIPOS_COMPRIMIBLES)
+                and not tipo.startswith(TIPOS_NO_COMPRIMIBLES)
+            )
+
+        def headers_negociados(headers: List[Tuple[bytes, bytes]]) -> List[Tuple[bytes, bytes]]:
+            """ETag débil y Vary: iguales en el 200 (comprimido o no por tamaño) y en el 304"""
+            return _agregar_vary(_etag_debil(list(headers)))
+
+        def headers_comprimidos() -> List[Tuple[bytes, bytes]]:
+            headers = _sin_encabezados(inicio.get("headers", []), (b"content-length",))
+            headers.append((b"content-encoding", codificacion.encode("latin-1")))
+            return headers_negociados(headers)
+
+        async def send_comprimido(mensaje):
+            if mensaje["type"] == "http.response.start":
+                if mensaje["status"] == 304:
+                    estado["modo"] = "pasar"
+                    if comprimible(mensaje):
+                        headers = _sin_encabezados(headers_negociados(mensaje.get("headers", [])), (b"content-type",))
+                        mensaje = {**mensaje, "headers": headers}
+                    await send(mensaje)
+                elif comprimible(mensaje):
+                    inicio.update(mensaje)
+                else:
+                    estado["modo"] = "pasar"
+                    await send(mensaje)
+                return
+            if mensaje["type"] != "http.response.body" or estado["modo"] == "pasar":
+                await send(mensaje)
+                return
+
+            cuerpo = mensaje.get("body", b"")
+            mas = mensaje.get("more_body", False)
+            if estado["modo"] is None:
+                if not mas:
+                    await enviar_completo(cuerpo)
+                    return
+                estado["modo"] = "stream"
+                estado["compresor"] = _CompresorIncremental(codificacion)
+                await send({**inicio, "headers": headers_comprimidos()})
+            compresor = estado["compresor"]
+            datos = compresor.bloque(cuerpo) if cuerpo else b""
+            if not mas:
+                datos += compresor.fin()
+            if datos or not mas:
+                await send({"type": "http.response.body", "body": datos, "more_body": mas})
+
+        async def enviar_completo(cuerpo: bytes):
+            estado["modo"] = "completo"
+            if len(cuerpo) < self.minimo_bytes:
+                await send({**inicio, "headers": headers_negociados(inicio.get("headers", []))})
+                await send({"type": "http.response.body", "body": cuerpo})
+                return
+            etag = _encabezado(inicio.get("headers", []), b"etag")
+            clave = f"{codificacion}:{etag}" if etag and not etag.startswith("W/") else None
+            comprimido = cache_comprimidos.obtener(clave) if clave else None
+            if comprimido is None:
+                comprimido = await _en_hilo_si_grande(comprimir, cuerpo, codificacion)
+                if clave:
+                    cache_comprimidos.guardar(clave, comprimido, TTL_COMPRIMIDOS)
+            headers = headers_comprimidos() + [(b"content-length", str(len(comprimido)).encode("latin-1"))]
+            await send({**inicio, "headers": headers})
+            await send({"type": "http.response.body", "body": comprimido})
+
+        await self.app(scope, receive, send_comprimido)
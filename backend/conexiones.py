@@ -0,0 +1,300 @@
+"""
+Pools de conexiones PostgreSQL compartidos por todo el proceso.
+
+Reemplaza el psycopg2.connect() por request: las conexiones se reutilizan,
+se verifican al entregarlas y se exponen estadísticas de uso para poder
+dimensionar el pool. Hay dos pools que se reparten un mismo tope:
+- PoolConexiones (psycopg2, sincrónico) para endpoints `def` y scripts
+- un AsyncConnectionPool (psycopg 3) para los endpoints `async def`, de modo
+  que las esperas a Postgres no bloqueen hilos del threadpool
+
+Variables de entorno:
+- DB_POOL_MIN: conexiones que abre cada pool al crearse (por defecto 1)
+- DB_POOL_MAX: máximo de conexiones abiertas a la vez por proceso, sumando los dos pools
+  (por defecto 10; cada pool tiene al menos 1)
+- DB_POOL_ASYNC_MAX: parte de DB_POOL_MAX para el pool async (por defecto 3/4, redondeado
+  hacia arriba: la mayoría de los endpoints son async). El pool sync usa el resto
+- DB_POOL_TIMEOUT: segundos que se espera una conexión libre (por defecto 30)
+- DB_POOL_PING_SEGUNDOS: si una conexión estuvo inactiva más que esto se
+  verifica con SELECT 1 antes de entregarla (0 = verificar siempre)
+"""
+
+import asyncio
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, List, Optional
+
+import psycopg2
+from dotenv import load_dotenv
+from psycopg.conninfo import make_conninfo
+from psycopg.rows import dict_row
+from psycopg_pool import AsyncConnectionPool
+
+# Cargar variables de entorno
+load_dotenv()
+
+# Reparto de DB_POOL_MAX entre los dos pools: sync + async nunca supera el total
+POOL_MAX_TOTAL = max(2, int(os.getenv("DB_POOL_MAX", "10")))
+POOL_ASYNC_MAX = min(
+    POOL_MAX_TOTAL - 1,
+    max(1, int(os.getenv("DB_POOL_ASYNC_MAX", "0")) or POOL_MAX_TOTAL - max(1, POOL_MAX_TOTAL // 4))
+)
+POOL_SYNC_MAX = POOL_MAX_TOTAL - POOL_ASYNC_MAX
+POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+
+# Configuración de base de datos
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "port": os.getenv("DB_PORT"),
+    "database": os.getenv("DB_NAME"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD")
+}
+
+
+class PoolAgotadoError(Exception):
+    """No se liberó ninguna conexión dentro del tiempo de espera"""
+
+
+class PoolConexiones:
+    """Pool thread-safe de conexiones psycopg2 con health check al entregar"""
+
+    def __init__(self, config: Dict[str, Any], minconn: int = 1, maxconn: int = 10,
+                 timeout: float = 30.0, ping_segundos: float = 30.0):
+        if maxconn < 1 or minconn < 0 or minconn > maxconn:
+            raise ValueError(f"Tamaño de pool inválido: min={minconn}, max={maxconn}")
+        self._config = config
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_segundos = ping_segundos
+
+        self._cond = threading.Condition()
+        self._libres = deque()  # (conexion, momento en que se devolvió)
+        self._total = 0
+        self._en_uso = 0
+        self._esperando = 0
+        self._cerrado = False
+
+        # Estadísticas
+        self._checkouts = 0
+        self._timeouts = 0
+        self._descartadas = 0
+        self._latencia_total = 0.0
+        self._latencia_max = 0.0
+        self._latencia_ultima = 0.0
+
+        for _ in range(minconn):
+            self._libres.append((self._crear(), time.monotonic()))
+            self._total += 1
+
+    def _crear(self):
+        return psycopg2.connect(**self._config)
+
+    def _saludable(self, connection, devuelta_en: float) -> bool:
+        if connection.closed:
+            return False
+        if time.monotonic() - devuelta_en < self.ping_segundos:
+            return True
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            connection.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _cerrar_silencioso(connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def obtener(self):
+        """Entrega una conexión lista para usar; espera hasta `timeout` si el pool está lleno"""
+        inicio = time.perf_counter()
+        limite = time.monotonic() + self.timeout
+        connection = None
+        devuelta_en = 0.0
+
+        with self._cond:
+            while True:
+                if self._cerrado:
+                    raise PoolAgotadoError("El pool de conexiones está cerrado")
+                if self._libres:
+                    connection, devuelta_en = self._libres.pop()
+                    break
+                if self._total < self.maxconn:
+                    self._total += 1
+                    break
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self._timeouts += 1
+                    raise PoolAgotadoError(
+                        f"Sin conexiones libres tras {self.timeout}s ({self.maxconn} en uso)"
+                    )
+                self._esperando += 1
+                try:
+                    self._cond.wait(restante)
+                finally:
+                    self._esperando -= 1
+            self._en_uso += 1
+
+        # Crear o verificar fuera del lock para no bloquear al resto de los hilos
+        try:
+            if connection is None:
+                connection = self._crear()
+            elif not self._saludable(connection, devuelta_en):
+                self._cerrar_silencioso(connection)
+                with self._cond:
+                    self._descartadas += 1
+                connection = self._crear()
+        except Exception:
+            with self._cond:
+                self._en_uso -= 1
+                self._total -= 1
+                self._cond.notify()
+            raise
+
+        latencia = time.perf_counter() - inicio
+        with self._cond:
+            self._checkouts += 1
+            self._latencia_total += latencia
+            self._latencia_ultima = latencia
+            self._latencia_max = max(self._latencia_max, latencia)
+        return connection
+
+    def devolver(self, connection, descartar: bool = False):
+        """Devuelve la conexión al pool, descartándola si quedó inutilizable"""
+        if not descartar and not connection.closed:
+            try:
+                # No dejar transacciones abiertas (o abortadas) para el próximo usuario
+                connection.rollback()
+            except psycopg2.Error:
+                descartar = True
+
+        with self._cond:
+            self._en_uso -= 1
+            if descartar or connection.closed or self._cerrado:
+                self._total -= 1
+                self._descartadas += 1
+                self._cerrar_silencioso(connection)
+            else:
+                self._libres.append((connection, time.monotonic()))
+            self._cond.notify()
+
+    def cerrar(self):
+        """Cierra las conexiones libres; las que están en uso se cierran al devolverse"""
+        with self._cond:
+            self._cerrado = True
+            while self._libres:
+                connection, _ = self._libres.pop()
+                self._total -= 1
+                self._cerrar_silencioso(connection)
+            self._cond.notify_all()
+
+    def estadisticas(self) -> Dict[str, Any]:
+        with self._cond:
+            promedio = self._latencia_total / self._checkouts if self._checkouts else 0.0
+            return {
+                "min": self.minconn,
+                "max": self.maxconn,
+                "abiertas": self._total,
+                "libres": len(self._libres),
+                "en_uso": self._en_uso,
+                "esperando": self._esperando,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "descartadas": self._descartadas,
+                "latencia_checkout_ms": {
+                    "promedio": round(promedio * 1000, 3),
+                    "max": round(self._latencia_max * 1000, 3),
+                    "ultima": round(self._latencia_ultima * 1000, 3)
+                }
+            }
+
+
+_pool: Optional[PoolConexiones] = None
+_pool_lock = threading.Lock()
+
+
+def obtener_pool() -> PoolConexiones:
+    """Devuelve el pool del proceso, creándolo en el primer uso"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PoolConexiones(
+                    DB_CONFIG,
+                    minconn=min(POOL_MIN, POOL_SYNC_MAX),
+                    maxconn=POOL_SYNC_MAX,
+                    timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+                    ping_segundos=float(os.getenv("DB_POOL_PING_SEGUNDOS", "30"))
+                )
+    return _pool
+
+
+def cerrar_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.cerrar()
+            _pool = None
+
+
+_pool_async: Optional[AsyncConnectionPool] = None
+_pool_async_lock: Optional[asyncio.Lock] = None
+
+
+def _conninfo_async() -> str:
+    params = {("dbname" if k == "database" else k): v for k, v in DB_CONFIG.items() if v}
+    return make_conninfo(**params)
+
+
+async def obtener_pool_async() -> AsyncConnectionPool:
+    """Devuelve el pool async del proceso, abriéndolo en el primer uso"""
+    global _pool_async, _pool_async_lock
+    if _pool_async is None:
+        if _pool_async_lock is None:
+            _pool_async_lock = asyncio.Lock()
+        async with _pool_async_lock:
+            if _pool_async is None:
+                pool = AsyncConnectionPool(
+                    _conninfo_async(),
+                    min_size=min(POOL_MIN, POOL_ASYNC_MAX),
+                    max_size=POOL_ASYNC_MAX,
+                    timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+                    # Sólo lecturas: autocommit evita devolver conexiones con transacciones abiertas
+                    kwargs={"row_factory": dict_row, "autocommit": True},
+                    check=AsyncConnectionPool.check_connection,
+                    open=False
+                )
+                await pool.open()
+                _pool_async = pool
+    return _pool_async
+
+
+async def consultar_async(query: str, params=None) -> List[Dict[str, Any]]:
+    """Ejecuta una consulta en una conexión propia del pool async y devuelve las filas como dicts.
+    Cada llamada usa su propia conexión, por lo que varias pueden correr en paralelo con asyncio.gather."""
+    pool = await obtener_pool_async()
+    async with pool.connection() as connection:
+        cursor = await connection.execute(query, params)
+        return await cursor.fetchall()
+
+
+def estadisticas_pool_async() -> Dict[str, Any]:
+    if _pool_async is None:
+        return {}
+    return _pool_async.get_stats()
+
+
+async def cerrar_pool_async():
+    global _pool_async
+    if _pool_async is not None:
+        await _pool_async.close()
+        _pool_async = None
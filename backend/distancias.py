@@ -0,0 +1,182 @@
+"""
+Distancias sobre la esfera (haversine) para pasos de rutas, recorridos GPS y comparaciones
+planificado vs. real.
+
+- `distancia_m`: un par de puntos (para bucles que deciden punto a punto, como el submuestreo).
+- `distancias_consecutivas_km`: todas las distancias entre puntos consecutivos de muchas
+  secuencias concatenadas en una sola pasada vectorizada con NumPy; el primer punto de cada
+  secuencia queda en 0.
+- `calcular_pasos_rutas`: distancia_desde_anterior, tiempo_estimado_minutos y los totales de
+  cada ruta del mapa, para todas las rutas a la vez.
+- `distancias_planificada_real`: largo del camino planificado (orden de sequence) y del real
+  (orden de visit_sequence) de muchas rutas en una pasada, con `CacheDistanciasRutas` para las
+  rutas de días cerrados.
+
+Si NumPy no está instalado se calcula lo mismo en Python puro.
+
+Variables de entorno:
+- CACHE_DISTANCIAS_MAX_RUTAS: rutas cerradas que guarda el cache de distancias (por defecto 50000)
+"""
+
+import math
+import os
+from collections import OrderedDict
+from typing import Any, Dict, List, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # dependencia opcional: sin ella se calcula punto a punto
+    np = None
+
+RADIO_TIERRA_KM = 6371.0088
+CACHE_MAX_RUTAS = int(os.getenv("CACHE_DISTANCIAS_MAX_RUTAS", "50000"))
+# Tiempo estimado de un paso: minutos fijos de visita + viaje a velocidad promedio
+MINUTOS_POR_VISITA = 5
+VELOCIDAD_PROMEDIO_KMH = 40
+
+
+def distancia_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Distancia haversine en metros entre dos puntos"""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * 1000 * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distancias_consecutivas_km(latitudes: Sequence[float], longitudes: Sequence[float],
+                               inicios: Sequence[int]) -> List[float]:
+    """Distancia (km) de cada punto al anterior de su secuencia. Los puntos de todas las
+    secuencias van concatenados; `inicios` son los índices donde empieza cada secuencia
+    (su distancia es 0)."""
+    n = len(latitudes)
+    if n == 0:
+        return []
+    if np is None:
+        distancias = [0.0] * n
+        for i in range(1, n):
+            distancias[i] = distancia_m(latitudes[i - 1], longitudes[i - 1], latitudes[i], longitudes[i]) / 1000
+        for i in inicios:
+            if i < n:
+                distancias[i] = 0.0
+        return distancias
+
+    lat = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lng = np.radians(np.asarray(longitudes, dtype=np.float64))
+    a = (np.sin((lat[1:] - lat[:-1]) / 2) ** 2
+         + np.cos(lat[:-1]) * np.cos(lat[1:]) * np.sin((lng[1:] - lng[:-1]) / 2) ** 2)
+    distancias = np.zeros(n)
+    distancias[1:] = 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    inicios = np.asarray(inicios, dtype=np.int64)
+    distancias[inicios[inicios < n]] = 0.0
+    return distancias.tolist()
+
+
+def tiempo_estimado_minutos(distancia_km: float) -> int:
+    return int(MINUTOS_POR_VISITA + distancia_km / VELOCIDAD_PROMEDIO_KMH * 60)
+
+
+def calcular_pasos_rutas(rutas: List[Dict[str, Any]]) -> None:
+    """Completa en cada paso de `secuencia_pasos` (ya ordenados) distancia_desde_anterior (km) y
+    tiempo_estimado_minutos, y en cada ruta con pasos distancia_total_estimada y
+    tiempo_total_estimado. Todas las rutas en una sola pasada."""
+    con_pasos = [r for r in rutas if r.get("secuencia_pasos")]
+    latitudes: List[float] = []
+    longitudes: List[float] = []
+    inicios: List[int] = []
+    for ruta in con_pasos:
+        inicios.append(len(latitudes))
+        for paso in ruta["secuencia_pasos"]:
+            lng, lat = paso["coordenadas"]
+            latitudes.append(lat)
+            longitudes.append(lng)
+
+    distancias = distancias_consecutivas_km(latitudes, longitudes, inicios)
+    i = 0
+    for ruta in con_pasos:
+        distancia_total = 0.0
+        tiempo_total = 0
+        for j, paso in enumerate(ruta["secuencia_pasos"]):
+            if j == 0:
+                paso["distancia_desde_anterior"] = 0.0
+                paso["tiempo_estimado_minutos"] = MINUTOS_POR_VISITA  # Tiempo base para el primer cliente
+            else:
+                paso["distancia_desde_anterior"] = round(distancias[i], 2)
+                paso["tiempo_estimado_minutos"] = tiempo_estimado_minutos(distancias[i])
+                distancia_total += distancias[i]
+            tiempo_total += paso["tiempo_estimado_minutos"]
+            i += 1
+        ruta["distancia_total_estimada"] = round(distancia_total, 2)
+        ruta["tiempo_total_estimado"] = tiempo_total
+
+
+def _coordenada_valida(lat: Any, lng: Any) -> bool:
+    return lat is not None and lng is not None and abs(lat) > 0.000001 and abs(lng) > 0.000001
+
+
+def distancias_planificada_real(filas: Sequence[Dict[str, Any]]) -> Dict[Any, Dict[str, float]]:
+    """Distancia (km) del camino planificado y del real de cada ruta, todas en una pasada.
+
+    `filas`: un route_detail por fila con route_id, route_detail_id, sequence, visit_sequence,
+    lat_plan/lng_plan (ubicación del cliente) y lat_real/lng_real (evento de inicio si hay).
+    - planificada: clientes planificados (sequence entre 1 y 999) en orden de sequence
+    - real: clientes visitados en orden de visit_sequence
+    Devuelve {route_id: {'planificada': km, 'real': km}}"""
+    planificados: Dict[Any, List[tuple]] = {}
+    visitados: Dict[Any, List[tuple]] = {}
+    for f in filas:
+        route_id = f['route_id']
+        planificados.setdefault(route_id, [])
+        visitados.setdefault(route_id, [])
+        sequence = f.get('sequence')
+        if sequence and 0 < sequence < 1000 and _coordenada_valida(f.get('lat_plan'), f.get('lng_plan')):
+            planificados[route_id].append((sequence, f['route_detail_id'], f['lat_plan'], f['lng_plan']))
+        if f.get('visit_sequence') is not None and _coordenada_valida(f.get('lat_real'), f.get('lng_real')):
+            visitados[route_id].append((f['visit_sequence'], f['route_detail_id'], f['lat_real'], f['lng_real']))
+
+    # Todas las secuencias (planificada y real de cada ruta) concatenadas en un solo cálculo
+    secuencias = [(route_id, tipo, sorted(puntos))
+                  for tipo, grupos in (('planificada', planificados), ('real', visitados))
+                  for route_id, puntos in grupos.items()]
+    latitudes: List[float] = []
+    longitudes: List[float] = []
+    inicios: List[int] = []
+    for _, _, puntos in secuencias:
+        inicios.append(len(latitudes))
+        latitudes.extend(p[2] for p in puntos)
+        longitudes.extend(p[3] for p in puntos)
+    distancias = distancias_consecutivas_km(latitudes, longitudes, inicios)
+
+    resultado: Dict[Any, Dict[str, float]] = {}
+    for (route_id, tipo, puntos), inicio in zip(secuencias, inicios):
+        total = sum(distancias[inicio:inicio + len(puntos)])
+        resultado.setdefault(route_id, {})[tipo] = round(total, 2)
+    return resultado
+
+
+class CacheDistanciasRutas:
+    """Distancias planificada/real por route_id de días ya cerrados (no cambian), FIFO acotado"""
+
+    def __init__(self, max_entradas: int = CACHE_MAX_RUTAS):
+        self.max_entradas = max_entradas
+        self._datos: "OrderedDict[Any, Dict[str, float]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def obtener(self, route_ids: Sequence[Any]) -> Dict[Any, Dict[str, float]]:
+        encontradas = {r: self._datos[r] for r in route_ids if r in self._datos}
+        self.hits += len(encontradas)
+        self.misses += len(route_ids) - len(encontradas)
+        return encontradas
+
+    def guardar(self, route_id: Any, distancias: Dict[str, float]):
+        self._datos[route_id] = distancias
+        while len(self._datos) > self.max_entradas:
+            self._datos.popitem(last=False)
+
+    def limpiar(self) -> int:
+        cantidad = len(self._datos)
+        self._datos.clear()
+        return cantidad
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {"entradas": len(self._datos), "max_entradas": self.max_entradas, "hits": self.hits, "misses": self.misses}
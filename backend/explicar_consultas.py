@@ -0,0 +1,161 @@
+"""
+Planes de ejecución (EXPLAIN) de las consultas calientes de cada endpoint, para comparar
+antes y después de aplicar las migraciones de índices.
+
+Las consultas salen de los mismos builders que usa la API (main.py / rollup_ventas.py) y se
+parametrizan con datos reales de la base: rutas del mes, sus route_detail y clientes, el
+vendedor con más rutas y un route_detail con ventas.
+
+Uso (desde backend/):
+    python explicar_consultas.py --analyze --guardar antes.json
+    python migrar.py aplicar
+    python explicar_consultas.py --analyze --guardar despues.json --comparar antes.json
+
+Sin --analyze sólo se muestran costos estimados (no ejecuta las consultas). Con --analyze
+cada consulta corre dentro de una transacción que se descarta, con BUFFERS.
+"""
+
+import argparse
+import json
+import sys
+from typing import Any, Dict, List, Optional, Tuple
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from conexiones import DB_CONFIG
+
+# Los builders de SQL de main.py son la fuente de verdad
+import main
+from rollup_ventas import SQL_AGREGACION
+
+
+def _muestra(cursor) -> Dict[str, Any]:
+    """Parámetros reales para las consultas: route_details y clientes del mes, vendedor y route_detail con ventas"""
+    cursor.execute("""
+        SELECT rd.id, rd.subject_code
+        FROM public.route r JOIN public.route_detail rd ON rd.route_id = r.id
+        WHERE r.day >= DATE_TRUNC('month', CURRENT_DATE)
+        LIMIT 2000
+    """)
+    filas = cursor.fetchall()
+    cursor.execute("SELECT user_id FROM public.route WHERE user_id IS NOT NULL GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1")
+    vendedor = cursor.fetchone()
+    cursor.execute("SELECT e.route_detail_id FROM public.event e JOIN public.invoice i ON i.event_id = e.id LIMIT 1")
+    con_ventas = cursor.fetchone()
+    return {
+        "rd_ids": [f["id"] for f in filas],
+        "clientes": sorted({f["subject_code"] for f in filas if f["subject_code"]}),
+        "vendedor": vendedor["user_id"] if vendedor else 0,
+        "rd_ventas": con_ventas["route_detail_id"] if con_ventas else 0
+    }
+
+
+def consultas(muestra: Dict[str, Any]) -> List[Tuple[str, str, tuple]]:
+    """(endpoint / consulta, sql, parámetros)"""
+    filtros_mes = main.construir_filtros_mapa("mes", None, None, None, None, None)
+    filtros_vendedor = main.construir_filtros_mapa("año", None, None, muestra["vendedor"], None, None)
+    # Viewport de Asunción a zoom 12 (el mapa pide bbox + zoom al panear)
+    filtros_bbox = main.construir_filtros_mapa("mes", None, None, None, None, None,
+                                               main.parsear_bbox("-57.70,-25.35,-57.50,-25.22", 12))
+    filtros_ventas, params_ventas = main.filtros_eventos_ventas(None, None, None)
+    sql_ventas_rd = f"""
+        SELECT{main.SQL_COLUMNAS_VENTAS_EVENTO}
+        FROM public.event e
+        LEFT JOIN public.invoice i ON i.event_id = e.id
+        LEFT JOIN public.invoice_detail idt ON idt.invoice_id = i.id
+        WHERE {" AND ".join(["e.route_detail_id = %s"] + filtros_ventas)}
+        ORDER BY e.event_date ASC, i.creation_date ASC, idt.row_number ASC
+    """
+    agregacion_mes = SQL_AGREGACION.format(
+        where="r.day >= DATE_TRUNC('month', CURRENT_DATE) - INTERVAL '3 months'"
+    )
+    return [
+        ("/mapa/rutas filas (mes)", main.sql_filas_rutas(filtros_mes), ()),
+        ("/mapa/rutas filas (vendedor, año)", main.sql_filas_rutas(filtros_vendedor), ()),
+        ("/mapa/rutas filas (mes, bbox)", main.sql_filas_rutas(filtros_bbox), ()),
+        ("/mapa/rutas eventos inicio/fin", main.SQL_EVENTOS_INICIO_FIN, (muestra["rd_ids"],)),
+        ("/mapa/rutas historial KPIs", main.sql_historial_clientes(), (muestra["clientes"],)),
+        ("/route_detail/{id}/ventas", sql_ventas_rd, tuple([muestra["rd_ventas"]] + params_ventas)),
+        ("ventas por zona (agregación viva, 3 meses)", agregacion_mes, ()),
+        ("/vendedores/ultima_ubicacion", main.sql_ultima_ubicacion(48), ()),
+    ]
+
+
+def _nodos(plan: Dict[str, Any]) -> List[str]:
+    """Accesos a tablas del plan: 'Seq Scan route', 'Index Scan ix_route_day_user', ..."""
+    nodos = []
+    tipo = plan.get("Node Type", "")
+    if "Scan" in tipo and ("Relation Name" in plan or "Index Name" in plan):
+        nodos.append(f"{tipo} {plan.get('Index Name') or plan.get('Relation Name')}")
+    for hijo in plan.get("Plans", []):
+        nodos.extend(_nodos(hijo))
+    return nodos
+
+
+def explicar(connection, analyze: bool) -> Dict[str, Dict[str, Any]]:
+    opciones = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    resultados = {}
+    with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+        muestra = _muestra(cursor)
+        for nombre, sql, params in consultas(muestra):
+            cursor.execute(f"EXPLAIN ({opciones}) {sql}", params or None)
+            salida = cursor.fetchone()["QUERY PLAN"][0]
+            plan = salida["Plan"]
+            resultados[nombre] = {
+                "costo": plan["Total Cost"],
+                "tiempo_ms": salida.get("Execution Time"),
+                "filas": plan.get("Actual Rows", plan.get("Plan Rows")),
+                "accesos": _nodos(plan),
+                "plan": salida
+            }
+            connection.rollback()
+    return resultados
+
+
+def _formato_tiempo(valor: Optional[float]) -> str:
+    return f"{valor:.1f} ms" if valor is not None else "-"
+
+
+def imprimir(resultados: Dict[str, Dict[str, Any]], antes: Optional[Dict[str, Dict[str, Any]]] = None):
+    for nombre, r in resultados.items():
+        print(f"\n📊 {nombre}")
+        previo = (antes or {}).get(nombre)
+        if previo:
+            print(f"   costo: {previo['costo']:.0f} -> {r['costo']:.0f}   "
+                  f"tiempo: {_formato_tiempo(previo['tiempo_ms'])} -> {_formato_tiempo(r['tiempo_ms'])}")
+            print(f"   antes:   {', '.join(previo['accesos'])}")
+            print(f"   después: {', '.join(r['accesos'])}")
+        else:
+            print(f"   costo: {r['costo']:.0f}   tiempo: {_formato_tiempo(r['tiempo_ms'])}   filas: {r['filas']}")
+            print(f"   accesos: {', '.join(r['accesos'])}")
+
+
+def main_cli() -> int:
+    parser = argparse.ArgumentParser(description="EXPLAIN de las consultas calientes por endpoint")
+    parser.add_argument("--analyze", action="store_true", help="Ejecutar las consultas (EXPLAIN ANALYZE, BUFFERS)")
+    parser.add_argument("--guardar", help="Archivo JSON donde guardar los planes")
+    parser.add_argument("--comparar", help="JSON de una corrida anterior (p. ej. antes de migrar)")
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(**DB_CONFIG)
+    try:
+        resultados = explicar(connection, args.analyze)
+    finally:
+        connection.close()
+
+    antes = None
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as archivo:
+            antes = json.load(archivo)
+    imprimir(resultados, antes)
+
+    if args.guardar:
+        with open(args.guardar, "w", encoding="utf-8") as archivo:
+            json.dump(resultados, archivo, ensure_ascii=False, indent=1, default=str)
+        print(f"\n💾 Planes guardados en {args.guardar}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,341 @@
+"""
+Generador determinístico de datos sintéticos para medir rendimiento en una base local.
+
+Llena users, zone, route, route_zone_detail, route_detail, event, invoice, invoice_detail y
+tracking con volúmenes configurables y coordenadas dentro de Paraguay (el rango que valida
+/mapa/rutas). Con la misma semilla, parámetros y fecha `--hasta` genera exactamente los mismos
+datos. Las filas se cargan con COPY por lotes, con ids explícitos, y al final se ajustan las
+secuencias y se corre ANALYZE.
+
+Modelo:
+- cada zona es un polígono de 8 vértices alrededor de un punto de una grilla sobre la región
+  oriental; cada vendedor trabaja una zona y tiene una cartera fija de clientes dentro de ella
+- cada día (salvo domingos, con probabilidad --prob-ruta) el vendedor tiene una ruta con
+  --visitas-por-ruta clientes de su cartera; ~80% se visitan (visit_sequence), las visitas
+  tienen eventos de inicio (1) y fin (2) y ~55% factura con 1 a 6 líneas
+- tracking: un punto cada 5 minutos de 8 a 17 h durante los últimos --dias-tracking días
+
+Tamaño aproximado con los valores por defecto (2000 vendedores, 90 días): ~3,2M route_detail,
+~5M eventos, ~1,4M facturas, ~4,9M líneas y ~1,5M puntos de tracking.
+
+Uso (desde backend/, contra una base local):
+    python generar_datos.py --limpiar
+    python generar_datos.py --limpiar --vendedores 50 --dias 30   # base chica para desarrollo
+    python migrar.py aplicar && python rollup_ventas.py reconstruir
+"""
+
+import argparse
+import io
+import math
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Sequence, Tuple
+
+import psycopg2
+
+from conexiones import DB_CONFIG
+
+# Región oriental de Paraguay (dentro del rango -28..-19 / -63..-54 que acepta /mapa/rutas)
+LAT_MIN, LAT_MAX = -27.2, -22.6
+LNG_MIN, LNG_MAX = -57.9, -54.8
+
+COLORES = ["#e6194b", "#3cb44b", "#ffe119", "#4363d8", "#f58231", "#911eb4", "#46f0f0", "#f032e6",
+           "#bcf60c", "#fabebe", "#008080", "#e6beff", "#9a6324", "#800000", "#aaffc3", "#000075"]
+PRODUCTOS = [(f"P{i:04d}", f"Producto {i}", round(5000 + (i * 7919) % 95000, -2)) for i in range(1, 401)]
+
+TABLAS = ["invoice_detail", "invoice", "event", "route_detail", "route_zone_detail", "route", "tracking", "zone", "users"]
+
+COLUMNAS = {
+    "users": ("id", "full_name"),
+    "zone": ("id", "group_id", "name", "color", "coordinates"),
+    "route": ("id", "day", "creation_date", "user_id", "group_id", "route_distance", "status"),
+    "route_zone_detail": ("id", "route_id", "zone_code", "zone_name", "zone_color"),
+    "route_detail": ("id", "route_id", "subject_name", "subject_code", "latitude", "longitude",
+                     "invoice_amount", "invoice_quantity", "order_amount", "order_quantity",
+                     "receipt_amount", "receipt_quantity", "visit_positive", "sequence", "visit_sequence"),
+    "event": ("id", "route_detail_id", "event_type_id", "event_date", "latitude", "longitude",
+              "comments", "distance_event_customer"),
+    "invoice": ("id", "event_id", "number", "creation_date", "gross_total", "net_total", "vat_total",
+                "currency_code", "type"),
+    "invoice_detail": ("id", "invoice_id", "product_code", "product_name", "quantity", "unit_price",
+                       "net_amount", "vat_amount", "row_number"),
+    "tracking": ("id", "user_id", "latitude", "longitude", "location_time_millis", "tracking_date",
+                 "batery_level", "altitude", "horizontal_accuracy", "vertical_accuracy"),
+}
+
+
+def _valor_copy(valor: Any) -> str:
+    if valor is None:
+        return "\\N"
+    if isinstance(valor, bool):
+        return "t" if valor else "f"
+    if isinstance(valor, float):
+        return f"{valor:.8f}".rstrip("0").rstrip(".")
+    return str(valor).replace("\\", "\\\\").replace("\t", " ").replace("\n", " ")
+
+
+class CargadorCopy:
+    """Acumula filas por tabla y las envía con COPY FROM STDIN cada `lote` filas"""
+
+    def __init__(self, connection, lote: int = 50_000):
+        self.connection = connection
+        self.lote = lote
+        self._buffers: Dict[str, io.StringIO] = {}
+        self._pendientes: Dict[str, int] = {}
+        self.totales: Dict[str, int] = {}
+
+    def agregar(self, tabla: str, fila: Sequence[Any]):
+        buffer = self._buffers.get(tabla)
+        if buffer is None:
+            buffer = self._buffers[tabla] = io.StringIO()
+            self._pendientes[tabla] = 0
+        buffer.write("\t".join(_valor_copy(v) for v in fila))
+        buffer.write("\n")
+        self._pendientes[tabla] += 1
+        if self._pendientes[tabla] >= self.lote:
+            # Enviar todo en orden de FK para que los hijos nunca lleguen antes que sus padres
+            self.enviar_todo()
+
+    def _enviar(self, tabla: str):
+        buffer = self._buffers[tabla]
+        if not self._pendientes[tabla]:
+            return
+        buffer.seek(0)
+        columnas = ", ".join(f'"{c}"' for c in COLUMNAS[tabla])
+        with self.connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY public.{tabla} ({columnas}) FROM STDIN", buffer)
+        self.totales[tabla] = self.totales.get(tabla, 0) + self._pendientes[tabla]
+        self._buffers[tabla] = io.StringIO()
+        self._pendientes[tabla] = 0
+
+    def enviar_todo(self):
+        # Respetar las FK: padres antes que hijos
+        for tabla in reversed(TABLAS):
+            if tabla in self._buffers:
+                self._enviar(tabla)
+
+
+def _poligono(rng: random.Random, lat: float, lng: float, radio: float) -> List[Tuple[float, float]]:
+    vertices = []
+    for k in range(8):
+        angulo = 2 * math.pi * k / 8
+        r = radio * rng.uniform(0.75, 1.0)
+        vertices.append((lat + r * math.sin(angulo), lng + r * math.cos(angulo)))
+    return vertices
+
+
+def _distancia_km(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    dlat = (b[0] - a[0]) * 111.0
+    dlng = (b[1] - a[1]) * 111.0 * math.cos(math.radians(a[0]))
+    return math.hypot(dlat, dlng)
+
+
+def generar_zonas(rng: random.Random, cargador: CargadorCopy, cantidad: int) -> List[Dict[str, Any]]:
+    columnas = max(1, math.ceil(math.sqrt(cantidad * (LNG_MAX - LNG_MIN) / (LAT_MAX - LAT_MIN))))
+    filas = math.ceil(cantidad / columnas)
+    paso_lat = (LAT_MAX - LAT_MIN) / filas
+    paso_lng = (LNG_MAX - LNG_MIN) / columnas
+    radio = min(paso_lat, paso_lng) * 0.45
+    zonas = []
+    for i in range(cantidad):
+        lat = LAT_MIN + paso_lat * (i // columnas + 0.5)
+        lng = LNG_MIN + paso_lng * (i % columnas + 0.5)
+        vertices = _poligono(rng, lat, lng, radio)
+        # Los dos formatos que acepta el parser de zone.coordinates
+        if i % 2 == 0:
+            texto = " ".join(f"{a:.6f},{b:.6f}" for a, b in vertices)
+        else:
+            texto = " ".join(f"{a:.6f} {b:.6f}" for a, b in vertices)
+        zona = {"id": i + 1, "nombre": f"Zona {i + 1:04d}", "color": COLORES[i % len(COLORES)],
+                "centro": (lat, lng), "radio": radio * 0.7}
+        cargador.agregar("zone", (zona["id"], i % 20 + 1, zona["nombre"], zona["color"], texto))
+        zonas.append(zona)
+    return zonas
+
+
+def generar(connection, args) -> Dict[str, int]:
+    rng = random.Random(args.semilla)
+    cargador = CargadorCopy(connection, args.lote)
+    hasta: date = args.hasta
+    desde = hasta - timedelta(days=args.dias - 1)
+
+    zonas = generar_zonas(rng, cargador, args.zonas)
+
+    # Vendedores con su zona y cartera fija de clientes
+    vendedores = []
+    for v in range(1, args.vendedores + 1):
+        zona = zonas[(v - 1) % len(zonas)]
+        cartera = []
+        for k in range(args.clientes_por_vendedor):
+            angulo = rng.uniform(0, 2 * math.pi)
+            r = zona["radio"] * math.sqrt(rng.random())
+            cartera.append({
+                "codigo": f"C{v:05d}{k:03d}",
+                "nombre": f"Cliente {v:05d}-{k:03d}",
+                "pos": (zona["centro"][0] + r * math.sin(angulo), zona["centro"][1] + r * math.cos(angulo)),
+                "ticket": rng.lognormvariate(12.5, 0.6)  # venta típica del cliente (Gs.)
+            })
+        vendedores.append({"id": v, "zona": zona, "cartera": cartera})
+        cargador.agregar("users", (v, f"Vendedor {v:05d}"))
+
+    ids = {"route": 0, "route_zone_detail": 0, "route_detail": 0, "event": 0, "invoice": 0,
+           "invoice_detail": 0, "tracking": 0}
+
+    def siguiente(tabla: str) -> int:
+        ids[tabla] += 1
+        return ids[tabla]
+
+    inicio = time.perf_counter()
+    dia = desde
+    while dia <= hasta:
+        for vendedor in vendedores:
+            if dia.weekday() == 6 or rng.random() > args.prob_ruta:
+                continue
+            zona = vendedor["zona"]
+            route_id = siguiente("route")
+            salida = datetime.combine(dia, datetime.min.time()) + timedelta(hours=7, minutes=rng.randint(0, 59))
+            clientes = rng.sample(vendedor["cartera"], min(args.visitas_por_ruta, len(vendedor["cartera"])))
+
+            visitados = [c for c in clientes if rng.random() < 0.8]
+            orden_visita = {id(c): n for n, c in enumerate(rng.sample(visitados, len(visitados)), start=1)}
+            recorrido = sorted(visitados, key=lambda c: orden_visita[id(c)])
+            distancia = sum(_distancia_km(a["pos"], b["pos"]) for a, b in zip(recorrido, recorrido[1:]))
+
+            cargador.agregar("route", (route_id, dia, salida, vendedor["id"], zona["id"] % 20 + 1,
+                                       round(distancia, 2), "completed"))
+            cargador.agregar("route_zone_detail", (siguiente("route_zone_detail"), route_id, str(zona["id"]),
+                                                   zona["nombre"], zona["color"]))
+
+            momento = salida + timedelta(minutes=30)
+            for secuencia, cliente in enumerate(clientes, start=1):
+                rd_id = siguiente("route_detail")
+                visit_sequence = orden_visita.get(id(cliente))
+                planificado = rng.random() > 0.05
+                monto = 0.0
+                lineas = []
+                if visit_sequence is not None and rng.random() < 0.55:
+                    for n in range(1, rng.randint(1, 6) + 1):
+                        codigo, nombre, precio = PRODUCTOS[rng.randrange(len(PRODUCTOS))]
+                        cantidad = rng.randint(1, 24)
+                        neto = round(precio * cantidad * cliente["ticket"] / 300000, 0)
+                        lineas.append((codigo, nombre, cantidad, round(neto / cantidad, 2), neto, round(neto * 0.1, 0), n))
+                        monto += neto
+                pedido = round(monto * rng.uniform(0.9, 1.2), 0) if monto else 0.0
+                cargador.agregar("route_detail", (
+                    rd_id, route_id, cliente["nombre"], cliente["codigo"],
+                    round(cliente["pos"][0], 8), round(cliente["pos"][1], 8),
+                    monto, len(lineas), pedido, 1 if pedido else 0, 0.0, 0,
+                    bool(lineas) or (visit_sequence is not None and rng.random() < 0.3),
+                    secuencia if planificado else 1000, visit_sequence
+                ))
+                if visit_sequence is None:
+                    continue
+
+                # Eventos de inicio y fin de la visita cerca del cliente
+                llegada = momento + timedelta(minutes=visit_sequence * 18 + rng.randint(0, 10))
+                fin = llegada + timedelta(minutes=rng.randint(4, 25))
+                lat_ev = cliente["pos"][0] + rng.uniform(-0.0004, 0.0004)
+                lng_ev = cliente["pos"][1] + rng.uniform(-0.0004, 0.0004)
+                distancia_ev = round(_distancia_km(cliente["pos"], (lat_ev, lng_ev)) * 1000, 1)
+                evento_inicio = siguiente("event")
+                cargador.agregar("event", (evento_inicio, rd_id, 1, llegada, round(lat_ev, 8), round(lng_ev, 8),
+                                           None, distancia_ev))
+                cargador.agregar("event", (siguiente("event"), rd_id, 2, fin, round(lat_ev, 8), round(lng_ev, 8),
+                                           None, distancia_ev))
+                if lineas:
+                    invoice_id = siguiente("invoice")
+                    iva = sum(l[5] for l in lineas)
+                    cargador.agregar("invoice", (invoice_id, evento_inicio, f"001-001-{invoice_id:07d}",
+                                                 fin - timedelta(minutes=2), monto + iva, monto, iva, "PYG", "FC"))
+                    for linea in lineas:
+                        cargador.agregar("invoice_detail", (siguiente("invoice_detail"), invoice_id) + linea)
+        if dia.day == 1 or dia == hasta:
+            print(f"  {dia}: {ids['route_detail']:,} route_detail ({time.perf_counter() - inicio:.0f}s)")
+        dia += timedelta(days=1)
+
+    # Tracking: recorrido continuo por la zona en los últimos días
+    for vendedor in vendedores:
+        zona = vendedor["zona"]
+        for d in range(args.dias_tracking - 1, -1, -1):
+            dia_tracking = hasta - timedelta(days=d)
+            if dia_tracking.weekday() == 6:
+                continue
+            lat, lng = zona["centro"]
+            momento = datetime.combine(dia_tracking, datetime.min.time()) + timedelta(hours=8)
+            bateria = rng.uniform(80, 100)
+            for _ in range(108):
+                lat = min(max(lat + rng.uniform(-0.002, 0.002), zona["centro"][0] - zona["radio"]), zona["centro"][0] + zona["radio"])
+                lng = min(max(lng + rng.uniform(-0.002, 0.002), zona["centro"][1] - zona["radio"]), zona["centro"][1] + zona["radio"])
+                bateria = max(bateria - rng.uniform(0, 0.6), 5)
+                cargador.agregar("tracking", (
+                    siguiente("tracking"), vendedor["id"], round(lat, 8), round(lng, 8),
+                    int(momento.timestamp() * 1000), momento, round(bateria, 1),
+                    round(rng.uniform(60, 250), 1), round(rng.uniform(3, 40), 1), round(rng.uniform(2, 15), 1)
+                ))
+                momento += timedelta(minutes=5)
+
+    cargador.enviar_todo()
+    return cargador.totales
+
+
+def limpiar(connection):
+    with connection.cursor() as cursor:
+        cursor.execute(f"TRUNCATE {', '.join('public.' + t for t in TABLAS)} RESTART IDENTITY CASCADE")
+
+
+def ajustar_secuencias(connection):
+    with connection.cursor() as cursor:
+        for tabla in TABLAS:
+            cursor.execute(f"""
+                SELECT setval(pg_get_serial_sequence('public.{tabla}', 'id'),
+                              COALESCE((SELECT MAX(id) FROM public.{tabla}), 0) + 1, false)
+            """)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Carga datos sintéticos determinísticos en la base local")
+    parser.add_argument("--semilla", type=int, default=42)
+    parser.add_argument("--vendedores", type=int, default=2000)
+    parser.add_argument("--dias", type=int, default=90, help="Días de rutas hacia atrás desde --hasta")
+    parser.add_argument("--hasta", type=date.fromisoformat, default=date.today(), help="Último día (YYYY-MM-DD)")
+    parser.add_argument("--zonas", type=int, default=200)
+    parser.add_argument("--clientes-por-vendedor", type=int, default=120)
+    parser.add_argument("--visitas-por-ruta", type=int, default=22)
+    parser.add_argument("--prob-ruta", type=float, default=0.85, help="Probabilidad de ruta por vendedor y día hábil")
+    parser.add_argument("--dias-tracking", type=int, default=7)
+    parser.add_argument("--lote", type=int, default=50_000, help="Filas por COPY")
+    parser.add_argument("--limpiar", action="store_true", help="TRUNCATE de las tablas antes de cargar")
+    args = parser.parse_args()
+
+    connection = psycopg2.connect(**DB_CONFIG)
+    inicio = time.perf_counter()
+    try:
+        if args.limpiar:
+            print("🧹 Vaciando tablas...")
+            limpiar(connection)
+        print(f"🔄 Generando {args.vendedores} vendedores x {args.dias} días (semilla {args.semilla})...")
+        totales = generar(connection, args)
+        ajustar_secuencias(connection)
+        connection.commit()
+    except Exception as e:
+        connection.rollback()
+        print(f"❌ Error generando datos: {e}")
+        return 1
+    finally:
+        connection.autocommit = True
+
+    with connection.cursor() as cursor:
+        cursor.execute(f"ANALYZE {', '.join('public.' + t for t in TABLAS)}")
+    connection.close()
+
+    for tabla in reversed(TABLAS):
+        print(f"  {tabla}: {totales.get(tabla, 0):,} filas")
+    print(f"✅ Datos generados en {time.perf_counter() - inicio:.0f}s")
+    print("   Siguiente: python migrar.py aplicar && python rollup_ventas.py reconstruir")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
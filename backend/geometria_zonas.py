@@ -0,0 +1,186 @@
+"""
+Cache de geometrías de zona (tabla zone).
+
+`zone.coordinates` es texto ("lat,lng lat,lng ..." o "lat lng lat lng ...") y antes se
+consultaba y parseaba en cada llamada a /mapa/rutas. Acá cada zona se parsea una sola vez
+a un anillo GeoJSON cerrado ([lng, lat]) con su centro y bbox, y se guarda por zone.id.
+
+Invalidación:
+- cada zona guarda una firma md5(coordinates) + nombre + color; pasado
+  ZONAS_REVALIDAR_SEGUNDOS (por defecto 300) se vuelve a pedir sólo la firma (sin el texto
+  de coordenadas) y se re-parsean únicamente las zonas cuya firma cambió
+- `invalidar()` / POST /zonas/geometria/refrescar fuerzan la recarga de una o todas las zonas
+
+Las geometrías devueltas se comparten entre requests: no modificarlas en el lugar.
+"""
+
+import asyncio
+import os
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from conexiones import consultar_async
+from registro import obtener_logger
+
+log = obtener_logger("zonas")
+
+REVALIDAR_SEGUNDOS = float(os.getenv("ZONAS_REVALIDAR_SEGUNDOS", "300"))
+
+CONSULTA_FIRMAS = """
+SELECT
+    z.id::text as zona_code,
+    md5(z.coordinates) as firma,
+    z.group_id,
+    z.name as nombre,
+    z.color
+FROM zone z
+WHERE z.id::text = ANY(%s)
+AND z.coordinates IS NOT NULL
+AND z.coordinates != ''
+"""
+
+CONSULTA_COORDENADAS = """
+SELECT z.id::text as zona_code, z.coordinates
+FROM zone z
+WHERE z.id::text = ANY(%s)
+"""
+
+
+def parsear_coordenadas_zona(coordinates_str: Optional[str], zona_id: Any = None) -> List[List[float]]:
+    """Convierte el texto de zone.coordinates en una lista de [lng, lat] (sin cerrar el anillo).
+    Las coordenadas pueden estar en formato:
+    1. "-25.123,-57.456 -25.124,-57.457 ..." (con coma)
+    2. "-25.123 -57.456 -25.124 -57.457 ..." (separado por espacios)"""
+    if not coordinates_str or not coordinates_str.strip():
+        return []
+    coordinate_tokens = coordinates_str.strip().split()
+    coordinates = []
+
+    if any(',' in token for token in coordinate_tokens):
+        # Formato con comas: "lat,lng lat,lng"
+        for pair in coordinate_tokens:
+            if ',' in pair:
+                try:
+                    lat_str, lng_str = pair.split(',')
+                    coordinates.append([float(lng_str), float(lat_str)])  # GeoJSON usa [lng, lat]
+                except (ValueError, IndexError) as e:
+                    log.warning("Error parseando coordenada '%s' de zona %s: %s", pair, zona_id, e)
+    else:
+        # Formato separado por espacios: "lat lng lat lng", agrupar de a pares
+        for j in range(0, len(coordinate_tokens) - 1, 2):
+            lat_str, lng_str = coordinate_tokens[j], coordinate_tokens[j + 1]
+            try:
+                coordinates.append([float(lng_str), float(lat_str)])
+            except ValueError as e:
+                log.warning("Error parseando coordenadas '%s %s' de zona %s: %s", lat_str, lng_str, zona_id, e)
+    return coordinates
+
+
+def geometria_desde_puntos(coordinates: List[List[float]]) -> Optional[Dict[str, Any]]:
+    """Anillo cerrado + centro + bbox; None si no alcanza para un polígono (mínimo 3 puntos)"""
+    if len(coordinates) < 3:
+        return None
+    anillo = list(coordinates)
+    # Asegurar que el polígono esté cerrado
+    if anillo[0] != anillo[-1]:
+        anillo.append(anillo[0])
+    lngs = [c[0] for c in anillo]
+    lats = [c[1] for c in anillo]
+    return {
+        "coordinates": [anillo],  # Array de polígonos (GeoJSON Polygon)
+        # Centro = promedio de los vértices del anillo cerrado (igual que antes del cache)
+        "centro_lng": sum(lngs) / len(anillo),
+        "centro_lat": sum(lats) / len(anillo),
+        "bbox": [min(lngs), min(lats), max(lngs), max(lats)]
+    }
+
+
+class CacheGeometriaZonas:
+    """Geometrías parseadas por zone.id, revalidadas por firma md5 de las coordenadas"""
+
+    def __init__(self, revalidar_segundos: float = REVALIDAR_SEGUNDOS):
+        self.revalidar_segundos = revalidar_segundos
+        self._zonas: Dict[str, Dict[str, Any]] = {}
+        self._verificadas_en: Dict[str, float] = {}
+        self._lock = asyncio.Lock()
+        self.parseos = 0
+        self.revalidaciones = 0
+
+    async def obtener(self, zone_codes: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        """{zona_code: {zona_id, group_id, nombre, color, coordinates, centro_lng, centro_lat, bbox}}
+        para las zonas con coordenadas válidas en la tabla zone"""
+        codigos = sorted({str(c) for c in zone_codes if c})
+        if not codigos:
+            return {}
+        if self._vencidas(codigos):
+            async with self._lock:
+                # Otro request pudo revalidarlas mientras se esperaba el lock
+                vencidas = self._vencidas(codigos)
+                if vencidas:
+                    await self._revalidar(vencidas)
+        return {c: self._zonas[c] for c in codigos if c in self._zonas}
+
+    def _vencidas(self, codigos: List[str]) -> List[str]:
+        ahora = time.monotonic()
+        return [c for c in codigos if ahora - self._verificadas_en.get(c, float("-inf")) >= self.revalidar_segundos]
+
+    async def _revalidar(self, codigos: List[str]):
+        self.revalidaciones += 1
+        firmas = {row['zona_code']: row for row in await consultar_async(CONSULTA_FIRMAS, (codigos,))}
+        cambiadas = [c for c, row in firmas.items()
+                     if c not in self._zonas or self._zonas[c]['firma'] != row['firma']]
+
+        coordenadas = {}
+        if cambiadas:
+            for row in await consultar_async(CONSULTA_COORDENADAS, (cambiadas,)):
+                coordenadas[row['zona_code']] = row['coordinates']
+
+        ahora = time.monotonic()
+        for codigo in codigos:
+            self._verificadas_en[codigo] = ahora
+            fila = firmas.get(codigo)
+            if fila is None:
+                # Zona borrada o sin coordenadas: no se cachea geometría
+                self._zonas.pop(codigo, None)
+                continue
+            if codigo in coordenadas:
+                self.parseos += 1
+                geometria = geometria_desde_puntos(parsear_coordenadas_zona(coordenadas[codigo], codigo))
+                self._zonas[codigo] = {"firma": fila['firma'], "geometria": geometria}
+            elif codigo in cambiadas:
+                # Borrada entre la consulta de firmas y la de coordenadas
+                self._zonas.pop(codigo, None)
+                continue
+            entrada = self._zonas[codigo]
+            entrada.update({
+                "zona_code": codigo,
+                "group_id": fila['group_id'],
+                "nombre": fila['nombre'],
+                "color": fila['color']
+            })
+            if entrada['geometria'] is None:
+                log.info("Zona %s (%s) sin geometría válida: menos de 3 coordenadas", codigo, fila['nombre'])
+
+    def invalidar(self, zona_codes: Optional[Iterable[Any]] = None) -> int:
+        """Fuerza la recarga de las zonas indicadas (o de todas) en el próximo uso"""
+        if zona_codes is None:
+            cantidad = len(self._zonas)
+            self._zonas.clear()
+            self._verificadas_en.clear()
+            return cantidad
+        cantidad = 0
+        for codigo in {str(c) for c in zona_codes}:
+            cantidad += self._zonas.pop(codigo, None) is not None
+            self._verificadas_en.pop(codigo, None)
+        return cantidad
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            "zonas": len(self._zonas),
+            "parseos": self.parseos,
+            "revalidaciones": self.revalidaciones,
+            "revalidar_segundos": self.revalidar_segundos
+        }
+
+
+cache_geometrias = CacheGeometriaZonas()
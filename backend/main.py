@@ -1,35 +1,64 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Depends, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
+import asyncio
+import psycopg
 import psycopg2
 from psycopg2.extras import RealDictCursor
-import os
+from psycopg_pool import PoolTimeout
 import math
-from dotenv import load_dotenv
-from typing import List, Dict, Any, Optional
+import os
+from typing import List, Dict, Any, Optional, Tuple
 from pydantic import BaseModel
+try:
+    import msgpack
+except ImportError:  # dependencia opcional: sin ella formato=msgpack responde 406
+    msgpack = None
 from datetime import date, datetime, timedelta
 
-# Cargar variables de entorno
-load_dotenv()
+from registro import obtener_logger, debug_activo, muestrear, ResumenRequest
+from metricas import MiddlewareMetricas, exponer_metricas, observar_resumen, server_timing
+from geometria_zonas import cache_geometrias, geometria_desde_puntos
+from rollup_ventas import fuente_ventas, estado_rollup, iniciar_refresco, detener_refresco
+from ubicaciones_vivo import ubicaciones_vivo, formatear_ubicacion, iniciar_ubicaciones, detener_ubicaciones
+from compresion import MiddlewareCompresion, MiddlewareETag
+import serializacion
+from serializacion import RespuestaJSONRapida, serializar_json
+from cache_respuestas import cache_mapa, cache_teselas, clave_desde_parametros, TTL_MAPA_HISTORICO, TTL_MAPA_ACTUAL
+from agrupamiento import agrupa_en_zoom, agrupar_clientes
+from polilineas import simplificar_linea, codificar_polilinea
+from recorridos import submuestrear_recorrido
+from distancias import calcular_pasos_rutas, distancias_planificada_real, CacheDistanciasRutas
+from optimizacion_rutas import optimizar_orden, optimizar_lote, minutos_de_viaje, cerrar_pool_optimizacion
+from teselas_mvt import (
+    Tesela, CapaMVT, codificar_tesela,
+    longitud_a_tesela, latitud_a_tesela, tesela_a_longitud, tesela_a_latitud
+)
+from conexiones import (
+    obtener_pool, cerrar_pool, PoolAgotadoError,
+    obtener_pool_async, cerrar_pool_async, consultar_async, estadisticas_pool_async,
+    POOL_MAX_TOTAL, POOL_ASYNC_MAX
+)
 
-# Configuración de base de datos
-DB_CONFIG = {
-    "host": os.getenv("DB_HOST"),
-    "port": os.getenv("DB_PORT"), 
-    "database": os.getenv("DB_NAME"),
-    "user": os.getenv("DB_USER"),
-    "password": os.getenv("DB_PASSWORD")
-}
+log = obtener_logger("api")
 
 def get_db_connection():
-    """Crear conexión a PostgreSQL"""
+    """Obtener una conexión a PostgreSQL desde el pool del proceso.
+    Debe devolverse con `release_db_connection`."""
     try:
-        connection = psycopg2.connect(**DB_CONFIG)
-        return connection
+        return obtener_pool().obtener()
+    except PoolAgotadoError as e:
+        log.warning("Pool de conexiones agotado: %s", e)
+        raise HTTPException(status_code=503, detail="Base de datos ocupada, reintente en unos segundos")
     except psycopg2.Error as e:
-        print(f"Error conectando a PostgreSQL: {e}")
+        log.error("Error conectando a PostgreSQL: %s", e)
         raise HTTPException(status_code=500, detail="Error de conexión a la base de datos")
 
+def release_db_connection(connection, descartar: bool = False):
+    """Devolver al pool una conexión obtenida con `get_db_connection`"""
+    obtener_pool().devolver(connection, descartar=descartar)
+
 def execute_query(query: str, params=None) -> List[Dict[str, Any]]:
     """Ejecutar consulta SQL y retornar resultados"""
     connection = None
@@ -38,13 +67,42 @@ def execute_query(query: str, params=None) -> List[Dict[str, Any]]:
         cursor = connection.cursor(cursor_factory=RealDictCursor)
         cursor.execute(query, params)
         results = cursor.fetchall()
+        cursor.close()
         return [dict(row) for row in results]
     except psycopg2.Error as e:
-        print(f"Error ejecutando consulta: {e}")
+        log.error("Error ejecutando consulta: %s", e)
         raise HTTPException(status_code=500, detail=f"Error en consulta SQL: {str(e)}")
     finally:
         if connection:
-            connection.close()
+            release_db_connection(connection)
+
+async def get_db_async():
+    """Dependencia FastAPI para endpoints async: entrega una conexión del pool async
+    (psycopg 3, filas como dict) y la devuelve al terminar el request"""
+    try:
+        pool = await obtener_pool_async()
+        connection = await pool.getconn()
+    except PoolTimeout as e:
+        log.warning("Pool de conexiones async agotado: %s", e)
+        raise HTTPException(status_code=503, detail="Base de datos ocupada, reintente en unos segundos")
+    except psycopg.Error as e:
+        log.error("Error conectando a PostgreSQL: %s", e)
+        raise HTTPException(status_code=500, detail="Error de conexión a la base de datos")
+    try:
+        yield connection
+    finally:
+        await pool.putconn(connection)
+
+async def execute_query_async(query: str, params=None) -> List[Dict[str, Any]]:
+    """Versión async de `execute_query` (no bloquea hilos mientras espera a Postgres)"""
+    try:
+        return await consultar_async(query, params)
+    except PoolTimeout as e:
+        log.warning("Pool de conexiones async agotado: %s", e)
+        raise HTTPException(status_code=503, detail="Base de datos ocupada, reintente en unos segundos")
+    except psycopg.Error as e:
+        log.error("Error ejecutando consulta: %s", e)
+        raise HTTPException(status_code=500, detail=f"Error en consulta SQL: {str(e)}")
 
 app = FastAPI(
     title="Dashboard Rutas API",
@@ -59,8 +117,23 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Cache", "ETag"],
 )
 
+# ETag (hash del contenido) + If-None-Match → 304 en los endpoints de lectura pesados
+RUTAS_CON_ETAG = (
+    "/mapa/rutas", "/zonas", "/vendedores",
+    "/events/{event_id}/ventas", "/vendedores/{user_id}/recorrido", "/route_detail/{route_detail_id}/ventas", "/route_details/ventas",
+    "/ventas_por_zona_comparar"
+)
+app.add_middleware(MiddlewareETag, rutas=RUTAS_CON_ETAG)
+
+# gzip / brotli según Accept-Encoding (ver compresion.py); va por fuera del ETag
+app.add_middleware(MiddlewareCompresion)
+
+# Duración de cada request por endpoint (ver /metrics)
+app.add_middleware(MiddlewareMetricas)
+
 # Modelos Pydantic
 class VentaPorDia(BaseModel):
     fecha: date
@@ -95,160 +168,182 @@ def test_database_connection():
             "message": f"Error de conexión: {str(e)}"
         }
 
-def buscar_ultimo_dia_con_datos(fecha_actual: str, connection) -> str:
-    """Busca el último día con datos disponible antes de la fecha actual"""
-    try:
-        cursor = connection.cursor(cursor_factory=RealDictCursor)
-        
-        # Buscar el último día con datos antes de la fecha actual
-        query = """
-        SELECT r.day
-        FROM public.route r
-        JOIN public.route_detail rd ON rd.route_id = r.id
-        WHERE r.day < %s
-          AND rd.visit_sequence IS NOT NULL
-        GROUP BY r.day
-        HAVING COUNT(*) > 0
-        ORDER BY r.day DESC
-        LIMIT 1
-        """
-        
-        cursor.execute(query, (fecha_actual,))
-        resultado = cursor.fetchone()
-        
-        if resultado:
-            return resultado['day'].strftime('%Y-%m-%d')
-        else:
-            # Si no encuentra, devolver 7 días atrás como fallback
-            fecha_dt = datetime.strptime(fecha_actual, '%Y-%m-%d')
-            return (fecha_dt - timedelta(days=7)).strftime('%Y-%m-%d')
-            
-    except Exception as e:
-        print(f"⚠️  Error buscando último día con datos: {e}")
-        # Fallback: 7 días atrás
-        fecha_dt = datetime.strptime(fecha_actual, '%Y-%m-%d')
-        return (fecha_dt - timedelta(days=7)).strftime('%Y-%m-%d')
+@app.get("/db/pool")
+def estadisticas_pool():
+    """Estado de los pools de conexiones (en uso, esperando, latencia de checkout) para dimensionarlos.
+    `total`: conexiones del proceso sumando los dos pools contra el tope DB_POOL_MAX"""
+    sync = obtener_pool().estadisticas()
+    asincrono = estadisticas_pool_async()
+    return {
+        "sync": sync,
+        "async": asincrono,
+        "total": {
+            "max": POOL_MAX_TOTAL,
+            "abiertas": sync["abiertas"] + asincrono.get("pool_size", 0)
+        }
+    }
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    """Métricas en formato de exposición de Prometheus"""
+    return PlainTextResponse(exponer_metricas(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+def cerrar_resumen(resumen: ResumenRequest, headers: Dict[str, str]) -> Dict[str, str]:
+    """Registra el resumen del request (log + métricas) y agrega Server-Timing si está activo"""
+    resumen.registrar(log)
+    observar_resumen(resumen)
+    timing = server_timing(resumen)
+    if timing:
+        headers["Server-Timing"] = timing
+        headers["Timing-Allow-Origin"] = "*"
+    return headers
+
+@app.get("/db/rollup")
+def estado_rollup_ventas():
+    """Estado del rollup diario de ventas por zona/vendedor"""
+    return estado_rollup()
+
+@app.on_event("startup")
+async def iniciar_tareas():
+    iniciar_refresco()
+    iniciar_ubicaciones()
+
+@app.on_event("shutdown")
+async def cerrar_conexiones():
+    await detener_refresco()
+    await detener_ubicaciones()
+    cerrar_pool_optimizacion()
+    cerrar_pool()
+    await cerrar_pool_async()
+
 @app.get("/route_details_with_events")
 def get_route_details_with_events():
     # Implementación de la función para obtener detalles de la ruta con eventos
     pass
 
-def obtener_ventas_anteriores_por_zona(fecha_actual: str, connection) -> dict:
-    """Obtiene las últimas ventas de cada zona específica antes de la fecha actual"""
+async def obtener_ventas_anteriores_por_zona(fecha_actual: str) -> dict:
+    """Obtiene las últimas ventas de cada zona específica antes de la fecha actual.
+    Resuelve todas las zonas con una sola consulta (DISTINCT ON zone_code) en lugar de una por zona,
+    sobre el rollup diario de ventas (ver rollup_ventas)."""
     try:
-        cursor = connection.cursor(cursor_factory=RealDictCursor)
-        
-        # Obtener todas las zonas que tienen ventas hoy
-        query_zonas_actuales = """
-        SELECT DISTINCT rzd.zone_code
-        FROM public.route r
-        JOIN public.route_detail rd ON rd.route_id = r.id
-        LEFT JOIN public.route_zone_detail rzd ON rzd.route_id = r.id
-        WHERE r.day = %s 
-          AND rzd.zone_code IS NOT NULL
-          AND rd.visit_sequence IS NOT NULL
+        # Zonas que tienen visitas en la fecha actual y, para cada una, el último día
+        # anterior con ventas > 0 (monto y clientes visitados distintos de ese día)
+        query = f"""
+        WITH ventas AS NOT MATERIALIZED (
+            SELECT * FROM {fuente_ventas()} r WHERE r.zone_code <> ''
+        ),
+        zonas_actuales AS (
+            SELECT DISTINCT zone_code
+            FROM ventas
+            WHERE day = %s
+              AND visitas > 0
+        ),
+        ventas_diarias AS (
+            SELECT
+                v.zone_code,
+                v.day as fecha_ultima,
+                SUM(v.ventas) as ventas_anteriores
+            FROM ventas v
+            WHERE v.zone_code IN (SELECT zone_code FROM zonas_actuales)
+              AND v.day < %s
+            GROUP BY v.zone_code, v.day
+            HAVING SUM(v.ventas) > 0
+        ),
+        ultima AS (
+            SELECT DISTINCT ON (za.zone_code)
+                za.zone_code,
+                vd.fecha_ultima,
+                vd.ventas_anteriores
+            FROM zonas_actuales za
+            LEFT JOIN ventas_diarias vd ON vd.zone_code = za.zone_code
+            ORDER BY za.zone_code, vd.fecha_ultima DESC NULLS LAST
+        )
+        SELECT
+            u.*,
+            (SELECT COUNT(DISTINCT c.codigo)
+             FROM ventas v, unnest(v.clientes_visitados) AS c(codigo)
+             WHERE v.zone_code = u.zone_code AND v.day = u.fecha_ultima) as clientes_anteriores
+        FROM ultima u
+        ORDER BY u.zone_code
         """
         
-        cursor.execute(query_zonas_actuales, (fecha_actual,))
-        zonas_actuales = [row['zone_code'] for row in cursor.fetchall()]
+        filas = await consultar_async(query, (fecha_actual, fecha_actual))
         
         ventas_por_zona = {}
-        
-        # Para cada zona, buscar su última venta
-        for zona_code in zonas_actuales:
-            query_ultima_venta = """
-            SELECT 
-                r.day as fecha_ultima,
-                SUM(CASE WHEN rd.visit_sequence IS NOT NULL AND rd.invoice_amount > 0 THEN rd.invoice_amount ELSE 0 END) as ventas_anteriores,
-                COUNT(DISTINCT rd.subject_code) as clientes_anteriores
-            FROM public.route r
-            JOIN public.route_detail rd ON rd.route_id = r.id
-            LEFT JOIN public.route_zone_detail rzd ON rzd.route_id = r.id
-            WHERE rzd.zone_code = %s 
-              AND r.day < %s
-              AND rd.visit_sequence IS NOT NULL
-            GROUP BY r.day
-            HAVING SUM(CASE WHEN rd.visit_sequence IS NOT NULL AND rd.invoice_amount > 0 THEN rd.invoice_amount ELSE 0 END) > 0
-            ORDER BY r.day DESC
-            LIMIT 1
-            """
-            
-            cursor.execute(query_ultima_venta, (zona_code, fecha_actual))
-            resultado = cursor.fetchone()
-            
-            if resultado:
+        detalle = debug_activo(log)
+        for resultado in filas:
+            zona_code = resultado['zone_code']
+            if resultado['fecha_ultima'] is not None:
                 ventas_por_zona[zona_code] = {
                     'ventas': float(resultado['ventas_anteriores']),
                     'fecha': resultado['fecha_ultima'].strftime('%Y-%m-%d'),
                     'clientes': int(resultado['clientes_anteriores'])
                 }
-                print(f"🔍 Zona {zona_code}: Última venta ₱{resultado['ventas_anteriores']:,.0f} en {resultado['fecha_ultima']}")
+                if detalle:
+                    log.debug("Zona %s: última venta %.0f en %s", zona_code, resultado['ventas_anteriores'], resultado['fecha_ultima'])
             else:
                 ventas_por_zona[zona_code] = {
                     'ventas': 0.0,
                     'fecha': None,
                     'clientes': 0
                 }
-                print(f"⚠️ Zona {zona_code}: No se encontró venta anterior")
+                if detalle:
+                    log.debug("Zona %s: no se encontró venta anterior", zona_code)
         
         return ventas_por_zona
             
     except Exception as e:
-        print(f"⚠️ Error obteniendo ventas por zona: {e}")
+        log.warning("Error obteniendo ventas por zona: %s", e)
         return {}
 
 
-def obtener_ventas_por_zonas_rango(connection, fecha_inicio: str, fecha_fin: str, filtro_vendedor: str = "") -> dict:
+async def obtener_ventas_por_zonas_rango(fecha_inicio: str, fecha_fin: str, filtro_vendedor: str = "") -> dict:
     """Helper: retorna un diccionario {zone_code: ventas} con la sumatoria de invoice_amount
     para cada zona entre fecha_inicio y fecha_fin (inclusive).
-    - connection: conexión abierta a la base de datos (psycopg2 connection)
     - fecha_inicio / fecha_fin: strings 'YYYY-MM-DD'
     - filtro_vendedor: cadena SQL adicional como " AND r.user_id = X" (opcional)
     """
     ventas_por_zona = {}
     try:
-        cursor = connection.cursor(cursor_factory=RealDictCursor)
         consulta = f"""
-        SELECT COALESCE(rzd.zone_code, 'unknown') as zone_code,
-               COALESCE(SUM(CASE WHEN rd.visit_sequence IS NOT NULL AND rd.invoice_amount > 0 THEN rd.invoice_amount ELSE 0 END), 0) as ventas
-        FROM public.route r
-        JOIN public.route_detail rd ON rd.route_id = r.id
-        LEFT JOIN public.route_zone_detail rzd ON rzd.route_id = r.id
+        SELECT r.zone_code,
+               COALESCE(SUM(r.ventas), 0) as ventas
+        FROM {fuente_ventas()} r
         WHERE r.day >= %s AND r.day <= %s
         {filtro_vendedor}
-        AND rzd.zone_code IS NOT NULL
-        GROUP BY rzd.zone_code
+        AND r.zone_code <> ''
+        GROUP BY r.zone_code
         """
 
-        cursor.execute(consulta, (fecha_inicio, fecha_fin))
-        rows = cursor.fetchall()
+        rows = await consultar_async(consulta, (fecha_inicio, fecha_fin))
         for row in rows:
             ventas_por_zona[row['zone_code']] = float(row['ventas'] or 0)
 
         return ventas_por_zona
     except Exception as e:
-        print(f"⚠️ Error en obtener_ventas_por_zonas_rango: {e}")
+        log.warning("Error en obtener_ventas_por_zonas_rango: %s", e)
         return {}
 
 
-def fetch_events_for_route_details(connection, rd_ids: List[int]) -> Dict[int, Dict[str, Any]]:
+# Eventos tipo 1 (inicio) y 2 (fin) de un lote de route_detail_ids
+SQL_EVENTOS_INICIO_FIN = """
+        SELECT route_detail_id, event_type_id, event_date, latitude, longitude, comments, distance_event_customer
+        FROM public.event
+        WHERE route_detail_id = ANY(%s)
+          AND event_type_id IN (1,2)
+        ORDER BY route_detail_id, event_type_id, event_date ASC, id
+        """
+
+
+async def fetch_events_for_route_details(rd_ids: List[int]) -> Dict[int, Dict[str, Any]]:
     """Devuelve un mapping { route_detail_id: {'start': event_row or None, 'end': event_row or None} }
     donde 'start' es el primer evento tipo 1 y 'end' es el primer evento tipo 2 para ese route_detail_id.
     """
     if not rd_ids:
         return {}
     try:
-        cursor = connection.cursor(cursor_factory=RealDictCursor)
         # Traer eventos tipo 1 y 2 para los route_detail_ids dados
-        query = """
-        SELECT route_detail_id, event_type_id, event_date, latitude, longitude, comments, distance_event_customer
-        FROM public.event
-        WHERE route_detail_id = ANY(%s)
-          AND event_type_id IN (1,2)
-        ORDER BY route_detail_id, event_type_id, event_date ASC
-        """
-        cursor.execute(query, (rd_ids,))
-        rows = cursor.fetchall()
+        rows = await consultar_async(SQL_EVENTOS_INICIO_FIN, (rd_ids,))
 
         mapping: Dict[int, Dict[str, Any]] = {}
         for r in rows:
@@ -262,7 +357,7 @@ def fetch_events_for_route_details(connection, rd_ids: List[int]) -> Dict[int, D
 
         return mapping
     except Exception as e:
-        print(f"⚠️ Error fetch_events_for_route_details: {e}")
+        log.warning("Error en fetch_events_for_route_details: %s", e)
         return {}
 
 def calcular_fechas_comparacion(fecha_inicio: str, fecha_fin: str) -> dict:
@@ -288,1217 +383,1853 @@ def calcular_fechas_comparacion(fecha_inicio: str, fecha_fin: str) -> dict:
         'tipo_comparacion': 'semana_anterior'
     }
 
-def obtener_kpis_cliente(subject_code: str, connection, fecha_actual: str, filtro_vendedor: str = "") -> dict:
-    """Calcula KPIs avanzados para un cliente específico"""
-    try:
-        cursor = connection.cursor(cursor_factory=RealDictCursor)
-        
-        # Obtener historial del cliente (últimos 3 meses)
-        query_historial = f"""
-        SELECT 
-            r.day,
-            rd.invoice_amount,
-            rd.order_amount,
-            rd.visit_sequence,
-            ROW_NUMBER() OVER (ORDER BY r.day DESC) as visita_orden
-        FROM public.route r
-        JOIN public.route_detail rd ON rd.route_id = r.id
-        WHERE rd.subject_code = %s
-          AND r.day >= DATE_TRUNC('month', CURRENT_DATE) - INTERVAL '3 months'
-          AND rd.visit_sequence IS NOT NULL
-        {filtro_vendedor}
-        ORDER BY r.day DESC
-        LIMIT 10
-        """
-        
-        cursor.execute(query_historial, (subject_code,))
-        historial = cursor.fetchall()
-        
-        if not historial:
-            return {
-                'venta_anterior': 0,
-                'promedio_cliente': 0,
-                'vs_promedio': 0,
-                'vs_anterior': 0,
-                'visitas_mes': 0,
-                'tendencia': 'sin_datos'
-            }
-        
-        # Calcular estadísticas
-        # historial está ordenado por r.day DESC (más reciente primero)
-        ventas_all = [float(h['invoice_amount'] or 0) for h in historial]
-        venta_actual = ventas_all[0] if ventas_all else 0
-
-        # Venta anterior: buscar la próxima venta NO CERO en el historial (la última facturación)
-        venta_anterior = 0
-        for v in ventas_all[1:]:
-            if v > 0:
-                venta_anterior = v
-                break
-
-        # Promedio del cliente: promediar sólo las visitas que tuvieron ventas (>0)
-        ventas_positivas = [v for v in ventas_all if v > 0]
-        promedio_cliente = sum(ventas_positivas) / len(ventas_positivas) if ventas_positivas else 0
-        visitas_mes = len(historial)
-        
-        # Comparaciones
-        vs_anterior = 0
-        if venta_anterior > 0:
-            vs_anterior = ((venta_actual - venta_anterior) / venta_anterior) * 100
-        
-        vs_promedio = 0
-        if promedio_cliente > 0:
-            vs_promedio = ((venta_actual - promedio_cliente) / promedio_cliente) * 100
-        
-        # Determinar tendencia usando las últimas 3 ventas reales (no-cero) si existen
-        if len(ventas_positivas) >= 3:
-            ultimas_3 = ventas_positivas[:3]
-            if ultimas_3[0] > ultimas_3[1] > ultimas_3[2]:
-                tendencia = 'creciente'
-            elif ultimas_3[0] < ultimas_3[1] < ultimas_3[2]:
-                tendencia = 'decreciente'
-            else:
-                tendencia = 'estable'
+KPIS_CLIENTE_VACIOS = {
+    'venta_anterior': 0,
+    'promedio_cliente': 0,
+    'vs_promedio': 0,
+    'vs_anterior': 0,
+    'visitas_mes': 0,
+    'tendencia': 'sin_datos'
+}
+
+def _calcular_kpis_desde_historial(historial: List[Dict[str, Any]]) -> dict:
+    """Calcula los KPIs de un cliente a partir de su historial de visitas
+    (máximo 10 filas, ordenadas por r.day DESC: más reciente primero)"""
+    if not historial:
+        return dict(KPIS_CLIENTE_VACIOS)
+
+    # Calcular estadísticas
+    ventas_all = [float(h['invoice_amount'] or 0) for h in historial]
+    venta_actual = ventas_all[0] if ventas_all else 0
+
+    # Venta anterior: buscar la próxima venta NO CERO en el historial (la última facturación)
+    venta_anterior = 0
+    for v in ventas_all[1:]:
+        if v > 0:
+            venta_anterior = v
+            break
+
+    # Promedio del cliente: promediar sólo las visitas que tuvieron ventas (>0)
+    ventas_positivas = [v for v in ventas_all if v > 0]
+    promedio_cliente = sum(ventas_positivas) / len(ventas_positivas) if ventas_positivas else 0
+    visitas_mes = len(historial)
+
+    # Comparaciones
+    vs_anterior = 0
+    if venta_anterior > 0:
+        vs_anterior = ((venta_actual - venta_anterior) / venta_anterior) * 100
+
+    vs_promedio = 0
+    if promedio_cliente > 0:
+        vs_promedio = ((venta_actual - promedio_cliente) / promedio_cliente) * 100
+
+    # Determinar tendencia usando las últimas 3 ventas reales (no-cero) si existen
+    if len(ventas_positivas) >= 3:
+        ultimas_3 = ventas_positivas[:3]
+        if ultimas_3[0] > ultimas_3[1] > ultimas_3[2]:
+            tendencia = 'creciente'
+        elif ultimas_3[0] < ultimas_3[1] < ultimas_3[2]:
+            tendencia = 'decreciente'
         else:
-            tendencia = 'pocos_datos'
-        
-        return {
-            'venta_anterior': round(venta_anterior, 2),
-            'promedio_cliente': round(promedio_cliente, 2),
-            'vs_promedio': round(vs_promedio, 2),
-            'vs_anterior': round(vs_anterior, 2),
-            'visitas_mes': visitas_mes,
-            'tendencia': tendencia
-        }
-        
+            tendencia = 'estable'
+    else:
+        tendencia = 'pocos_datos'
+
+    return {
+        'venta_anterior': round(venta_anterior, 2),
+        'promedio_cliente': round(promedio_cliente, 2),
+        'vs_promedio': round(vs_promedio, 2),
+        'vs_anterior': round(vs_anterior, 2),
+        'visitas_mes': visitas_mes,
+        'tendencia': tendencia
+    }
+
+def sql_historial_clientes(filtro_vendedor: str = "") -> str:
+    """Últimas 10 visitas (últimos 3 meses) por cliente para un lote de subject_codes (%s = lista)"""
+    return f"""
+        SELECT subject_code, day, invoice_amount, order_amount, visit_sequence, visita_orden
+        FROM (
+            SELECT
+                rd.subject_code,
+                r.day,
+                rd.invoice_amount,
+                rd.order_amount,
+                rd.visit_sequence,
+                ROW_NUMBER() OVER (PARTITION BY rd.subject_code ORDER BY r.day DESC, rd.id DESC) as visita_orden
+            FROM public.route r
+            JOIN public.route_detail rd ON rd.route_id = r.id
+            WHERE rd.subject_code = ANY(%s)
+              AND r.day >= DATE_TRUNC('month', CURRENT_DATE) - INTERVAL '3 months'
+              AND rd.visit_sequence IS NOT NULL
+            {filtro_vendedor}
+        ) h
+        WHERE h.visita_orden <= 10
+        ORDER BY subject_code, visita_orden
+    """
+
+
+async def obtener_kpis_clientes(subject_codes: List[str], filtro_vendedor: str = "") -> Dict[str, dict]:
+    """KPIs avanzados de muchos clientes: trae en una sola consulta las últimas
+    10 visitas (últimos 3 meses) de cada cliente y calcula los KPIs en memoria.
+    Devuelve {subject_code: kpis}.
+    """
+    codigos = sorted({c for c in subject_codes if c})
+    if not codigos:
+        return {}
+    try:
+        query_historial = sql_historial_clientes(filtro_vendedor)
+        historial_por_cliente: Dict[str, List[Dict[str, Any]]] = {}
+        for row in await consultar_async(query_historial, (codigos,)):
+            historial_por_cliente.setdefault(row['subject_code'], []).append(row)
+
+        return {c: _calcular_kpis_desde_historial(historial_por_cliente.get(c, [])) for c in codigos}
+
     except Exception as e:
-        print(f"⚠️ Error calculando KPIs para cliente {subject_code}: {e}")
-        return {
-            'venta_anterior': 0,
-            'promedio_cliente': 0,
-            'vs_promedio': 0,
-            'vs_anterior': 0,
-            'visitas_mes': 0,
-            'tendencia': 'error'
-        }
+        log.warning("Error calculando KPIs para %d clientes: %s", len(codigos), e)
+        return {c: dict(KPIS_CLIENTE_VACIOS, tendencia='error') for c in codigos}
+
+DIAS_SEMANA = ["lunes", "martes", "miercoles", "jueves", "viernes", "sabado", "domingo"]
+
+# Mapeo de colores por día de la semana
+DIA_COLORES = {
+    "lunes": "#ef4444",     # Rojo
+    "martes": "#f97316",    # Naranja
+    "miercoles": "#eab308", # Amarillo
+    "jueves": "#22c55e",    # Verde
+    "viernes": "#3b82f6",   # Azul
+    "sabado": "#8b5cf6",    # Violeta
+    "domingo": "#ec4899"    # Rosa
+}
 
-@app.get("/mapa/rutas")
-def get_mapa_rutas(
-    periodo: str = "dia",  # dia, semana, mes, año
-    fecha_inicio: Optional[str] = None,
-    fecha_fin: Optional[str] = None,
-    vendedor_id: Optional[int] = None,
-    vendedor_ids: Optional[List[int]] = Query(None),
-    dia_semana: Optional[str] = None,  # lunes, martes, miercoles, jueves, viernes, sabado, domingo
-    compact: bool = False  # si True devuelve versión reducida (menos campos) para disminuir payload
-):
-    """Datos de rutas reales desde PostgreSQL para visualización en mapa con filtros"""
+ESTADISTICAS_MAPA_VACIAS = {
+    "total_clientes_planificados": 0,
+    "total_clientes_visitados": 0,
+    "clientes_no_visitados": 0,
+    "visitas_no_planificadas": 0,
+    "ventas_totales": 0,
+    "distancia_total_planificada": 0,
+    "distancia_total_real": 0,
+    "zonas_activas": 0,
+    "km_recorridos": 0
+}
+
+# Rango válido de coordenadas (Paraguay): los puntos fuera de este rango no se dibujan
+RANGO_LATITUD = (-28.0, -19.0)
+RANGO_LONGITUD = (-63.0, -54.0)
+ZOOM_MAXIMO = 22
+
+def parsear_bbox(bbox: Optional[str], zoom: Optional[int]) -> Optional[Tuple[float, float, float, float]]:
+    """`bbox` = "minLng,minLat,maxLng,maxLat" (lo que da mapbox con getBounds().toArray().flat()).
+    Con `zoom` el bbox se agranda hasta los bordes de las teselas XYZ de ese zoom que lo cubren:
+    los paneos chicos dentro de las mismas teselas piden el mismo bbox (misma entrada de cache)
+    y el mapa ya tiene los puntos de alrededor. Error 400 si el formato o los valores no sirven;
+    el rango de `zoom` (0..ZOOM_MAXIMO) lo valida cada endpoint con Query."""
+    if not bbox:
+        return None
     try:
-        # Construir filtros de fecha según el período - USANDO CAMPO 'day' NO 'creation_date'
-        if fecha_inicio and fecha_fin:
-            condicion_fecha = f"r.day >= '{fecha_inicio}' AND r.day <= '{fecha_fin}'"
-        elif periodo == "dia":
-            condicion_fecha = "r.day = CURRENT_DATE"
+        min_lng, min_lat, max_lng, max_lat = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox debe ser 'minLng,minLat,maxLng,maxLat'")
+    if not all(math.isfinite(v) for v in (min_lng, min_lat, max_lng, max_lat)) \
+            or not (-180 <= min_lng < max_lng <= 180 and -90 <= min_lat < max_lat <= 90):
+        raise HTTPException(status_code=400, detail="bbox fuera de rango o con mínimos mayores que máximos")
+    if zoom is not None:
+        n = 2 ** zoom
+        x_min = math.floor(longitud_a_tesela(min_lng, n))
+        x_max = min(n, math.floor(longitud_a_tesela(max_lng, n)) + 1)
+        y_min = math.floor(latitud_a_tesela(max_lat, n))  # y crece hacia el sur
+        y_max = min(n, math.floor(latitud_a_tesela(min_lat, n)) + 1)
+        min_lng, max_lng = tesela_a_longitud(x_min, n), tesela_a_longitud(x_max, n)
+        max_lat, min_lat = tesela_a_latitud(y_min, n), tesela_a_latitud(y_max, n)
+    return tuple(round(v, 6) for v in (min_lng, min_lat, max_lng, max_lat))
+
+def rango_coordenadas(bbox: Optional[Tuple[float, float, float, float]] = None) -> Tuple[float, float, float, float]:
+    """(lat_min, lat_max, lng_min, lng_max): el rango de Paraguay recortado al bbox si se pide"""
+    lat_min, lat_max = RANGO_LATITUD
+    lng_min, lng_max = RANGO_LONGITUD
+    if bbox:
+        lng_min, lng_max = max(lng_min, bbox[0]), min(lng_max, bbox[2])
+        lat_min, lat_max = max(lat_min, bbox[1]), min(lat_max, bbox[3])
+    return lat_min, lat_max, lng_min, lng_max
+
+def sql_filtro_coordenadas(bbox: Optional[Tuple[float, float, float, float]] = None) -> str:
+    """Coordenada efectiva (ver sql_filas_rutas) dentro de Paraguay y, si se pide, del bbox del mapa"""
+    lat_min, lat_max, lng_min, lng_max = rango_coordenadas(bbox)
+    return (f" AND coord.latitud BETWEEN {lat_min} AND {lat_max}"
+            f" AND coord.longitud BETWEEN {lng_min} AND {lng_max}")
+
+def sql_prefiltro_bbox(bbox: Optional[Tuple[float, float, float, float]] = None) -> str:
+    """JOIN de sql_filas_rutas que, con bbox, deja sólo los route_detail con alguna coordenada
+    cruda adentro: la propia o la de alguno de sus eventos de inicio. Es condición necesaria para
+    que la coordenada efectiva caiga en el bbox y sale de índices sobre las columnas crudas
+    (ix_route_detail_coordenadas, ix_event_inicio_lat_lng) en lugar de resolver el evento de
+    inicio de cada fila del período. El filtro exacto sigue siendo `sql_filtro_coordenadas`."""
+    if not bbox:
+        return ""
+    lat_min, lat_max, lng_min, lng_max = rango_coordenadas(bbox)
+    return f"""
+    JOIN (
+        SELECT rdb.id
+        FROM public.route_detail rdb
+        WHERE rdb.latitude BETWEEN {lat_min} AND {lat_max} AND rdb.longitude BETWEEN {lng_min} AND {lng_max}
+        UNION
+        SELECT eb.route_detail_id
+        FROM public.event eb
+        WHERE eb.event_type_id = 1
+          AND eb.latitude BETWEEN {lat_min} AND {lat_max} AND eb.longitude BETWEEN {lng_min} AND {lng_max}
+    ) en_bbox ON en_bbox.id = rd.id"""
+
+def construir_filtros_mapa(
+    periodo: str,
+    fecha_inicio: Optional[str],
+    fecha_fin: Optional[str],
+    vendedor_id: Optional[int],
+    vendedor_ids: Optional[List[int]],
+    dia_semana: Optional[str],
+    bbox: Optional[Tuple[float, float, float, float]] = None
+) -> dict:
+    """Traduce los parámetros de /mapa/rutas a fragmentos SQL (sobre r.day, r.user_id y la
+    coordenada efectiva de cada cliente) y a las fechas del período actual y de comparación.
+    `bbox` es el resultado de `parsear_bbox`."""
+    # Construir filtros de fecha según el período - USANDO CAMPO 'day' NO 'creation_date'
+    if fecha_inicio and fecha_fin:
+        condicion_fecha = f"r.day >= '{fecha_inicio}' AND r.day <= '{fecha_fin}'"
+    elif periodo == "dia":
+        condicion_fecha = "r.day = CURRENT_DATE"
+    elif periodo == "semana":
+        condicion_fecha = "r.day >= CURRENT_DATE - INTERVAL '7 days' AND r.day <= CURRENT_DATE"
+    elif periodo == "mes":
+        condicion_fecha = "r.day >= DATE_TRUNC('month', CURRENT_DATE) AND r.day < DATE_TRUNC('month', CURRENT_DATE) + INTERVAL '1 month'"
+    elif periodo == "año":
+        condicion_fecha = "r.day >= DATE_TRUNC('year', CURRENT_DATE) AND r.day < DATE_TRUNC('year', CURRENT_DATE) + INTERVAL '1 year'"
+    else:
+        # Por defecto últimos 30 días
+        condicion_fecha = "r.day >= CURRENT_DATE - INTERVAL '30 days' AND r.day <= CURRENT_DATE"
+
+    # Filtro por vendedor específico - se acepta un único `vendedor_id` o múltiples `vendedor_ids`
+    filtro_vendedor = ""
+    if vendedor_ids:
+        # FastAPI valida que los elementos sean ints; construir lista segura
+        ids_list = ",".join(str(int(x)) for x in vendedor_ids)
+        filtro_vendedor = f" AND r.user_id IN ({ids_list})"
+    elif vendedor_id:
+        filtro_vendedor = f" AND r.user_id = {vendedor_id}"
+
+    # Filtro por día de la semana específico - USANDO CAMPO 'day'
+    filtro_dia_semana = ""
+    if dia_semana:
+        dias_map = {
+            "lunes": 1, "martes": 2, "miercoles": 3, "jueves": 4,
+            "viernes": 5, "sabado": 6, "domingo": 0
+        }
+        if dia_semana.lower() in dias_map:
+            dia_numero = dias_map[dia_semana.lower()]
+            filtro_dia_semana = f" AND EXTRACT(DOW FROM r.day) = {dia_numero}"
+
+    filtro_coordenadas = sql_filtro_coordenadas(bbox)
+    prefiltro_bbox = sql_prefiltro_bbox(bbox)
+
+    # Calcular fechas de comparación inteligentes
+    fechas_comp = None
+    if fecha_inicio and fecha_fin:
+        fechas_comp = calcular_fechas_comparacion(fecha_inicio, fecha_fin)
+    elif periodo == "dia":
+        # Para hoy, comparar con el mismo día de la semana pasada
+        hoy = datetime.now().date()
+        comp_fecha = hoy - timedelta(days=7)
+        fechas_comp = {
+            'comp_inicio': comp_fecha.strftime('%Y-%m-%d'),
+            'comp_fin': comp_fecha.strftime('%Y-%m-%d'),
+            'tipo_comparacion': 'mismo_dia_semana_anterior'
+        }
+
+    # Determinar fechas reales del período actual
+    if fecha_inicio and fecha_fin:
+        fecha_real_inicio = fecha_inicio
+        fecha_real_fin = fecha_fin
+    else:
+        # Calcular fechas basado en el período
+        hoy = datetime.now()
+        if periodo == "dia":
+            fecha_real_inicio = hoy.strftime('%Y-%m-%d')
+            fecha_real_fin = hoy.strftime('%Y-%m-%d')
         elif periodo == "semana":
-            condicion_fecha = "r.day >= CURRENT_DATE - INTERVAL '7 days' AND r.day <= CURRENT_DATE"
+            inicio_semana = hoy - timedelta(days=7)
+            fecha_real_inicio = inicio_semana.strftime('%Y-%m-%d')
+            fecha_real_fin = hoy.strftime('%Y-%m-%d')
         elif periodo == "mes":
-            condicion_fecha = "r.day >= DATE_TRUNC('month', CURRENT_DATE) AND r.day < DATE_TRUNC('month', CURRENT_DATE) + INTERVAL '1 month'"
-        elif periodo == "año":
-            condicion_fecha = "r.day >= DATE_TRUNC('year', CURRENT_DATE) AND r.day < DATE_TRUNC('year', CURRENT_DATE) + INTERVAL '1 year'"
+            inicio_mes = hoy.replace(day=1)
+            fecha_real_inicio = inicio_mes.strftime('%Y-%m-%d')
+            fecha_real_fin = hoy.strftime('%Y-%m-%d')
+        elif periodo == "ano":
+            inicio_ano = hoy.replace(month=1, day=1)
+            fecha_real_inicio = inicio_ano.strftime('%Y-%m-%d')
+            fecha_real_fin = hoy.strftime('%Y-%m-%d')
         else:
             # Por defecto últimos 30 días
-            condicion_fecha = "r.day >= CURRENT_DATE - INTERVAL '30 days' AND r.day <= CURRENT_DATE"
-        
-        # Filtro por vendedor específico - se acepta un único `vendedor_id` o múltiples `vendedor_ids`
-        filtro_vendedor = ""
-        if vendedor_ids:
-            # FastAPI valida que los elementos sean ints; construir lista segura
-            ids_list = ",".join(str(int(x)) for x in vendedor_ids)
-            filtro_vendedor = f" AND r.user_id IN ({ids_list})"
-        elif vendedor_id:
-            filtro_vendedor = f" AND r.user_id = {vendedor_id}"
-        
-        # Filtro por día de la semana específico - USANDO CAMPO 'day'
-        filtro_dia_semana = ""
-        if dia_semana:
-            dias_map = {
-                "lunes": 1, "martes": 2, "miercoles": 3, "jueves": 4,
-                "viernes": 5, "sabado": 6, "domingo": 0
-            }
-            if dia_semana.lower() in dias_map:
-                dia_numero = dias_map[dia_semana.lower()]
-                filtro_dia_semana = f" AND EXTRACT(DOW FROM r.day) = {dia_numero}"
-        
-        # Calcular fechas de comparación inteligentes
-        fechas_comp = None
-        if fecha_inicio and fecha_fin:
-            fechas_comp = calcular_fechas_comparacion(fecha_inicio, fecha_fin)
-            condicion_fecha_comp = f"r.day >= '{fechas_comp['comp_inicio']}' AND r.day <= '{fechas_comp['comp_fin']}'"
-        elif periodo == "dia":
-            # Para hoy, comparar con el mismo día de la semana pasada
-            hoy = datetime.now().date()
-            comp_fecha = hoy - timedelta(days=7)
-            fechas_comp = {
-                'comp_inicio': comp_fecha.strftime('%Y-%m-%d'),
-                'comp_fin': comp_fecha.strftime('%Y-%m-%d'),
-                'tipo_comparacion': 'mismo_dia_semana_anterior'
+            inicio_30_dias = hoy - timedelta(days=30)
+            fecha_real_inicio = inicio_30_dias.strftime('%Y-%m-%d')
+            fecha_real_fin = hoy.strftime('%Y-%m-%d')
+
+    # Calcular período anterior (mismo rango de fechas pero período anterior)
+    inicio_dt = datetime.strptime(fecha_real_inicio, '%Y-%m-%d')
+    fin_dt = datetime.strptime(fecha_real_fin, '%Y-%m-%d')
+    diferencia_dias = (fin_dt - inicio_dt).days + 1
+
+    # Calcular fechas del período anterior usando lógica inteligente
+    if periodo == "dia" or diferencia_dias == 1:
+        # Para día específico, primero intentamos comparar con el mismo día de la semana pasada
+        # y luego, por zona, si no hay ventas en esa fecha, usamos la última fecha con datos de esa zona
+        comp_fecha = (inicio_dt - timedelta(days=7)).strftime('%Y-%m-%d')
+        fecha_anterior_inicio = comp_fecha
+        fecha_anterior_fin = comp_fecha
+    elif fechas_comp:
+        # Semana o períodos más largos: usar comparación inteligente
+        fecha_anterior_inicio = fechas_comp['comp_inicio']
+        fecha_anterior_fin = fechas_comp['comp_fin']
+    elif periodo == "semana" or diferencia_dias <= 7:
+        # Para semana, comparar con la semana anterior
+        fecha_anterior_inicio = (inicio_dt - timedelta(days=7)).strftime('%Y-%m-%d')
+        fecha_anterior_fin = (fin_dt - timedelta(days=7)).strftime('%Y-%m-%d')
+    else:
+        fecha_anterior_inicio = (inicio_dt - timedelta(days=diferencia_dias)).strftime('%Y-%m-%d')
+        fecha_anterior_fin = (inicio_dt - timedelta(days=1)).strftime('%Y-%m-%d')
+
+    return {
+        'condicion_fecha': condicion_fecha,
+        'filtro_vendedor': filtro_vendedor,
+        'filtro_dia_semana': filtro_dia_semana,
+        'filtro_coordenadas': filtro_coordenadas,
+        'prefiltro_bbox': prefiltro_bbox,
+        'fechas_comp': fechas_comp,
+        'fecha_real_inicio': fecha_real_inicio,
+        'fecha_real_fin': fecha_real_fin,
+        'fecha_anterior_inicio': fecha_anterior_inicio,
+        'fecha_anterior_fin': fecha_anterior_fin,
+        'diferencia_dias': diferencia_dias
+    }
+
+def sql_filas_rutas(filtros: dict, orden: str = "r.day DESC, rd.visit_sequence NULLS LAST") -> str:
+    """SQL de la consulta principal de /mapa/rutas con los filtros de `construir_filtros_mapa`.
+    La coordenada de cada cliente (coord_latitud/coord_longitud) se resuelve acá: la del primer
+    evento de inicio si es válida (no nula ni 0), si no la de route_detail. El rango de Paraguay y
+    el bbox se filtran sobre esa coordenada, así las filas que no se dibujan no salen de la base.
+    Con bbox, `prefiltro_bbox` descarta antes por índice los route_detail que no pueden caer adentro."""
+    # Consulta principal de rutas con información de zona usando tabla intermedia - USANDO CAMPO 'day'
+    return f"""
+    SELECT
+        r.id AS route_id,
+        r.day as fecha_ruta,
+        r.creation_date,
+        r.user_id,
+        r.group_id,
+        r.route_distance,
+        r.status,
+        rd.id AS route_detail_id,
+        rd.subject_name,
+        rd.subject_code,
+        rd.latitude,
+        rd.longitude,
+        rd.invoice_amount,
+        rd.invoice_quantity,
+        rd.order_amount,
+        rd.order_quantity,
+        rd.receipt_amount,
+        rd.receipt_quantity,
+        rd.visit_positive,
+        rd.sequence,
+        rd.visit_sequence,
+        v.full_name as vendedor_nombre,
+        rzd.zone_code,
+        rzd.zone_name,
+        rzd.zone_color,
+        coord.latitud AS coord_latitud,
+        coord.longitud AS coord_longitud,
+        coord.fuente AS coord_fuente
+    FROM public.route r
+    JOIN public.route_detail rd ON rd.route_id = r.id{filtros.get('prefiltro_bbox', '')}
+    LEFT JOIN public.v_users v ON v.id = r.user_id
+    LEFT JOIN public.route_zone_detail rzd ON rzd.route_id = r.id
+    -- Primer evento de inicio (mismo orden que SQL_EVENTOS_INICIO_FIN); sale de ix_event_inicio_coordenadas
+    LEFT JOIN LATERAL (
+        SELECT e.latitude, e.longitude
+        FROM public.event e
+        WHERE e.route_detail_id = rd.id AND e.event_type_id = 1
+        ORDER BY e.event_date, e.id
+        LIMIT 1
+    ) ev ON TRUE
+    CROSS JOIN LATERAL (
+        SELECT
+            ABS(ev.latitude) > 0.000001 AND ABS(ev.longitude) > 0.000001 AS del_evento,
+            ABS(rd.latitude) > 0.000001 AND ABS(rd.longitude) > 0.000001 AS de_route_detail
+    ) val
+    CROSS JOIN LATERAL (
+        SELECT
+            (CASE WHEN val.del_evento THEN ev.latitude WHEN val.de_route_detail THEN rd.latitude END)::float8 AS latitud,
+            (CASE WHEN val.del_evento THEN ev.longitude WHEN val.de_route_detail THEN rd.longitude END)::float8 AS longitud,
+            CASE WHEN val.del_evento THEN 'evento' WHEN val.de_route_detail THEN 'route_detail' END AS fuente
+    ) coord
+    WHERE {filtros['condicion_fecha']}{filtros['filtro_vendedor']}{filtros['filtro_dia_semana']}{filtros['filtro_coordenadas']}
+    ORDER BY {orden}
+    """
+
+async def consultar_filas_rutas(filtros: dict) -> List[Dict[str, Any]]:
+    """Consulta principal de /mapa/rutas: una fila por route_detail con su ruta, vendedor y zona"""
+    query = sql_filas_rutas(filtros)
+    log.debug("Consulta de rutas: %s", query)
+
+    try:
+        return await consultar_async(query)
+    except Exception as query_error:
+        log.error("Error ejecutando consulta de rutas: %s", query_error)
+        raise HTTPException(status_code=500, detail=f"Error en consulta de rutas: {str(query_error)}")
+
+async def consultar_poligonos_zonas(zone_codes: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Geometría ya parseada (anillo GeoJSON, centro, bbox), color y nombre de la tabla zone
+    para los zone_code dados (zone.id). Sale del cache de geometrías; sólo consulta la base
+    para zonas nuevas o cuya revalidación venció."""
+    try:
+        return await cache_geometrias.obtener(zone_codes)
+    except Exception as zona_error:
+        log.warning("Error obteniendo coordenadas reales de zonas: %s", zona_error)
+        return {}
+
+async def obtener_promedios_mensuales_zonas(filtro_vendedor: str = "") -> dict:
+    """Promedio de venta por visita, días activos y clientes únicos por zona (últimos 3 meses)"""
+    consulta_promedios = f"""
+    WITH ventas AS NOT MATERIALIZED (
+        SELECT *
+        FROM {fuente_ventas()} r
+        WHERE r.day >= DATE_TRUNC('month', CURRENT_DATE) - INTERVAL '3 months'
+          AND r.day < DATE_TRUNC('month', CURRENT_DATE) + INTERVAL '1 month'
+        {filtro_vendedor}
+        AND r.zone_code <> ''
+    ),
+    clientes AS (
+        SELECT v.zone_code, COUNT(DISTINCT c.codigo) as clientes_unicos
+        FROM ventas v, unnest(v.clientes) AS c(codigo)
+        GROUP BY v.zone_code
+    )
+    SELECT
+        v.zone_code,
+        COALESCE(SUM(v.ventas) / NULLIF(SUM(v.visitas_con_venta), 0), 0) as promedio_mensual,
+        COUNT(DISTINCT v.day) as dias_activos,
+        COALESCE(MAX(c.clientes_unicos), 0) as clientes_unicos
+    FROM ventas v
+    LEFT JOIN clientes c ON c.zone_code = v.zone_code
+    GROUP BY v.zone_code
+    """
+    try:
+        promedios_mensuales = {}
+        for row in await consultar_async(consulta_promedios):
+            promedios_mensuales[row['zone_code']] = {
+                'promedio_mensual': float(row['promedio_mensual']) if row['promedio_mensual'] else 0,
+                'dias_activos': int(row['dias_activos']) if row['dias_activos'] else 0,
+                'clientes_unicos': int(row['clientes_unicos']) if row['clientes_unicos'] else 0
             }
-            condicion_fecha_comp = f"r.day = '{fechas_comp['comp_inicio']}'"
-        else:
-            condicion_fecha_comp = None
-        
-        print(f"🎯 FILTROS APLICADOS:")
-        print(f"   - Período: {periodo}")
-        print(f"   - Condición fecha: {condicion_fecha}")
-        print(f"   - Filtro vendedor: {filtro_vendedor}")
-        print(f"   - Filtro día semana: {filtro_dia_semana}")
-        print(f"   - Vendedor ID seleccionado: {vendedor_id}")
-        if fechas_comp:
-            print(f"   - Comparación: {fechas_comp['comp_inicio']} a {fechas_comp['comp_fin']} ({fechas_comp['tipo_comparacion']})")
-        
-        connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=RealDictCursor)
-        
-        # Consulta principal de rutas con información de zona usando tabla intermedia - USANDO CAMPO 'day'
-        query = f"""
-        SELECT 
-            r.id AS route_id,
-            r.day as fecha_ruta,
-            r.creation_date,
-            r.user_id,
-            r.group_id,
-            r.route_distance,
-            r.status,
-            rd.id AS route_detail_id,
-            rd.subject_name,
-            rd.subject_code,
-            rd.latitude,
-            rd.longitude,
-            rd.invoice_amount,
-            rd.invoice_quantity,
-            rd.order_amount,
-            rd.order_quantity,
-            rd.receipt_amount,
-            rd.receipt_quantity,
-            rd.visit_positive,
-            rd.sequence,
-            rd.visit_sequence,
-            v.full_name as vendedor_nombre,
-            rzd.zone_code,
-            rzd.zone_name,
-            rzd.zone_color
-        FROM public.route r
-        JOIN public.route_detail rd ON rd.route_id = r.id
-        LEFT JOIN public.v_users v ON v.id = r.user_id
-        LEFT JOIN public.route_zone_detail rzd ON rzd.route_id = r.id
-    WHERE {condicion_fecha}{filtro_vendedor}{filtro_dia_semana}
-    -- Nota: removimos el filtro por rd.latitude/rd.longitude para permitir
-    -- devolver route_detail que no tengan coordenadas en rd cuando existan
-    -- eventos asociados con coordenadas reales (event_start/event_end).
-    -- Esto permite que la UI use las coordenadas del evento como fuente
-    -- primaria para mostrar la ruta y los pasos de visita.
-        ORDER BY r.day DESC, rd.visit_sequence NULLS LAST
-        """
-        
-        print(f"📊 Ejecutando consulta de rutas: {query}")
-        
-        try:
-            cursor.execute(query)
-            print(f"✅ Consulta de rutas ejecutada correctamente")
-        except Exception as query_error:
-            print(f"❌ Error ejecutando consulta de rutas: {query_error}")
-            cursor.close()
-            connection.close()
-            raise HTTPException(status_code=500, detail=f"Error en consulta de rutas: {str(query_error)}")
-        
-        rutas_dict = {}
+        return promedios_mensuales
+    except Exception as e:
+        log.warning("Error obteniendo promedios mensuales por zona: %s", e)
+        return {}
 
-        rows = cursor.fetchall()
-        print(f"📊 Obtenidas {len(rows)} filas de la consulta de rutas")
-        
-        if len(rows) == 0:
-            print("⚠️ No se encontraron filas en la consulta")
-            cursor.close()
-            connection.close()
-            return {
-                "rutas": [],
-                "zonas": [],
-                "estadisticas_mapa": {
-                    "total_clientes_planificados": 0,
-                    "total_clientes_visitados": 0,
-                    "clientes_no_visitados": 0,
-                    "visitas_no_planificadas": 0,
-                    "ventas_totales": 0,
-                    "distancia_total_planificada": 0,
-                    "distancia_total_real": 0,
-                    "zonas_activas": 0,
-                    "km_recorridos": 0
+async def _sin_datos() -> dict:
+    return {}
+
+def estado_cliente(visitado: bool, planificado: Any, visit_positive: Any, invoice_amount: float) -> str:
+    """Estado de un cliente de la ruta (mismo criterio en /mapa/rutas y en las teselas)"""
+    if not visitado:
+        return "no_visitado"
+    if not planificado:
+        return "visita_no_planificada"
+    if visit_positive and invoice_amount > 0:
+        return "visitado_exitoso"
+    return "visitado_sin_venta"
+
+# Coordenadas de todos los route_detail de las rutas pedidas (sin el filtro de bbox del mapa):
+# la del cliente para el camino planificado y la del primer evento de inicio (si es válida)
+# para el real, igual que sql_filas_rutas
+SQL_PUNTOS_DISTANCIAS = """
+SELECT
+    rd.route_id,
+    r.day,
+    rd.id AS route_detail_id,
+    rd.sequence,
+    rd.visit_sequence,
+    rd.latitude::float8 AS lat_plan,
+    rd.longitude::float8 AS lng_plan,
+    (CASE WHEN ABS(ev.latitude) > 0.000001 AND ABS(ev.longitude) > 0.000001 THEN ev.latitude ELSE rd.latitude END)::float8 AS lat_real,
+    (CASE WHEN ABS(ev.latitude) > 0.000001 AND ABS(ev.longitude) > 0.000001 THEN ev.longitude ELSE rd.longitude END)::float8 AS lng_real
+FROM public.route_detail rd
+JOIN public.route r ON r.id = rd.route_id
+LEFT JOIN LATERAL (
+    SELECT e.latitude, e.longitude
+    FROM public.event e
+    WHERE e.route_detail_id = rd.id AND e.event_type_id = 1
+    ORDER BY e.event_date, e.id
+    LIMIT 1
+) ev ON TRUE
+WHERE rd.route_id = ANY(%s)
+"""
+
+# Distancias planificada/real de rutas de días cerrados
+cache_distancias_rutas = CacheDistanciasRutas()
+
+async def obtener_distancias_rutas(route_ids: List[int]) -> Dict[int, Dict[str, float]]:
+    """{route_id: {'planificada': km, 'real': km}} del camino en orden de sequence y en orden de
+    visit_sequence (ver distancias.py). Las rutas de días anteriores a hoy salen del cache;
+    el resto se calcula con una sola consulta para todas."""
+    route_ids = list(set(route_ids))
+    if not route_ids:
+        return {}
+    resultado = cache_distancias_rutas.obtener(route_ids)
+    faltantes = [r for r in route_ids if r not in resultado]
+    if not faltantes:
+        return resultado
+    try:
+        filas = await consultar_async(SQL_PUNTOS_DISTANCIAS, (faltantes,))
+    except Exception as e:
+        log.warning("No se pudieron calcular distancias planificada/real: %s", e)
+        return resultado
+    calculadas = await run_in_threadpool(distancias_planificada_real, filas)
+    hoy = date.today()
+    cerradas = {f['route_id'] for f in filas if f['day'] < hoy}
+    for route_id, distancias in calculadas.items():
+        if route_id in cerradas:
+            cache_distancias_rutas.guardar(route_id, distancias)
+    resultado.update(calculadas)
+    return resultado
+
+def aplicar_distancias_rutas(rutas_list: List[dict], distancias: Dict[int, Dict[str, float]]) -> None:
+    """Reemplaza distancia_planificada/distancia_real (route_distance) por las calculadas"""
+    for ruta in rutas_list:
+        calculada = distancias.get(ruta['route_id'])
+        if calculada:
+            ruta['distancia_planificada'] = calculada.get('planificada', 0.0)
+            ruta['distancia_real'] = calculada.get('real', 0.0)
+
+def construir_rutas(rows: List[Dict[str, Any]], eventos_por_rd: Dict[int, Dict[str, Any]], kpis_por_cliente: Dict[str, dict],
+                    resumen: Optional[ResumenRequest] = None) -> List[dict]:
+    """Agrupa las filas de route_detail por ruta: clientes, ruta_linea y secuencia de pasos del reproductor"""
+    rutas_dict = {}
+    # Diagnóstico por fila sólo con LOG_LEVEL=DEBUG (y muestreado); si no, sólo contadores
+    detalle = debug_activo(log)
+    contadores = {'coords_evento': 0, 'coords_route_detail': 0, 'sin_coordenadas': 0, 'filas_con_error': 0}
+
+    for i, row in enumerate(rows):
+        if not row:
+            contadores['filas_con_error'] += 1
+            continue
+
+        if detalle and muestrear():
+            log.debug("Procesando fila %d: route_id=%s vendedor=%s", i, row.get('route_id'), row.get('user_id'))
+
+        try:
+            # Acceso por nombre de campo
+            route_id = row['route_id']
+            fecha_ruta = row['fecha_ruta']  # r.day
+            user_id = row['user_id']
+            route_distance = row['route_distance']
+            status = row['status']
+
+            # Información del cliente/punto de ruta
+            route_detail_id = row['route_detail_id']
+            subject_name = row['subject_name']
+            subject_code = row['subject_code']
+            invoice_amount = row['invoice_amount'] or 0
+            order_amount = row['order_amount'] or 0
+            receipt_amount = row['receipt_amount'] or 0
+            visit_positive = row['visit_positive']
+            sequence = row['sequence']
+            visit_sequence = row['visit_sequence']
+            vendedor_nombre = row['vendedor_nombre'] or f"Vendedor {user_id}"
+
+            # Información de zona desde tabla intermedia
+            zona_code = row['zone_code']
+            zona_name = row['zone_name']
+            zona_color = row['zone_color']
+
+            # Buscar eventos asociados (prefiere coordenadas de event_start si existen)
+            eventos = eventos_por_rd.get(route_detail_id, {})
+            event_start = eventos.get('start') if eventos else None
+            event_end = eventos.get('end') if eventos else None
+
+            # Coordenada efectiva resuelta y filtrada en SQL (event_start -> rd, rango de Paraguay y bbox)
+            lat = row['coord_latitud']
+            lng = row['coord_longitud']
+            if lat is None or lng is None:
+                contadores['sin_coordenadas'] += 1
+                continue
+            if row['coord_fuente'] == 'evento':
+                contadores['coords_evento'] += 1
+            else:
+                contadores['coords_route_detail'] += 1
+            if detalle and muestrear():
+                log.debug("Coordenadas de %s para RD %s: %s, %s", row['coord_fuente'], route_detail_id, lat, lng)
+
+            # Crear ruta si no existe
+            if route_id not in rutas_dict:
+                # Obtener día de la semana desde el campo 'day' en lugar de 'creation_date'
+                dia_semana_nombre = DIAS_SEMANA[fecha_ruta.weekday()]  # 0=lunes, 6=domingo
+
+                rutas_dict[route_id] = {
+                    "route_id": route_id,
+                    "vendedor_id": user_id,
+                    "vendedor": vendedor_nombre,
+                    "fecha": fecha_ruta.strftime('%Y-%m-%d'),  # Usar fecha_ruta (day)
+                    "dia_semana": dia_semana_nombre,
+                    "color": DIA_COLORES.get(dia_semana_nombre, '#6b7280'),
+                    "status": status,
+                    "distancia_planificada": route_distance or 0,
+                    "distancia_real": route_distance or 0,
+                    "zona_code": zona_code,
+                    "zona_name": zona_name,
+                    "zona_color": zona_color,
+                    "clientes": [],
+                    "ruta_linea": [],
+                    "secuencia_pasos": [],
+                    "total_puntos_ruta": 0,
+                    "clientes_visitados_validos": 0
                 }
+
+            # Determinar estado del cliente
+            visitado = visit_sequence is not None
+            planificado = sequence and sequence < 1000
+            estado = estado_cliente(visitado, planificado, visit_positive, invoice_amount)
+
+            # KPIs avanzados del cliente si fue visitado (calculados en batch)
+            kpis_cliente = {}
+            if visitado and subject_code:
+                kpis_cliente = kpis_por_cliente.get(subject_code, KPIS_CLIENTE_VACIOS)
+
+            cliente = {
+                "cliente_id": route_detail_id,
+                "codigo": subject_code,
+                "nombre": subject_name,
+                "latitud": lat,
+                "longitud": lng,
+                "sequence": sequence,
+                "visit_sequence": visit_sequence,
+                "visitado": visitado,
+                "planificado": planificado,
+                "visita_positiva": bool(visit_positive) if visit_positive is not None else False,
+                "ventas": float(invoice_amount),
+                "pedidos": float(order_amount),
+                "recibos": float(receipt_amount),
+                "estado": estado,
+                "kpis": kpis_cliente  # Nuevos KPIs avanzados
             }
-        
-        # Preparar mapeo de eventos por route_detail (batch)
-        route_detail_ids = [r['route_detail_id'] for r in rows if r and r.get('route_detail_id')]
-        eventos_por_rd = fetch_events_for_route_details(connection, route_detail_ids)
+            # Adjuntar datos de evento al cliente para uso en frontend
+            if event_start:
+                cliente['event_begin'] = {
+                    'event_date': event_start.get('event_date'),
+                    'latitude': event_start.get('latitude'),
+                    'longitude': event_start.get('longitude'),
+                    'comments': event_start.get('comments'),
+                    'distance_event_customer': event_start.get('distance_event_customer')
+                }
+            if event_end:
+                cliente['event_end'] = {
+                    'event_date': event_end.get('event_date'),
+                    'latitude': event_end.get('latitude'),
+                    'longitude': event_end.get('longitude'),
+                    'comments': event_end.get('comments'),
+                    'distance_event_customer': event_end.get('distance_event_customer')
+                }
 
-        for i, row in enumerate(rows):
-            if not row:
-                print(f"⚠️ Fila {i} es None o vacía")
-                continue
-            
-            print(f"🔍 Procesando fila {i}: tipo={type(row)}")
-            print(f"🔍 Route ID: {row.get('route_id', 'N/A')}, Vendedor: {row.get('user_id', 'N/A')}")
-                
-            try:
-                # Acceso por nombre de campo (RealDictRow)
-                route_id = row['route_id']
-                fecha_ruta = row['fecha_ruta']  # r.day
-                creation_date = row['creation_date']
-                user_id = row['user_id']
-                group_id = row['group_id']
-                route_distance = row['route_distance']
-                status = row['status']
-                
-                # Información del cliente/punto de ruta
-                route_detail_id = row['route_detail_id']
-                subject_name = row['subject_name']
-                subject_code = row['subject_code']
-                latitude = row['latitude']
-                longitude = row['longitude']
-                invoice_amount = row['invoice_amount'] or 0
-                invoice_quantity = row['invoice_quantity'] or 0
-                order_amount = row['order_amount'] or 0
-                order_quantity = row['order_quantity'] or 0
-                receipt_amount = row['receipt_amount'] or 0
-                receipt_quantity = row['receipt_quantity'] or 0
-                visit_positive = row['visit_positive']
-                sequence = row['sequence']
-                visit_sequence = row['visit_sequence']
-                vendedor_nombre = row['vendedor_nombre'] or f"Vendedor {user_id}"
-                
-                # Información de zona desde tabla intermedia
-                zona_code = row['zone_code']
-                zona_name = row['zone_name']
-                zona_color = row['zone_color']
-                
-                # Buscar eventos asociados (prefiere coordenadas de event_start si existen)
-                eventos = eventos_por_rd.get(route_detail_id, {})
-                event_start = eventos.get('start') if eventos else None
-                event_end = eventos.get('end') if eventos else None
-
-                # Si el evento tiene coordenadas válidas, usar event_start; sino, fallback a rd.latitude/rd.longitude
-                lat = None
-                lng = None
-                # Prioridad solicitada: event_start -> rd.latitude/rd.longitude
-                def _valid_coord(v):
-                    try:
-                        if v is None:
-                            return False
-                        fv = float(str(v).replace(',', '.'))
-                        # Rechazar valores 0.0 como inválidos (según petición)
-                        return abs(fv) > 0.000001
-                    except Exception:
-                        return False
-
-                if event_start and _valid_coord(event_start.get('latitude')) and _valid_coord(event_start.get('longitude')):
-                    try:
-                        lat = float(str(event_start['latitude']).replace(',', '.'))
-                        lng = float(str(event_start['longitude']).replace(',', '.'))
-                        print(f"ℹ️ Usando coordenadas de event_start para RD {route_detail_id}: {lat}, {lng}")
-                    except Exception:
-                        lat = None
-                        lng = None
-                else:
-                    # Fallback a coordenadas en route_detail si existen
-                    try:
-                        if latitude is not None and longitude is not None:
-                            lat_tmp = float(str(latitude).replace(',', '.'))
-                            lng_tmp = float(str(longitude).replace(',', '.'))
-                            # Aceptar lat/lng de rd si no son 0
-                            if abs(lat_tmp) > 0.000001 and abs(lng_tmp) > 0.000001:
-                                lat = lat_tmp
-                                lng = lng_tmp
-                                print(f"ℹ️ Usando coordenadas de route_detail para RD {route_detail_id}: {lat}, {lng}")
-                    except Exception:
-                        lat = None
-                        lng = None
-
-                # Validar rango paraguay si existe lat/lng
-                if lat is None or lng is None:
-                    print(f"⚠️ Coordenadas no disponibles para cliente {subject_name} (RD {route_detail_id}) - eventos: start={bool(event_start)}, end={bool(event_end)}")
-                    # Continuar sin agregar el cliente si no hay coordenadas de ninguna fuente
-                    continue
-                if not (-28 <= lat <= -19 and -63 <= lng <= -54):
-                    print(f"⚠️ Coordenadas fuera de rango para Paraguay: {lat}, {lng} para cliente {subject_name} (RD {route_detail_id})")
-                    continue
-                
-                # Crear ruta si no existe
-                if route_id not in rutas_dict:
-                    # Obtener día de la semana desde el campo 'day' en lugar de 'creation_date'
-                    dia_semana_num = fecha_ruta.weekday()  # 0=lunes, 6=domingo
-                    dia_semana_nombre = ["lunes", "martes", "miercoles", "jueves", "viernes", "sabado", "domingo"][dia_semana_num]
-                    
-                    # Mapeo de colores por día de la semana
-                    dia_colores = {
-                        "lunes": "#ef4444",     # Rojo
-                        "martes": "#f97316",    # Naranja
-                        "miercoles": "#eab308", # Amarillo
-                        "jueves": "#22c55e",    # Verde
-                        "viernes": "#3b82f6",   # Azul
-                        "sabado": "#8b5cf6",    # Violeta
-                        "domingo": "#ec4899"    # Rosa
-                    }
-                    
-                    rutas_dict[route_id] = {
-                        "route_id": route_id,
-                        "vendedor_id": user_id,
-                        "vendedor": vendedor_nombre,
-                        "fecha": fecha_ruta.strftime('%Y-%m-%d'),  # Usar fecha_ruta (day)
-                        "dia_semana": dia_semana_nombre,
-                        "color": dia_colores.get(dia_semana_nombre, '#6b7280'),
-                        "status": status,
-                        "distancia_planificada": route_distance or 0,
-                        "distancia_real": route_distance or 0,
-                        "zona_code": zona_code,
-                        "zona_name": zona_name,
-                        "zona_color": zona_color,
-                        "clientes": [],
-                        "ruta_linea": [],
-                        "secuencia_pasos": [],
-                        "total_puntos_ruta": 0,
-                        "clientes_visitados_validos": 0
-                    }
-                
-                # Determinar estado del cliente
-                visitado = visit_sequence is not None
-                planificado = sequence and sequence < 1000
-                
-                if visitado:
-                    if not planificado:
-                        estado = "visita_no_planificada"
-                    elif visit_positive and invoice_amount > 0:
-                        estado = "visitado_exitoso"
-                    elif visit_positive:
-                        estado = "visitado_sin_venta"
-                    else:
-                        estado = "visitado_sin_venta"
-                else:
-                    estado = "no_visitado"
-            
-                # Obtener KPIs avanzados del cliente si fue visitado
-                kpis_cliente = {}
-                if visitado and subject_code:
-                    kpis_cliente = obtener_kpis_cliente(subject_code, connection, str(fecha_ruta), filtro_vendedor)
-            
-                cliente = {
+            rutas_dict[route_id]["clientes"].append(cliente)
+
+            # Solo agregar coordenadas a ruta_linea si el cliente FUE VISITADO
+            # Esto evita que aparezcan líneas hacia clientes no visitados
+            rutas_dict[route_id]["total_puntos_ruta"] += 1
+            if visitado:
+                rutas_dict[route_id]["ruta_linea"].append([lng, lat])
+                rutas_dict[route_id]["clientes_visitados_validos"] += 1
+
+                # Solo crear paso para reproducción si el cliente fue VISITADO
+                # Esto evita que aparezcan pasos hacia clientes no visitados en el reproductor
+                paso = {
+                    "paso_numero": len(rutas_dict[route_id]["secuencia_pasos"]) + 1,
                     "cliente_id": route_detail_id,
                     "codigo": subject_code,
                     "nombre": subject_name,
-                    "latitud": lat,
-                    "longitud": lng,
-                    "sequence": sequence,
-                    "visit_sequence": visit_sequence,
-                    "visitado": visitado,
-                    "planificado": planificado,
-                    "visita_positiva": bool(visit_positive) if visit_positive is not None else False,
-                    "ventas": float(invoice_amount),
-                    "pedidos": float(order_amount),
-                    "recibos": float(receipt_amount),
-                    "estado": estado,
-                    "kpis": kpis_cliente  # Nuevos KPIs avanzados
-                }
-                # Adjuntar datos de evento al cliente para uso en frontend
-                if event_start:
-                    cliente['event_begin'] = {
+                    # incluir coordenadas preferentes (event_start preferido) en el paso
+                    "coordenadas": [lng, lat],
+                    "event_begin": (event_start and {
                         'event_date': event_start.get('event_date'),
                         'latitude': event_start.get('latitude'),
                         'longitude': event_start.get('longitude'),
-                        'comments': event_start.get('comments'),
-                        'distance_event_customer': event_start.get('distance_event_customer')
-                    }
-                if event_end:
-                    cliente['event_end'] = {
+                        'comments': event_start.get('comments')
+                    }) or None,
+                    "event_end": (event_end and {
                         'event_date': event_end.get('event_date'),
                         'latitude': event_end.get('latitude'),
                         'longitude': event_end.get('longitude'),
-                        'comments': event_end.get('comments'),
-                        'distance_event_customer': event_end.get('distance_event_customer')
-                    }
-
-                rutas_dict[route_id]["clientes"].append(cliente)
-
-                # CORREGIDO: Solo agregar coordenadas a ruta_linea si el cliente FUE VISITADO
-                # Esto evita que aparezcan líneas hacia clientes no visitados
-                if lat is not None and lng is not None:
-                    rutas_dict[route_id]["total_puntos_ruta"] += 1
-                    
-                    # Solo agregar a ruta_linea si el cliente fue VISITADO
-                    if visitado:
-                        rutas_dict[route_id]["ruta_linea"].append([lng, lat])
-                        rutas_dict[route_id]["clientes_visitados_validos"] += 1
-
-                    # CORREGIDO: Solo crear paso para reproducción si el cliente fue VISITADO
-                    # Esto evita que aparezcan pasos hacia clientes no visitados en el reproductor
-                    if visitado:
-                        paso = {
-                            "paso_numero": len(rutas_dict[route_id]["secuencia_pasos"]) + 1,
-                            "cliente_id": route_detail_id,
-                            "codigo": subject_code,
-                            "nombre": subject_name,
-                            # incluir coordenadas preferentes (event_start preferido) en el paso
-                            "coordenadas": [lng, lat],
-                            "event_begin": (event_start and {
-                                'event_date': event_start.get('event_date'),
-                                'latitude': event_start.get('latitude'),
-                                'longitude': event_start.get('longitude'),
-                                'comments': event_start.get('comments')
-                            }) or None,
-                            "event_end": (event_end and {
-                                'event_date': event_end.get('event_date'),
-                                'latitude': event_end.get('latitude'),
-                                'longitude': event_end.get('longitude'),
-                                'comments': event_end.get('comments')
-                            }) or None,
-                            "visit_sequence": visit_sequence,
-                            "ventas": float(invoice_amount),
-                            "pedidos": float(order_amount),
-                            "recibos": float(receipt_amount),
-                            "estado": estado,
-                            "es_planificado": planificado,
-                            "distancia_desde_anterior": 0.0,  # Se calculará después
-                            "tiempo_estimado_minutos": 0  # Se calculará después
-                        }
-                        rutas_dict[route_id]["secuencia_pasos"].append(paso)
-            
-            except (IndexError, TypeError, ValueError) as e:
-                print(f"⚠️ Error procesando fila {i}: {e}")
-                print(f"⚠️ Contenido de la fila: {row}")
-                continue
-        
-        # Ordenar secuencia_pasos por visit_sequence y actualizar paso_numero
-        for ruta in rutas_dict.values():
-            if ruta["secuencia_pasos"]:
-                # Ordenar por visit_sequence
-                ruta["secuencia_pasos"].sort(key=lambda x: x["visit_sequence"] or 0)
-                
-                # Actualizar paso_numero y calcular distancias
-                distancia_total = 0.0
-                tiempo_total = 0
-                
-                for i, paso in enumerate(ruta["secuencia_pasos"]):
-                    paso["paso_numero"] = i + 1
-                    
-                    # Calcular distancia desde el paso anterior (aproximada)
-                    if i > 0:
-                        paso_anterior = ruta["secuencia_pasos"][i-1]
-                        lat1, lng1 = paso_anterior["coordenadas"][1], paso_anterior["coordenadas"][0]
-                        lat2, lng2 = paso["coordenadas"][1], paso["coordenadas"][0]
-                        
-                        # Fórmula de distancia euclidiana aproximada (en km)
-                        lat_diff = lat2 - lat1
-                        lng_diff = lng2 - lng1
-                        distancia_km = math.sqrt(lat_diff**2 + lng_diff**2) * 111.32  # 1 grado ≈ 111.32 km
-                        
-                        paso["distancia_desde_anterior"] = round(distancia_km, 2)
-                        distancia_total += distancia_km
-                        
-                        # Tiempo estimado: 5 minutos por visita + tiempo de viaje (40 km/h promedio)
-                        tiempo_viaje = (distancia_km / 40) * 60  # minutos
-                        paso["tiempo_estimado_minutos"] = int(5 + tiempo_viaje)
-                        tiempo_total += paso["tiempo_estimado_minutos"]
-                    else:
-                        paso["distancia_desde_anterior"] = 0.0
-                        paso["tiempo_estimado_minutos"] = 5  # Tiempo base para el primer cliente
-                        tiempo_total += 5
-                    
-                # Reconstruir ruta_linea en el orden correcto
-                ruta["ruta_linea"] = [paso["coordenadas"] for paso in ruta["secuencia_pasos"]]
-                
-                # Agregar estadísticas totales a la ruta
-                ruta["distancia_total_estimada"] = round(distancia_total, 2)
-                ruta["tiempo_total_estimado"] = tiempo_total
-                
-                print(f"🔄 Ruta {ruta['route_id']}: {len(ruta['secuencia_pasos'])} pasos ordenados por visit_sequence")
-        
-        rutas_list = list(rutas_dict.values())
-        print(f"📊 Procesadas {len(rutas_list)} rutas con {sum(r['total_puntos_ruta'] for r in rutas_list)} puntos totales")
-        
-        # CONSULTA DE ZONAS ALTERNATIVA - Primero intentamos con route_zone_detail, si no funciona usamos group_id
-        zonas_query = f"""
-        SELECT DISTINCT
-            z.id as zona_id,
-            z.group_id,
-            z.name as nombre,
-            z.color,
-            z.coordinates,
-            COUNT(DISTINCT r.id) as total_rutas,
-            COALESCE(SUM(CASE WHEN rd.visit_sequence IS NOT NULL AND rd.invoice_amount > 0 THEN rd.invoice_amount ELSE 0 END), 0) as total_ventas,
-            COUNT(DISTINCT CASE WHEN rd.visit_sequence IS NOT NULL THEN rd.id END) as total_clientes_visitados
-        FROM zone z
-        INNER JOIN route_zone_detail rzd ON z.id::text = rzd.zone_code
-        INNER JOIN route r ON r.id = rzd.route_id
-        INNER JOIN route_detail rd ON rd.route_id = r.id
-        WHERE z.coordinates IS NOT NULL 
-        AND z.coordinates != ''
-        AND {condicion_fecha}{filtro_vendedor}{filtro_dia_semana}
-        GROUP BY z.id, z.group_id, z.name, z.color, z.coordinates
-        HAVING COUNT(DISTINCT r.id) > 0
-        ORDER BY z.name
-        """
-        
-        print(f"🗺️ PRIMERA CONSULTA DE ZONAS (con route_zone_detail):")
-        print(f"🗺️ {zonas_query}")
-        
-        try:
-            cursor.execute(zonas_query)
-            print(f"✅ Primera consulta de zonas ejecutada correctamente")
-            zonas_rows = cursor.fetchall()
-            print(f"📍 Encontradas {len(zonas_rows)} zonas con route_zone_detail")
-        except Exception as zona_error:
-            print(f"❌ Error ejecutando primera consulta de zonas: {zona_error}")
-            zonas_rows = []
-
-        # Si no encontramos zonas con route_zone_detail, intentamos con group_id directo
-        if len(zonas_rows) == 0:
-            print(f"🔄 Intentando consulta alternativa usando group_id...")
-            
-            # Primero veamos qué group_ids tenemos en las rutas procesadas
-            group_ids_encontrados = set()
-            for ruta in rutas_list:
-                if hasattr(ruta, 'group_id') and ruta.get('group_id'):
-                    group_ids_encontrados.add(ruta['group_id'])
-            print(f"🔍 Group IDs encontrados en rutas: {list(group_ids_encontrados)}")
-            
-            zonas_query_alt = f"""
-            SELECT DISTINCT
-                z.id as zona_id,
-                z.group_id,
-                z.name as nombre,
-                z.color,
-                z.coordinates,
-                COUNT(DISTINCT r.id) as total_rutas,
-                COALESCE(SUM(CASE WHEN rd.visit_sequence IS NOT NULL AND rd.invoice_amount > 0 THEN rd.invoice_amount ELSE 0 END), 0) as total_ventas,
-                COUNT(DISTINCT CASE WHEN rd.visit_sequence IS NOT NULL THEN rd.id END) as total_clientes_visitados
-            FROM zone z
-            INNER JOIN route r ON r.group_id = z.group_id
-            INNER JOIN route_detail rd ON rd.route_id = r.id
-            WHERE z.coordinates IS NOT NULL 
-            AND z.coordinates != ''
-            AND {condicion_fecha}{filtro_vendedor}{filtro_dia_semana}
-            GROUP BY z.id, z.group_id, z.name, z.color, z.coordinates
-            HAVING COUNT(DISTINCT r.id) > 0
-            ORDER BY z.name
-            """
-            
-            print(f"🗺️ CONSULTA ALTERNATIVA DE ZONAS (con group_id):")
-            print(f"🗺️ {zonas_query_alt}")
-            
-            try:
-                cursor.execute(zonas_query_alt)
-                print(f"✅ Consulta alternativa de zonas ejecutada correctamente")
-                zonas_rows = cursor.fetchall()
-                print(f"📍 Encontradas {len(zonas_rows)} zonas con group_id")
-            except Exception as zona_error:
-                print(f"❌ Error ejecutando consulta alternativa de zonas: {zona_error}")
-                zonas_rows = []
-        
-        # TERCERA ESTRATEGIA: Si aún no hay zonas, mostrar todas las zonas disponibles (para debug)
-        if len(zonas_rows) == 0:
-            print(f"🔍 TERCERA ESTRATEGIA - Verificando todas las zonas disponibles:")
-            zonas_debug_query = """
-            SELECT DISTINCT
-                z.id as zona_id,
-                z.group_id,
-                z.name as nombre,
-                z.color,
-                CASE 
-                    WHEN z.coordinates IS NULL THEN 'NULL'
-                    WHEN z.coordinates = '' THEN 'EMPTY'
-                    ELSE 'HAS_COORDS'
-                END as coord_status,
-                SUBSTRING(z.coordinates, 1, 50) as coord_sample
-            FROM zone z
-            ORDER BY z.group_id
-            LIMIT 10
-            """
-            
-            try:
-                cursor.execute(zonas_debug_query)
-                debug_zones = cursor.fetchall()
-                print(f"🔍 Zonas disponibles en la base de datos:")
-                for zone in debug_zones:
-                    print(f"   - Zona {zone['zona_id']}: Group {zone['group_id']}, Nombre: {zone['nombre']}, Coords: {zone['coord_status']}")
-            except Exception as debug_error:
-                print(f"❌ Error en consulta de debug: {debug_error}")
-                
-            # También verificar si hay registros en route_zone_detail
-            route_zone_debug_query = """
-            SELECT COUNT(*) as total_records,
-                   COUNT(DISTINCT zone_code) as unique_zones,
-                   COUNT(DISTINCT route_id) as unique_routes
-            FROM route_zone_detail
-            """
-            
-            try:
-                cursor.execute(route_zone_debug_query)
-                debug_rzd = cursor.fetchone()
-                print(f"🔍 Tabla route_zone_detail: {debug_rzd['total_records']} registros, {debug_rzd['unique_zones']} zonas, {debug_rzd['unique_routes']} rutas")
-            except Exception as debug_error:
-                print(f"❌ Error verificando route_zone_detail: {debug_error}")
-        
-        # ESTRATEGIA HÍBRIDA: Intentar obtener coordenadas reales, si no crear zonas artificiales
-        # Esto garantiza que las zonas correspondan exactamente a las fechas y vendedores seleccionados
-        print(f"🏗️ ESTRATEGIA HÍBRIDA - Coordenadas reales si existen, artificiales si no...")
-        print(f"🗓️ Filtros aplicados - Período: {periodo}, Vendedor: {vendedor_id}, Fechas: {fecha_inicio} a {fecha_fin}")
-        
-        # Recopilar información de zonas desde las rutas procesadas (ya filtradas por fecha/vendedor)
-        zonas_desde_rutas = {}
-        zone_codes_filtrados = set()
-        fechas_procesadas = set()
-        
-        for ruta in rutas_list:
-            zona_code = ruta.get('zona_code')
-            zona_name = ruta.get('zona_name') 
-            zona_color = ruta.get('zona_color')
-            fecha_ruta = ruta.get('fecha')
-            
-            # Capturar fecha para debugging
-            if fecha_ruta:
-                fechas_procesadas.add(fecha_ruta)
-            
-            if zona_code and zona_name:  # Solo si tenemos código y nombre de zona
-                zone_codes_filtrados.add(zona_code)
-                
-                if zona_code not in zonas_desde_rutas:
-                    zonas_desde_rutas[zona_code] = {
-                        'zona_id': f"auto_{zona_code}",
-                        'zona_code': zona_code,
-                        'group_id': ruta.get('group_id', 0),
-                        'nombre': zona_name,
-                        'color': f"#{zona_color}" if zona_color and not zona_color.startswith('#') else zona_color or '#666666',
-                        'coordinates': None,  # Se intentará obtener de BD
-                        'total_rutas': 0,
-                        'total_ventas': 0,
-                        'total_clientes_visitados': 0,
-                        'clientes_coords': []  # Para crear zona artificial si no hay coordenadas reales
-                    }
-                
-                # Acumular estadísticas
-                zona_info = zonas_desde_rutas[zona_code]
-                zona_info['total_rutas'] += 1
-                
-                # Agregar coordenadas de clientes para posible zona artificial
-                for cliente in ruta.get('clientes', []):
-                    if cliente.get('visitado') and cliente.get('latitud') and cliente.get('longitud'):
-                        zona_info['total_clientes_visitados'] += 1
-                        zona_info['total_ventas'] += cliente.get('ventas', 0)
-                        zona_info['clientes_coords'].append([cliente['longitud'], cliente['latitud']])
-            
-        print(f"🔍 Zone codes encontrados en rutas filtradas: {sorted(zone_codes_filtrados)}")
-        print(f"📅 Fechas procesadas: {sorted(fechas_procesadas)}")
-        
-        # Obtener coordenadas reales desde la tabla zone usando zone.id
-        if zone_codes_filtrados:
-            zone_codes_str = "', '".join(zone_codes_filtrados)
-            zonas_reales_query = f"""
-            SELECT DISTINCT
-                z.id::text as zona_code,
-                z.id as zona_id,
-                z.group_id,
-                z.name as nombre,
-                z.color,
-                z.coordinates
-            FROM zone z
-            WHERE z.id::text IN ('{zone_codes_str}')
-            AND z.coordinates IS NOT NULL 
-            AND z.coordinates != ''
-            ORDER BY z.name
-            """
-            
-            print(f"🗺️ OBTENIENDO COORDENADAS REALES desde zone usando zone.id:")
-            print(f"🗺️ {zonas_reales_query}")
-            
-            try:
-                cursor.execute(zonas_reales_query)
-                zonas_reales_bd = cursor.fetchall()
-                print(f"📍 Encontradas {len(zonas_reales_bd)} zonas con coordenadas reales en zone")
-                
-                # Actualizar con coordenadas reales donde sea posible
-                for zona_bd in zonas_reales_bd:
-                    zona_code = str(zona_bd['zona_code'])  # Convertir a string para comparar
-                    if zona_code in zonas_desde_rutas:
-                        zonas_desde_rutas[zona_code]['coordinates'] = zona_bd['coordinates']
-                        # También actualizar color y nombre si vienen de la BD
-                        if zona_bd['color']:
-                            color = zona_bd['color']
-                            if not color.startswith('#'):
-                                color = f"#{color}"
-                            zonas_desde_rutas[zona_code]['color'] = color
-                        if zona_bd['nombre']:
-                            zonas_desde_rutas[zona_code]['nombre'] = zona_bd['nombre']
-                        print(f"   ✅ Zona {zona_code} usando coordenadas REALES de zone tabla ({len(zona_bd['coordinates'])} chars)")
-                        
-            except Exception as zona_error:
-                print(f"❌ Error obteniendo coordenadas reales: {zona_error}")
-        
-        # Convertir a formato de zonas_rows, usando coordenadas reales o creando artificiales
-        zonas_rows = []
-        for zona_code, zona_info in zonas_desde_rutas.items():
-            if zona_info['coordinates']:
-                # Usar coordenadas reales de la base de datos
-                zona_row = {
-                    'zona_id': zona_info['zona_id'],
-                    'group_id': zona_info['group_id'],
-                    'nombre': zona_info['nombre'],
-                    'color': zona_info['color'],
-                    'coordinates': zona_info['coordinates'],  # Coordenadas reales
-                    'total_rutas': zona_info['total_rutas'],
-                    'total_ventas': zona_info['total_ventas'],
-                    'total_clientes_visitados': zona_info['total_clientes_visitados']
+                        'comments': event_end.get('comments')
+                    }) or None,
+                    "visit_sequence": visit_sequence,
+                    "ventas": float(invoice_amount),
+                    "pedidos": float(order_amount),
+                    "recibos": float(receipt_amount),
+                    "estado": estado,
+                    "es_planificado": planificado,
+                    "distancia_desde_anterior": 0.0,  # Se calculará después
+                    "tiempo_estimado_minutos": 0  # Se calculará después
                 }
-                print(f"   🗺️ Zona {zona_code} usa coordenadas REALES ({len(zona_info['coordinates'])} chars)")
-                
-            elif zona_info['clientes_coords']:
-                # Crear zona artificial si no hay coordenadas reales pero sí clientes
-                coords = zona_info['clientes_coords']
-                centro_lng = sum(coord[0] for coord in coords) / len(coords)
-                centro_lat = sum(coord[1] for coord in coords) / len(coords)
-                
-                # Crear un polígono simple alrededor del centro (cuadrado de ~1km)
-                radio = 0.01  # Aproximadamente 1km
-                polygon_coords = [
-                    [centro_lng - radio, centro_lat - radio],  # SW
-                    [centro_lng + radio, centro_lat - radio],  # SE  
-                    [centro_lng + radio, centro_lat + radio],  # NE
-                    [centro_lng - radio, centro_lat + radio],  # NW
-                    [centro_lng - radio, centro_lat - radio]   # Cerrar polígono
-                ]
-                
-                zona_row = {
-                    'zona_id': zona_info['zona_id'],
-                    'group_id': zona_info['group_id'],
-                    'nombre': zona_info['nombre'],
-                    'color': zona_info['color'],
-                    'coordinates': ' '.join([f"{coord[1]},{coord[0]}" for coord in polygon_coords]),  # formato "lat,lng lat,lng"
-                    'total_rutas': zona_info['total_rutas'],
-                    'total_ventas': zona_info['total_ventas'], 
-                    'total_clientes_visitados': zona_info['total_clientes_visitados']
+                rutas_dict[route_id]["secuencia_pasos"].append(paso)
+
+        except (IndexError, TypeError, ValueError) as e:
+            contadores['filas_con_error'] += 1
+            log.warning("Error procesando fila %d: %s", i, e)
+            if detalle:
+                log.debug("Contenido de la fila %d: %s", i, row)
+            continue
+
+    # Ordenar secuencia_pasos por visit_sequence y actualizar paso_numero
+    for ruta in rutas_dict.values():
+        if ruta["secuencia_pasos"]:
+            # Ordenar por visit_sequence
+            ruta["secuencia_pasos"].sort(key=lambda x: x["visit_sequence"] or 0)
+            for i, paso in enumerate(ruta["secuencia_pasos"]):
+                paso["paso_numero"] = i + 1
+
+            # Reconstruir ruta_linea en el orden correcto
+            ruta["ruta_linea"] = [paso["coordenadas"] for paso in ruta["secuencia_pasos"]]
+
+    rutas_list = list(rutas_dict.values())
+    # Distancias haversine entre pasos, tiempos estimados y totales de todas las rutas a la vez
+    calcular_pasos_rutas(rutas_list)
+    if resumen is not None:
+        # incrementar (no reemplazar): en modo streaming se llama una vez por lote de rutas
+        resumen.incrementar('rutas', len(rutas_list))
+        resumen.incrementar('puntos', sum(r['total_puntos_ruta'] for r in rutas_list))
+        for nombre, cantidad in contadores.items():
+            resumen.incrementar(nombre, cantidad)
+    return rutas_list
+
+def construir_zonas(rutas_list: List[dict], geometrias: Dict[str, Dict[str, Any]],
+                    resumen: Optional[ResumenRequest] = None) -> List[dict]:
+    """Arma las zonas del mapa a partir de las rutas ya filtradas por fecha/vendedor.
+    Usa la geometría real de la tabla zone (`geometrias`, del cache de geometria_zonas) si existe;
+    si no, crea un polígono artificial alrededor de los clientes visitados de la zona."""
+    # Recopilar información de zonas desde las rutas procesadas (ya filtradas por fecha/vendedor)
+    zonas_desde_rutas = {}
+
+    for ruta in rutas_list:
+        zona_code = ruta.get('zona_code')
+        zona_name = ruta.get('zona_name')
+        zona_color = ruta.get('zona_color')
+
+        if zona_code and zona_name:  # Solo si tenemos código y nombre de zona
+            if zona_code not in zonas_desde_rutas:
+                zonas_desde_rutas[zona_code] = {
+                    'zona_id': f"auto_{zona_code}",
+                    'zona_code': zona_code,
+                    'group_id': ruta.get('group_id', 0),
+                    'nombre': zona_name,
+                    'color': f"#{zona_color}" if zona_color and not zona_color.startswith('#') else zona_color or '#666666',
+                    'real': False,  # True si la zona tiene fila en la tabla zone
+                    'geometria': None,
+                    'total_rutas': 0,
+                    'total_ventas': 0,
+                    'total_clientes_visitados': 0,
+                    'clientes_coords': []  # Para crear zona artificial si no hay coordenadas reales
                 }
-                print(f"   🔶 Zona {zona_code} usa polígono ARTIFICIAL (no se encontraron coordenadas reales)")
-            else:
-                print(f"   ❌ Zona {zona_code} descartada: sin coordenadas reales ni clientes visitados")
-                continue
-                
-            zonas_rows.append(zona_row)
-        
-        print(f"🏗️ Generadas {len(zonas_rows)} zonas (reales + artificiales) para visualización")
-        
-        zonas_result = []
-        
-        print(f"🔍 Procesando {len(zonas_rows)} zonas encontradas...")
-        
-        for i, zona_row in enumerate(zonas_rows):
-            try:
-                print(f"🔍 Procesando zona {i+1}: ID={zona_row.get('zona_id', 'N/A')}, Nombre={zona_row.get('nombre', 'N/A')}")
-                
-                # Parsear coordenadas - usando nombres de campo
-                coordinates_str = zona_row['coordinates']
-                print(f"🔍 Coordenadas string: '{coordinates_str}' (len={len(coordinates_str) if coordinates_str else 0})")
-                
-                if coordinates_str and coordinates_str.strip():
-                    # Las coordenadas pueden estar en formato: 
-                    # 1. "-25.123,-57.456 -25.124,-57.457 ..." (con coma)
-                    # 2. "-25.123 -57.456 -25.124 -57.457 ..." (separado por espacios)
-                    coordinate_tokens = coordinates_str.strip().split()
-                    coordinates = []
-                    
-                    if any(',' in token for token in coordinate_tokens):
-                        # Formato con comas: "lat,lng lat,lng"
-                        for pair in coordinate_tokens:
-                            if ',' in pair:
-                                try:
-                                    lat_str, lng_str = pair.split(',')
-                                    lat = float(lat_str.replace(',', '.'))
-                                    lng = float(lng_str.replace(',', '.'))
-                                    coordinates.append([lng, lat])  # GeoJSON usa [lng, lat]
-                                except (ValueError, IndexError) as e:
-                                    print(f"⚠️ Error parseando coordenada '{pair}': {e}")
-                                    continue
-                    else:
-                        # Formato separado por espacios: "lat lng lat lng"
-                        # Agrupar de a pares
-                        for i in range(0, len(coordinate_tokens) - 1, 2):
-                            try:
-                                lat_str = coordinate_tokens[i]
-                                lng_str = coordinate_tokens[i + 1]
-                                lat = float(lat_str.replace(',', '.'))
-                                lng = float(lng_str.replace(',', '.'))
-                                coordinates.append([lng, lat])  # GeoJSON usa [lng, lat]
-                            except (ValueError, IndexError) as e:
-                                print(f"⚠️ Error parseando coordenadas '{lat_str} {lng_str}': {e}")
-                                continue
-                    
-                    print(f"🔍 Coordenadas parseadas: {len(coordinates)} puntos")
-                    
-                    if len(coordinates) >= 3:  # Mínimo 3 puntos para un polígono
-                        # Asegurar que el polígono esté cerrado
-                        if coordinates[0] != coordinates[-1]:
-                            coordinates.append(coordinates[0])
-                        
-                        # Calcular centro del polígono
-                        centro_lng = sum(coord[0] for coord in coordinates) / len(coordinates)
-                        centro_lat = sum(coord[1] for coord in coordinates) / len(coordinates)
-                        
-                        # Asegurar que el color tenga el prefijo #
-                        color = zona_row['color']
-                        if color and not color.startswith('#'):
-                            color = f"#{color}"
-                        elif not color:
-                            color = "#666666"  # Color por defecto
-                        
-                        # Calcular KPIs comparativos para la zona
-                        ventas_actuales = float(zona_row['total_ventas']) if zona_row['total_ventas'] else 0
-                        clientes_actuales = zona_row['total_clientes_visitados'] if zona_row['total_clientes_visitados'] else 0
-                        
-                        zona_data = {
-                            "zona_id": zona_row['zona_id'],
-                            "group_id": zona_row['group_id'],
-                            "nombre": zona_row['nombre'],
-                            "color": color,
-                            "coordinates": [coordinates],  # Array de polígonos
-                            "centro_lng": centro_lng,
-                            "centro_lat": centro_lat,
-                            "total_rutas": zona_row['total_rutas'],
-                            "total_ventas": ventas_actuales,
-                            "total_clientes_visitados": clientes_actuales,
-                            "kpis": {
-                                "ventas_actuales": ventas_actuales,
-                                "clientes_actuales": clientes_actuales,
-                                "promedio_venta_cliente": round(ventas_actuales / clientes_actuales, 2) if clientes_actuales > 0 else 0,
-                                "ventas_periodo_anterior": 0,  # Se calculará después
-                                "crecimiento_porcentual": 0,  # Se calculará después
-                                "rendimiento_vs_promedio": "promedio",  # Se calculará después
-                                "ranking_zona": 0  # Se calculará después
-                            }
-                        }
-                        
-                        print(f"✅ Zona procesada exitosamente: {zona_data['nombre']}")
-                        zonas_result.append(zona_data)
-                    else:
-                        print(f"❌ Zona {zona_row.get('nombre', 'N/A')} descartada: insuficientes coordenadas ({len(coordinates)} < 3)")
-                else:
-                    print(f"❌ Zona {zona_row.get('nombre', 'N/A')} descartada: coordenadas vacías o nulas")
-                        
-            except Exception as e:
-                print(f"⚠️ Error procesando zona {zona_row['zona_id'] if 'zona_id' in zona_row else 'desconocida'}: {e}")
+
+            # Acumular estadísticas
+            zona_info = zonas_desde_rutas[zona_code]
+            zona_info['total_rutas'] += 1
+
+            # Agregar coordenadas de clientes para posible zona artificial
+            for cliente in ruta.get('clientes', []):
+                if cliente.get('visitado') and cliente.get('latitud') and cliente.get('longitud'):
+                    zona_info['total_clientes_visitados'] += 1
+                    zona_info['total_ventas'] += cliente.get('ventas', 0)
+                    zona_info['clientes_coords'].append([cliente['longitud'], cliente['latitud']])
+
+    detalle = debug_activo(log)
+    if detalle:
+        log.debug("Zone codes encontrados en rutas filtradas: %s", sorted(zonas_desde_rutas))
+
+    # Actualizar con la geometría real (tabla zone, zone.id, ya parseada y cacheada) donde sea posible
+    for zona_code, zona_bd in geometrias.items():
+        if zona_code in zonas_desde_rutas:
+            zonas_desde_rutas[zona_code]['real'] = True
+            zonas_desde_rutas[zona_code]['geometria'] = zona_bd['geometria']
+            # También actualizar color y nombre si vienen de la BD
+            if zona_bd['color']:
+                color = zona_bd['color']
+                if not color.startswith('#'):
+                    color = f"#{color}"
+                zonas_desde_rutas[zona_code]['color'] = color
+            if zona_bd['nombre']:
+                zonas_desde_rutas[zona_code]['nombre'] = zona_bd['nombre']
+
+    zonas_result = []
+    for zona_code, zona_info in zonas_desde_rutas.items():
+        if zona_info.get('real'):
+            geometria = zona_info['geometria']
+            if geometria is None:
+                log.info("Zona %s descartada: insuficientes coordenadas (< 3)", zona_info['nombre'])
                 continue
-        
-        print(f"🗺️ Zonas procesadas con filtros aplicados: {len(zonas_result)} zonas")
-        
-        # Calcular KPIs comparativos y colores de rendimiento
-        if len(zonas_result) > 0:
-            print(f"📊 Calculando KPIs comparativos...")
-            
-            # Calcular promedio de facturación entre todas las zonas
-            total_ventas_todas = sum(z['total_ventas'] for z in zonas_result)
-            promedio_ventas = total_ventas_todas / len(zonas_result) if len(zonas_result) > 0 else 0
-            
-            # Ordenar zonas por ventas para ranking
-            zonas_ordenadas = sorted(zonas_result, key=lambda x: x['total_ventas'], reverse=True)
-            
-            # Inicializar variables de fechas
-            fecha_real_inicio = None
-            fecha_real_fin = None
-            
-            # Determinar fechas reales del período actual
-            if fecha_inicio and fecha_fin:
-                fecha_real_inicio = fecha_inicio
-                fecha_real_fin = fecha_fin
-                print(f"🗓️ Usando fechas proporcionadas: {fecha_inicio} a {fecha_fin}")
-            else:
-                # Calcular fechas basado en el período
-                hoy = datetime.now()
-                print(f"🗓️ Calculando fechas para período: {periodo}")
-                
-                if periodo == "dia":
-                    fecha_real_inicio = hoy.strftime('%Y-%m-%d')
-                    fecha_real_fin = hoy.strftime('%Y-%m-%d')
-                elif periodo == "semana":
-                    inicio_semana = hoy - timedelta(days=7)
-                    fecha_real_inicio = inicio_semana.strftime('%Y-%m-%d')
-                    fecha_real_fin = hoy.strftime('%Y-%m-%d')
-                elif periodo == "mes":
-                    inicio_mes = hoy.replace(day=1)
-                    fecha_real_inicio = inicio_mes.strftime('%Y-%m-%d')
-                    fecha_real_fin = hoy.strftime('%Y-%m-%d')
-                elif periodo == "ano":
-                    inicio_ano = hoy.replace(month=1, day=1)
-                    fecha_real_inicio = inicio_ano.strftime('%Y-%m-%d')
-                    fecha_real_fin = hoy.strftime('%Y-%m-%d')
-                else:
-                    # Por defecto últimos 30 días
-                    inicio_30_dias = hoy - timedelta(days=30)
-                    fecha_real_inicio = inicio_30_dias.strftime('%Y-%m-%d')
-                    fecha_real_fin = hoy.strftime('%Y-%m-%d')
-                
-                print(f"🗓️ Fechas calculadas: {fecha_real_inicio} a {fecha_real_fin}")
-            
-            # Validar que las fechas no sean None antes de strptime
-            if fecha_real_inicio is None or fecha_real_fin is None:
-                print(f"⚠️ Error: fechas None - inicio: {fecha_real_inicio}, fin: {fecha_real_fin}")
-                # Usar fechas por defecto
-                hoy = datetime.now()
-                fecha_real_inicio = (hoy - timedelta(days=7)).strftime('%Y-%m-%d')
-                fecha_real_fin = hoy.strftime('%Y-%m-%d')
-            
-            # Calcular período anterior (mismo rango de fechas pero período anterior)
-            inicio_dt = datetime.strptime(fecha_real_inicio, '%Y-%m-%d')
-            fin_dt = datetime.strptime(fecha_real_fin, '%Y-%m-%d')
-            diferencia_dias = (fin_dt - inicio_dt).days + 1
-            
-            # Calcular fechas del período anterior usando lógica inteligente
-            if periodo == "dia" or diferencia_dias == 1:
-                # Para día específico, primero intentamos comparar con el mismo día de la semana pasada
-                # y luego, por zona, si no hay ventas en esa fecha, usamos la última fecha con datos de esa zona
-                inicio_dt_single = inicio_dt
-                comp_fecha_dt = inicio_dt_single - timedelta(days=7)
-                comp_fecha = comp_fecha_dt.strftime('%Y-%m-%d')
-                fecha_anterior_inicio = comp_fecha
-                fecha_anterior_fin = comp_fecha
-                print(f"🔍 Día específico: intentaremos comparar con el mismo día de la semana pasada: {comp_fecha}")
-            elif periodo == "semana" or diferencia_dias <= 7:
-                # Para semana, comparar con la semana anterior
-                if fechas_comp:
-                    fecha_anterior_inicio = fechas_comp['comp_inicio']
-                    fecha_anterior_fin = fechas_comp['comp_fin']
-                else:
-                    fecha_anterior_inicio = (inicio_dt - timedelta(days=7)).strftime('%Y-%m-%d')
-                    fecha_anterior_fin = (fin_dt - timedelta(days=7)).strftime('%Y-%m-%d')
-            else:
-                # Para períodos más largos, usar comparación inteligente o fallback
-                if fechas_comp:
-                    fecha_anterior_inicio = fechas_comp['comp_inicio']
-                    fecha_anterior_fin = fechas_comp['comp_fin']
-                else:
-                    fecha_anterior_inicio = (inicio_dt - timedelta(days=diferencia_dias)).strftime('%Y-%m-%d')
-                    fecha_anterior_fin = (inicio_dt - timedelta(days=1)).strftime('%Y-%m-%d')
-            
-            print(f"📈 Período actual: {fecha_real_inicio} a {fecha_real_fin}")
-            print(f"📉 Período anterior: {fecha_anterior_inicio} a {fecha_anterior_fin}")
-            if fechas_comp:
-                print(f"🧠 Comparación inteligente: {fechas_comp['tipo_comparacion']}")
-            
-            # Obtener ventas del período anterior para comparación (LÓGICA MEJORADA POR ZONA)
-            ventas_periodo_anterior = {}
-            try:
-                # Usar helper reutilizable para obtener ventas por zona entre fechas
-                if diferencia_dias == 1:
-                    # Fecha única: fecha_anterior_inicio == fecha_anterior_fin
-                    ventas_periodo_anterior = obtener_ventas_por_zonas_rango(connection, fecha_anterior_inicio, fecha_anterior_fin, filtro_vendedor)
-
-                    # Para zonas sin datos en la fecha de comparación, usar fallback a la última venta conocida por zona
-                    ventas_anteriores_zonas = obtener_ventas_anteriores_por_zona(fecha_real_inicio, connection)
-                    falta_zonas = []
-                    for zona in zonas_ordenadas:
-                        zona_id = zona['zona_id'].replace('auto_', '')
-                        if ventas_periodo_anterior.get(zona_id, 0) == 0:
-                            fallback = ventas_anteriores_zonas.get(zona_id, {})
-                            ventas_periodo_anterior[zona_id] = float(fallback.get('ventas', 0)) if fallback else 0
-                            if ventas_periodo_anterior[zona_id] > 0:
-                                falta_zonas.append(zona_id)
-
-                    if falta_zonas:
-                        print(f"⚠️ Zonas sin ventas en {fecha_anterior_inicio} que usaron fallback a última venta: {falta_zonas}")
-                    else:
-                        print(f"✅ Todas las zonas tienen datos en la fecha de comparación {fecha_anterior_inicio} o tienen fallback vacío")
-                else:
-                    # Rango de fechas: usar el helper directamente
-                    ventas_periodo_anterior = obtener_ventas_por_zonas_rango(connection, fecha_anterior_inicio, fecha_anterior_fin, filtro_vendedor)
-
-                    print(f"📊 Obtenidas ventas de {len(ventas_periodo_anterior)} zonas del período anterior (rango de fechas)")
-
-                    # Calcular promedios mensuales por zona (últimos 3 meses)
-                    promedios_mensuales = {}
-                    consulta_promedios = f"""
-                    SELECT 
-                        rzd.zone_code,
-                        COALESCE(AVG(CASE WHEN rd.visit_sequence IS NOT NULL AND rd.invoice_amount > 0 THEN rd.invoice_amount ELSE NULL END), 0) as promedio_mensual,
-                        COUNT(DISTINCT r.day) as dias_activos,
-                        COUNT(DISTINCT rd.subject_code) as clientes_unicos
-                    FROM public.route r
-                    JOIN public.route_detail rd ON rd.route_id = r.id
-                    LEFT JOIN public.route_zone_detail rzd ON rzd.route_id = r.id
-                    WHERE r.day >= DATE_TRUNC('month', CURRENT_DATE) - INTERVAL '3 months'
-                      AND r.day < DATE_TRUNC('month', CURRENT_DATE) + INTERVAL '1 month'
-                    {filtro_vendedor}
-                    AND rzd.zone_code IS NOT NULL
-                    GROUP BY rzd.zone_code
-                    """
-
-                    cursor.execute(consulta_promedios)
-                    rows_promedios = cursor.fetchall()
-                
-                for row in rows_promedios:
-                    promedios_mensuales[row['zone_code']] = {
-                        'promedio_mensual': float(row['promedio_mensual']) if row['promedio_mensual'] else 0,
-                        'dias_activos': int(row['dias_activos']) if row['dias_activos'] else 0,
-                        'clientes_unicos': int(row['clientes_unicos']) if row['clientes_unicos'] else 0
-                    }
-                    
-                print(f"📊 Calculados promedios mensuales de {len(promedios_mensuales)} zonas")
-                
-            except Exception as e:
-                print(f"⚠️ Error obteniendo ventas período anterior: {e}")
-                promedios_mensuales = {}
-            
-            # Actualizar KPIs de cada zona
-            for i, zona in enumerate(zonas_ordenadas):
-                zona_id = zona['zona_id'].replace('auto_', '')  # Obtener ID limpio
-                
-                # Ventas período anterior
-                ventas_anterior = ventas_periodo_anterior.get(zona_id, 0)
-                
-                # Datos del promedio mensual
-                datos_promedio = promedios_mensuales.get(zona_id, {})
-                promedio_mensual = datos_promedio.get('promedio_mensual', 0)
-                dias_activos = datos_promedio.get('dias_activos', 0)
-                clientes_unicos_mes = datos_promedio.get('clientes_unicos', 0)
-                
-                # Calcular crecimiento porcentual
-                if ventas_anterior > 0:
-                    crecimiento = ((zona['total_ventas'] - ventas_anterior) / ventas_anterior) * 100
-                else:
-                    crecimiento = 100 if zona['total_ventas'] > 0 else 0
-                
-                # Comparar con promedio mensual
-                vs_promedio_mensual = 0
-                if promedio_mensual > 0:
-                    vs_promedio_mensual = ((zona['total_ventas'] - promedio_mensual) / promedio_mensual) * 100
-                
-                # Determinar rendimiento vs promedio general
-                if zona['total_ventas'] > promedio_ventas * 1.2:  # 20% por encima
-                    rendimiento = "excelente"
-                    color_rendimiento = "#22c55e"  # Verde
-                elif zona['total_ventas'] > promedio_ventas * 0.8:  # Entre 80% y 120%
-                    rendimiento = "promedio"
-                    color_rendimiento = "#eab308"  # Amarillo
-                else:
-                    rendimiento = "bajo"
-                    color_rendimiento = "#ef4444"  # Rojo
-                
-                # Actualizar KPIs con datos avanzados
-                zona['kpis'].update({
-                    "ventas_periodo_anterior": ventas_anterior,
-                    "crecimiento_porcentual": round(crecimiento, 2),
-                    "rendimiento_vs_promedio": rendimiento,
-                    "ranking_zona": i + 1,  # Posición en ranking
-                    "promedio_general": round(promedio_ventas, 2),
-                    "color_rendimiento": color_rendimiento,
-                    "promedio_mensual": round(promedio_mensual, 2),
-                    "vs_promedio_mensual": round(vs_promedio_mensual, 2),
-                    "dias_activos_mes": dias_activos,
-                    "clientes_unicos_mes": clientes_unicos_mes,
-                    "eficiencia_diaria": round(zona['total_ventas'] / max(dias_activos, 1), 2)
-                })
-                
-                # Opcional: Cambiar color de la zona según rendimiento
-                # zona['color'] = color_rendimiento
-                
-                print(f"   📊 Zona {zona['nombre']}: ${zona['total_ventas']:,.0f} (anterior: ${ventas_anterior:,.0f}, {crecimiento:+.1f}%, {rendimiento})")
-        
-        if vendedor_id:
-            print(f"👤 Mostrando SOLO zonas donde trabajó el vendedor ID: {vendedor_id}")
+            if detalle:
+                log.debug("Zona %s usa coordenadas reales", zona_code)
+
+        elif zona_info['clientes_coords']:
+            # Crear zona artificial si no hay coordenadas reales pero sí clientes
+            coords = zona_info['clientes_coords']
+            centro_lng = sum(coord[0] for coord in coords) / len(coords)
+            centro_lat = sum(coord[1] for coord in coords) / len(coords)
+
+            # Crear un polígono simple alrededor del centro (cuadrado de ~1km)
+            radio = 0.01  # Aproximadamente 1km
+            geometria = geometria_desde_puntos([
+                [centro_lng - radio, centro_lat - radio],  # SW
+                [centro_lng + radio, centro_lat - radio],  # SE
+                [centro_lng + radio, centro_lat + radio],  # NE
+                [centro_lng - radio, centro_lat + radio],  # NW
+                [centro_lng - radio, centro_lat - radio]   # Cerrar polígono
+            ])
+            if detalle:
+                log.debug("Zona %s usa polígono artificial (no se encontraron coordenadas reales)", zona_code)
+        else:
+            if detalle:
+                log.debug("Zona %s descartada: sin coordenadas reales ni clientes visitados", zona_code)
+            continue
+
+        # Asegurar que el color tenga el prefijo #
+        color = zona_info['color']
+        if color and not color.startswith('#'):
+            color = f"#{color}"
+        elif not color:
+            color = "#666666"  # Color por defecto
+
+        # Calcular KPIs comparativos para la zona
+        ventas_actuales = float(zona_info['total_ventas']) if zona_info['total_ventas'] else 0
+        clientes_actuales = zona_info['total_clientes_visitados'] if zona_info['total_clientes_visitados'] else 0
+
+        zonas_result.append({
+            "zona_id": zona_info['zona_id'],
+            "group_id": zona_info['group_id'],
+            "nombre": zona_info['nombre'],
+            "color": color,
+            "coordinates": geometria['coordinates'],  # Array de polígonos (compartido con el cache: no modificar)
+            "centro_lng": geometria['centro_lng'],
+            "centro_lat": geometria['centro_lat'],
+            "total_rutas": zona_info['total_rutas'],
+            "total_ventas": ventas_actuales,
+            "total_clientes_visitados": clientes_actuales,
+            "kpis": {
+                "ventas_actuales": ventas_actuales,
+                "clientes_actuales": clientes_actuales,
+                "promedio_venta_cliente": round(ventas_actuales / clientes_actuales, 2) if clientes_actuales > 0 else 0,
+                "ventas_periodo_anterior": 0,  # Se calculará después
+                "crecimiento_porcentual": 0,  # Se calculará después
+                "rendimiento_vs_promedio": "promedio",  # Se calculará después
+                "ranking_zona": 0  # Se calculará después
+            }
+        })
+
+    if resumen is not None:
+        resumen.contar(zonas=len(zonas_result), zonas_reales=len(geometrias))
+    return zonas_result
+
+def aplicar_kpis_zonas(
+    zonas_result: List[dict],
+    ventas_periodo_anterior: Dict[str, float],
+    ventas_anteriores_zonas: dict,
+    promedios_mensuales: dict
+):
+    """Completa los KPIs comparativos de cada zona (período anterior, ranking, rendimiento
+    vs promedio general y vs promedio mensual). Modifica `zonas_result` en el lugar."""
+    if not zonas_result:
+        return
+    # Calcular promedio de facturación entre todas las zonas
+    total_ventas_todas = sum(z['total_ventas'] for z in zonas_result)
+    promedio_ventas = total_ventas_todas / len(zonas_result) if len(zonas_result) > 0 else 0
+
+    # Ordenar zonas por ventas para ranking
+    zonas_ordenadas = sorted(zonas_result, key=lambda x: x['total_ventas'], reverse=True)
+
+    # Para fecha única: zonas sin ventas en la fecha de comparación usan la última venta conocida por zona
+    ventas_periodo_anterior = dict(ventas_periodo_anterior)
+    if ventas_anteriores_zonas:
+        falta_zonas = []
+        for zona in zonas_ordenadas:
+            zona_id = zona['zona_id'].replace('auto_', '')
+            if ventas_periodo_anterior.get(zona_id, 0) == 0:
+                fallback = ventas_anteriores_zonas.get(zona_id, {})
+                ventas_periodo_anterior[zona_id] = float(fallback.get('ventas', 0)) if fallback else 0
+                if ventas_periodo_anterior[zona_id] > 0:
+                    falta_zonas.append(zona_id)
+        if falta_zonas:
+            log.debug("Zonas que usaron fallback a última venta: %s", falta_zonas)
+
+    detalle = debug_activo(log)
+    # Actualizar KPIs de cada zona
+    for i, zona in enumerate(zonas_ordenadas):
+        zona_id = zona['zona_id'].replace('auto_', '')  # Obtener ID limpio
+
+        # Ventas período anterior
+        ventas_anterior = ventas_periodo_anterior.get(zona_id, 0)
+
+        # Datos del promedio mensual
+        datos_promedio = promedios_mensuales.get(zona_id, {})
+        promedio_mensual = datos_promedio.get('promedio_mensual', 0)
+        dias_activos = datos_promedio.get('dias_activos', 0)
+        clientes_unicos_mes = datos_promedio.get('clientes_unicos', 0)
+
+        # Calcular crecimiento porcentual
+        if ventas_anterior > 0:
+            crecimiento = ((zona['total_ventas'] - ventas_anterior) / ventas_anterior) * 100
         else:
-            print(f"🌍 Mostrando zonas para TODOS los vendedores en el período")
-        
-        # Calcular estadísticas
-        total_clientes = sum(len(r["clientes"]) for r in rutas_list)
-        total_visitados = sum(len([c for c in r["clientes"] if c["visitado"]]) for r in rutas_list)
-        total_no_visitados = sum(len([c for c in r["clientes"] if not c["visitado"]]) for r in rutas_list)
-        visitas_no_planificadas = sum(len([c for c in r["clientes"] if c["estado"] == "visita_no_planificada"]) for r in rutas_list)
-        ventas_totales = sum(sum(c["ventas"] for c in r["clientes"]) for r in rutas_list)
-        
-        cursor.close()
-        connection.close()
-        
-        # Si el cliente solicitó una versión compacta, devolver menos campos para reducir el tamaño
-        if compact:
-            compact_rutas = []
-            for r in rutas_list:
-                compact_clients = []
-                for c in r.get('clientes', []):
-                    compact_clients.append({
-                        'cliente_id': c.get('cliente_id'),
-                        'codigo': c.get('codigo'),
-                        'nombre': c.get('nombre'),
-                        'latitud': c.get('latitud'),
-                        'longitud': c.get('longitud'),
-                        'visitado': c.get('visitado'),
-                        'ventas': c.get('ventas')
-                    })
-
-                compact_rutas.append({
-                    'route_id': r.get('route_id'),
-                    'vendedor_id': r.get('vendedor_id'),
-                    'vendedor': r.get('vendedor'),
-                    'fecha': r.get('fecha'),
-                    'dia_semana': r.get('dia_semana'),
-                    'color': r.get('color'),
-                    'status': r.get('status'),
-                    'zona_code': r.get('zona_code'),
-                    'zona_name': r.get('zona_name'),
-                    'ruta_linea': r.get('ruta_linea'),
-                    'clientes': compact_clients,
-                    'total_puntos_ruta': r.get('total_puntos_ruta')
-                })
+            crecimiento = 100 if zona['total_ventas'] > 0 else 0
+
+        # Comparar con promedio mensual
+        vs_promedio_mensual = 0
+        if promedio_mensual > 0:
+            vs_promedio_mensual = ((zona['total_ventas'] - promedio_mensual) / promedio_mensual) * 100
+
+        # Determinar rendimiento vs promedio general
+        if zona['total_ventas'] > promedio_ventas * 1.2:  # 20% por encima
+            rendimiento = "excelente"
+            color_rendimiento = "#22c55e"  # Verde
+        elif zona['total_ventas'] > promedio_ventas * 0.8:  # Entre 80% y 120%
+            rendimiento = "promedio"
+            color_rendimiento = "#eab308"  # Amarillo
+        else:
+            rendimiento = "bajo"
+            color_rendimiento = "#ef4444"  # Rojo
+
+        # Actualizar KPIs con datos avanzados
+        zona['kpis'].update({
+            "ventas_periodo_anterior": ventas_anterior,
+            "crecimiento_porcentual": round(crecimiento, 2),
+            "rendimiento_vs_promedio": rendimiento,
+            "ranking_zona": i + 1,  # Posición en ranking
+            "promedio_general": round(promedio_ventas, 2),
+            "color_rendimiento": color_rendimiento,
+            "promedio_mensual": round(promedio_mensual, 2),
+            "vs_promedio_mensual": round(vs_promedio_mensual, 2),
+            "dias_activos_mes": dias_activos,
+            "clientes_unicos_mes": clientes_unicos_mes,
+            "eficiencia_diaria": round(zona['total_ventas'] / max(dias_activos, 1), 2)
+        })
+
+        if detalle:
+            log.debug("Zona %s: %.0f (anterior: %.0f, %+.1f%%, %s)", zona['nombre'], zona['total_ventas'], ventas_anterior, crecimiento, rendimiento)
+
+def compactar_ruta(r: dict) -> dict:
+    """Versión reducida de una ruta (compact=true)"""
+    compact_clients = []
+    for c in r.get('clientes', []):
+        compact_clients.append({
+            'cliente_id': c.get('cliente_id'),
+            'codigo': c.get('codigo'),
+            'nombre': c.get('nombre'),
+            'latitud': c.get('latitud'),
+            'longitud': c.get('longitud'),
+            'visitado': c.get('visitado'),
+            'ventas': c.get('ventas')
+        })
 
-            compact_zonas = []
-            for z in zonas_result:
-                compact_zonas.append({
-                    'zona_id': z.get('zona_id'),
-                    'nombre': z.get('nombre'),
-                    'color': z.get('color'),
-                    'centro_lng': z.get('centro_lng'),
-                    'centro_lat': z.get('centro_lat'),
-                    'total_ventas': z.get('total_ventas')
-                })
+    return {
+        'route_id': r.get('route_id'),
+        'vendedor_id': r.get('vendedor_id'),
+        'vendedor': r.get('vendedor'),
+        'fecha': r.get('fecha'),
+        'dia_semana': r.get('dia_semana'),
+        'color': r.get('color'),
+        'status': r.get('status'),
+        'zona_code': r.get('zona_code'),
+        'zona_name': r.get('zona_name'),
+        'ruta_linea': r.get('ruta_linea'),
+        'clientes': compact_clients,
+        'total_puntos_ruta': r.get('total_puntos_ruta')
+    }
+
+def ruta_con_polilinea(r: dict, tolerancia_m: float) -> dict:
+    """Ruta con la línea como polilínea codificada (simplificada con Douglas–Peucker a
+    `tolerancia_m` metros) y sin secuencia_pasos, que se pide por ruta en /rutas/{route_id}/pasos"""
+    resultado = {k: v for k, v in r.items() if k not in ('ruta_linea', 'secuencia_pasos')}
+    linea = simplificar_linea(r.get('ruta_linea') or [], tolerancia_m)
+    resultado['ruta_polilinea'] = codificar_polilinea(linea)
+    resultado['puntos_linea'] = len(linea)
+    return resultado
+
+def forma_ruta(r: dict, compact: bool, tolerancia_polilinea: Optional[float]) -> dict:
+    """Ruta como la pidió el cliente: completa o compacta, y con la línea como coordenadas o polilínea"""
+    if compact:
+        r = compactar_ruta(r)
+    if tolerancia_polilinea is not None:
+        r = ruta_con_polilinea(r, tolerancia_polilinea)
+    return r
+
+# Formatos de /mapa/rutas: json (filas), columnar (JSON por columnas) y msgpack (columnar en MessagePack)
+FORMATOS_MAPA = ("json", "columnar", "msgpack")
+# Códigos fijos de estado en el formato columnar (también van en diccionarios.estado)
+ESTADOS_CLIENTE = ["no_visitado", "visitado_exitoso", "visitado_sin_venta", "visita_no_planificada"]
+CODIGO_ESTADO = {estado: i for i, estado in enumerate(ESTADOS_CLIENTE)}
+
+class DiccionarioValores:
+    """Strings repetidos codificados como índice en una lista compartida por toda la respuesta"""
+
+    def __init__(self):
+        self.valores: List[Any] = []
+        self._indices: Dict[Any, int] = {}
+
+    def indice(self, valor: Any) -> int:
+        indice = self._indices.get(valor)
+        if indice is None:
+            indice = self._indices[valor] = len(self.valores)
+            self.valores.append(valor)
+        return indice
+
+def ruta_columnar(r: dict, diccionarios: Dict[str, DiccionarioValores], tolerancia_polilinea: Optional[float]) -> dict:
+    """Ruta compacta con los clientes por columnas: un arreglo por campo en lugar de un dict por
+    cliente. codigo y nombre son índices en diccionarios; estado es un código de ESTADOS_CLIENTE.
+    visitado = visit_sequence no nulo."""
+    resultado = forma_ruta({**r, 'clientes': []}, True, tolerancia_polilinea)
+    clientes = r['clientes']
+    codigos, nombres = diccionarios['codigo'], diccionarios['nombre']
+    resultado['clientes'] = {
+        'cliente_id': [c['cliente_id'] for c in clientes],
+        'codigo': [codigos.indice(c['codigo']) for c in clientes],
+        'nombre': [nombres.indice(c['nombre']) for c in clientes],
+        'lat': [c['latitud'] for c in clientes],
+        'lng': [c['longitud'] for c in clientes],
+        'ventas': [c['ventas'] for c in clientes],
+        'visit_sequence': [c['visit_sequence'] for c in clientes],
+        'sequence': [c['sequence'] for c in clientes],
+        'estado': [CODIGO_ESTADO[c['estado']] for c in clientes]
+    }
+    return resultado
+
+def compactar_zona(z: dict) -> dict:
+    """Versión reducida de una zona (compact=true)"""
+    return {
+        'zona_id': z.get('zona_id'),
+        'nombre': z.get('nombre'),
+        'color': z.get('color'),
+        'centro_lng': z.get('centro_lng'),
+        'centro_lat': z.get('centro_lat'),
+        'total_ventas': z.get('total_ventas')
+    }
+
+def calcular_estadisticas_mapa(rutas_list: List[dict], zonas_result: List[dict], compact: bool) -> dict:
+    """Estadísticas globales del mapa (versión completa o compacta)"""
+    total_clientes = sum(len(r["clientes"]) for r in rutas_list)
+    total_visitados = sum(len([c for c in r["clientes"] if c["visitado"]]) for r in rutas_list)
+    total_no_visitados = sum(len([c for c in r["clientes"] if not c["visitado"]]) for r in rutas_list)
+    visitas_no_planificadas = sum(len([c for c in r["clientes"] if c["estado"] == "visita_no_planificada"]) for r in rutas_list)
+    ventas_totales = sum(sum(c["ventas"] for c in r["clientes"]) for r in rutas_list)
+
+    if compact:
+        return {
+            'total_clientes_planificados': total_clientes - visitas_no_planificadas,
+            'total_clientes_visitados': total_visitados,
+            'ventas_totales': ventas_totales,
+            'zonas_activas': len(zonas_result)
+        }
+
+    return {
+        "total_clientes_planificados": total_clientes - visitas_no_planificadas,
+        "total_clientes_visitados": total_visitados,
+        "clientes_no_visitados": total_no_visitados,
+        "visitas_no_planificadas": visitas_no_planificadas,
+        "ventas_totales": ventas_totales,
+        "distancia_total_planificada": sum(r["distancia_planificada"] for r in rutas_list),
+        "distancia_total_real": sum(r["distancia_real"] for r in rutas_list),
+        "zonas_activas": len(zonas_result),
+        "km_recorridos": sum(r["distancia_real"] for r in rutas_list)
+    }
+
+def resumir_ruta(r: dict) -> dict:
+    """Ruta sin clientes, línea ni pasos (modo clusters: los clientes van agrupados aparte)"""
+    return {
+        'route_id': r.get('route_id'),
+        'vendedor_id': r.get('vendedor_id'),
+        'vendedor': r.get('vendedor'),
+        'fecha': r.get('fecha'),
+        'dia_semana': r.get('dia_semana'),
+        'color': r.get('color'),
+        'status': r.get('status'),
+        'zona_code': r.get('zona_code'),
+        'zona_name': r.get('zona_name'),
+        'zona_color': r.get('zona_color'),
+        'distancia_planificada': r.get('distancia_planificada'),
+        'total_puntos_ruta': r.get('total_puntos_ruta'),
+        'clientes_visitados_validos': r.get('clientes_visitados_validos'),
+        'ventas': sum(c['ventas'] for c in r.get('clientes', []))
+    }
+
+def clusters_de_rutas(rutas_list: List[dict], zoom: int) -> List[dict]:
+    """Clusters (ver agrupamiento.py) de todos los clientes de las rutas"""
+    return agrupar_clientes(
+        ((c['longitud'], c['latitud'], c['estado'], c['ventas'], c['cliente_id'])
+         for r in rutas_list for c in r['clientes']),
+        zoom
+    )
+
+def armar_respuesta_mapa(rutas_list: List[dict], zonas_result: List[dict], compact: bool,
+                         zoom_clusters: Optional[int] = None, tolerancia_polilinea: Optional[float] = None,
+                         formato: str = "json") -> dict:
+    """Estadísticas globales y forma final de la respuesta (completa o compacta).
+    Con `zoom_clusters` los clientes se devuelven agrupados en `clusters` y las rutas resumidas;
+    zonas y estadísticas se calculan igual, sobre todos los clientes.
+    Con `tolerancia_polilinea` las rutas llevan la línea como polilínea (ver `ruta_con_polilinea`).
+    Con formato columnar/msgpack (implica compact) los clientes van por columnas (ver `ruta_columnar`)."""
+    estadisticas = calcular_estadisticas_mapa(rutas_list, zonas_result, compact)
+
+    if zoom_clusters is not None:
+        return {
+            'rutas': [resumir_ruta(r) for r in rutas_list],
+            'clusters': clusters_de_rutas(rutas_list, zoom_clusters),
+            'clusters_zoom': zoom_clusters,
+            'zonas': [compactar_zona(z) for z in zonas_result] if compact else zonas_result,
+            'estadisticas_mapa': estadisticas
+        }
+
+    if formato != "json":
+        diccionarios = {'codigo': DiccionarioValores(), 'nombre': DiccionarioValores()}
+        rutas = [ruta_columnar(r, diccionarios, tolerancia_polilinea) for r in rutas_list]
+        return {
+            'formato': 'columnar',
+            'diccionarios': {
+                'estado': ESTADOS_CLIENTE,
+                'codigo': diccionarios['codigo'].valores,
+                'nombre': diccionarios['nombre'].valores
+            },
+            'rutas': rutas,
+            'zonas': [compactar_zona(z) for z in zonas_result],
+            'estadisticas_mapa': estadisticas
+        }
 
-            estadisticas_compact = {
-                'total_clientes_planificados': total_clientes - visitas_no_planificadas,
-                'total_clientes_visitados': total_visitados,
-                'ventas_totales': ventas_totales,
-                'zonas_activas': len(compact_zonas)
+    # Si el cliente solicitó una versión compacta, devolver menos campos para reducir el tamaño
+    if compact:
+        return {
+            'rutas': [forma_ruta(r, True, tolerancia_polilinea) for r in rutas_list],
+            'zonas': [compactar_zona(z) for z in zonas_result],
+            'estadisticas_mapa': estadisticas
+        }
+
+    # Versión completa por defecto
+    return {
+        "rutas": rutas_list if tolerancia_polilinea is None else [ruta_con_polilinea(r, tolerancia_polilinea) for r in rutas_list],
+        "zonas": zonas_result,
+        "estadisticas_mapa": estadisticas
+    }
+
+def procesar_mapa_rutas(rows, eventos_por_rd, kpis_por_cliente, geometrias,
+                        ventas_periodo_anterior, ventas_anteriores_zonas, promedios_mensuales, compact,
+                        resumen: Optional[ResumenRequest] = None, zoom_clusters: Optional[int] = None,
+                        tolerancia_polilinea: Optional[float] = None, formato: str = "json",
+                        distancias_rutas: Optional[Dict[int, Dict[str, float]]] = None) -> dict:
+    """Parte CPU de /mapa/rutas (sin I/O): se ejecuta en el threadpool para no bloquear el event loop"""
+    resumen = resumen or ResumenRequest("/mapa/rutas")
+    with resumen.fase("construir_rutas"):
+        rutas_list = construir_rutas(rows, eventos_por_rd, kpis_por_cliente, resumen)
+        aplicar_distancias_rutas(rutas_list, distancias_rutas or {})
+    with resumen.fase("construir_zonas"):
+        zonas_result = construir_zonas(rutas_list, geometrias, resumen)
+    with resumen.fase("kpis_zonas"):
+        aplicar_kpis_zonas(zonas_result, ventas_periodo_anterior, ventas_anteriores_zonas, promedios_mensuales)
+    with resumen.fase("armar_respuesta"):
+        return armar_respuesta_mapa(rutas_list, zonas_result, compact, zoom_clusters, tolerancia_polilinea, formato)
+
+def clave_cache_mapa(
+    periodo: str,
+    fecha_inicio: Optional[str],
+    fecha_fin: Optional[str],
+    vendedor_id: Optional[int],
+    vendedor_ids: Optional[List[int]],
+    dia_semana: Optional[str],
+    compact: bool,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+    tesela: Optional[Tuple[int, int, int]] = None,
+    zoom_clusters: Optional[int] = None,
+    tolerancia_polilinea: Optional[float] = None,
+    formato: str = "json"
+) -> tuple:
+    """Normaliza los filtros de /mapa/rutas a una clave de cache y elige el TTL.
+    Rangos que terminan antes de hoy no cambian: TTL largo. Si incluyen hoy: TTL corto.
+    La fecha de hoy forma parte de la clave porque los períodos relativos (dia, mes...)
+    y los KPIs históricos de clientes/zonas dependen de CURRENT_DATE."""
+    hoy = date.today()
+    if vendedor_ids:
+        vendedores = sorted({int(x) for x in vendedor_ids})
+    elif vendedor_id:
+        vendedores = [int(vendedor_id)]
+    else:
+        vendedores = []
+    dia = dia_semana.lower() if dia_semana and dia_semana.lower() in DIAS_SEMANA else None
+
+    if fecha_inicio and fecha_fin:
+        parametros = {'rango': [fecha_inicio, fecha_fin]}
+        try:
+            historico = datetime.strptime(fecha_fin, '%Y-%m-%d').date() < hoy
+        except ValueError:
+            historico = False
+    else:
+        parametros = {'periodo': periodo}
+        historico = False
+
+    parametros.update({
+        'hoy': hoy.isoformat(),
+        'vendedores': vendedores,
+        'dia_semana': dia,
+        'compact': bool(compact),
+        'bbox': list(bbox) if bbox else None
+    })
+    if tesela:
+        parametros['tesela'] = list(tesela)
+    if zoom_clusters is not None:
+        parametros['clusters'] = zoom_clusters
+    if tolerancia_polilinea is not None:
+        parametros['polilinea'] = tolerancia_polilinea
+    if formato != "json":
+        parametros['formato'] = formato
+    ttl = TTL_MAPA_HISTORICO if historico else TTL_MAPA_ACTUAL
+    return clave_desde_parametros(parametros), ttl
+
+def serializar_msgpack(data: Any) -> bytes:
+    """MessagePack de los mismos datos que `serializar_json` (floats en 64 bits)"""
+    return msgpack.packb(data, default=serializacion._por_defecto, use_bin_type=True)
+
+@app.get("/mapa/rutas")
+async def get_mapa_rutas(
+    periodo: str = "dia",  # dia, semana, mes, año
+    fecha_inicio: Optional[str] = None,
+    fecha_fin: Optional[str] = None,
+    vendedor_id: Optional[int] = None,
+    vendedor_ids: Optional[List[int]] = Query(None),
+    dia_semana: Optional[str] = None,  # lunes, martes, miercoles, jueves, viernes, sabado, domingo
+    compact: bool = False,  # si True devuelve versión reducida (menos campos) para disminuir payload
+    bbox: Optional[str] = None,  # minLng,minLat,maxLng,maxLat del mapa visible
+    zoom: Optional[int] = Query(None, ge=0, le=ZOOM_MAXIMO),  # con bbox: se ajusta a las teselas de este zoom (ver parsear_bbox)
+    clusters: bool = False,  # con zoom: clientes agrupados por debajo de ZOOM_CLIENTES
+    polilinea: bool = False,  # líneas como polilínea codificada, sin secuencia_pasos
+    tolerancia: float = Query(0.0, ge=0, le=5000),  # con polilinea: metros de simplificación Douglas–Peucker
+    formato: str = "json"  # json, columnar o msgpack
+):
+    """Datos de rutas reales desde PostgreSQL para visualización en mapa con filtros.
+    Con `bbox` sólo se devuelven los clientes dentro de ese rectángulo (y las rutas que tienen
+    alguno); zonas y estadísticas se calculan sobre lo devuelto.
+    Con `clusters=true` y un `zoom` menor que ZOOM_CLIENTES, los clientes no van dentro de cada
+    ruta sino agrupados en `clusters` (cantidad, ventas, desglose por estado, centroide, bbox) y
+    las rutas vienen resumidas; desde ZOOM_CLIENTES la respuesta es la de siempre. Sólo con
+    formato=json.
+    Con `polilinea=true` cada ruta trae `ruta_polilinea` (formato de polilínea codificada, precisión
+    1e-5, simplificada a `tolerancia` metros) y `puntos_linea` en lugar de `ruta_linea`, y no trae
+    `secuencia_pasos`: el reproductor la pide por ruta a /rutas/{route_id}/pasos.
+    `formato=columnar` devuelve las rutas compactas con los clientes por columnas (arreglos de
+    lat, lng, ventas, visit_sequence, sequence y código de estado; codigo y nombre como índices en
+    `diccionarios`); `formato=msgpack` lo mismo en MessagePack (application/x-msgpack).
+    La respuesta serializada se cachea por filtros normalizados (ver `clave_cache_mapa`);
+    el header X-Cache indica HIT o MISS."""
+    if clusters and zoom is None:
+        raise HTTPException(status_code=400, detail="clusters=true requiere zoom")
+    if formato not in FORMATOS_MAPA:
+        raise HTTPException(status_code=400, detail=f"formato debe ser uno de: {', '.join(FORMATOS_MAPA)}")
+    if clusters and formato != "json":
+        raise HTTPException(status_code=400, detail="clusters=true sólo está disponible con formato=json")
+    if formato == "msgpack" and msgpack is None:
+        raise HTTPException(status_code=406, detail="formato=msgpack no disponible: falta el paquete msgpack")
+    resumen = ResumenRequest("/mapa/rutas")
+    rectangulo = parsear_bbox(bbox, zoom)
+    zoom_clusters = zoom if clusters and agrupa_en_zoom(zoom) else None
+    tolerancia_polilinea = tolerancia if polilinea else None
+    clave, ttl = clave_cache_mapa(periodo, fecha_inicio, fecha_fin, vendedor_id, vendedor_ids, dia_semana, compact, rectangulo,
+                                  zoom_clusters=zoom_clusters, tolerancia_polilinea=tolerancia_polilinea, formato=formato)
+
+    async def calcular() -> bytes:
+        resultado = await calcular_mapa_rutas(periodo, fecha_inicio, fecha_fin, vendedor_id, vendedor_ids, dia_semana, compact,
+                                              resumen, rectangulo, zoom_clusters, tolerancia_polilinea, formato)
+        with resumen.fase("serializacion"):
+            return await run_in_threadpool(serializar_msgpack if formato == "msgpack" else serializar_json, resultado)
+
+    contenido, hit = await cache_mapa.obtener_o_calcular(clave, ttl, calcular)
+    resumen.contar(cache="HIT" if hit else "MISS", bytes=len(contenido))
+    return Response(
+        content=contenido,
+        media_type="application/x-msgpack" if formato == "msgpack" else "application/json",
+        headers=cerrar_resumen(resumen, {"X-Cache": "HIT" if hit else "MISS"})
+    )
+
+@app.get("/cache/mapa")
+def estadisticas_cache_mapa():
+    """Métricas del cache de /mapa/rutas (hits, misses, entradas, bytes, evictions)"""
+    return cache_mapa.estadisticas()
+
+@app.delete("/cache/mapa")
+async def limpiar_cache_mapa():
+    """Vacía el cache de /mapa/rutas (p. ej. después de corregir datos históricos)"""
+    eliminadas = await cache_mapa.limpiar()
+    return {"eliminadas": eliminadas}
+
+async def calcular_mapa_rutas(
+    periodo: str,
+    fecha_inicio: Optional[str],
+    fecha_fin: Optional[str],
+    vendedor_id: Optional[int],
+    vendedor_ids: Optional[List[int]],
+    dia_semana: Optional[str],
+    compact: bool,
+    resumen: Optional[ResumenRequest] = None,
+    bbox: Optional[Tuple[float, float, float, float]] = None,
+    zoom_clusters: Optional[int] = None,
+    tolerancia_polilinea: Optional[float] = None,
+    formato: str = "json"
+) -> dict:
+    """Arma la respuesta de /mapa/rutas sin cache.
+    Las consultas independientes (filas de rutas, ventas del período anterior, promedios
+    mensuales; luego eventos, KPIs de clientes y polígonos de zona) corren en paralelo,
+    cada una en su propia conexión del pool async."""
+    resumen = resumen or ResumenRequest("/mapa/rutas")
+    try:
+        filtros = construir_filtros_mapa(periodo, fecha_inicio, fecha_fin, vendedor_id, vendedor_ids, dia_semana, bbox)
+        filtro_vendedor = filtros['filtro_vendedor']
+        fechas_comp = filtros['fechas_comp']
+
+        resumen.contar(
+            periodo=periodo,
+            fecha_inicio=filtros['fecha_real_inicio'],
+            fecha_fin=filtros['fecha_real_fin'],
+            vendedores=vendedor_ids or ([vendedor_id] if vendedor_id else []),
+            dia_semana=dia_semana,
+            bbox=list(bbox) if bbox else None
+        )
+        if debug_activo(log):
+            log.debug("Filtros /mapa/rutas", extra={"campos": {
+                "condicion_fecha": filtros['condicion_fecha'],
+                "filtro_vendedor": filtro_vendedor,
+                "filtro_dia_semana": filtros['filtro_dia_semana'],
+                "filtro_coordenadas": filtros['filtro_coordenadas'],
+                "comparacion": fechas_comp or None,
+                "periodo_anterior": [filtros['fecha_anterior_inicio'], filtros['fecha_anterior_fin']]
+            }})
+
+        # Fecha única: comparar con la misma fecha de la semana pasada y completar con la última
+        # venta conocida por zona. Rango: comparar con el rango anterior y agregar promedios mensuales.
+        fecha_unica = filtros['diferencia_dias'] == 1
+        with resumen.fase("consulta_rutas"):
+            rows, ventas_periodo_anterior, ventas_anteriores_zonas, promedios_mensuales = await asyncio.gather(
+                consultar_filas_rutas(filtros),
+                obtener_ventas_por_zonas_rango(filtros['fecha_anterior_inicio'], filtros['fecha_anterior_fin'], filtro_vendedor),
+                obtener_ventas_anteriores_por_zona(filtros['fecha_real_inicio']) if fecha_unica else _sin_datos(),
+                _sin_datos() if fecha_unica else obtener_promedios_mensuales_zonas(filtro_vendedor)
+            )
+        resumen.contar(filas=len(rows))
+
+        if len(rows) == 0:
+            vacia = {
+                "rutas": [],
+                "zonas": [],
+                "estadisticas_mapa": dict(ESTADISTICAS_MAPA_VACIAS)
             }
+            if zoom_clusters is not None:
+                vacia.update(clusters=[], clusters_zoom=zoom_clusters)
+            elif formato != "json":
+                vacia.update(formato='columnar', diccionarios={'estado': ESTADOS_CLIENTE, 'codigo': [], 'nombre': []})
+            return vacia
+
+        # Eventos por route_detail, KPIs de los clientes visitados (una sola consulta cada uno)
+        # y polígonos reales de las zonas presentes en las filas
+        route_detail_ids = [r['route_detail_id'] for r in rows if r and r.get('route_detail_id')]
+        codigos_visitados = [r['subject_code'] for r in rows if r and r.get('visit_sequence') is not None and r.get('subject_code')]
+        zone_codes = {r['zone_code'] for r in rows if r and r.get('zone_code') and r.get('zone_name')}
+        with resumen.fase("eventos_kpis_poligonos"):
+            eventos_por_rd, kpis_por_cliente, geometrias, distancias_rutas = await asyncio.gather(
+                fetch_events_for_route_details(route_detail_ids),
+                obtener_kpis_clientes(codigos_visitados, filtro_vendedor),
+                consultar_poligonos_zonas(list(zone_codes)),
+                obtener_distancias_rutas([r['route_id'] for r in rows if r])
+            )
+        resumen.contar(eventos=len(eventos_por_rd), clientes_kpis=len(kpis_por_cliente))
+
+        return await run_in_threadpool(
+            procesar_mapa_rutas,
+            rows, eventos_por_rd, kpis_por_cliente, geometrias,
+            ventas_periodo_anterior, ventas_anteriores_zonas, promedios_mensuales, compact, resumen, zoom_clusters,
+            tolerancia_polilinea, formato, distancias_rutas
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        log.exception("Error en get_mapa_rutas")
+        raise HTTPException(status_code=500, detail=f"Error obteniendo datos de rutas: {str(e)}")
 
-            return {
-                'rutas': compact_rutas,
-                'zonas': compact_zonas,
-                'estadisticas_mapa': estadisticas_compact
+
+# Filas que se leen del cursor de servidor por vuelta en /mapa/rutas/stream
+LOTE_FILAS_STREAM = 2000
+# Streams con cursor abierto a la vez. Cada uno retiene una conexión del pool async mientras dura
+# y cada lote pide hasta 3 más (eventos, KPIs, distancias): con el límite por debajo del tamaño
+# del pool async siempre quedan conexiones para esas consultas cortas. Los demás esperan su turno.
+MAX_STREAMS_MAPA = int(os.getenv("MAPA_STREAMS_MAX", "0")) or max(1, POOL_ASYNC_MAX // 2)
+streams_mapa = asyncio.Semaphore(MAX_STREAMS_MAPA)
+
+def ruta_para_zonas(ruta: dict) -> dict:
+    """Lo mínimo de una ruta que usan `construir_zonas` y `calcular_estadisticas_mapa`
+    (en streaming no se retienen las rutas completas hasta el final)"""
+    return {
+        'zona_code': ruta.get('zona_code'),
+        'zona_name': ruta.get('zona_name'),
+        'zona_color': ruta.get('zona_color'),
+        'distancia_planificada': ruta['distancia_planificada'],
+        'distancia_real': ruta['distancia_real'],
+        'clientes': [
+            {
+                'visitado': c['visitado'],
+                'estado': c['estado'],
+                'ventas': c['ventas'],
+                'latitud': c['latitud'],
+                'longitud': c['longitud']
             }
+            for c in ruta['clientes']
+        ]
+    }
 
-        # Versión completa por defecto
-        return {
-            "rutas": rutas_list,
-            "zonas": zonas_result,
-            "estadisticas_mapa": {
-                "total_clientes_planificados": total_clientes - visitas_no_planificadas,
-                "total_clientes_visitados": total_visitados,
-                "clientes_no_visitados": total_no_visitados,
-                "visitas_no_planificadas": visitas_no_planificadas,
-                "ventas_totales": ventas_totales,
-                "distancia_total_planificada": sum(r["distancia_planificada"] for r in rutas_list),
-                "distancia_total_real": sum(r["distancia_real"] for r in rutas_list),
-                "zonas_activas": len(zonas_result),
-                "km_recorridos": sum(r["distancia_real"] for r in rutas_list)
+def linea_ndjson(tipo: str, **datos) -> bytes:
+    return serializar_json({"tipo": tipo, **datos}) + b"\n"
+
+async def generar_mapa_rutas_ndjson(filtros: dict, compact: bool, resumen: ResumenRequest,
+                                   tolerancia_polilinea: Optional[float] = None):
+    """Genera /mapa/rutas como NDJSON: una línea por ruta apenas se completa, y al final
+    las zonas (necesitan todas las rutas) y las estadísticas.
+    Las filas se leen con un cursor de servidor ordenado por ruta, de a LOTE_FILAS_STREAM;
+    eventos y KPIs se piden por lote, así la memoria no crece con el rango consultado."""
+    filtro_vendedor = filtros['filtro_vendedor']
+    fecha_unica = filtros['diferencia_dias'] == 1
+    # Datos de comparación por zona: en paralelo mientras se transmiten las rutas
+    comparacion = asyncio.ensure_future(asyncio.gather(
+        obtener_ventas_por_zonas_rango(filtros['fecha_anterior_inicio'], filtros['fecha_anterior_fin'], filtro_vendedor),
+        obtener_ventas_anteriores_por_zona(filtros['fecha_real_inicio']) if fecha_unica else _sin_datos(),
+        _sin_datos() if fecha_unica else obtener_promedios_mensuales_zonas(filtro_vendedor)
+    ))
+    rutas_zonas: List[dict] = []
+    kpis_por_cliente: Dict[str, dict] = {}
+    zone_codes = set()
+
+    async def emitir_rutas(filas: List[Dict[str, Any]]):
+        route_detail_ids = [r['route_detail_id'] for r in filas if r.get('route_detail_id')]
+        codigos_nuevos = [r['subject_code'] for r in filas
+                          if r.get('visit_sequence') is not None and r.get('subject_code') and r['subject_code'] not in kpis_por_cliente]
+        with resumen.fase("eventos_kpis"):
+            eventos_por_rd, kpis_nuevos, distancias_rutas = await asyncio.gather(
+                fetch_events_for_route_details(route_detail_ids),
+                obtener_kpis_clientes(codigos_nuevos, filtro_vendedor),
+                obtener_distancias_rutas([r['route_id'] for r in filas])
+            )
+        kpis_por_cliente.update(kpis_nuevos)
+        resumen.incrementar('eventos', len(eventos_por_rd))
+        with resumen.fase("construir_rutas"):
+            rutas = await run_in_threadpool(construir_rutas, filas, eventos_por_rd, kpis_por_cliente, resumen)
+            aplicar_distancias_rutas(rutas, distancias_rutas)
+        zone_codes.update(r['zone_code'] for r in filas if r.get('zone_code') and r.get('zone_name'))
+        lineas = []
+        for ruta in rutas:
+            rutas_zonas.append(ruta_para_zonas(ruta))
+            lineas.append(linea_ndjson("ruta", ruta=forma_ruta(ruta, compact, tolerancia_polilinea)))
+        return b"".join(lineas)
+
+    try:
+        yield linea_ndjson("inicio", periodo_actual=[filtros['fecha_real_inicio'], filtros['fecha_real_fin']],
+                           periodo_anterior=[filtros['fecha_anterior_inicio'], filtros['fecha_anterior_fin']])
+
+        pool = await obtener_pool_async()
+        with resumen.fase("espera_stream"):
+            await streams_mapa.acquire()
+        try:
+            async with pool.connection() as connection:
+                # Los cursores de servidor viven dentro de una transacción (el pool usa autocommit)
+                async with connection.transaction():
+                    async with connection.cursor(name="mapa_rutas_stream") as cursor:
+                        await cursor.execute(sql_filas_rutas(filtros, orden="r.day DESC, r.id, rd.visit_sequence NULLS LAST, rd.id"))
+                        pendientes: List[Dict[str, Any]] = []
+                        while True:
+                            with resumen.fase("consulta_rutas"):
+                                lote = await cursor.fetchmany(LOTE_FILAS_STREAM)
+                            resumen.incrementar('filas', len(lote))
+                            if not lote:
+                                break
+                            pendientes.extend(lote)
+                            # La última ruta del lote puede seguir en el próximo: sólo se emiten las completas
+                            ultima_ruta = pendientes[-1]['route_id']
+                            corte = len(pendientes)
+                            while corte > 0 and pendientes[corte - 1]['route_id'] == ultima_ruta:
+                                corte -= 1
+                            if corte > 0:
+                                yield await emitir_rutas(pendientes[:corte])
+                                pendientes = pendientes[corte:]
+                        if pendientes:
+                            yield await emitir_rutas(pendientes)
+        finally:
+            streams_mapa.release()
+
+        with resumen.fase("comparacion_zonas"):
+            ventas_periodo_anterior, ventas_anteriores_zonas, promedios_mensuales = await comparacion
+            geometrias = await consultar_poligonos_zonas(list(zone_codes))
+        with resumen.fase("construir_zonas"):
+            zonas_result = construir_zonas(rutas_zonas, geometrias, resumen)
+            aplicar_kpis_zonas(zonas_result, ventas_periodo_anterior, ventas_anteriores_zonas, promedios_mensuales)
+        yield linea_ndjson("zonas", zonas=[compactar_zona(z) for z in zonas_result] if compact else zonas_result)
+        yield linea_ndjson("estadisticas", estadisticas_mapa=calcular_estadisticas_mapa(rutas_zonas, zonas_result, compact))
+        yield linea_ndjson("fin", rutas=len(rutas_zonas))
+        cerrar_resumen(resumen, {})
+    except Exception as e:
+        # El status 200 ya se envió: el error viaja como última línea
+        log.exception("Error en get_mapa_rutas_stream")
+        yield linea_ndjson("error", detail=f"Error obteniendo datos de rutas: {str(e)}")
+    finally:
+        if not comparacion.done():
+            comparacion.cancel()
+
+@app.get("/mapa/rutas/stream")
+async def get_mapa_rutas_stream(
+    periodo: str = "dia",
+    fecha_inicio: Optional[str] = None,
+    fecha_fin: Optional[str] = None,
+    vendedor_id: Optional[int] = None,
+    vendedor_ids: Optional[List[int]] = Query(None),
+    dia_semana: Optional[str] = None,
+    compact: bool = False,
+    bbox: Optional[str] = None,
+    zoom: Optional[int] = Query(None, ge=0, le=ZOOM_MAXIMO),
+    polilinea: bool = False,
+    tolerancia: float = Query(0.0, ge=0, le=5000)
+):
+    """Mismos datos y filtros que /mapa/rutas, transmitidos como NDJSON (application/x-ndjson).
+    Pensado para rangos largos (periodo=año o fechas amplias): el mapa puede empezar a dibujar
+    con las primeras rutas. Líneas: inicio, ruta (una por ruta), zonas, estadisticas, fin
+    (o error si algo falla a mitad de camino)."""
+    filtros = construir_filtros_mapa(periodo, fecha_inicio, fecha_fin, vendedor_id, vendedor_ids, dia_semana,
+                                     parsear_bbox(bbox, zoom))
+    resumen = ResumenRequest("/mapa/rutas/stream")
+    resumen.contar(periodo=periodo, fecha_inicio=filtros['fecha_real_inicio'], fecha_fin=filtros['fecha_real_fin'])
+    return StreamingResponse(
+        generar_mapa_rutas_ndjson(filtros, compact, resumen, tolerancia if polilinea else None),
+        media_type="application/x-ndjson",
+        headers={"X-Accel-Buffering": "no"}  # que nginx no acumule la respuesta
+    )
+
+@app.get("/rutas/{route_id}/pasos")
+async def get_pasos_ruta(route_id: int):
+    """Secuencia de pasos del reproductor y línea completa de una ruta: lo que /mapa/rutas no
+    incluye con polilinea=true. Mismo armado que /mapa/rutas (construir_rutas) sobre las filas
+    de esa ruta, sin filtro de bbox."""
+    filtros = {
+        'condicion_fecha': f"r.id = {int(route_id)}",
+        'filtro_vendedor': '',
+        'filtro_dia_semana': '',
+        'filtro_coordenadas': sql_filtro_coordenadas()
+    }
+    try:
+        rows = await consultar_async(sql_filas_rutas(filtros))
+        eventos_por_rd = await fetch_events_for_route_details([r['route_detail_id'] for r in rows])
+        rutas = await run_in_threadpool(construir_rutas, rows, eventos_por_rd, {})
+    except Exception as e:
+        log.exception("Error en get_pasos_ruta")
+        raise HTTPException(status_code=500, detail=f"Error obteniendo pasos de la ruta: {str(e)}")
+    if not rutas:
+        raise HTTPException(status_code=404, detail=f"Ruta {route_id} sin puntos con coordenadas")
+    ruta = rutas[0]
+    return {
+        "route_id": route_id,
+        "secuencia_pasos": ruta["secuencia_pasos"],
+        "ruta_linea": ruta["ruta_linea"],
+        "distancia_total_estimada": ruta.get("distancia_total_estimada"),
+        "tiempo_total_estimado": ruta.get("tiempo_total_estimado")
+    }
+
+# Clientes planificados (sequence entre 1 y 999) con coordenadas válidas, en el orden planificado
+SQL_PARADAS_PLANIFICADAS = """
+SELECT
+    rd.route_id,
+    r.user_id,
+    r.day,
+    rd.id AS route_detail_id,
+    rd.sequence,
+    rd.subject_code,
+    rd.subject_name,
+    rd.latitude::float8 AS latitud,
+    rd.longitude::float8 AS longitud
+FROM public.route_detail rd
+JOIN public.route r ON r.id = rd.route_id
+WHERE {condicion}
+  AND rd.sequence > 0 AND rd.sequence < 1000
+  AND ABS(rd.latitude) > 0.000001 AND ABS(rd.longitude) > 0.000001
+ORDER BY rd.route_id, rd.sequence, rd.id
+"""
+
+def armar_optimizacion(paradas: List[Dict[str, Any]], resultado: Dict[str, Any]) -> Dict[str, Any]:
+    """Respuesta de /rutas/{route_id}/optimizar a partir de las paradas en orden planificado y
+    el resultado de `optimizar_orden` (índices sobre `paradas`)"""
+    actual = resultado['distancia_actual_km']
+    sugerida = resultado['distancia_sugerida_km']
+    ahorro = actual - sugerida
+    primera = paradas[0]
+    return {
+        "route_id": primera['route_id'],
+        "vendedor_id": primera['user_id'],
+        "fecha": primera['day'].strftime('%Y-%m-%d'),
+        "paradas": len(paradas),
+        "orden_actual": [p['route_detail_id'] for p in paradas],
+        "orden_sugerido": [
+            {
+                "route_detail_id": paradas[i]['route_detail_id'],
+                "codigo": paradas[i]['subject_code'],
+                "nombre": paradas[i]['subject_name'],
+                "sequence": paradas[i]['sequence'],
+                "sequence_sugerida": posicion,
+                "coordenadas": [paradas[i]['longitud'], paradas[i]['latitud']]
             }
+            for posicion, i in enumerate(resultado['orden'], start=1)
+        ],
+        "distancia_actual_km": round(actual, 2),
+        "distancia_sugerida_km": round(sugerida, 2),
+        "distancia_ahorrada_km": round(ahorro, 2),
+        "ahorro_porcentual": round(ahorro / actual * 100, 1) if actual > 0 else 0.0,
+        "tiempo_ahorrado_minutos": round(minutos_de_viaje(ahorro), 1),
+        "duracion_ms": resultado['duracion_ms']
+    }
+
+@app.get("/rutas/optimizar")
+async def optimizar_rutas_dia(
+    fecha: str,
+    vendedor_id: Optional[int] = None,
+    fijar_inicio: bool = True
+):
+    """Orden de visita sugerido para todas las rutas de un día (YYYY-MM-DD), opcionalmente de un
+    vendedor. Cada ruta se resuelve como /rutas/{route_id}/optimizar, repartidas en el pool de
+    procesos de optimizacion_rutas.py. Incluye los totales de distancia y tiempo ahorrados."""
+    try:
+        dia = datetime.strptime(fecha, '%Y-%m-%d').date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="fecha debe tener formato YYYY-MM-DD")
+    resumen = ResumenRequest("/rutas/optimizar")
+    condicion, parametros = "r.day = %s", [dia]
+    if vendedor_id is not None:
+        condicion += " AND r.user_id = %s"
+        parametros.append(vendedor_id)
+    try:
+        with resumen.fase("sql"):
+            filas = await consultar_async(SQL_PARADAS_PLANIFICADAS.format(condicion=condicion), tuple(parametros))
+        paradas_por_ruta: Dict[int, List[Dict[str, Any]]] = {}
+        for fila in filas:
+            paradas_por_ruta.setdefault(fila['route_id'], []).append(fila)
+        with resumen.fase("optimizacion"):
+            resultados = await optimizar_lote(
+                [[(p['latitud'], p['longitud']) for p in paradas] for paradas in paradas_por_ruta.values()],
+                fijar_inicio
+            )
+    except Exception as e:
+        log.exception("Error en optimizar_rutas_dia")
+        raise HTTPException(status_code=500, detail=f"Error optimizando las rutas del día: {str(e)}")
+    rutas = [armar_optimizacion(paradas, resultado)
+             for paradas, resultado in zip(paradas_por_ruta.values(), resultados)]
+    resumen.contar(rutas=len(rutas), paradas=len(filas))
+    return RespuestaJSONRapida({
+        "fecha": dia.isoformat(),
+        "vendedor_id": vendedor_id,
+        "rutas": rutas,
+        "totales": {
+            "rutas": len(rutas),
+            "paradas": len(filas),
+            "distancia_actual_km": round(sum(r['distancia_actual_km'] for r in rutas), 2),
+            "distancia_sugerida_km": round(sum(r['distancia_sugerida_km'] for r in rutas), 2),
+            "distancia_ahorrada_km": round(sum(r['distancia_ahorrada_km'] for r in rutas), 2),
+            "tiempo_ahorrado_minutos": round(sum(r['tiempo_ahorrado_minutos'] for r in rutas), 1)
         }
-        
+    }, headers=cerrar_resumen(resumen, {}))
+
+@app.get("/rutas/{route_id}/optimizar")
+async def optimizar_ruta(route_id: int, fijar_inicio: bool = True):
+    """Orden de visita sugerido para los clientes planificados de una ruta (vecino más cercano +
+    2-opt/Or-opt sobre distancias haversine, ver optimizacion_rutas.py), con la distancia (km) y
+    el tiempo de viaje (minutos) que se ahorran frente al orden planificado. Con
+    fijar_inicio=true (por defecto) la primera parada planificada se mantiene primera."""
+    try:
+        paradas = await consultar_async(SQL_PARADAS_PLANIFICADAS.format(condicion="rd.route_id = %s"), (route_id,))
+        if paradas:
+            puntos = [(p['latitud'], p['longitud']) for p in paradas]
+            resultado = await run_in_threadpool(optimizar_orden, puntos, fijar_inicio)
     except Exception as e:
-        print(f"Error en get_mapa_rutas: {e}")
-        raise HTTPException(status_code=500, detail=f"Error obteniendo datos de rutas: {str(e)}")
+        log.exception("Error en optimizar_ruta")
+        raise HTTPException(status_code=500, detail=f"Error optimizando la ruta: {str(e)}")
+    if not paradas:
+        raise HTTPException(status_code=404, detail=f"Ruta {route_id} sin clientes planificados con coordenadas")
+    return armar_optimizacion(paradas, resultado)
+
+# Capas de /tiles/{z}/{x}/{y}.mvt
+CAPA_ZONAS = "zonas"
+CAPA_NO_VISITADOS = "clientes_no_visitados"
+CAPA_VISITADOS = "clientes_visitados"
+CAPA_CLUSTERS = "clusters"
+
+async def obtener_ventas_por_zonas_filtros(filtros: dict) -> Dict[str, float]:
+    """{zone_code: ventas} del rollup con los filtros de fecha, vendedor y día de `construir_filtros_mapa`"""
+    consulta = f"""
+    SELECT r.zone_code, COALESCE(SUM(r.ventas), 0) as ventas
+    FROM {fuente_ventas()} r
+    WHERE {filtros['condicion_fecha']}{filtros['filtro_vendedor']}{filtros['filtro_dia_semana']}
+    AND r.zone_code <> ''
+    GROUP BY r.zone_code
+    """
+    try:
+        return {row['zone_code']: float(row['ventas'] or 0) for row in await consultar_async(consulta)}
+    except Exception as e:
+        log.warning("Error obteniendo ventas por zona para teselas: %s", e)
+        return {}
 
+def armar_tesela(tesela: Tesela, rows: List[Dict[str, Any]], ventas_zonas: Dict[str, float],
+                 geometrias: Dict[str, Dict[str, Any]]) -> bytes:
+    """Codifica la tesela: polígonos de las zonas con ventas en el período, clientes planificados
+    no visitados y clientes visitados (cada route_detail una vez aunque la ruta tenga varias zonas).
+    Por debajo de ZOOM_CLIENTES los clientes van agrupados en la capa de clusters."""
+    zonas = CapaMVT(CAPA_ZONAS)
+    no_visitados = CapaMVT(CAPA_NO_VISITADOS)
+    visitados = CapaMVT(CAPA_VISITADOS)
+    capa_clusters = CapaMVT(CAPA_CLUSTERS)
+    agrupar = agrupa_en_zoom(tesela.z)
+    puntos_clusters = []
+
+    min_lng, min_lat, max_lng, max_lat = tesela.limites()
+    for zona_code, ventas in ventas_zonas.items():
+        geometria = (geometrias.get(zona_code) or {}).get('geometria')
+        if not geometria:
+            continue
+        z_min_lng, z_min_lat, z_max_lng, z_max_lat = geometria['bbox']
+        if z_max_lng < min_lng or z_min_lng > max_lng or z_max_lat < min_lat or z_min_lat > max_lat:
+            continue
+        anillo = tesela.anillo(geometria['coordinates'][0])
+        if anillo:
+            zona = geometrias[zona_code]
+            zonas.agregar_poligono(anillo, {
+                "zona": zona_code,
+                "nombre": zona.get('nombre'),
+                "color": zona.get('color'),
+                "ventas": round(ventas, 2)
+            }, int(zona_code) if zona_code.isdigit() else None)
+
+    vistos = set()
+    for row in rows:
+        route_detail_id = row['route_detail_id']
+        if route_detail_id in vistos:
+            continue
+        vistos.add(route_detail_id)
+        lng, lat = row['coord_longitud'], row['coord_latitud']
+        punto = tesela.punto(lng, lat)
+        if punto is None:
+            continue
+        visitado = row['visit_sequence'] is not None
+        planificado = row['sequence'] and row['sequence'] < 1000
+        if not visitado and not planificado:
+            continue
+        ventas = float(row['invoice_amount'] or 0)
+        if agrupar:
+            # Las celdas de la grilla están alineadas con las teselas: las del margen son de las vecinas
+            if tesela.contiene(lng, lat):
+                estado = estado_cliente(visitado, planificado, row['visit_positive'], ventas)
+                puntos_clusters.append((lng, lat, estado, ventas, route_detail_id))
+            continue
+        propiedades = {
+            "cliente_id": route_detail_id,
+            "route_id": row['route_id'],
+            "codigo": row['subject_code'],
+            "nombre": row['subject_name'],
+            "estado": estado_cliente(visitado, planificado, row['visit_positive'], ventas),
+            "ventas": ventas,
+            "zona": row['zone_code'],
+            "vendedor_id": row['user_id'],
+            "fecha": row['fecha_ruta'].strftime('%Y-%m-%d')
+        }
+        (visitados if visitado else no_visitados).agregar_punto(punto, propiedades, route_detail_id)
+
+    for cluster in agrupar_clientes(puntos_clusters, tesela.z):
+        # Atributos planos (MVT no admite objetos): un atributo por estado
+        capa_clusters.agregar_punto(tesela.punto(cluster['longitud'], cluster['latitud']), {
+            "cluster_id": cluster['id'],
+            "cantidad": cluster['cantidad'],
+            "ventas": cluster['ventas'],
+            "cliente_id": cluster.get('cliente_id'),
+            **cluster['estados']
+        })
+
+    return codificar_tesela([zonas, no_visitados, visitados, capa_clusters])
+
+async def calcular_tesela(tesela: Tesela, periodo: str, fecha_inicio: Optional[str], fecha_fin: Optional[str],
+                          vendedor_id: Optional[int], vendedor_ids: Optional[List[int]], dia_semana: Optional[str],
+                          resumen: ResumenRequest) -> bytes:
+    # Mismas filas que /mapa/rutas restringidas al rectángulo de la tesela (con margen)
+    filtros = construir_filtros_mapa(periodo, fecha_inicio, fecha_fin, vendedor_id, vendedor_ids, dia_semana,
+                                     tesela.limites())
+    with resumen.fase("consulta_rutas"):
+        rows, ventas_zonas = await asyncio.gather(
+            consultar_async(sql_filas_rutas(filtros, orden="rd.id")),
+            obtener_ventas_por_zonas_filtros(filtros)
+        )
+    with resumen.fase("poligonos"):
+        geometrias = await consultar_poligonos_zonas(list(ventas_zonas))
+    resumen.contar(filas=len(rows), zonas=len(ventas_zonas))
+    with resumen.fase("codificar"):
+        return await run_in_threadpool(armar_tesela, tesela, rows, ventas_zonas, geometrias)
+
+@app.get("/tiles/{z}/{x}/{y}.mvt")
+async def get_tesela_mapa(
+    z: int,
+    x: int,
+    y: int,
+    periodo: str = "dia",
+    fecha_inicio: Optional[str] = None,
+    fecha_fin: Optional[str] = None,
+    vendedor_id: Optional[int] = None,
+    vendedor_ids: Optional[List[int]] = Query(None),
+    dia_semana: Optional[str] = None
+):
+    """Tesela vectorial de Mapbox con los filtros de /mapa/rutas. Capas:
+    - zonas: polígonos de las zonas con ventas en el período (zona, nombre, color, ventas)
+    - clientes_no_visitados: clientes planificados sin visita
+    - clientes_visitados: visitas (planificadas o no)
+    - clusters: en lugar de las dos anteriores cuando z < ZOOM_CLIENTES (cluster_id, cantidad,
+      ventas, un atributo con la cantidad por cada estado y cliente_id si agrupa uno solo)
+    Los clientes llevan cliente_id (route_detail), route_id, codigo, nombre, estado, ventas, zona,
+    vendedor_id y fecha. Se cachea por hash de los filtros normalizados + z/x/y (X-Cache);
+    una tesela sin datos responde 204."""
+    tesela = Tesela(z, x, y)
+    if not (z <= ZOOM_MAXIMO and tesela.valida()):
+        raise HTTPException(status_code=400, detail=f"Tesela inválida: {z}/{x}/{y}")
+    resumen = ResumenRequest("/tiles")
+    clave, ttl = clave_cache_mapa(periodo, fecha_inicio, fecha_fin, vendedor_id, vendedor_ids, dia_semana, False,
+                                  tesela=(z, x, y))
+
+    async def calcular() -> bytes:
+        return await calcular_tesela(tesela, periodo, fecha_inicio, fecha_fin, vendedor_id, vendedor_ids, dia_semana, resumen)
+
+    contenido, hit = await cache_teselas.obtener_o_calcular(clave, ttl, calcular)
+    resumen.contar(cache="HIT" if hit else "MISS", bytes=len(contenido))
+    headers = cerrar_resumen(resumen, {"X-Cache": "HIT" if hit else "MISS"})
+    if not contenido:
+        return Response(status_code=204, headers=headers)
+    return Response(content=contenido, media_type="application/vnd.mapbox-vector-tile", headers=headers)
+
+@app.get("/cache/distancias")
+def estadisticas_cache_distancias():
+    """Métricas del cache de distancias planificada/real por ruta (días cerrados)"""
+    return cache_distancias_rutas.estadisticas()
+
+@app.get("/cache/teselas")
+def estadisticas_cache_teselas():
+    """Métricas del cache de /tiles/{z}/{x}/{y}.mvt"""
+    return cache_teselas.estadisticas()
+
+@app.delete("/cache/teselas")
+async def limpiar_cache_teselas():
+    """Vacía el cache de teselas"""
+    eliminadas = await cache_teselas.limpiar()
+    return {"eliminadas": eliminadas}
 
 @app.get("/route_details_with_events")
-def route_details_with_events(
+async def route_details_with_events(
     fecha_inicio: Optional[str] = None,
     fecha_fin: Optional[str] = None,
     vendedor_id: Optional[int] = None,
@@ -1512,9 +2243,6 @@ def route_details_with_events(
     - limit: cantidad máxima de filas a devolver
     """
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=RealDictCursor)
-
         # Construir condición de fechas sobre r.day
         if fecha_inicio and fecha_fin:
             where_fecha = "r.day >= %s AND r.day <= %s"
@@ -1541,11 +2269,10 @@ def route_details_with_events(
         """
 
         params.append(limit)
-        cursor.execute(query, tuple(params))
-        rows = cursor.fetchall()
+        rows = await execute_query_async(query, tuple(params))
 
         rd_ids = [r['route_detail_id'] for r in rows if r and r.get('route_detail_id')]
-        eventos = fetch_events_for_route_details(connection, rd_ids)
+        eventos = await fetch_events_for_route_details(rd_ids)
 
         resultado = []
         for r in rows:
@@ -1556,25 +2283,20 @@ def route_details_with_events(
             item['event_end'] = evt.get('end') if evt else None
             resultado.append(item)
 
-        cursor.close()
-        connection.close()
-        return { 'count': len(resultado), 'rows': resultado }
+        return RespuestaJSONRapida({ 'count': len(resultado), 'rows': resultado })
     except Exception as e:
-        print(f"Error en route_details_with_events: {e}")
+        log.exception("Error en route_details_with_events")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/events/{event_id}/ventas")
-def ventas_por_evento(event_id: int):
+async def ventas_por_evento(event_id: int, connection=Depends(get_db_async)):
     """Devuelve las líneas de factura (invoice_detail) asociadas a las invoice
     vinculadas al `event` indicado. Filtra solo invoices con `type = 16`.
     Si no existen invoice_detail para el evento, devuelve los totales
     agregados guardados en `route_detail.invoice_amount` como fallback.
     """
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=RealDictCursor)
-
         sql = """
         SELECT
           r.id AS route_id,
@@ -1608,16 +2330,16 @@ def ventas_por_evento(event_id: int):
         ORDER BY i.creation_date ASC, idt.row_number ASC
         """
 
-        cursor.execute(sql, (event_id,))
-        rows = cursor.fetchall()
+        cursor = await connection.execute(sql, (event_id,))
+        rows = await cursor.fetchall()
 
         ventas = [dict(r) for r in rows] if rows else []
 
         # Si no encontramos filas con el filtro de tipo (i.type = 16), intentar sin filtro
         if not ventas:
             alt_sql = sql.replace("AND i.type::text = '16'", "")
-            cursor.execute(alt_sql, (event_id,))
-            rows2 = cursor.fetchall()
+            cursor = await connection.execute(alt_sql, (event_id,))
+            rows2 = await cursor.fetchall()
             ventas = [dict(r) for r in rows2] if rows2 else []
 
         if ventas:
@@ -1634,16 +2356,14 @@ def ventas_por_evento(event_id: int):
                 except Exception:
                     pass
 
-            cursor.close()
-            connection.close()
-            return {
+            return RespuestaJSONRapida({
                 'event_id': event_id,
                 'count': len(ventas),
                 'ventas': ventas,
                 'totales': {
                     'line_total_sum': round(total_line, 2)
                 }
-            }
+            })
 
         # Si no hay invoice_detail / invoice asociada, devolver fallback usando route_detail.invoice_amount
         fallback_sql = """
@@ -1654,13 +2374,11 @@ def ventas_por_evento(event_id: int):
         WHERE e.id = %s
         LIMIT 1
         """
-        cursor.execute(fallback_sql, (event_id,))
-        rd_row = cursor.fetchone()
-        cursor.close()
-        connection.close()
+        cursor = await connection.execute(fallback_sql, (event_id,))
+        rd_row = await cursor.fetchone()
 
         if rd_row:
-            return {
+            return RespuestaJSONRapida({
                 'event_id': event_id,
                 'count': 0,
                 'ventas': [],
@@ -1669,58 +2387,22 @@ def ventas_por_evento(event_id: int):
                     'order_amount': float(rd_row.get('order_amount') or 0)
                 },
                 'route_detail': rd_row
-            }
+            })
 
-        return {
+        return RespuestaJSONRapida({
             'event_id': event_id,
             'count': 0,
             'ventas': [],
             'mensaje': 'No se encontraron invoice ni invoice_detail asociados al evento.'
-        }
+        })
 
     except Exception as e:
-        print(f"Error en ventas_por_evento: {e}")
+        log.exception("Error en ventas_por_evento")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-@app.get("/route_detail/{route_detail_id}/ventas")
-def ventas_por_route_detail(
-    route_detail_id: int,
-    only_event_type: Optional[int] = None,
-    fecha_inicio: Optional[str] = None,
-    fecha_fin: Optional[str] = None,
-):
-    """Devuelve todos los eventos asociados al `route_detail_id` con sus
-    facturas e invoice_detail (líneas). Si no se encuentran facturas/lineas,
-    devuelve totales agregados desde `route_detail`.
-
-    Se pueden pasar `fecha_inicio` y `fecha_fin` (YYYY-MM-DD) para filtrar
-    los eventos por su `event_date` (inclusive).
-    """
-    try:
-        connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=RealDictCursor)
-
-        # Construir dinámicamente la consulta y parámetros
-        where_clauses = ["e.route_detail_id = %s"]
-        params = [route_detail_id]
-
-        if only_event_type is not None:
-            where_clauses.append("e.event_type_id = %s")
-            params.append(only_event_type)
-
-        # Filtrar por rango de fechas si se proporcionan
-        if fecha_inicio:
-            where_clauses.append("e.event_date::date >= %s")
-            params.append(fecha_inicio)
-        if fecha_fin:
-            where_clauses.append("e.event_date::date <= %s")
-            params.append(fecha_fin)
-
-        where_sql = " AND ".join(where_clauses)
-
-        sql_all = f"""
-        SELECT
+# Columnas de evento -> factura -> línea compartidas por /route_detail/{id}/ventas y /route_details/ventas
+SQL_COLUMNAS_VENTAS_EVENTO = """
           e.id AS event_id,
           e.event_date,
           e.comments AS comments,
@@ -1738,7 +2420,143 @@ def ventas_por_route_detail(
           idt.net_amount,
           idt.vat_amount,
           COALESCE(idt.net_amount, (idt.quantity * idt.unit_price)) AS line_total,
-          idt.row_number
+          idt.row_number"""
+
+# Tope de route_details por request del endpoint por lote
+MAX_ROUTE_DETAILS_LOTE = 2000
+
+
+def filtros_eventos_ventas(
+    only_event_type: Optional[int],
+    fecha_inicio: Optional[str],
+    fecha_fin: Optional[str]
+) -> Tuple[List[str], List[Any]]:
+    """Condiciones opcionales sobre `event e` (tipo y rango de event_date, inclusive)"""
+    where_clauses = []
+    params: List[Any] = []
+    if only_event_type is not None:
+        where_clauses.append("e.event_type_id = %s")
+        params.append(only_event_type)
+    # Filtrar por rango de fechas si se proporcionan
+    if fecha_inicio:
+        where_clauses.append("e.event_date::date >= %s")
+        params.append(fecha_inicio)
+    if fecha_fin:
+        where_clauses.append("e.event_date::date <= %s")
+        params.append(fecha_fin)
+    return where_clauses, params
+
+
+def agrupar_ventas_route_detail(route_detail_id: int, rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Agrupa las filas evento/factura/línea (ordenadas por fecha) en la respuesta de un route_detail"""
+    eventos_map = {}
+    for r in rows:
+        ev_id = r.get('event_id')
+        if ev_id is None:
+            # evento sin id? ignorar
+            continue
+        if ev_id not in eventos_map:
+            eventos_map[ev_id] = {
+                    'event_id': ev_id,
+                    'event_date': r.get('event_date'),
+                    'comments': r.get('comments'),
+                    'event_type_id': r.get('event_type_id'),
+                    'invoices': {}
+                }
+        ev = eventos_map[ev_id]
+        inv_id = r.get('invoice_id')
+        if inv_id is None:
+            # evento sin factura, seguir
+            continue
+        if inv_id not in ev['invoices']:
+            ev['invoices'][inv_id] = {
+                'invoice_id': inv_id,
+                'invoice_number': r.get('invoice_number'),
+                'invoice_date': r.get('invoice_date'),
+                'invoice_total': r.get('invoice_total'),
+                'currency_code': r.get('currency_code'),
+                'lines': []
+            }
+        inv = ev['invoices'][inv_id]
+        if r.get('invoice_detail_id'):
+            inv['lines'].append({
+                'invoice_detail_id': r.get('invoice_detail_id'),
+                'product_code': r.get('product_code'),
+                'product_name': r.get('product_name'),
+                'quantity': float(r.get('quantity') or 0),
+                'unit_price': float(r.get('unit_price') or 0),
+                'net_amount': float(r.get('net_amount') or 0),
+                'vat_amount': float(r.get('vat_amount') or 0),
+                'line_total': float(r.get('line_total') or 0),
+                'row_number': r.get('row_number')
+            })
+
+    # Convertir map a lista ordenada
+    eventos_list = []
+    for ev_id, ev in eventos_map.items():
+        invoices_list = []
+        for inv_id, inv in ev['invoices'].items():
+            invoices_list.append(inv)
+        # Ordenar invoices por invoice_date
+        invoices_list.sort(key=lambda x: x.get('invoice_date') or '')
+        ev['invoices'] = invoices_list
+        eventos_list.append(ev)
+
+    eventos_list.sort(key=lambda x: x.get('event_date') or '')
+
+    # Calcular conteo total de lineas encontradas
+    total_lines = sum(len(inv['lines']) for ev in eventos_list for inv in ev['invoices'])
+    return {
+        'route_detail_id': route_detail_id,
+        'events': eventos_list,
+        'count': total_lines
+    }
+
+
+def respuesta_route_detail_sin_eventos(
+    route_detail_id: int,
+    only_event_type: Optional[int],
+    rd_row: Optional[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """Respuesta cuando no hay eventos: vacía si se pidió un tipo de evento, si no los totales
+    agregados de `route_detail` (comportamiento legacy)"""
+    if only_event_type is not None:
+        return {'route_detail_id': route_detail_id, 'events': [], 'count': 0, 'ventas': [], 'mensaje': f'No se encontraron eventos del tipo {only_event_type} con líneas de venta.'}
+    if rd_row:
+        return {
+            'route_detail_id': route_detail_id,
+            'events': [],
+            'count': 0,
+            'ventas_aggregadas': {
+                'invoice_amount': float(rd_row.get('invoice_amount') or 0),
+                'order_amount': float(rd_row.get('order_amount') or 0)
+            }
+        }
+    return {'route_detail_id': route_detail_id, 'events': [], 'count': 0, 'ventas': [], 'mensaje': 'No se encontraron eventos ni ventas'}
+
+
+@app.get("/route_detail/{route_detail_id}/ventas")
+async def ventas_por_route_detail(
+    route_detail_id: int,
+    only_event_type: Optional[int] = None,
+    fecha_inicio: Optional[str] = None,
+    fecha_fin: Optional[str] = None,
+    connection=Depends(get_db_async)
+):
+    """Devuelve todos los eventos asociados al `route_detail_id` con sus
+    facturas e invoice_detail (líneas). Si no se encuentran facturas/lineas,
+    devuelve totales agregados desde `route_detail`.
+
+    Se pueden pasar `fecha_inicio` y `fecha_fin` (YYYY-MM-DD) para filtrar
+    los eventos por su `event_date` (inclusive).
+    """
+    try:
+        # Construir dinámicamente la consulta y parámetros
+        filtros, params = filtros_eventos_ventas(only_event_type, fecha_inicio, fecha_fin)
+        where_sql = " AND ".join(["e.route_detail_id = %s"] + filtros)
+
+        sql_all = f"""
+        SELECT{SQL_COLUMNAS_VENTAS_EVENTO}
         FROM public.event e
         LEFT JOIN public.invoice i ON i.event_id = e.id
         LEFT JOIN public.invoice_detail idt ON idt.invoice_id = i.id
@@ -1746,15 +2564,14 @@ def ventas_por_route_detail(
         ORDER BY e.event_date ASC, i.creation_date ASC, idt.row_number ASC
         """
 
-        cursor.execute(sql_all, tuple(params))
-        rows = cursor.fetchall()
-        # If caller requested a specific event type, and no rows found, return empty events (no aggregated fallback)
-        if not rows:
-            if only_event_type is not None:
-                cursor.close()
-                connection.close()
-                return {'route_detail_id': route_detail_id, 'events': [], 'count': 0, 'ventas': [], 'mensaje': f'No se encontraron eventos del tipo {only_event_type} con líneas de venta.'}
+        cursor = await connection.execute(sql_all, tuple([route_detail_id] + params))
+        rows = await cursor.fetchall()
+        if rows:
+            return RespuestaJSONRapida(agrupar_ventas_route_detail(route_detail_id, rows))
 
+        # If caller requested a specific event type, and no rows found, return empty events (no aggregated fallback)
+        rd_row = None
+        if only_event_type is None:
             # fallback: no events with invoice details — return aggregated route_detail (legacy behavior)
             fallback_sql = """
             SELECT rd.id AS route_detail_id, rd.invoice_amount, rd.order_amount, rd.subject_code, rd.subject_name, r.id AS route_id
@@ -1763,94 +2580,105 @@ def ventas_por_route_detail(
             WHERE rd.id = %s
             LIMIT 1
             """
-            cursor.execute(fallback_sql, (route_detail_id,))
-            rd_row = cursor.fetchone()
-            cursor.close()
-            connection.close()
-            if rd_row:
-                return {
-                    'route_detail_id': route_detail_id,
-                    'events': [],
-                    'count': 0,
-                    'ventas_aggregadas': {
-                        'invoice_amount': float(rd_row.get('invoice_amount') or 0),
-                        'order_amount': float(rd_row.get('order_amount') or 0)
-                    }
-                }
-            return {'route_detail_id': route_detail_id, 'events': [], 'count': 0, 'ventas': [], 'mensaje': 'No se encontraron eventos ni ventas'}
+            cursor = await connection.execute(fallback_sql, (route_detail_id,))
+            rd_row = await cursor.fetchone()
+        return RespuestaJSONRapida(respuesta_route_detail_sin_eventos(route_detail_id, only_event_type, rd_row))
+    except Exception as e:
+        log.exception("Error en ventas_por_route_detail")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        # Agrupar por evento -> factura -> lineas
-        eventos_map = {}
-        for r in rows:
-            ev_id = r.get('event_id')
-            if ev_id is None:
-                # evento sin id? ignorar
-                continue
-            if ev_id not in eventos_map:
-                eventos_map[ev_id] = {
-                        'event_id': ev_id,
-                        'event_date': r.get('event_date'),
-                        'comments': r.get('comments'),
-                        'event_type_id': r.get('event_type_id'),
-                        'invoices': {}
-                    }
-            ev = eventos_map[ev_id]
-            inv_id = r.get('invoice_id')
-            if inv_id is None:
-                # evento sin factura, seguir
-                continue
-            if inv_id not in ev['invoices']:
-                ev['invoices'][inv_id] = {
-                    'invoice_id': inv_id,
-                    'invoice_number': r.get('invoice_number'),
-                    'invoice_date': r.get('invoice_date'),
-                    'invoice_total': r.get('invoice_total'),
-                    'currency_code': r.get('currency_code'),
-                    'lines': []
-                }
-            inv = ev['invoices'][inv_id]
-            if r.get('invoice_detail_id'):
-                inv['lines'].append({
-                    'invoice_detail_id': r.get('invoice_detail_id'),
-                    'product_code': r.get('product_code'),
-                    'product_name': r.get('product_name'),
-                    'quantity': float(r.get('quantity') or 0),
-                    'unit_price': float(r.get('unit_price') or 0),
-                    'net_amount': float(r.get('net_amount') or 0),
-                    'vat_amount': float(r.get('vat_amount') or 0),
-                    'line_total': float(r.get('line_total') or 0),
-                    'row_number': r.get('row_number')
-                })
 
-        # Convertir map a lista ordenada
-        eventos_list = []
-        for ev_id, ev in eventos_map.items():
-            invoices_list = []
-            for inv_id, inv in ev['invoices'].items():
-                invoices_list.append(inv)
-            # Ordenar invoices por invoice_date
-            invoices_list.sort(key=lambda x: x.get('invoice_date') or '')
-            ev['invoices'] = invoices_list
-            eventos_list.append(ev)
+@app.get("/route_details/ventas")
+async def ventas_por_route_details(
+    route_detail_ids: Optional[List[int]] = Query(None),
+    route_id: Optional[int] = None,
+    only_event_type: Optional[int] = None,
+    fecha_inicio: Optional[str] = None,
+    fecha_fin: Optional[str] = None,
+    connection=Depends(get_db_async)
+):
+    """Ventas de varios route_detail en un solo request (p. ej. toda una ruta para el player).
+
+    Recibe `route_detail_ids` (repetible) o un `route_id` (todos sus route_detail) y devuelve
+    `{ventas: {route_detail_id: <misma estructura que /route_detail/{id}/ventas>}}`, resuelto
+    con una única consulta: route_detail + route (para el fallback agregado) LEFT JOIN
+    event/invoice/invoice_detail con los mismos filtros que el endpoint individual.
+    """
+    if not route_detail_ids and route_id is None:
+        raise HTTPException(status_code=400, detail="Indicar route_detail_ids o route_id")
+
+    try:
+        filtros, params_eventos = filtros_eventos_ventas(only_event_type, fecha_inicio, fecha_fin)
+        join_eventos = " AND ".join(["e.route_detail_id = d.route_detail_id"] + filtros)
+
+        if route_detail_ids:
+            ids = list(dict.fromkeys(route_detail_ids))
+            if len(ids) > MAX_ROUTE_DETAILS_LOTE:
+                raise HTTPException(
+                    status_code=400,
+                    detail=f"Máximo {MAX_ROUTE_DETAILS_LOTE} route_detail_ids por request"
+                )
+            sql_ids = "SELECT unnest(%s::bigint[]) AS route_detail_id"
+            params_ids: List[Any] = [ids]
+        else:
+            sql_ids = "SELECT rd.id AS route_detail_id FROM public.route_detail rd WHERE rd.route_id = %s"
+            params_ids = [route_id]
+
+        sql_lote = f"""
+        WITH ids AS ({sql_ids}),
+        detalles AS (
+            SELECT ids.route_detail_id, rd.invoice_amount, rd.order_amount, r.id AS route_id
+            FROM ids
+            LEFT JOIN (public.route_detail rd JOIN public.route r ON r.id = rd.route_id)
+                ON rd.id = ids.route_detail_id
+        )
+        SELECT
+          d.route_detail_id,
+          d.invoice_amount AS rd_invoice_amount,
+          d.order_amount AS rd_order_amount,
+          d.route_id AS rd_route_id,{SQL_COLUMNAS_VENTAS_EVENTO}
+        FROM detalles d
+        LEFT JOIN public.event e ON {join_eventos}
+        LEFT JOIN public.invoice i ON i.event_id = e.id
+        LEFT JOIN public.invoice_detail idt ON idt.invoice_id = i.id
+        ORDER BY d.route_detail_id, e.event_date ASC, i.creation_date ASC, idt.row_number ASC
+        """
 
-        eventos_list.sort(key=lambda x: x.get('event_date') or '')
+        cursor = await connection.execute(sql_lote, tuple(params_ids + params_eventos))
+        rows = await cursor.fetchall()
 
-        cursor.close()
-        connection.close()
-        # Calcular conteo total de lineas encontradas
-        total_lines = sum(len(inv['lines']) for ev in eventos_list for inv in ev['invoices'])
-        return {
-            'route_detail_id': route_detail_id,
-            'events': eventos_list,
-            'count': total_lines
-        }
+        filas_por_rd: Dict[int, List[Dict[str, Any]]] = {}
+        for r in rows:
+            filas_por_rd.setdefault(r['route_detail_id'], []).append(r)
+
+        ventas = {}
+        for rd_id, filas in filas_por_rd.items():
+            if filas[0].get('event_id') is not None:
+                ventas[rd_id] = agrupar_ventas_route_detail(rd_id, filas)
+            else:
+                # Sin eventos: la única fila trae los totales de route_detail (o NULL si no existe)
+                rd_row = None
+                if filas[0].get('rd_route_id') is not None:
+                    rd_row = {
+                        'invoice_amount': filas[0].get('rd_invoice_amount'),
+                        'order_amount': filas[0].get('rd_order_amount')
+                    }
+                ventas[rd_id] = respuesta_route_detail_sin_eventos(rd_id, only_event_type, rd_row)
+
+        return RespuestaJSONRapida({
+            'route_id': route_id,
+            'ventas': ventas,
+            'cantidad': len(ventas)
+        })
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error en ventas_por_route_detail: {e}")
+        log.exception("Error en ventas_por_route_details")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/ventas_por_zona_comparar")
-def ventas_por_zona_comparar(
+async def ventas_por_zona_comparar(
     periodo: str = "dia",
     fecha: Optional[str] = None,
     vendedor_id: Optional[int] = None
@@ -1865,9 +2693,6 @@ def ventas_por_zona_comparar(
     - vendedor_id: opcional filtro por vendedor.
     """
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=RealDictCursor)
-
         # Fecha actual a consultar
         hoy = datetime.now().date()
         if periodo == "dia":
@@ -1896,41 +2721,36 @@ def ventas_por_zona_comparar(
 
         # Obtener ventas actuales por zona
         consulta_actual = f"""
-        SELECT COALESCE(rzd.zone_code, 'unknown') as zone_code,
-               COALESCE(SUM(CASE WHEN rd.visit_sequence IS NOT NULL AND rd.invoice_amount > 0 THEN rd.invoice_amount ELSE 0 END), 0) as ventas_actuales
-        FROM public.route r
-        JOIN public.route_detail rd ON rd.route_id = r.id
-        LEFT JOIN public.route_zone_detail rzd ON rzd.route_id = r.id
+        SELECT r.zone_code,
+               COALESCE(SUM(r.ventas), 0) as ventas_actuales
+        FROM {fuente_ventas()} r
         WHERE {where_actual}
         {filtro_vendedor}
-        AND rzd.zone_code IS NOT NULL
-        GROUP BY rzd.zone_code
+        AND r.zone_code <> ''
+        GROUP BY r.zone_code
         """
 
-        cursor.execute(consulta_actual)
-        rows_actual = cursor.fetchall()
-
-        ventas_actuales_por_zona = {row['zone_code']: float(row['ventas_actuales'] or 0) for row in rows_actual}
-
         # Obtener ventas periodo de comparación por zona
         consulta_comp = f"""
-        SELECT COALESCE(rzd.zone_code, 'unknown') as zone_code,
-               COALESCE(SUM(CASE WHEN rd.visit_sequence IS NOT NULL AND rd.invoice_amount > 0 THEN rd.invoice_amount ELSE 0 END), 0) as ventas_comp
-        FROM public.route r
-        JOIN public.route_detail rd ON rd.route_id = r.id
-        LEFT JOIN public.route_zone_detail rzd ON rzd.route_id = r.id
+        SELECT r.zone_code,
+               COALESCE(SUM(r.ventas), 0) as ventas_comp
+        FROM {fuente_ventas()} r
         WHERE {where_comp}
         {filtro_vendedor}
-        AND rzd.zone_code IS NOT NULL
-        GROUP BY rzd.zone_code
+        AND r.zone_code <> ''
+        GROUP BY r.zone_code
         """
 
-        cursor.execute(consulta_comp)
-        rows_comp = cursor.fetchall()
-        ventas_comp_por_zona = {row['zone_code']: float(row['ventas_comp'] or 0) for row in rows_comp}
-
+        # Las tres consultas son independientes: correrlas en paralelo.
         # Para zonas que no aparecen en la fecha de comparación, usar fallback: última venta conocida por zona
-        ventas_anteriores_fallback = obtener_ventas_anteriores_por_zona(fecha_actual, connection)
+        rows_actual, rows_comp, ventas_anteriores_fallback = await asyncio.gather(
+            execute_query_async(consulta_actual),
+            execute_query_async(consulta_comp),
+            obtener_ventas_anteriores_por_zona(fecha_actual)
+        )
+
+        ventas_actuales_por_zona = {row['zone_code']: float(row['ventas_actuales'] or 0) for row in rows_actual}
+        ventas_comp_por_zona = {row['zone_code']: float(row['ventas_comp'] or 0) for row in rows_comp}
 
         # Construir unión de zonas
         zonas_union = set(list(ventas_actuales_por_zona.keys()) + list(ventas_comp_por_zona.keys()) + list(ventas_anteriores_fallback.keys()))
@@ -1972,9 +2792,6 @@ def ventas_por_zona_comparar(
         else:
             crecimiento_total = 100.0 if total_actual > 0 else 0.0
 
-        cursor.close()
-        connection.close()
-
         return {
             "periodo": periodo,
             "fecha_consulta": fecha_actual,
@@ -1986,7 +2803,7 @@ def ventas_por_zona_comparar(
         }
 
     except Exception as e:
-        print(f"Error en ventas_por_zona_comparar: {e}")
+        log.exception("Error en ventas_por_zona_comparar")
         raise HTTPException(status_code=500, detail=f"Error calculando ventas por zona: {str(e)}")
 
 # Otros endpoints con datos dummy por ahora
@@ -2008,7 +2825,7 @@ def get_vendedores():
         rows = execute_query("SELECT id, full_name FROM public.v_users ORDER BY full_name")
         return {"count": len(rows), "vendedores": rows}
     except Exception as e:
-        print(f"Error en get_vendedores: {e}")
+        log.exception("Error en get_vendedores")
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/ventas_por_dia") 
@@ -2114,7 +2931,7 @@ def get_clientes_visitados(
         }
 
     except Exception as e:
-        print(f"Error en get_clientes_visitados: {e}")
+        log.exception("Error en get_clientes_visitados")
         raise HTTPException(status_code=500, detail=f"Error obteniendo clientes visitados: {str(e)}")
 
     def _calcular_rango_por_defecto_ultimos_meses(meses: int = 3):
@@ -2199,7 +3016,7 @@ def get_clientes_visitados(
                 })
 
             cursor.close()
-            connection.close()
+            release_db_connection(connection)
 
             return {
                 'fecha_inicio': fecha_inicio,
@@ -2209,7 +3026,7 @@ def get_clientes_visitados(
             }
 
         except Exception as e:
-            print(f"Error en get_clientes_no_visitados: {e}")
+            log.exception("Error en get_clientes_no_visitados")
             raise HTTPException(status_code=500, detail=str(e))
 
 @app.get("/vendedores")
@@ -2231,86 +3048,158 @@ def get_vendedores():
         return [{"id": row['id'], "nombre": row['nombre'], "total_rutas": row['total_rutas']} for row in resultados]
 
     except Exception as e:
-        print(f"Error en get_vendedores: {e}")
+        log.exception("Error en get_vendedores")
         raise HTTPException(status_code=500, detail=f"Error obteniendo vendedores: {str(e)}")
 
 
+def sql_ultima_ubicacion(hours: int = 48, limit: Optional[int] = None) -> str:
+    """Última fila de `tracking` por vendedor dentro de las últimas `hours` horas"""
+    # Usamos un INTERVAL dinámico basado en `hours` para filtrar registros recientes
+    sql = f"""
+    SELECT DISTINCT ON (t.user_id)
+        t.user_id,
+        v.full_name as user_full_name,
+        t.latitude,
+        t.longitude,
+        t.location_time_millis,
+        t.tracking_date,
+        t.batery_level as battery_level,
+        t.altitude,
+        t.horizontal_accuracy,
+        t.vertical_accuracy
+    FROM public.tracking t
+    LEFT JOIN public.v_users v ON v.id = t.user_id
+    WHERE t.latitude IS NOT NULL
+      AND t.longitude IS NOT NULL
+      AND t.tracking_date >= NOW() - INTERVAL '{int(hours)} hours'
+    ORDER BY t.user_id, t.tracking_date DESC, t.location_time_millis DESC
+    """
+    if limit and isinstance(limit, int) and limit > 0:
+        sql += f" LIMIT {int(limit)}"
+    return sql
+
 @app.get("/vendedores/ultima_ubicacion")
-def get_vendedores_ultima_ubicacion(limit: Optional[int] = None, hours: int = 48):
+async def get_vendedores_ultima_ubicacion(limit: Optional[int] = None, hours: int = 48):
     """Devuelve la última ubicación conocida por vendedor desde la tabla `tracking`.
 
     - Retorna una fila por `user_id` con la última `tracking_date` dentro de las últimas `hours` horas.
     - Parámetro opcional `limit` para devolver solo los primeros N registros (útil para debug).
     - Parámetro opcional `hours` para ajustar el umbral (por defecto 48).
+
+    Se sirve del snapshot en memoria de ubicaciones_vivo.py; si no está listo o `hours` supera
+    su ventana, se consulta `tracking` directamente.
     """
+    if ubicaciones_vivo.cubre(hours):
+        result = ubicaciones_vivo.ubicaciones(hours, limit)
+        return {'count': len(result), 'rows': result}
     try:
-        connection = get_db_connection()
-        cursor = connection.cursor(cursor_factory=RealDictCursor)
-
-        # Usamos un INTERVAL dinámico basado en `hours` para filtrar registros recientes
-        sql = f"""
-        SELECT DISTINCT ON (t.user_id)
-            t.user_id,
-            v.full_name as user_full_name,
-            t.latitude,
-            t.longitude,
-            t.location_time_millis,
-            t.tracking_date,
-            t.batery_level as battery_level,
-            t.altitude,
-            t.horizontal_accuracy,
-            t.vertical_accuracy
-        FROM public.tracking t
-        LEFT JOIN public.v_users v ON v.id = t.user_id
-        WHERE t.latitude IS NOT NULL
-          AND t.longitude IS NOT NULL
-          AND t.tracking_date >= NOW() - INTERVAL '{hours} hours'
-        ORDER BY t.user_id, t.tracking_date DESC, t.location_time_millis DESC
-        """
-
-        if limit and isinstance(limit, int) and limit > 0:
-            sql += f" LIMIT {int(limit)}"
-
-        cursor.execute(sql)
-        rows = cursor.fetchall()
-
-        result = []
-        for r in rows:
-            try:
-                lat = float(r['latitude']) if r.get('latitude') is not None else None
-                lng = float(r['longitude']) if r.get('longitude') is not None else None
-            except Exception:
-                lat = None
-                lng = None
-
-            tracking_date = r.get('tracking_date')
-            if hasattr(tracking_date, 'strftime'):
-                tracking_date = tracking_date.strftime('%Y-%m-%d %H:%M:%S')
-
-            result.append({
-                'user_id': r.get('user_id'),
-                'user_full_name': r.get('user_full_name') or None,
-                'latitude': lat,
-                'longitude': lng,
-                'location_time_millis': r.get('location_time_millis'),
-                'tracking_date': tracking_date,
-                'battery_level': float(r.get('battery_level')) if r.get('battery_level') is not None else None,
-                'altitude': float(r.get('altitude')) if r.get('altitude') is not None else None,
-                'horizontal_accuracy': float(r.get('horizontal_accuracy')) if r.get('horizontal_accuracy') is not None else None,
-                'vertical_accuracy': float(r.get('vertical_accuracy')) if r.get('vertical_accuracy') is not None else None
-            })
-
-        cursor.close()
-        connection.close()
-
+        sql = sql_ultima_ubicacion(hours, limit)
+        result = [formatear_ubicacion(r) for r in await execute_query_async(sql)]
         return {'count': len(result), 'rows': result}
 
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error en get_vendedores_ultima_ubicacion: {e}")
+        log.exception("Error en get_vendedores_ultima_ubicacion")
         raise HTTPException(status_code=500, detail=f"Error obteniendo última ubicación de vendedores: {str(e)}")
 
+def evento_sse(evento: str, datos: Any) -> bytes:
+    return b"event: " + evento.encode("utf-8") + b"\ndata: " + serializar_json(datos) + b"\n\n"
+
+@app.get("/vendedores/ubicaciones/stream")
+async def stream_ubicaciones_vendedores(request: Request, hours: int = 48):
+    """Server-Sent Events con las posiciones de los vendedores (en lugar de hacer polling de
+    /vendedores/ultima_ubicacion):
+    - `snapshot`: {count, rows} como /vendedores/ultima_ubicacion, al conectar (y de nuevo si el
+      cliente se atrasó demasiado)
+    - `delta`: {rows} sólo con los vendedores que se movieron
+    Cada 15 s sin cambios se manda un comentario para mantener viva la conexión.
+    503 si el snapshot en memoria no está disponible."""
+    if not ubicaciones_vivo.cubre(hours):
+        raise HTTPException(status_code=503, detail="Ubicaciones en vivo no disponibles, use /vendedores/ultima_ubicacion")
+
+    async def generar():
+        cola = ubicaciones_vivo.suscribir()
+        try:
+            filas = ubicaciones_vivo.ubicaciones(hours)
+            yield evento_sse("snapshot", {'count': len(filas), 'rows': filas})
+            while not await request.is_disconnected():
+                try:
+                    cambios = await asyncio.wait_for(cola.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+                if cambios is None:
+                    filas = ubicaciones_vivo.ubicaciones(hours)
+                    yield evento_sse("snapshot", {'count': len(filas), 'rows': filas})
+                else:
+                    yield evento_sse("delta", {'rows': cambios})
+        finally:
+            ubicaciones_vivo.desuscribir(cola)
+
+    return StreamingResponse(
+        generar(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/vendedores/ubicaciones/estado")
+def estado_ubicaciones_vendedores():
+    """Estado del snapshot de ubicaciones en memoria (vendedores, marca de tracking.id, lecturas)"""
+    return ubicaciones_vivo.estadisticas()
+
+SQL_RECORRIDO = """
+SELECT t.latitude, t.longitude, t.location_time_millis, t.horizontal_accuracy
+FROM public.tracking t
+WHERE t.user_id = %s
+  AND t.tracking_date >= %s::date
+  AND t.tracking_date < %s::date + 1
+  AND t.latitude IS NOT NULL
+  AND t.longitude IS NOT NULL
+  AND t.location_time_millis IS NOT NULL
+ORDER BY t.location_time_millis, t.id
+"""
+
+@app.get("/vendedores/{user_id}/recorrido")
+async def get_recorrido_vendedor(
+    user_id: int,
+    fecha: str,
+    intervalo: float = Query(30, ge=0, le=3600),  # segundos mínimos entre puntos
+    distancia: float = Query(15, ge=0, le=5000),  # metros mínimos entre puntos
+    precision_max: float = Query(50, gt=0)  # horizontal_accuracy máxima aceptada (metros)
+):
+    """Recorrido GPS de un vendedor en un día (YYYY-MM-DD) desde `tracking`, submuestreado por
+    tiempo y distancia y sin fixes imprecisos (ver recorridos.py). Devuelve la polilínea
+    codificada (lat/lng, precisión 1e-5) y `segundos` desde `inicio_millis` para cada punto.
+    Los días anteriores a hoy se cachean como /mapa/rutas (X-Cache)."""
+    try:
+        dia = datetime.strptime(fecha, '%Y-%m-%d').date()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="fecha debe tener formato YYYY-MM-DD")
+    resumen = ResumenRequest("/vendedores/recorrido")
+    clave = clave_desde_parametros({
+        'endpoint': 'recorrido', 'user_id': user_id, 'fecha': dia.isoformat(),
+        'intervalo': intervalo, 'distancia': distancia, 'precision_max': precision_max
+    })
+    ttl = TTL_MAPA_HISTORICO if dia < date.today() else TTL_MAPA_ACTUAL
+
+    async def calcular() -> bytes:
+        with resumen.fase("sql"):
+            filas = await execute_query_async(SQL_RECORRIDO, (user_id, dia, dia))
+        with resumen.fase("submuestreo"):
+            recorrido = submuestrear_recorrido(filas, intervalo, distancia, precision_max)
+        return serializar_json({'user_id': user_id, 'fecha': dia.isoformat(), **recorrido})
+
+    contenido, hit = await cache_mapa.obtener_o_calcular(clave, ttl, calcular)
+    resumen.contar(cache="HIT" if hit else "MISS", bytes=len(contenido))
+    return Response(
+        content=contenido,
+        media_type="application/json",
+        headers=cerrar_resumen(resumen, {"X-Cache": "HIT" if hit else "MISS"})
+    )
+
 @app.get("/zonas")
-def get_zonas():
+async def get_zonas():
     """Obtener zonas geográficas para visualización en mapa"""
     try:
         # Consulta para obtener zonas con estadísticas
@@ -2334,7 +3223,7 @@ def get_zonas():
         ORDER BY r.group_id
         """
         
-        resultados = execute_query(query_zonas)
+        resultados = await execute_query_async(query_zonas)
         
         zonas = []
         for row in resultados:
@@ -2357,9 +3246,23 @@ def get_zonas():
         }
         
     except Exception as e:
-        print(f"Error en get_zonas: {e}")
+        log.exception("Error en get_zonas")
         raise HTTPException(status_code=500, detail=f"Error obteniendo zonas: {str(e)}")
 
+@app.get("/zonas/geometria")
+def estadisticas_geometria_zonas():
+    """Estado del cache de geometrías de zona"""
+    return cache_geometrias.estadisticas()
+
+@app.post("/zonas/geometria/refrescar")
+async def refrescar_geometria_zonas(zona_ids: Optional[List[int]] = Query(None)):
+    """Invalida la geometría cacheada de las zonas indicadas (o de todas) después de editar zone.
+    También vacía los caches de /mapa/rutas y de teselas, que incluyen los polígonos."""
+    invalidadas = cache_geometrias.invalidar(zona_ids)
+    await cache_mapa.limpiar()
+    await cache_teselas.limpiar()
+    return {"invalidadas": invalidadas}
+
 @app.get("/clientes")
 def get_clientes():
     """Lista de clientes para tabla (dummy data para compatibilidad)"""
@@ -0,0 +1,182 @@
+"""
+Métricas del backend en formato de exposición de Prometheus (texto 0.0.4).
+
+Implementación mínima sin dependencias (contadores e histogramas con labels,
+thread-safe) para no sumar prometheus_client al despliegue:
+- rutas_http_request_duracion_segundos{endpoint,metodo,estado}: middleware ASGI
+- rutas_fase_duracion_segundos{endpoint,fase}: fases de un `ResumenRequest`
+- rutas_filas_total{endpoint,tipo}: filas / rutas / zonas procesadas
+- rutas_respuesta_bytes{endpoint}: tamaño del payload
+
+El endpoint se etiqueta con la plantilla de la ruta (/route_detail/{route_detail_id}/ventas)
+y no con la URL concreta, para que la cantidad de series quede acotada.
+"""
+
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BUCKETS_BYTES = (1_000, 10_000, 100_000, 500_000, 1_000_000, 5_000_000, 10_000_000, 50_000_000)
+
+# Server-Timing en las respuestas instrumentadas (desactivado por defecto: expone tiempos internos)
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0").lower() in ("1", "true", "si", "yes")
+
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _numero(valor: float) -> str:
+    return str(int(valor)) if float(valor).is_integer() else repr(float(valor))
+
+
+def _labels(nombres: Tuple[str, ...], valores: Tuple[str, ...], extra: str = "") -> str:
+    partes = [f'{n}="{_escapar(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        partes.append(extra)
+    return "{" + ",".join(partes) + "}" if partes else ""
+
+
+class Contador:
+    def __init__(self, nombre: str, ayuda: str, labels: Tuple[str, ...] = ()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.labels = labels
+        self._valores: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, *valores_labels: str, cantidad: float = 1.0):
+        with self._lock:
+            self._valores[valores_labels] = self._valores.get(valores_labels, 0.0) + cantidad
+
+    def exponer(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            for valores, total in sorted(self._valores.items()):
+                lineas.append(f"{self.nombre}{_labels(self.labels, valores)} {_numero(total)}")
+        return lineas
+
+
+INF = 'le="+Inf"'
+
+
+class Histograma:
+    def __init__(self, nombre: str, ayuda: str, labels: Tuple[str, ...] = (),
+                 buckets: Iterable[float] = BUCKETS_SEGUNDOS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple[str, ...], list] = {}  # labels -> [conteos por bucket, suma, total]
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float, *valores_labels: str):
+        with self._lock:
+            serie = self._series.get(valores_labels)
+            if serie is None:
+                serie = self._series[valores_labels] = [[0] * len(self.buckets), 0.0, 0]
+            for i, limite in enumerate(self.buckets):
+                if valor <= limite:
+                    serie[0][i] += 1
+                    break
+            serie[1] += valor
+            serie[2] += 1
+
+    def exponer(self) -> List[str]:
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            for valores, (conteos, suma, total) in sorted(self._series.items()):
+                acumulado = 0
+                for limite, conteo in zip(self.buckets, conteos):
+                    acumulado += conteo
+                    le = 'le="%g"' % limite
+                    lineas.append(f"{self.nombre}_bucket{_labels(self.labels, valores, le)} {acumulado}")
+                lineas.append(f"{self.nombre}_bucket{_labels(self.labels, valores, INF)} {total}")
+                lineas.append(f"{self.nombre}_sum{_labels(self.labels, valores)} {_numero(suma)}")
+                lineas.append(f"{self.nombre}_count{_labels(self.labels, valores)} {total}")
+        return lineas
+
+
+duracion_requests = Histograma(
+    "rutas_http_request_duracion_segundos", "Duración de los requests HTTP por endpoint",
+    ("endpoint", "metodo", "estado")
+)
+duracion_fases = Histograma(
+    "rutas_fase_duracion_segundos", "Duración de cada fase de los endpoints instrumentados",
+    ("endpoint", "fase")
+)
+filas_procesadas = Contador(
+    "rutas_filas_total", "Filas, rutas y zonas procesadas por endpoint", ("endpoint", "tipo")
+)
+bytes_respuesta = Histograma(
+    "rutas_respuesta_bytes", "Tamaño del payload de respuesta", ("endpoint",), BUCKETS_BYTES
+)
+cache_resultados = Contador(
+    "rutas_cache_total", "Resultados del cache de respuestas", ("endpoint", "resultado")
+)
+
+METRICAS = [duracion_requests, duracion_fases, filas_procesadas, bytes_respuesta, cache_resultados]
+
+# Contadores del ResumenRequest que se exportan como filas procesadas
+CONTADORES_FILAS = ("filas", "eventos", "clientes_kpis", "rutas", "puntos", "zonas")
+
+
+def exponer_metricas() -> str:
+    lineas: List[str] = []
+    for metrica in METRICAS:
+        lineas.extend(metrica.exponer())
+    return "\n".join(lineas) + "\n"
+
+
+def observar_resumen(resumen) -> None:
+    """Vuelca un `registro.ResumenRequest` terminado en los histogramas y contadores"""
+    for fase, ms in resumen.fases_ms.items():
+        duracion_fases.observar(ms / 1000, resumen.endpoint, fase)
+    for tipo in CONTADORES_FILAS:
+        cantidad = resumen.contadores.get(tipo)
+        if cantidad:
+            filas_procesadas.incrementar(resumen.endpoint, tipo, cantidad=cantidad)
+    if "bytes" in resumen.contadores:
+        bytes_respuesta.observar(resumen.contadores["bytes"], resumen.endpoint)
+    if "cache" in resumen.contadores:
+        cache_resultados.incrementar(resumen.endpoint, resumen.contadores["cache"])
+
+
+def server_timing(resumen) -> Optional[str]:
+    """Valor del header Server-Timing (`fase;dur=ms, ..., total;dur=ms`) o None si está desactivado"""
+    if not SERVER_TIMING:
+        return None
+    partes = [f"{fase};dur={ms:.1f}" for fase, ms in resumen.fases_ms.items()]
+    partes.append(f"total;dur={resumen.duracion_ms():.1f}")
+    return ", ".join(partes)
+
+
+class MiddlewareMetricas:
+    """Middleware ASGI que mide la duración de cada request HTTP por plantilla de ruta"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        inicio = time.perf_counter()
+        estado = {"codigo": 500}
+
+        async def send_con_estado(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado["codigo"] = mensaje["status"]
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, send_con_estado)
+        finally:
+            ruta = scope.get("route")
+            endpoint = getattr(ruta, "path", None) or "sin_ruta"
+            duracion_requests.observar(
+                time.perf_counter() - inicio, endpoint, scope.get("method", ""), str(estado["codigo"])
+            )
@@ -0,0 +1,74 @@
+-- Alinea bases creadas con el init.sql original con el esquema real que usa la API:
+-- route.day (fecha de la ruta, completada desde creation_date) y las tablas de zonas,
+-- eventos, facturas y tracking. En la base real todo esto ya existe y no hace nada.
+ALTER TABLE public.route ADD COLUMN IF NOT EXISTS day date;
+UPDATE public.route SET day = creation_date::date WHERE day IS NULL AND creation_date IS NOT NULL;
+
+-- Zonas (coordinates: "lat,lng lat,lng ..." o "lat lng lat lng ...")
+CREATE TABLE IF NOT EXISTS public.zone (
+    id SERIAL PRIMARY KEY,
+    group_id INTEGER,
+    name VARCHAR(255),
+    color VARCHAR(20),
+    coordinates TEXT
+);
+
+-- Zonas de cada ruta (zone_code = zone.id como texto)
+CREATE TABLE IF NOT EXISTS public.route_zone_detail (
+    id SERIAL PRIMARY KEY,
+    route_id INTEGER REFERENCES public.route(id),
+    zone_code VARCHAR(50),
+    zone_name VARCHAR(255),
+    zone_color VARCHAR(20)
+);
+
+-- Eventos de visita (event_type_id 1 = inicio, 2 = fin)
+CREATE TABLE IF NOT EXISTS public.event (
+    id SERIAL PRIMARY KEY,
+    route_detail_id INTEGER REFERENCES public.route_detail(id),
+    event_type_id INTEGER,
+    event_date TIMESTAMP,
+    latitude DECIMAL(10, 8),
+    longitude DECIMAL(11, 8),
+    comments TEXT,
+    distance_event_customer DECIMAL(12, 2)
+);
+
+-- Facturas y sus líneas
+CREATE TABLE IF NOT EXISTS public.invoice (
+    id SERIAL PRIMARY KEY,
+    event_id INTEGER REFERENCES public.event(id),
+    "number" VARCHAR(50),
+    creation_date TIMESTAMP,
+    gross_total DECIMAL(14, 2),
+    net_total DECIMAL(14, 2),
+    vat_total DECIMAL(14, 2),
+    currency_code VARCHAR(10),
+    type VARCHAR(10)
+);
+
+CREATE TABLE IF NOT EXISTS public.invoice_detail (
+    id SERIAL PRIMARY KEY,
+    invoice_id INTEGER REFERENCES public.invoice(id),
+    product_code VARCHAR(50),
+    product_name VARCHAR(255),
+    quantity DECIMAL(12, 3),
+    unit_price DECIMAL(14, 2),
+    net_amount DECIMAL(14, 2),
+    vat_amount DECIMAL(14, 2),
+    row_number INTEGER
+);
+
+-- Posiciones GPS de los vendedores
+CREATE TABLE IF NOT EXISTS public.tracking (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER REFERENCES public.users(id),
+    latitude DECIMAL(10, 8),
+    longitude DECIMAL(11, 8),
+    location_time_millis BIGINT,
+    tracking_date TIMESTAMP,
+    batery_level DECIMAL(5, 2),
+    altitude DECIMAL(10, 2),
+    horizontal_accuracy DECIMAL(10, 2),
+    vertical_accuracy DECIMAL(10, 2)
+);
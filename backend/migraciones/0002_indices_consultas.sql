@@ -0,0 +1,38 @@
+-- sin_transaccion
+-- Índices para los patrones de consulta de backend/main.py. CONCURRENTLY para no bloquear
+-- escrituras en producción (por eso esta migración corre fuera de transacción, una sentencia
+-- a la vez). Si una creación se interrumpe queda un índice INVALID: migrar.py lo detecta,
+-- lo elimina y vuelve a intentar en la próxima ejecución.
+
+-- /mapa/rutas, comparativas y KPIs: rango de r.day, opcionalmente por vendedor
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_route_day_user ON public.route (day, user_id);
+-- Filtros por un vendedor en rangos largos (año, últimos 90 días)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_route_user_day ON public.route (user_id, day);
+-- /clientes y /vendedores filtran por creation_date
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_route_creation_date ON public.route (creation_date);
+
+-- Join route -> route_detail (la FK no crea índice del lado hijo)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_route_detail_route ON public.route_detail (route_id, visit_sequence);
+-- Historial de KPIs por cliente: sólo visitas efectivas (parcial: visit_sequence no nulo)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_route_detail_cliente_visitado
+    ON public.route_detail (subject_code, route_id) WHERE visit_sequence IS NOT NULL;
+
+-- Zona de cada ruta (join por route_id) y rutas de una zona (ventas por zona)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_route_zone_detail_route ON public.route_zone_detail (route_id, zone_code);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_route_zone_detail_zona ON public.route_zone_detail (zone_code, route_id);
+
+-- Eventos de inicio/fin por route_detail (event_type_id IN (1,2)) y ventas por route_detail
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_event_route_detail_tipo
+    ON public.event (route_detail_id, event_type_id, event_date);
+
+-- Facturas por evento y líneas por factura
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_invoice_event ON public.invoice (event_id, creation_date);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_invoice_detail_invoice ON public.invoice_detail (invoice_id, row_number);
+
+-- Última ubicación por vendedor: DISTINCT ON (user_id) ORDER BY user_id, tracking_date DESC,
+-- location_time_millis DESC sobre puntos con coordenadas
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tracking_user_fecha
+    ON public.tracking (user_id, tracking_date DESC, location_time_millis DESC)
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL;
+-- tracking crece sólo por inserción en orden de fecha: BRIN chico para rangos de tiempo
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_tracking_fecha_brin ON public.tracking USING brin (tracking_date);
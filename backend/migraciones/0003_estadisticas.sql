@@ -0,0 +1,9 @@
+-- sin_transaccion
+-- Estadísticas actualizadas para que el planificador considere los índices nuevos
+ANALYZE public.route;
+ANALYZE public.route_detail;
+ANALYZE public.route_zone_detail;
+ANALYZE public.event;
+ANALYZE public.invoice;
+ANALYZE public.invoice_detail;
+ANALYZE public.tracking;
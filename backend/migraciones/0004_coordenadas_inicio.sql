@@ -0,0 +1,9 @@
+-- sin_transaccion
+-- /mapa/rutas resuelve en SQL la coordenada de cada cliente (primer evento de inicio, si no la
+-- de route_detail) y filtra por rango de Paraguay / bbox del mapa. El primer evento de inicio
+-- de cada route_detail sale de este índice parcial sin leer la tabla event: está ordenado como
+-- el LATERAL de sql_filas_rutas e incluye latitud y longitud.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_event_inicio_coordenadas
+    ON public.event (route_detail_id, event_date, id) INCLUDE (latitude, longitude)
+    WHERE event_type_id = 1;
+ANALYZE public.event
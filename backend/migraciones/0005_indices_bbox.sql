@@ -0,0 +1,11 @@
+-- sin_transaccion
+-- /mapa/rutas?bbox= y /tiles: sql_prefiltro_bbox busca por rango de latitud/longitud los
+-- route_detail con su coordenada cruda dentro del rectángulo, o con algún evento de inicio
+-- adentro, antes de resolver la coordenada efectiva de cada fila (que no es indexable).
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_route_detail_coordenadas
+    ON public.route_detail (latitude, longitude);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_event_inicio_lat_lng
+    ON public.event (latitude, longitude) INCLUDE (route_detail_id)
+    WHERE event_type_id = 1;
+ANALYZE public.route_detail;
+ANALYZE public.event
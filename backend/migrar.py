@@ -0,0 +1,218 @@
+"""
+Migraciones versionadas del esquema (índices y columnas que necesitan las consultas de la API).
+
+Cada archivo de backend/migraciones/ se llama NNNN_descripcion.sql y se aplica una sola vez,
+en orden de versión; lo aplicado queda registrado en public.schema_migraciones con un checksum
+del archivo (si un archivo ya aplicado cambia, `estado` lo marca como modificado).
+
+- Por defecto cada migración corre en una transacción junto con su registro.
+- Si la primera línea es `-- sin_transaccion`, las sentencias se ejecutan una por una en
+  autocommit (necesario para CREATE INDEX CONCURRENTLY). En ese modo las sentencias se separan
+  por `;`, así que no pueden contener `;` dentro de literales ni cuerpos de funciones, y tienen
+  que ser idempotentes (IF NOT EXISTS) porque una falla a mitad de archivo se reintenta entera.
+  Los índices INVALID que haya dejado un CONCURRENTLY interrumpido se eliminan antes de reintentar.
+
+Un advisory lock evita que dos procesos migren a la vez.
+
+Uso (desde backend/):
+    python migrar.py estado
+    python migrar.py aplicar [--hasta NNNN]
+
+init.sql crea una base nueva con el mismo esquema e índices; correr `aplicar` sobre ella sólo
+registra las versiones.
+"""
+
+import argparse
+import hashlib
+import re
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import psycopg2
+from psycopg2.extras import RealDictCursor
+
+from conexiones import DB_CONFIG
+
+DIRECTORIO = Path(__file__).resolve().parent / "migraciones"
+TABLA = "public.schema_migraciones"
+LOCK_MIGRACIONES = 582018
+MARCA_SIN_TRANSACCION = "-- sin_transaccion"
+
+SQL_CREAR_TABLA = f"""
+CREATE TABLE IF NOT EXISTS {TABLA} (
+    version integer PRIMARY KEY,
+    nombre varchar(255) NOT NULL,
+    checksum char(64) NOT NULL,
+    aplicada_en timestamptz NOT NULL DEFAULT now(),
+    duracion_ms numeric(12,1)
+)
+"""
+
+PATRON_ARCHIVO = re.compile(r"^(\d{4})_([a-z0-9_]+)\.sql$")
+PATRON_INDICE = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+
+
+class Migracion:
+    def __init__(self, ruta: Path):
+        coincidencia = PATRON_ARCHIVO.match(ruta.name)
+        if not coincidencia:
+            raise ValueError(f"Nombre de migración inválido: {ruta.name} (esperado NNNN_descripcion.sql)")
+        self.ruta = ruta
+        self.version = int(coincidencia.group(1))
+        self.nombre = coincidencia.group(2)
+        self.sql = ruta.read_text(encoding="utf-8")
+        self.checksum = hashlib.sha256(self.sql.encode("utf-8")).hexdigest()
+        self.sin_transaccion = self.sql.lstrip().startswith(MARCA_SIN_TRANSACCION)
+
+    def sentencias(self) -> List[str]:
+        """Sentencias del archivo sin comentarios de línea (para el modo sin transacción)"""
+        sin_comentarios = "\n".join(
+            linea for linea in self.sql.splitlines() if not linea.strip().startswith("--")
+        )
+        return [s.strip() for s in sin_comentarios.split(";") if s.strip()]
+
+    def indices_concurrentes(self) -> List[str]:
+        return PATRON_INDICE.findall(self.sql)
+
+
+def cargar_migraciones(directorio: Path = DIRECTORIO) -> List[Migracion]:
+    migraciones = sorted((Migracion(r) for r in directorio.glob("*.sql")), key=lambda m: m.version)
+    versiones = [m.version for m in migraciones]
+    if len(versiones) != len(set(versiones)):
+        raise ValueError(f"Versiones de migración repetidas en {directorio}")
+    return migraciones
+
+
+def aplicadas(connection) -> Dict[int, Dict[str, Any]]:
+    with connection.cursor(cursor_factory=RealDictCursor) as cursor:
+        cursor.execute(f"SELECT version, nombre, checksum, aplicada_en, duracion_ms FROM {TABLA}")
+        return {row["version"]: row for row in cursor.fetchall()}
+
+
+def _indices_invalidos(connection, nombres: List[str]) -> List[str]:
+    if not nombres:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute("""
+            SELECT c.relname
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            JOIN pg_namespace n ON n.oid = c.relnamespace
+            WHERE NOT i.indisvalid AND n.nspname = 'public' AND c.relname = ANY(%s)
+        """, (nombres,))
+        return [row[0] for row in cursor.fetchall()]
+
+
+def _registrar(cursor, migracion: Migracion, duracion_ms: float):
+    cursor.execute(
+        f"INSERT INTO {TABLA} (version, nombre, checksum, duracion_ms) VALUES (%s, %s, %s, %s)",
+        (migracion.version, migracion.nombre, migracion.checksum, round(duracion_ms, 1))
+    )
+
+
+def aplicar_migracion(connection, migracion: Migracion) -> float:
+    """Aplica una migración y la registra; devuelve la duración en ms"""
+    inicio = time.perf_counter()
+    if migracion.sin_transaccion:
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            for indice in _indices_invalidos(connection, migracion.indices_concurrentes()):
+                print(f"⚠️ Eliminando índice inválido {indice} (CONCURRENTLY interrumpido)")
+                cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS public.{indice}")
+            for sentencia in migracion.sentencias():
+                cursor.execute(sentencia)
+            invalidos = _indices_invalidos(connection, migracion.indices_concurrentes())
+            if invalidos:
+                raise RuntimeError(f"Índices inválidos tras la migración {migracion.version}: {', '.join(invalidos)}")
+            duracion_ms = (time.perf_counter() - inicio) * 1000
+            _registrar(cursor, migracion, duracion_ms)
+    else:
+        connection.autocommit = False
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(migracion.sql)
+                duracion_ms = (time.perf_counter() - inicio) * 1000
+                _registrar(cursor, migracion, duracion_ms)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+    return duracion_ms
+
+
+def conectar():
+    connection = psycopg2.connect(**DB_CONFIG)
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute(SQL_CREAR_TABLA)
+    return connection
+
+
+def estado(connection, migraciones: List[Migracion]) -> int:
+    registradas = aplicadas(connection)
+    pendientes = 0
+    for m in migraciones:
+        fila = registradas.get(m.version)
+        if fila is None:
+            pendientes += 1
+            print(f"⏳ {m.version:04d} {m.nombre}: pendiente")
+        elif fila["checksum"] != m.checksum:
+            print(f"⚠️ {m.version:04d} {m.nombre}: aplicada el {fila['aplicada_en']:%Y-%m-%d %H:%M} pero el archivo cambió")
+        else:
+            print(f"✅ {m.version:04d} {m.nombre}: aplicada el {fila['aplicada_en']:%Y-%m-%d %H:%M} ({fila['duracion_ms']} ms)")
+    for version in sorted(set(registradas) - {m.version for m in migraciones}):
+        print(f"❓ {version:04d} {registradas[version]['nombre']}: registrada pero sin archivo")
+    return pendientes
+
+
+def aplicar(connection, migraciones: List[Migracion], hasta: Optional[int] = None) -> int:
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (LOCK_MIGRACIONES,))
+        if not cursor.fetchone()[0]:
+            raise RuntimeError("Otro proceso está aplicando migraciones")
+    try:
+        registradas = aplicadas(connection)
+        cantidad = 0
+        for m in migraciones:
+            if m.version in registradas or (hasta is not None and m.version > hasta):
+                continue
+            print(f"🔄 Aplicando {m.version:04d} {m.nombre}{' (sin transacción)' if m.sin_transaccion else ''}...")
+            duracion_ms = aplicar_migracion(connection, m)
+            print(f"✅ {m.version:04d} aplicada en {duracion_ms:.0f} ms")
+            cantidad += 1
+        return cantidad
+    finally:
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (LOCK_MIGRACIONES,))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Migraciones versionadas del esquema")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("estado", help="Lista migraciones aplicadas, pendientes y modificadas")
+    p = sub.add_parser("aplicar", help="Aplica las migraciones pendientes en orden")
+    p.add_argument("--hasta", type=int, help="Última versión a aplicar")
+    args = parser.parse_args()
+
+    migraciones = cargar_migraciones()
+    connection = conectar()
+    try:
+        if args.comando == "estado":
+            pendientes = estado(connection, migraciones)
+            print(f"{pendientes} migraciones pendientes")
+        else:
+            cantidad = aplicar(connection, migraciones, args.hasta)
+            print(f"{cantidad} migraciones aplicadas")
+        return 0
+    except Exception as e:
+        print(f"❌ Error en migraciones: {e}")
+        return 1
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,192 @@
+"""
+Orden de visita sugerido para los clientes planificados de una ruta (TSP de camino abierto).
+
+1. Matriz de distancias haversine entre todas las paradas (NumPy, ver distancias.py).
+2. Solución inicial por vecino más cercano.
+3. Mejora local hasta que ninguna mejora: 2-opt (invertir un tramo) y Or-opt (mover un tramo
+   de 1 a 3 paradas a otra posición, en cualquier sentido), con tope de vueltas.
+
+El camino es abierto (no vuelve al inicio). Con `fijar_inicio` la primera parada planificada
+queda primera (el vendedor arranca ahí); si no, el inicio también se optimiza.
+El tiempo ahorrado usa el mismo modelo que los pasos del mapa (VELOCIDAD_PROMEDIO_KMH): el
+tiempo fijo por visita no cambia con el orden.
+
+`optimizar_lote` reparte muchas rutas en un pool de procesos (OPTIMIZACION_PROCESOS, por
+defecto la cantidad de CPUs): cada ruta es CPU puro y así no se frena el event loop ni se
+comparte el GIL.
+
+Variables de entorno:
+- OPTIMIZACION_PROCESOS: procesos del pool para lotes (por defecto os.cpu_count())
+- OPTIMIZACION_MAX_VUELTAS: tope de vueltas de mejora 2-opt + Or-opt (por defecto 50)
+"""
+
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from distancias import RADIO_TIERRA_KM, VELOCIDAD_PROMEDIO_KMH, distancia_m
+
+try:
+    import numpy as np
+except ImportError:  # dependencia opcional: sin ella la matriz se arma punto a punto
+    np = None
+
+PROCESOS = int(os.getenv("OPTIMIZACION_PROCESOS", "0")) or (os.cpu_count() or 1)
+MAX_VUELTAS = int(os.getenv("OPTIMIZACION_MAX_VUELTAS", "50"))
+EPSILON_KM = 1e-9
+
+# (latitud, longitud) de cada parada
+Punto = Tuple[float, float]
+
+
+def matriz_distancias_km(puntos: Sequence[Punto]) -> List[List[float]]:
+    """Matriz n×n de distancias haversine (km)"""
+    if np is None:
+        return [[distancia_m(a[0], a[1], b[0], b[1]) / 1000 for b in puntos] for a in puntos]
+    coordenadas = np.radians(np.asarray(puntos, dtype=np.float64).reshape(-1, 2))
+    lat, lng = coordenadas[:, 0:1], coordenadas[:, 1:2]
+    a = (np.sin((lat.T - lat) / 2) ** 2
+         + np.cos(lat) * np.cos(lat.T) * np.sin((lng.T - lng) / 2) ** 2)
+    return (2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))).tolist()
+
+
+def largo_camino(orden: Sequence[int], matriz: List[List[float]]) -> float:
+    return sum(matriz[a][b] for a, b in zip(orden, orden[1:]))
+
+
+def vecino_mas_cercano(matriz: List[List[float]], inicio: int = 0) -> List[int]:
+    n = len(matriz)
+    orden = [inicio]
+    pendientes = set(range(n)) - {inicio}
+    while pendientes:
+        fila = matriz[orden[-1]]
+        siguiente = min(pendientes, key=fila.__getitem__)
+        orden.append(siguiente)
+        pendientes.remove(siguiente)
+    return orden
+
+
+def _dos_opt(orden: List[int], matriz: List[List[float]], desde: int) -> bool:
+    """Una vuelta de 2-opt sobre camino abierto: invierte orden[i..j] si acorta. True si mejoró"""
+    n = len(orden)
+    mejoro = False
+    for i in range(desde, n - 1):
+        for j in range(i + 1, n):
+            a = orden[i - 1] if i > 0 else None
+            b, c = orden[i], orden[j]
+            d = orden[j + 1] if j + 1 < n else None
+            antes = (matriz[a][b] if a is not None else 0.0) + (matriz[c][d] if d is not None else 0.0)
+            despues = (matriz[a][c] if a is not None else 0.0) + (matriz[b][d] if d is not None else 0.0)
+            if despues < antes - EPSILON_KM:
+                orden[i:j + 1] = orden[i:j + 1][::-1]
+                mejoro = True
+    return mejoro
+
+
+def _or_opt(orden: List[int], matriz: List[List[float]], desde: int) -> bool:
+    """Una vuelta de Or-opt: mueve tramos de 1 a 3 paradas a la mejor posición. True si mejoró"""
+    mejoro = False
+    for largo in (1, 2, 3):
+        i = desde
+        while i + largo <= len(orden):
+            n = len(orden)
+            tramo = orden[i:i + largo]
+            previo = orden[i - 1] if i > 0 else None
+            siguiente = orden[i + largo] if i + largo < n else None
+            # Ahorro de sacar el tramo y unir sus vecinos
+            quitar = ((matriz[previo][tramo[0]] if previo is not None else 0.0)
+                      + (matriz[tramo[-1]][siguiente] if siguiente is not None else 0.0)
+                      - (matriz[previo][siguiente] if previo is not None and siguiente is not None else 0.0))
+            resto = orden[:i] + orden[i + largo:]
+            mejor: Optional[Tuple[float, int, List[int]]] = None
+            for k in range(desde, len(resto) + 1):
+                if k == i:
+                    continue
+                izquierda = resto[k - 1] if k > 0 else None
+                derecha = resto[k] if k < len(resto) else None
+                for variante in (tramo, tramo[::-1]) if largo > 1 else (tramo,):
+                    agregar = ((matriz[izquierda][variante[0]] if izquierda is not None else 0.0)
+                               + (matriz[variante[-1]][derecha] if derecha is not None else 0.0)
+                               - (matriz[izquierda][derecha] if izquierda is not None and derecha is not None else 0.0))
+                    if agregar < quitar - EPSILON_KM and (mejor is None or agregar < mejor[0]):
+                        mejor = (agregar, k, variante)
+            if mejor is not None:
+                _, k, variante = mejor
+                orden[:] = resto[:k] + variante + resto[k:]
+                mejoro = True
+            else:
+                i += 1
+    return mejoro
+
+
+def optimizar_orden(puntos: Sequence[Punto], fijar_inicio: bool = True) -> Dict[str, Any]:
+    """Orden sugerido (índices de `puntos`) y distancias (km) del orden dado y del sugerido"""
+    inicio_reloj = time.perf_counter()
+    n = len(puntos)
+    actual = list(range(n))
+    if n < 3:
+        matriz = matriz_distancias_km(puntos) if n else []
+        distancia = largo_camino(actual, matriz)
+        return {'orden': actual, 'distancia_actual_km': distancia, 'distancia_sugerida_km': distancia,
+                'vueltas': 0, 'duracion_ms': round((time.perf_counter() - inicio_reloj) * 1000, 1)}
+
+    matriz = matriz_distancias_km(puntos)
+    if fijar_inicio:
+        orden = vecino_mas_cercano(matriz, 0)
+    else:
+        orden = min((vecino_mas_cercano(matriz, s) for s in range(n)), key=lambda o: largo_camino(o, matriz)) \
+            if n <= 100 else vecino_mas_cercano(matriz, 0)
+    desde = 1 if fijar_inicio else 0
+
+    vueltas = 0
+    while vueltas < MAX_VUELTAS:
+        vueltas += 1
+        mejoro = _dos_opt(orden, matriz, desde)
+        mejoro = _or_opt(orden, matriz, desde) or mejoro
+        if not mejoro:
+            break
+
+    distancia_actual = largo_camino(actual, matriz)
+    distancia_sugerida = largo_camino(orden, matriz)
+    if distancia_sugerida > distancia_actual:
+        # La heurística no garantiza mejorar un orden que ya es bueno
+        orden, distancia_sugerida = actual, distancia_actual
+    return {
+        'orden': orden,
+        'distancia_actual_km': distancia_actual,
+        'distancia_sugerida_km': distancia_sugerida,
+        'vueltas': vueltas,
+        'duracion_ms': round((time.perf_counter() - inicio_reloj) * 1000, 1)
+    }
+
+
+def minutos_de_viaje(distancia_km: float) -> float:
+    return distancia_km / VELOCIDAD_PROMEDIO_KMH * 60
+
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _obtener_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PROCESOS)
+    return _pool
+
+
+async def optimizar_lote(rutas: Sequence[Sequence[Punto]], fijar_inicio: bool = True) -> List[Dict[str, Any]]:
+    """`optimizar_orden` de muchas rutas en paralelo en el pool de procesos"""
+    if not rutas:
+        return []
+    loop = asyncio.get_running_loop()
+    pool = _obtener_pool()
+    return await asyncio.gather(*(loop.run_in_executor(pool, optimizar_orden, puntos, fijar_inicio) for puntos in rutas))
+
+
+def cerrar_pool_optimizacion():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
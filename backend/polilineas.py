@@ -0,0 +1,104 @@
+"""
+Geometría compacta de las rutas del mapa.
+
+- Simplificación Douglas–Peucker con tolerancia en metros (proyección equirectangular local:
+  a la escala de una ruta de un día la distorsión es despreciable). Se conservan siempre el
+  primer y el último punto.
+- Polilínea codificada (formato de Google, precisión 1e-5 ≈ 1 m), que decodifican mapbox,
+  @mapbox/polyline o `decodificarPolilinea` de frontend/src/services/rutas.service.ts.
+  El formato ordena cada punto como (lat, lng); las funciones reciben y devuelven [lng, lat]
+  como ruta_linea.
+"""
+
+import math
+from typing import List, Sequence
+
+METROS_POR_GRADO_LAT = 110_540.0
+METROS_POR_GRADO_LNG_ECUADOR = 111_320.0
+PRECISION = 5
+
+
+def simplificar_linea(puntos: Sequence[Sequence[float]], tolerancia_m: float) -> List[List[float]]:
+    """Douglas–Peucker: quita los vértices que se apartan menos de `tolerancia_m` metros de la
+    línea simplificada. Con tolerancia 0 (o menos de 3 puntos) devuelve los puntos tal cual."""
+    if tolerancia_m <= 0 or len(puntos) < 3:
+        return [list(p) for p in puntos]
+
+    lat0 = math.radians(sum(p[1] for p in puntos) / len(puntos))
+    escala_x = METROS_POR_GRADO_LNG_ECUADOR * math.cos(lat0)
+    xy = [(p[0] * escala_x, p[1] * METROS_POR_GRADO_LAT) for p in puntos]
+    tolerancia2 = tolerancia_m * tolerancia_m
+
+    conservar = [False] * len(puntos)
+    conservar[0] = conservar[-1] = True
+    pendientes = [(0, len(puntos) - 1)]
+    while pendientes:
+        inicio, fin = pendientes.pop()
+        if fin - inicio < 2:
+            continue
+        ax, ay = xy[inicio]
+        bx, by = xy[fin]
+        dx, dy = bx - ax, by - ay
+        largo2 = dx * dx + dy * dy
+        peor, indice = -1.0, inicio
+        for i in range(inicio + 1, fin):
+            px, py = xy[i]
+            if largo2 == 0:
+                d2 = (px - ax) ** 2 + (py - ay) ** 2
+            else:
+                # Distancia al segmento (no a la recta): las rutas vuelven sobre sí mismas
+                t = max(0.0, min(1.0, ((px - ax) * dx + (py - ay) * dy) / largo2))
+                d2 = (px - ax - t * dx) ** 2 + (py - ay - t * dy) ** 2
+            if d2 > peor:
+                peor, indice = d2, i
+        if peor > tolerancia2:
+            conservar[indice] = True
+            pendientes.append((inicio, indice))
+            pendientes.append((indice, fin))
+    return [list(p) for p, si in zip(puntos, conservar) if si]
+
+
+def _codificar_valor(valor: int) -> str:
+    valor = ~(valor << 1) if valor < 0 else valor << 1
+    caracteres = []
+    while valor >= 0x20:
+        caracteres.append(chr((0x20 | (valor & 0x1F)) + 63))
+        valor >>= 5
+    caracteres.append(chr(valor + 63))
+    return "".join(caracteres)
+
+
+def codificar_polilinea(puntos: Sequence[Sequence[float]], precision: int = PRECISION) -> str:
+    """Polilínea codificada de una lista de [lng, lat]"""
+    factor = 10 ** precision
+    salida = []
+    lat_previa = lng_previa = 0
+    for lng, lat in puntos:
+        lat_e, lng_e = round(lat * factor), round(lng * factor)
+        salida.append(_codificar_valor(lat_e - lat_previa))
+        salida.append(_codificar_valor(lng_e - lng_previa))
+        lat_previa, lng_previa = lat_e, lng_e
+    return "".join(salida)
+
+
+def decodificar_polilinea(texto: str, precision: int = PRECISION) -> List[List[float]]:
+    """Inversa de `codificar_polilinea` (lista de [lng, lat])"""
+    factor = 10 ** precision
+    puntos: List[List[float]] = []
+    indice = lat = lng = 0
+    while indice < len(texto):
+        deltas = []
+        for _ in range(2):
+            resultado = desplazamiento = 0
+            while True:
+                byte = ord(texto[indice]) - 63
+                indice += 1
+                resultado |= (byte & 0x1F) << desplazamiento
+                desplazamiento += 5
+                if byte < 0x20:
+                    break
+            deltas.append(~(resultado >> 1) if resultado & 1 else resultado >> 1)
+        lat += deltas[0]
+        lng += deltas[1]
+        puntos.append([lng / factor, lat / factor])
+    return puntos
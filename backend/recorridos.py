@@ -0,0 +1,70 @@
+"""
+Recorrido GPS de un vendedor en un día, reducido para el reproductor del mapa.
+
+Sobre los puntos de `tracking` ordenados por location_time_millis:
+1. Se descartan los fixes con horizontal_accuracy peor (mayor) que `precision_max_m`.
+2. Se conserva a lo sumo un punto por intervalo de `intervalo_s` segundos y sólo si se alejó al
+   menos `distancia_min_m` metros del último punto conservado: un vendedor detenido deja un
+   único punto en lugar de cientos.
+3. Al salir de una parada se conserva también el último punto descartado del lugar, para que el
+   reproductor no reparta el tiempo detenido en el tramo siguiente. El último punto del día se
+   conserva siempre.
+
+El resultado es una polilínea codificada (ver polilineas.py) más los segundos de cada punto
+desde el primero, para poder ubicar el reproductor en cualquier instante.
+"""
+
+from typing import Any, Dict, List, Sequence
+
+from distancias import distancia_m, distancias_consecutivas_km
+from polilineas import codificar_polilinea
+
+
+def submuestrear_recorrido(
+    filas: Sequence[Dict[str, Any]],
+    intervalo_s: float,
+    distancia_min_m: float,
+    precision_max_m: float
+) -> Dict[str, Any]:
+    """`filas` con latitude, longitude, location_time_millis y horizontal_accuracy, ordenadas
+    por tiempo. Devuelve {puntos_originales, descartados_precision, puntos, inicio_millis,
+    fin_millis, distancia_m, polilinea, segundos}"""
+    validos = []
+    descartados_precision = 0
+    for f in filas:
+        precision = f.get('horizontal_accuracy')
+        if precision is not None and float(precision) > precision_max_m:
+            descartados_precision += 1
+            continue
+        validos.append((float(f['latitude']), float(f['longitude']), int(f['location_time_millis'])))
+
+    conservados: List[tuple] = []
+    pendiente = None  # último punto descartado desde el último conservado
+    intervalo_ms = intervalo_s * 1000
+    for punto in validos:
+        if not conservados:
+            conservados.append(punto)
+            continue
+        ultimo = conservados[-1]
+        if punto[2] - ultimo[2] >= intervalo_ms and distancia_m(ultimo[0], ultimo[1], punto[0], punto[1]) >= distancia_min_m:
+            if pendiente is not None and pendiente[2] - ultimo[2] >= intervalo_ms:
+                conservados.append(pendiente)
+            conservados.append(punto)
+            pendiente = None
+        else:
+            pendiente = punto
+    if pendiente is not None:
+        conservados.append(pendiente)
+
+    distancia = sum(distancias_consecutivas_km([p[0] for p in conservados], [p[1] for p in conservados], [0])) * 1000
+    inicio = conservados[0][2] if conservados else None
+    return {
+        'puntos_originales': len(filas),
+        'descartados_precision': descartados_precision,
+        'puntos': len(conservados),
+        'inicio_millis': inicio,
+        'fin_millis': conservados[-1][2] if conservados else None,
+        'distancia_m': round(distancia, 1),
+        'polilinea': codificar_polilinea([(lng, lat) for lat, lng, _ in conservados]),
+        'segundos': [round((t - inicio) / 1000) for _, _, t in conservados]
+    }
@@ -0,0 +1,146 @@
+"""
+Logging estructurado del backend.
+
+Reemplaza los print() de diagnóstico: todos los módulos piden su logger con
+`obtener_logger(__name__)` y los mensajes salen con nivel, nombre de logger y
+campos adicionales (`extra={"campos": {...}}`) en texto o JSON de una línea.
+
+Los diagnósticos por fila/zona de los bucles calientes se emiten en DEBUG y,
+además, muestreados: el llamador calcula una sola vez `debug_activo(log)` antes
+del bucle, de modo que con el nivel por defecto no cuestan nada.
+
+Cada request pesado arma un `ResumenRequest` con tiempos por fase y contadores
+(filas, rutas, zonas...) y lo registra en una única línea INFO al terminar.
+
+Variables de entorno:
+- LOG_LEVEL: DEBUG, INFO, WARNING, ERROR (por defecto INFO)
+- LOG_FORMAT: texto o json (por defecto texto)
+- LOG_MUESTREO_DEBUG: fracción 0..1 de mensajes DEBUG de bucles que se emiten (por defecto 1)
+"""
+
+import json
+import logging
+import os
+import random
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+LOGGER_RAIZ = "rutas"
+
+_configurado = False
+_muestreo_debug = 1.0
+
+
+class FormatoJSON(logging.Formatter):
+    """Una línea JSON por registro, con los `campos` extra al primer nivel"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        datos = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "nivel": record.levelname,
+            "logger": record.name,
+            "mensaje": record.getMessage()
+        }
+        campos = getattr(record, "campos", None)
+        if campos:
+            datos.update(campos)
+        if record.exc_info:
+            datos["excepcion"] = self.formatException(record.exc_info)
+        return json.dumps(datos, ensure_ascii=False, default=str)
+
+
+class FormatoTexto(logging.Formatter):
+    """Formato legible para desarrollo: `campo=valor` a continuación del mensaje"""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        texto = super().format(record)
+        campos = getattr(record, "campos", None)
+        if campos:
+            texto += " " + " ".join(
+                f"{k}={json.dumps(v, ensure_ascii=False, default=str) if isinstance(v, (dict, list)) else v}"
+                for k, v in campos.items()
+            )
+        return texto
+
+
+def configurar_logging(nivel: Optional[str] = None, formato: Optional[str] = None,
+                       muestreo_debug: Optional[float] = None):
+    """Configura el logger raíz del backend (idempotente; una nueva llamada reemplaza la configuración)"""
+    global _configurado, _muestreo_debug
+    nivel = (nivel or os.getenv("LOG_LEVEL", "INFO")).upper()
+    formato = (formato or os.getenv("LOG_FORMAT", "texto")).lower()
+    if muestreo_debug is None:
+        muestreo_debug = float(os.getenv("LOG_MUESTREO_DEBUG", "1"))
+    _muestreo_debug = min(max(muestreo_debug, 0.0), 1.0)
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(FormatoJSON() if formato == "json" else FormatoTexto())
+
+    raiz = logging.getLogger(LOGGER_RAIZ)
+    raiz.handlers[:] = [handler]
+    raiz.setLevel(getattr(logging, nivel, logging.INFO))
+    # uvicorn configura su propio logging; no duplicar líneas a través del root
+    raiz.propagate = False
+    _configurado = True
+
+
+def obtener_logger(nombre: str) -> logging.Logger:
+    """Logger hijo de `rutas` (configura el logging en el primer uso)"""
+    if not _configurado:
+        configurar_logging()
+    return logging.getLogger(f"{LOGGER_RAIZ}.{nombre}")
+
+
+def debug_activo(logger: logging.Logger) -> bool:
+    """Consultar una vez antes de un bucle caliente: False con el nivel por defecto"""
+    return logger.isEnabledFor(logging.DEBUG)
+
+
+def muestrear() -> bool:
+    """True para la fracción LOG_MUESTREO_DEBUG de los mensajes de bucle"""
+    return _muestreo_debug >= 1.0 or random.random() < _muestreo_debug
+
+
+class ResumenRequest:
+    """Tiempos por fase y contadores de un request, registrados en una sola línea al final"""
+
+    def __init__(self, endpoint: str):
+        self.endpoint = endpoint
+        self.inicio = time.perf_counter()
+        self.fases_ms: Dict[str, float] = {}
+        self.contadores: Dict[str, Any] = {}
+
+    @contextmanager
+    def fase(self, nombre: str):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.agregar_tiempo(nombre, time.perf_counter() - inicio)
+
+    def agregar_tiempo(self, nombre: str, segundos: float):
+        self.fases_ms[nombre] = round(self.fases_ms.get(nombre, 0.0) + segundos * 1000, 3)
+
+    def contar(self, **contadores):
+        self.contadores.update(contadores)
+
+    def incrementar(self, nombre: str, cantidad: int = 1):
+        self.contadores[nombre] = self.contadores.get(nombre, 0) + cantidad
+
+    def duracion_ms(self) -> float:
+        return round((time.perf_counter() - self.inicio) * 1000, 3)
+
+    def registrar(self, logger: logging.Logger, mensaje: str = "request completado", nivel: int = logging.INFO):
+        if logger.isEnabledFor(nivel):
+            logger.log(nivel, mensaje, extra={"campos": {
+                "endpoint": self.endpoint,
+                "duracion_ms": self.duracion_ms(),
+                "fases_ms": self.fases_ms,
+                **self.contadores
+            }})
@@ -0,0 +1,302 @@
+"""
+Rollup diario de ventas por (day, zone_code, user_id) en la tabla public.ventas_zona_dia.
+
+Los helpers de ventas por zona (rango, comparación, última venta por zona, promedios de
+3 meses, último día con datos) ya no recorren route × route_detail × route_zone_detail:
+leen de `fuente_ventas()`, que es la tabla de rollup cuando está lista o, si todavía no
+existe (o falló su creación), una subconsulta equivalente sobre las tablas vivas.
+
+Columnas (por día, zona y vendedor; la agregación es sobre el mismo join que usaban las
+consultas originales, incluidas las filas repetidas si una ruta tiene varias zonas):
+- ventas: SUM(invoice_amount) de visitas (visit_sequence no nulo) con invoice_amount > 0
+- visitas_con_venta: cantidad de esas visitas (para promedios de venta por visita)
+- visitas: filas con visit_sequence no nulo
+- visitas_planificadas: filas planificadas (sequence distinto de 0 y < 1000)
+- filas: total de filas route_detail
+- clientes / clientes_visitados: subject_code distintos (todos / visitados), como arreglo
+  para poder contar clientes distintos en rangos de varios días o varios vendedores
+zone_code '' = ruta sin zona, user_id 0 = ruta sin vendedor.
+
+Refresco: al iniciar la API se crea la tabla si no existe (y se reconstruye si está vacía);
+luego cada ROLLUP_REFRESCO_SEGUNDOS se recalculan sólo los últimos ROLLUP_DIAS_RECIENTES días.
+Un advisory lock serializa los refrescos entre procesos. En la carga inicial cada worker espera
+el lock (si otro está reconstruyendo, hasta que termine) y sólo pasa a leer de la tabla cuando
+su propia carga terminó y la tabla tiene filas; mientras tanto usa las consultas vivas.
+
+Uso por línea de comandos (desde backend/):
+    python rollup_ventas.py crear
+    python rollup_ventas.py reconstruir [--desde YYYY-MM-DD] [--hasta YYYY-MM-DD]
+    python rollup_ventas.py refrescar [--dias N]
+    python rollup_ventas.py verificar [--desde YYYY-MM-DD] [--hasta YYYY-MM-DD]
+
+Variables de entorno:
+- ROLLUP_HABILITADO: 0 para no usar la tabla (siempre consultas vivas). Por defecto 1
+- ROLLUP_DIAS_RECIENTES: días hacia atrás que recalcula el refresco incremental (por defecto 3)
+- ROLLUP_REFRESCO_SEGUNDOS: intervalo del refresco en segundo plano (por defecto 60)
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
+
+from conexiones import obtener_pool_async, cerrar_pool_async
+from registro import obtener_logger
+
+log = obtener_logger("rollup")
+
+TABLA = "public.ventas_zona_dia"
+HABILITADO = os.getenv("ROLLUP_HABILITADO", "1").lower() not in ("0", "false", "no")
+DIAS_RECIENTES = int(os.getenv("ROLLUP_DIAS_RECIENTES", "3"))
+REFRESCO_SEGUNDOS = float(os.getenv("ROLLUP_REFRESCO_SEGUNDOS", "60"))
+
+# Evita que dos procesos (workers/réplicas) refresquen a la vez
+LOCK_REFRESCO = 582017
+
+COLUMNAS = "day, zone_code, user_id, ventas, visitas_con_venta, visitas, visitas_planificadas, filas, clientes, clientes_visitados"
+
+SQL_CREAR = f"""
+CREATE TABLE IF NOT EXISTS {TABLA} (
+    day date NOT NULL,
+    zone_code varchar(50) NOT NULL,
+    user_id integer NOT NULL,
+    ventas numeric(16,2) NOT NULL DEFAULT 0,
+    visitas_con_venta integer NOT NULL DEFAULT 0,
+    visitas integer NOT NULL DEFAULT 0,
+    visitas_planificadas integer NOT NULL DEFAULT 0,
+    filas integer NOT NULL DEFAULT 0,
+    clientes varchar(50)[] NOT NULL DEFAULT '{{}}',
+    clientes_visitados varchar(50)[] NOT NULL DEFAULT '{{}}',
+    actualizado_en timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (day, zone_code, user_id)
+);
+CREATE INDEX IF NOT EXISTS ix_ventas_zona_dia_zona_dia ON {TABLA} (zone_code, day);
+"""
+
+# Agregación sobre las tablas vivas; {where} filtra r.day
+SQL_AGREGACION = """
+SELECT
+    r.day,
+    COALESCE(rzd.zone_code, '') AS zone_code,
+    COALESCE(r.user_id, 0) AS user_id,
+    COALESCE(SUM(CASE WHEN rd.visit_sequence IS NOT NULL AND rd.invoice_amount > 0 THEN rd.invoice_amount ELSE 0 END), 0) AS ventas,
+    COUNT(*) FILTER (WHERE rd.visit_sequence IS NOT NULL AND rd.invoice_amount > 0)::int AS visitas_con_venta,
+    COUNT(*) FILTER (WHERE rd.visit_sequence IS NOT NULL)::int AS visitas,
+    COUNT(*) FILTER (WHERE rd.sequence <> 0 AND rd.sequence < 1000)::int AS visitas_planificadas,
+    COUNT(*)::int AS filas,
+    COALESCE(ARRAY_AGG(DISTINCT rd.subject_code) FILTER (WHERE rd.subject_code IS NOT NULL), '{{}}')::varchar(50)[] AS clientes,
+    COALESCE(ARRAY_AGG(DISTINCT rd.subject_code) FILTER (WHERE rd.subject_code IS NOT NULL AND rd.visit_sequence IS NOT NULL), '{{}}')::varchar(50)[] AS clientes_visitados
+FROM public.route r
+JOIN public.route_detail rd ON rd.route_id = r.id
+LEFT JOIN public.route_zone_detail rzd ON rzd.route_id = r.id
+WHERE {where}
+GROUP BY r.day, COALESCE(rzd.zone_code, ''), COALESCE(r.user_id, 0)
+"""
+
+_estado: Dict[str, Any] = {
+    "disponible": False,
+    "ultimo_refresco": None,
+    "duracion_ultimo_refresco_ms": None,
+    "refrescos": 0,
+    "errores": 0
+}
+_tarea: Optional[asyncio.Task] = None
+
+
+def fuente_ventas() -> str:
+    """Relación (tabla o subconsulta) con las columnas del rollup, para usar como `FROM {fuente} r`"""
+    if HABILITADO and _estado["disponible"]:
+        return TABLA
+    return f"({SQL_AGREGACION.format(where='TRUE')})"
+
+
+def estado_rollup() -> Dict[str, Any]:
+    return dict(_estado, habilitado=HABILITADO, dias_recientes=DIAS_RECIENTES, refresco_segundos=REFRESCO_SEGUNDOS)
+
+
+async def crear_tabla():
+    pool = await obtener_pool_async()
+    async with pool.connection() as connection:
+        await connection.execute(SQL_CREAR)
+
+
+def _condiciones_dias(desde: Optional[date], hasta: Optional[date]):
+    """(where sobre el rollup, where sobre las tablas vivas, parámetros) para el rango de días"""
+    condiciones, params = [], []
+    if desde:
+        condiciones.append("day >= %s")
+        params.append(desde)
+    if hasta:
+        condiciones.append("day <= %s")
+        params.append(hasta)
+    where_rollup = " AND ".join(condiciones) or "TRUE"
+    where_vivo = " AND ".join(f"r.{c}" for c in condiciones) or "TRUE"
+    return where_rollup, where_vivo, params
+
+
+async def _reemplazar(connection, desde: Optional[date], hasta: Optional[date]) -> int:
+    """Reemplaza las filas del rollup del rango por la agregación viva, dentro de la transacción
+    (y el lock) de `connection`. Devuelve la cantidad de filas escritas."""
+    where_rollup, where_vivo, params = _condiciones_dias(desde, hasta)
+    inicio = time.perf_counter()
+    await connection.execute(f"DELETE FROM {TABLA} WHERE {where_rollup}", params)
+    cursor = await connection.execute(
+        f"INSERT INTO {TABLA} ({COLUMNAS}) {SQL_AGREGACION.format(where=where_vivo)}", params
+    )
+    filas = cursor.rowcount
+
+    duracion_ms = round((time.perf_counter() - inicio) * 1000, 1)
+    _estado.update(ultimo_refresco=time.time(), duracion_ultimo_refresco_ms=duracion_ms, refrescos=_estado["refrescos"] + 1)
+    log.info("Rollup de ventas recalculado", extra={"campos": {
+        "desde": desde, "hasta": hasta, "filas": filas, "duracion_ms": duracion_ms
+    }})
+    return filas
+
+
+async def recalcular(desde: Optional[date] = None, hasta: Optional[date] = None) -> Optional[int]:
+    """Reemplaza las filas del rollup entre `desde` y `hasta` (inclusive; None = sin límite)
+    por la agregación viva, en una sola transacción. Devuelve la cantidad de filas escritas, o
+    None si no se hizo nada porque otro proceso está refrescando."""
+    pool = await obtener_pool_async()
+    async with pool.connection() as connection:
+        async with connection.transaction():
+            cursor = await connection.execute("SELECT pg_try_advisory_xact_lock(%s) AS ok", (LOCK_REFRESCO,))
+            if not (await cursor.fetchone())['ok']:
+                log.info("Refresco del rollup omitido: otro proceso lo está ejecutando")
+                return None
+            return await _reemplazar(connection, desde, hasta)
+
+
+async def preparar() -> bool:
+    """Carga inicial al arrancar: espera el lock si otro proceso está refrescando (por ejemplo la
+    reconstrucción completa de otro worker), reconstruye todo si la tabla está vacía o si no
+    recalcula lo que pudo cambiar mientras la API estuvo detenida. Devuelve True si al terminar
+    el rollup tiene filas (recién entonces se puede leer de la tabla)."""
+    pool = await obtener_pool_async()
+    async with pool.connection() as connection:
+        async with connection.transaction():
+            await connection.execute("SELECT pg_advisory_xact_lock(%s)", (LOCK_REFRESCO,))
+            cursor = await connection.execute(f"SELECT max(actualizado_en)::date AS ultimo FROM {TABLA}")
+            ultimo = (await cursor.fetchone())['ultimo']
+            if ultimo is None:
+                log.info("Rollup de ventas vacío: reconstruyendo completo")
+                await _reemplazar(connection, None, None)
+            else:
+                await _reemplazar(connection, min(ultimo, date.today()) - timedelta(days=DIAS_RECIENTES), None)
+            cursor = await connection.execute(f"SELECT EXISTS (SELECT 1 FROM {TABLA}) AS con_filas")
+            return (await cursor.fetchone())['con_filas']
+
+
+async def refrescar_recientes(dias: int = DIAS_RECIENTES) -> Optional[int]:
+    """Refresco incremental: sólo los últimos `dias` días (y rutas futuras ya cargadas)"""
+    return await recalcular(desde=date.today() - timedelta(days=dias))
+
+
+async def verificar(desde: Optional[date] = None, hasta: Optional[date] = None) -> List[Dict[str, Any]]:
+    """Compara el rollup con la agregación viva; devuelve las filas que difieren (vacío = OK)"""
+    where_rollup, where_vivo, params = _condiciones_dias(desde, hasta)
+    query = f"""
+    WITH vivo AS ({SQL_AGREGACION.format(where=where_vivo)}),
+    rollup AS (SELECT {COLUMNAS} FROM {TABLA} WHERE {where_rollup})
+    SELECT 'falta_o_difiere_en_rollup' AS problema, * FROM (SELECT * FROM vivo EXCEPT SELECT * FROM rollup) a
+    UNION ALL
+    SELECT 'sobra_o_difiere_en_rollup' AS problema, * FROM (SELECT * FROM rollup EXCEPT SELECT * FROM vivo) b
+    ORDER BY day, zone_code, user_id, problema
+    """
+    pool = await obtener_pool_async()
+    async with pool.connection() as connection:
+        cursor = await connection.execute(query, params + params)
+        return await cursor.fetchall()
+
+
+async def _preparar_y_refrescar():
+    """Tarea de fondo de la API: crea/llena la tabla y la mantiene al día. Hasta que la carga
+    inicial de este proceso termine con filas en la tabla se siguen usando las consultas vivas."""
+    while True:
+        try:
+            if not _estado["disponible"]:
+                await crear_tabla()
+                _estado["disponible"] = await preparar()
+                if not _estado["disponible"]:
+                    log.info("Rollup de ventas sin filas todavía, se usan consultas vivas")
+            else:
+                await refrescar_recientes()
+        except Exception as e:
+            _estado["errores"] += 1
+            log.warning("Error preparando/refrescando rollup de ventas (se usan consultas vivas hasta que esté listo): %s", e)
+        await asyncio.sleep(REFRESCO_SEGUNDOS)
+
+
+def iniciar_refresco():
+    """Lanza la tarea de refresco en el event loop actual (startup de la API)"""
+    global _tarea
+    if HABILITADO and _tarea is None:
+        _tarea = asyncio.get_running_loop().create_task(_preparar_y_refrescar())
+
+
+async def detener_refresco():
+    global _tarea
+    if _tarea is not None:
+        _tarea.cancel()
+        try:
+            await _tarea
+        except (asyncio.CancelledError, Exception):
+            pass
+        _tarea = None
+    _estado["disponible"] = False
+
+
+def _fecha(texto: str) -> date:
+    return date.fromisoformat(texto)
+
+
+async def _cli(args) -> int:
+    try:
+        if args.comando == "crear":
+            await crear_tabla()
+            print(f"Tabla {TABLA} creada (o ya existía)")
+        elif args.comando == "reconstruir":
+            await crear_tabla()
+            filas = await recalcular(args.desde, args.hasta)
+            if filas is None:
+                print("Otro proceso está refrescando el rollup; reintentar en unos segundos")
+                return 1
+            print(f"Rollup reconstruido: {filas} filas")
+        elif args.comando == "refrescar":
+            filas = await refrescar_recientes(args.dias)
+            if filas is None:
+                print("Otro proceso está refrescando el rollup; reintentar en unos segundos")
+                return 1
+            print(f"Rollup refrescado (últimos {args.dias} días): {filas} filas")
+        elif args.comando == "verificar":
+            diferencias = await verificar(args.desde, args.hasta)
+            for fila in diferencias[:50]:
+                print(fila)
+            if diferencias:
+                print(f"❌ {len(diferencias)} diferencias entre el rollup y la agregación viva")
+                return 1
+            print("✅ El rollup coincide con la agregación viva")
+        return 0
+    finally:
+        await cerrar_pool_async()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=f"Mantenimiento del rollup {TABLA}")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("crear", help="Crea la tabla e índices si no existen")
+    for nombre, ayuda in (("reconstruir", "Recalcula el rollup (todo o un rango de días)"),
+                          ("verificar", "Compara el rollup con la agregación sobre las tablas vivas")):
+        p = sub.add_parser(nombre, help=ayuda)
+        p.add_argument("--desde", type=_fecha)
+        p.add_argument("--hasta", type=_fecha)
+    p = sub.add_parser("refrescar", help="Recalcula sólo los últimos días")
+    p.add_argument("--dias", type=int, default=DIAS_RECIENTES)
+    return asyncio.run(_cli(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,74 @@
+"""
+Serialización JSON rápida para las respuestas pesadas (mapa, ventas, eventos).
+
+Con orjson los dicts anidados se serializan directo a bytes, con datetime/date nativos y Decimal
+por `_por_defecto`, sin pasar por `jsonable_encoder` (que recorre y copia todo el árbol antes
+de json.dumps). El resultado es el mismo JSON que el JSONResponse por defecto de FastAPI:
+- Decimal → int si no tiene decimales, float si los tiene (igual que jsonable_encoder)
+- datetime/date/time → ISO 8601; claves no string (ints) → string; set/tuple → lista
+- UTF-8 sin escapar (ensure_ascii=False)
+Diferencia: NaN/Infinity salen como null en lugar de error.
+
+Si orjson no está instalado se usa jsonable_encoder + json (el camino anterior).
+
+Los endpoints tienen que devolver `RespuestaJSONRapida(contenido)` (o los bytes de
+`serializar_json`): si devuelven un dict, FastAPI lo pasa igual por jsonable_encoder.
+Ver benchmark_serializacion.py para la comparación de tiempos.
+"""
+
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # dependencia opcional: sin ella se serializa con json de la stdlib
+    orjson = None
+
+if orjson is not None:
+    _OPCIONES_ORJSON = orjson.OPT_NON_STR_KEYS
+
+
+def _por_defecto(valor: Any) -> Any:
+    """Tipos que orjson (o msgpack) no conoce, convertidos como lo hace jsonable_encoder"""
+    if isinstance(valor, Decimal):
+        return int(valor) if valor.as_tuple().exponent >= 0 else float(valor)
+    if isinstance(valor, (datetime, date, time)):
+        return valor.isoformat()
+    if isinstance(valor, (set, frozenset)):
+        return list(valor)
+    return jsonable_encoder(valor)
+
+
+def serializar_json_stdlib(data: Any) -> bytes:
+    """Serializa igual que el JSONResponse por defecto de FastAPI"""
+    return json.dumps(
+        jsonable_encoder(data),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":")
+    ).encode("utf-8")
+
+
+def serializar_json(data: Any) -> bytes:
+    """JSON compacto en UTF-8 (orjson si está disponible)"""
+    if orjson is None:
+        return serializar_json_stdlib(data)
+    return orjson.dumps(data, default=_por_defecto, option=_OPCIONES_ORJSON)
+
+
+def serializacion_disponible() -> str:
+    return "orjson" if orjson is not None else "json"
+
+
+class RespuestaJSONRapida(JSONResponse):
+    """JSONResponse que serializa con `serializar_json`"""
+
+    def render(self, content: Any) -> bytes:
+        return serializar_json(content)
+
@@ -0,0 +1,254 @@
+"""
+Teselas vectoriales de Mapbox (MVT, especificación 2.1) sin dependencias externas.
+
+- Proyección Web Mercator de [lng, lat] a coordenadas de tesela (0..EXTENSION) para z/x/y.
+- Recorte de polígonos contra la tesela más un margen (Sutherland–Hodgman), para que los bordes
+  de las zonas se dibujen continuos entre teselas vecinas.
+- Codificación protobuf de capas con puntos y polígonos: claves y valores de atributos
+  deduplicados por capa, geometría con comandos MoveTo/LineTo/ClosePath y enteros zigzag.
+
+Sólo se usa lo que necesita /tiles/{z}/{x}/{y}.mvt (puntos y polígonos de un anillo).
+"""
+
+import math
+import struct
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+EXTENSION = 4096
+# Margen alrededor de la tesela (en unidades de tesela) para que símbolos y bordes no se corten
+MARGEN = 64
+LATITUD_MAXIMA_MERCATOR = 85.05112878
+
+# Comandos de geometría
+_MOVE_TO = 1
+_LINE_TO = 2
+_CLOSE_PATH = 7
+
+# Tipos de geometría de Feature
+PUNTO = 1
+POLIGONO = 3
+
+
+def longitud_a_tesela(lng: float, n: int) -> float:
+    """X de tesela (con fracción) de una longitud para un zoom con n = 2**z teselas por lado"""
+    return (lng + 180) / 360 * n
+
+
+def latitud_a_tesela(lat: float, n: int) -> float:
+    """Y de tesela (con fracción, crece hacia el sur) de una latitud"""
+    lat = max(-LATITUD_MAXIMA_MERCATOR, min(LATITUD_MAXIMA_MERCATOR, lat))
+    return (1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n
+
+
+def tesela_a_longitud(x: float, n: int) -> float:
+    return x / n * 360 - 180
+
+
+def tesela_a_latitud(y: float, n: int) -> float:
+    return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / n))))
+
+
+class Tesela:
+    """Tesela z/x/y: límites geográficos y proyección a coordenadas enteras de la tesela"""
+
+    def __init__(self, z: int, x: int, y: int, extension: int = EXTENSION, margen: int = MARGEN):
+        self.z, self.x, self.y = z, x, y
+        self.n = 2 ** z
+        self.extension = extension
+        self.margen = margen
+
+    def valida(self) -> bool:
+        return self.z >= 0 and 0 <= self.x < self.n and 0 <= self.y < self.n
+
+    def limites(self, con_margen: bool = True) -> Tuple[float, float, float, float]:
+        """(min_lng, min_lat, max_lng, max_lat), por defecto incluyendo el margen"""
+        m = self.margen / self.extension if con_margen else 0
+        return (
+            tesela_a_longitud(self.x - m, self.n),
+            tesela_a_latitud(self.y + 1 + m, self.n),
+            tesela_a_longitud(self.x + 1 + m, self.n),
+            tesela_a_latitud(self.y - m, self.n)
+        )
+
+    def proyectar(self, lng: float, lat: float) -> Tuple[float, float]:
+        return ((longitud_a_tesela(lng, self.n) - self.x) * self.extension,
+                (latitud_a_tesela(lat, self.n) - self.y) * self.extension)
+
+    def _dentro(self, px: float, py: float) -> bool:
+        return -self.margen <= px <= self.extension + self.margen and -self.margen <= py <= self.extension + self.margen
+
+    def contiene(self, lng: float, lat: float) -> bool:
+        """True si el punto cae dentro de la tesela (sin margen)"""
+        px, py = self.proyectar(lng, lat)
+        return 0 <= px < self.extension and 0 <= py < self.extension
+
+    def punto(self, lng: float, lat: float) -> Optional[Tuple[int, int]]:
+        """Coordenadas enteras del punto, o None si cae fuera de la tesela más el margen"""
+        px, py = self.proyectar(lng, lat)
+        if not self._dentro(px, py):
+            return None
+        return round(px), round(py)
+
+    def anillo(self, coordenadas: Sequence[Sequence[float]]) -> Optional[List[Tuple[int, int]]]:
+        """Anillo [lng, lat] proyectado y recortado a la tesela más el margen, sin cerrar y
+        sin puntos repetidos; None si no queda un polígono (menos de 3 vértices)"""
+        puntos = [self.proyectar(lng, lat) for lng, lat in coordenadas]
+        if len(puntos) > 1 and puntos[0] == puntos[-1]:
+            puntos.pop()
+        puntos = _recortar(puntos, -self.margen, self.extension + self.margen)
+        enteros: List[Tuple[int, int]] = []
+        for px, py in puntos:
+            p = (round(px), round(py))
+            if not enteros or enteros[-1] != p:
+                enteros.append(p)
+        if len(enteros) > 1 and enteros[0] == enteros[-1]:
+            enteros.pop()
+        return enteros if len(enteros) >= 3 else None
+
+
+def _recortar(puntos: List[Tuple[float, float]], minimo: float, maximo: float) -> List[Tuple[float, float]]:
+    """Sutherland–Hodgman contra el cuadrado [minimo, maximo]² (anillo sin cerrar)"""
+    bordes = (
+        (lambda p: p[0] >= minimo, lambda a, b: _cruce_x(a, b, minimo)),
+        (lambda p: p[0] <= maximo, lambda a, b: _cruce_x(a, b, maximo)),
+        (lambda p: p[1] >= minimo, lambda a, b: _cruce_y(a, b, minimo)),
+        (lambda p: p[1] <= maximo, lambda a, b: _cruce_y(a, b, maximo)),
+    )
+    for adentro, cruce in bordes:
+        if not puntos:
+            break
+        entrada, puntos = puntos, []
+        anterior = entrada[-1]
+        for actual in entrada:
+            if adentro(actual):
+                if not adentro(anterior):
+                    puntos.append(cruce(anterior, actual))
+                puntos.append(actual)
+            elif adentro(anterior):
+                puntos.append(cruce(anterior, actual))
+            anterior = actual
+    return puntos
+
+
+def _cruce_x(a: Tuple[float, float], b: Tuple[float, float], x: float) -> Tuple[float, float]:
+    t = (x - a[0]) / (b[0] - a[0])
+    return x, a[1] + t * (b[1] - a[1])
+
+
+def _cruce_y(a: Tuple[float, float], b: Tuple[float, float], y: float) -> Tuple[float, float]:
+    t = (y - a[1]) / (b[1] - a[1])
+    return a[0] + t * (b[0] - a[0]), y
+
+
+# --- Protobuf mínimo ---
+
+def _varint(n: int) -> bytes:
+    salida = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            salida.append(byte | 0x80)
+        else:
+            salida.append(byte)
+            return bytes(salida)
+
+
+def _zigzag(n: int) -> int:
+    return (n << 1) ^ (n >> 63)
+
+
+def _clave(numero: int, tipo: int) -> bytes:
+    return _varint((numero << 3) | tipo)
+
+
+def _delimitado(numero: int, datos: bytes) -> bytes:
+    return _clave(numero, 2) + _varint(len(datos)) + datos
+
+
+def _empaquetado(numero: int, enteros: List[int]) -> bytes:
+    return _delimitado(numero, b"".join(_varint(i) for i in enteros))
+
+
+def _valor(v: Any) -> bytes:
+    """Mensaje Value: string (1), double (3), sint (6) o bool (7)"""
+    if isinstance(v, bool):
+        return _clave(7, 0) + _varint(int(v))
+    if isinstance(v, int):
+        return _clave(6, 0) + _varint(_zigzag(v))
+    if isinstance(v, float):
+        return _clave(3, 1) + struct.pack("<d", v)
+    return _delimitado(1, str(v).encode("utf-8"))
+
+
+def _comando(id_comando: int, cantidad: int) -> int:
+    return (id_comando & 0x7) | (cantidad << 3)
+
+
+class CapaMVT:
+    """Capa de una tesela: features con geometría ya en coordenadas de tesela y atributos"""
+
+    def __init__(self, nombre: str, extension: int = EXTENSION):
+        self.nombre = nombre
+        self.extension = extension
+        self._features: List[bytes] = []
+        self._claves: Dict[str, int] = {}
+        self._valores: Dict[Tuple[str, Any], int] = {}
+
+    def __len__(self) -> int:
+        return len(self._features)
+
+    def _tags(self, propiedades: Dict[str, Any]) -> List[int]:
+        tags = []
+        for clave, valor in propiedades.items():
+            if valor is None:
+                continue
+            indice_clave = self._claves.setdefault(clave, len(self._claves))
+            indice_valor = self._valores.setdefault((type(valor).__name__, valor), len(self._valores))
+            tags.extend((indice_clave, indice_valor))
+        return tags
+
+    def _agregar(self, tipo: int, geometria: List[int], propiedades: Dict[str, Any], id_feature: Optional[int]):
+        feature = b""
+        if id_feature is not None and id_feature >= 0:
+            feature += _clave(1, 0) + _varint(id_feature)
+        tags = self._tags(propiedades)
+        if tags:
+            feature += _empaquetado(2, tags)
+        feature += _clave(3, 0) + _varint(tipo) + _empaquetado(4, geometria)
+        self._features.append(feature)
+
+    def agregar_punto(self, punto: Tuple[int, int], propiedades: Dict[str, Any], id_feature: Optional[int] = None):
+        x, y = punto
+        self._agregar(PUNTO, [_comando(_MOVE_TO, 1), _zigzag(x), _zigzag(y)], propiedades, id_feature)
+
+    def agregar_poligono(self, anillo: List[Tuple[int, int]], propiedades: Dict[str, Any], id_feature: Optional[int] = None):
+        """`anillo` sin cerrar (ver Tesela.anillo). El anillo exterior tiene que tener área
+        positiva en coordenadas de tesela (horario con y hacia abajo): se invierte si hace falta"""
+        area = sum(a[0] * b[1] - b[0] * a[1] for a, b in zip(anillo, anillo[1:] + anillo[:1]))
+        if area < 0:
+            anillo = anillo[::-1]
+        elif area == 0:
+            return
+        geometria = [_comando(_MOVE_TO, 1)]
+        cx, cy = anillo[0]
+        geometria.extend((_zigzag(cx), _zigzag(cy)))
+        geometria.append(_comando(_LINE_TO, len(anillo) - 1))
+        for x, y in anillo[1:]:
+            geometria.extend((_zigzag(x - cx), _zigzag(y - cy)))
+            cx, cy = x, y
+        geometria.append(_comando(_CLOSE_PATH, 1))
+        self._agregar(POLIGONO, geometria, propiedades, id_feature)
+
+    def codificar(self) -> bytes:
+        datos = _clave(15, 0) + _varint(2) + _delimitado(1, self.nombre.encode("utf-8"))
+        datos += b"".join(_delimitado(2, f) for f in self._features)
+        datos += b"".join(_delimitado(3, c.encode("utf-8")) for c in self._claves)
+        datos += b"".join(_delimitado(4, _valor(v)) for _, v in self._valores)
+        datos += _clave(5, 0) + _varint(self.extension)
+        return datos
+
+
+def codificar_tesela(capas: List[CapaMVT]) -> bytes:
+    """Mensaje Tile con las capas que tienen al menos una feature (b"" si ninguna)"""
+    return b"".join(_delimitado(3, capa.codificar()) for capa in capas if len(capa))
@@ -0,0 +1,94 @@
+"""
+Fixtures de las pruebas del backend: una base PostgreSQL descartable con el esquema de init.sql.
+
+Usa las mismas variables DB_HOST/DB_PORT/DB_USER/DB_PASSWORD que la API y crea (borrándola si
+existía) la base TEST_DB_NAME, por defecto routes_pruebas. Si no hay servidor accesible las
+pruebas que usan la base se saltean.
+
+Uso (desde backend/):
+    pip install -r requirements-dev.txt
+    python -m pytest tests
+"""
+
+import io
+import os
+import sys
+from contextlib import redirect_stdout
+from pathlib import Path
+
+import psycopg2
+import pytest
+
+BACKEND = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND))
+
+NOMBRE_BASE = os.getenv("TEST_DB_NAME", "routes_pruebas")
+TABLAS = "invoice_detail, invoice, event, route_zone_detail, route_detail, route, zone, subject_user, subject, tracking, users"
+
+
+def _conectar(base: str):
+    config = {
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT"),
+        "dbname": base,
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD")
+    }
+    connection = psycopg2.connect(**{k: v for k, v in config.items() if v}, connect_timeout=3)
+    connection.autocommit = True
+    return connection
+
+
+def _esquema() -> str:
+    """DDL de init.sql sin los datos de ejemplo ni la extensión uuid-ossp (ninguna tabla la usa)"""
+    sql = (BACKEND.parent / "init.sql").read_text(encoding="utf-8")
+    sql = sql.split("-- Datos de ejemplo")[0]
+    return "\n".join(linea for linea in sql.splitlines() if not linea.startswith("CREATE EXTENSION"))
+
+
+@pytest.fixture(scope="session")
+def base_pruebas():
+    """Crea la base de pruebas con el esquema y apunta las variables DB_* de la API a ella"""
+    try:
+        admin = _conectar(os.getenv("TEST_DB_ADMIN", "postgres"))
+    except psycopg2.OperationalError as e:
+        pytest.skip(f"PostgreSQL no disponible para las pruebas: {e}")
+    with admin.cursor() as cursor:
+        cursor.execute(f'DROP DATABASE IF EXISTS "{NOMBRE_BASE}" WITH (FORCE)')
+        cursor.execute(f'CREATE DATABASE "{NOMBRE_BASE}"')
+    admin.close()
+
+    connection = _conectar(NOMBRE_BASE)
+    with connection.cursor() as cursor:
+        cursor.execute(_esquema())
+    os.environ["DB_NAME"] = NOMBRE_BASE
+    # Sin tareas de fondo: el rollup y las ubicaciones en vivo se preparan en cada prueba
+    os.environ.setdefault("ROLLUP_HABILITADO", "0")
+    os.environ.setdefault("UBICACIONES_VIVO", "0")
+    yield connection
+    connection.close()
+
+
+@pytest.fixture
+def db(base_pruebas):
+    """Conexión (autocommit) a la base de pruebas con las tablas vacías"""
+    with base_pruebas.cursor() as cursor:
+        cursor.execute(f"TRUNCATE {TABLAS} RESTART IDENTITY CASCADE")
+    return base_pruebas
+
+
+@pytest.fixture(scope="session")
+def api(base_pruebas):
+    """Módulo main importado contra la base de pruebas"""
+    with redirect_stdout(io.StringIO()):
+        import main
+    return main
+
+
+@pytest.fixture(scope="session")
+def cliente(api):
+    """TestClient con un único event loop: sirve también para llamar funciones async de la API
+    con `cliente.portal.call(funcion, *args)`"""
+    from fastapi.testclient import TestClient
+    with TestClient(api.app) as cliente:
+        yield cliente
@@ -0,0 +1,115 @@
+"""
+`obtener_ventas_anteriores_por_zona` (una consulta DISTINCT ON sobre el rollup o su subconsulta
+viva) contra el bucle original de una consulta por zona, sobre un conjunto de datos chico que
+cubre: varios días con ventas, días sólo con visitas sin venta, filas no visitadas con monto,
+rutas con dos zonas, rutas sin zona, clientes repetidos en el día y ventas posteriores a la fecha.
+"""
+
+from datetime import date, timedelta
+
+import pytest
+from psycopg2.extras import RealDictCursor
+
+DATOS = """
+INSERT INTO users (id, full_name, email) VALUES (1, 'Vendedor 1', 'v1@x'), (2, 'Vendedor 2', 'v2@x');
+INSERT INTO route (id, day, user_id) VALUES
+    (1, '2025-03-01', 1), (2, '2025-03-03', 1), (3, '2025-03-05', 1),
+    (4, '2025-03-02', 2), (5, '2025-03-05', 2), (6, '2025-03-04', 2),
+    (7, '2025-03-06', 1), (8, '2025-03-03', 2), (9, '2025-03-05', NULL);
+INSERT INTO route_zone_detail (route_id, zone_code) VALUES
+    (1, '10'), (2, '10'), (3, '10'), (3, '30'),
+    (4, '20'), (5, '20'), (6, '30'), (7, '10'), (8, '40');
+INSERT INTO route_detail (route_id, subject_code, invoice_amount, sequence, visit_sequence) VALUES
+    (1, 'C1', 100.00, 1, 1), (1, 'C2', 50.00, 2, 2), (1, 'C3', 70.00, 3, NULL),
+    (2, 'C1', 30.00, 1, 1), (2, 'C1', 20.00, 1, 2), (2, 'C4', 0, 2, 3), (2, 'C5', 999.00, 3, NULL),
+    (3, 'C1', 10.00, 1, 1), (3, 'C2', 0, 2, NULL),
+    (4, 'C6', 0, 1, 1), (4, 'C7', 0, 2, 2),
+    (5, 'C6', 15.00, 1, 1),
+    (6, 'C8', 40.00, 1, 1), (6, 'C9', 0, 2, 2),
+    (7, 'C1', 500.00, 1, 1),
+    (8, 'C10', 80.00, 1, 1),
+    (9, 'C11', 60.00, 1, 1);
+"""
+
+FECHAS = [date(2025, 3, 1) + timedelta(days=d) for d in range(8)]
+
+
+def ventas_anteriores_por_zona_bucle(connection, fecha_actual: str) -> dict:
+    """Implementación original: zonas con visitas en la fecha y una consulta por zona"""
+    cursor = connection.cursor(cursor_factory=RealDictCursor)
+    cursor.execute("""
+    SELECT DISTINCT rzd.zone_code
+    FROM public.route r
+    JOIN public.route_detail rd ON rd.route_id = r.id
+    LEFT JOIN public.route_zone_detail rzd ON rzd.route_id = r.id
+    WHERE r.day = %s
+      AND rzd.zone_code IS NOT NULL
+      AND rd.visit_sequence IS NOT NULL
+    """, (fecha_actual,))
+    zonas_actuales = [row['zone_code'] for row in cursor.fetchall()]
+
+    ventas_por_zona = {}
+    for zona_code in zonas_actuales:
+        cursor.execute("""
+        SELECT
+            r.day as fecha_ultima,
+            SUM(CASE WHEN rd.visit_sequence IS NOT NULL AND rd.invoice_amount > 0 THEN rd.invoice_amount ELSE 0 END) as ventas_anteriores,
+            COUNT(DISTINCT rd.subject_code) as clientes_anteriores
+        FROM public.route r
+        JOIN public.route_detail rd ON rd.route_id = r.id
+        LEFT JOIN public.route_zone_detail rzd ON rzd.route_id = r.id
+        WHERE rzd.zone_code = %s
+          AND r.day < %s
+          AND rd.visit_sequence IS NOT NULL
+        GROUP BY r.day
+        HAVING SUM(CASE WHEN rd.visit_sequence IS NOT NULL AND rd.invoice_amount > 0 THEN rd.invoice_amount ELSE 0 END) > 0
+        ORDER BY r.day DESC
+        LIMIT 1
+        """, (zona_code, fecha_actual))
+        resultado = cursor.fetchone()
+        if resultado:
+            ventas_por_zona[zona_code] = {
+                'ventas': float(resultado['ventas_anteriores']),
+                'fecha': resultado['fecha_ultima'].strftime('%Y-%m-%d'),
+                'clientes': int(resultado['clientes_anteriores'])
+            }
+        else:
+            ventas_por_zona[zona_code] = {'ventas': 0.0, 'fecha': None, 'clientes': 0}
+    return ventas_por_zona
+
+
+@pytest.fixture
+def datos(db):
+    with db.cursor() as cursor:
+        cursor.execute(DATOS)
+    return db
+
+
+@pytest.fixture(params=["vivo", "rollup"])
+def fuente(request, datos, api, cliente, monkeypatch):
+    """Corre cada prueba sobre la subconsulta viva y sobre la tabla de rollup"""
+    import rollup_ventas
+    if request.param == "rollup":
+        monkeypatch.setattr(rollup_ventas, "HABILITADO", True)
+        cliente.portal.call(rollup_ventas.crear_tabla)
+        cliente.portal.call(rollup_ventas.recalcular)
+        monkeypatch.setitem(rollup_ventas._estado, "disponible", True)
+    return request.param
+
+
+def test_coincide_con_bucle_por_zona(fuente, datos, api, cliente):
+    for fecha in FECHAS:
+        esperado = ventas_anteriores_por_zona_bucle(datos, fecha.isoformat())
+        obtenido = cliente.portal.call(api.obtener_ventas_anteriores_por_zona, fecha.isoformat())
+        assert obtenido == esperado, fecha
+
+
+def test_casos_del_conjunto(fuente, api, cliente):
+    obtenido = cliente.portal.call(api.obtener_ventas_anteriores_por_zona, "2025-03-05")
+    assert obtenido == {
+        # Último día con venta antes del 5: el 3 (C1 dos veces y C4 sin venta; C5 no visitado)
+        '10': {'ventas': 50.0, 'fecha': '2025-03-03', 'clientes': 2},
+        # Sólo visitas sin venta antes del 5
+        '20': {'ventas': 0.0, 'fecha': None, 'clientes': 0},
+        '30': {'ventas': 40.0, 'fecha': '2025-03-04', 'clientes': 2}
+    }
@@ -0,0 +1,99 @@
+"""
+/route_details/ventas (lote, una consulta) contra /route_detail/{id}/ventas (uno por uno): para
+cada route_detail de una ruta la estructura tiene que ser la misma, con y sin only_event_type,
+con rango de fechas, y en los casos sin eventos (totales agregados o mensaje vacío).
+"""
+
+import pytest
+
+DATOS = """
+INSERT INTO users (id, full_name, email) VALUES (1, 'Vendedor 1', 'v1@x');
+INSERT INTO route (id, day, user_id) VALUES (1, '2025-05-10', 1), (2, '2025-05-11', 1);
+INSERT INTO route_detail (id, route_id, subject_code, subject_name, invoice_amount, order_amount, sequence, visit_sequence) VALUES
+    (11, 1, 'C1', 'Cliente 1', 150.00, 20.00, 1, 1),
+    (12, 1, 'C2', 'Cliente 2', 80.00, 5.00, 2, 2),
+    (13, 1, 'C3', 'Cliente 3', 0, 0, 3, 3),
+    (14, 1, 'C4', 'Cliente 4', 30.00, 0, 4, NULL),
+    (21, 2, 'C1', 'Cliente 1', 10.00, 0, 1, 1);
+INSERT INTO event (id, route_detail_id, event_type_id, event_date, comments) VALUES
+    (101, 11, 1, '2025-05-10 09:00', 'inicio'),
+    (102, 11, 2, '2025-05-10 09:20', 'fin'),
+    (103, 11, 2, '2025-05-11 08:00', 'reapertura'),
+    (104, 13, 2, '2025-05-10 11:00', NULL),
+    (105, 12, 1, '2025-05-10 10:00', 'sin factura'),
+    (201, 21, 1, '2025-05-11 09:00', NULL);
+INSERT INTO invoice (id, event_id, "number", creation_date, gross_total, net_total, currency_code, type) VALUES
+    (1001, 102, 'F-1', '2025-05-10 09:15', 110.00, 100.00, 'PYG', '16'),
+    (1002, 102, 'F-2', '2025-05-10 09:18', NULL, 40.00, 'PYG', '16'),
+    (1003, 104, 'F-3', '2025-05-10 11:05', 0, 0, 'PYG', '16'),
+    (1004, 201, 'F-4', '2025-05-11 09:10', 10.00, 10.00, 'PYG', '16');
+INSERT INTO invoice_detail (id, invoice_id, product_code, product_name, quantity, unit_price, net_amount, vat_amount, row_number) VALUES
+    (5001, 1001, 'P1', 'Producto 1', 2, 25.00, 50.00, 5.00, 1),
+    (5002, 1001, 'P2', 'Producto 2', 1, 50.00, NULL, 5.00, 2),
+    (5003, 1002, 'P1', 'Producto 1', 4, 10.00, 40.00, 4.00, 1),
+    (5004, 1004, 'P3', 'Producto 3', 1, 10.00, 10.00, 1.00, 1);
+"""
+
+ROUTE_DETAILS_RUTA_1 = [11, 12, 13, 14]
+
+
+@pytest.fixture
+def datos(db):
+    with db.cursor() as cursor:
+        cursor.execute(DATOS)
+    return db
+
+
+def ventas_individuales(cliente, route_detail_ids, **params):
+    resultado = {}
+    for route_detail_id in route_detail_ids:
+        respuesta = cliente.get(f"/route_detail/{route_detail_id}/ventas", params=params)
+        assert respuesta.status_code == 200
+        resultado[str(route_detail_id)] = respuesta.json()
+    return resultado
+
+
+@pytest.mark.parametrize("params", [
+    {},
+    {"only_event_type": 1},
+    {"only_event_type": 2},
+    {"only_event_type": 3},
+    {"fecha_inicio": "2025-05-11"},
+    {"only_event_type": 2, "fecha_fin": "2025-05-10"}
+], ids=["todo", "tipo_1", "tipo_2", "tipo_sin_eventos", "desde", "tipo_y_hasta"])
+def test_lote_por_ruta_igual_a_individual(datos, cliente, params):
+    respuesta = cliente.get("/route_details/ventas", params={"route_id": 1, **params})
+    assert respuesta.status_code == 200
+    cuerpo = respuesta.json()
+    assert cuerpo["route_id"] == 1
+    assert cuerpo["cantidad"] == len(ROUTE_DETAILS_RUTA_1)
+    assert cuerpo["ventas"] == ventas_individuales(cliente, ROUTE_DETAILS_RUTA_1, **params)
+
+
+def test_lote_por_ids_igual_a_individual(datos, cliente):
+    # Incluye un route_detail de otra ruta, uno repetido y uno inexistente
+    ids = [21, 11, 11, 999]
+    respuesta = cliente.get("/route_details/ventas", params={"route_detail_ids": ids})
+    assert respuesta.status_code == 200
+    assert respuesta.json()["ventas"] == ventas_individuales(cliente, [21, 11, 999])
+
+
+def test_casos_sin_eventos(datos, cliente):
+    ventas = cliente.get("/route_details/ventas", params={"route_id": 1}).json()["ventas"]
+    # Sin eventos: totales agregados de route_detail
+    assert ventas["14"] == {
+        "route_detail_id": 14, "events": [], "count": 0,
+        "ventas_aggregadas": {"invoice_amount": 30.0, "order_amount": 0.0}
+    }
+    # Evento sin factura: aparece con invoices vacío
+    assert ventas["12"]["events"][0]["invoices"] == [] and ventas["12"]["count"] == 0
+    assert ventas["11"]["count"] == 3
+
+    ventas = cliente.get("/route_details/ventas", params={"route_id": 1, "only_event_type": 1}).json()["ventas"]
+    # Con only_event_type no hay fallback agregado
+    assert ventas["13"]["events"] == [] and "ventas_aggregadas" not in ventas["13"]
+    assert ventas["13"]["mensaje"] == "No se encontraron eventos del tipo 1 con líneas de venta."
+
+
+def test_requiere_ids_o_ruta(cliente):
+    assert cliente.get("/route_details/ventas").status_code == 400
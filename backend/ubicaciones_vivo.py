@@ -0,0 +1,286 @@
+"""
+Última ubicación de cada vendedor en memoria, actualizada en forma incremental.
+
+En lugar de repetir el DISTINCT ON (user_id) sobre `tracking` en cada consulta de
+/vendedores/ultima_ubicacion, una tarea de fondo:
+- carga una vez la última posición por vendedor de las últimas UBICACIONES_VENTANA_HORAS horas
+  y toma como marca (high-water mark) el mayor tracking.id visto;
+- cada UBICACIONES_INTERVALO_SEGUNDOS lee sólo las filas con id > marca - UBICACIONES_RELECTURA_IDS
+  (índice de la PK), actualiza la posición de los vendedores que cambiaron y publica esos cambios
+  (deltas) a los suscriptores de /vendedores/ubicaciones/stream (Server-Sent Events).
+
+Los ids de la secuencia no se confirman en orden: una fila con id menor que la marca puede hacerse
+visible después de que la marca la pasó. Por eso cada lectura vuelve a leer los últimos
+UBICACIONES_RELECTURA_IDS ids; releer es inofensivo porque una fila ya aplicada no es más reciente
+que la guardada y no genera delta.
+
+Una fila nueva sólo reemplaza a la guardada si es más reciente con el mismo orden que la consulta
+original (tracking_date DESC, location_time_millis DESC, y el id para desempatar), así una posición
+que llega tarde no pisa una más nueva. El filtro por `hours` se aplica sobre el snapshot con el reloj de la base
+(LOCALTIMESTAMP), igual que el NOW() - INTERVAL de la consulta.
+
+Si el snapshot todavía no está listo, está deshabilitado o se piden más horas que la ventana,
+el endpoint usa la consulta SQL de siempre.
+
+Variables de entorno:
+- UBICACIONES_VIVO: 0 para deshabilitar (por defecto 1)
+- UBICACIONES_VENTANA_HORAS: horas que cubre el snapshot (por defecto 168)
+- UBICACIONES_INTERVALO_SEGUNDOS: intervalo del polling incremental (por defecto 2)
+- UBICACIONES_LOTE: filas máximas por lectura incremental (por defecto 5000)
+- UBICACIONES_RELECTURA_IDS: ids por debajo de la marca que se releen en cada lectura, para las
+  filas confirmadas tarde (por defecto 2000)
+"""
+
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+from conexiones import consultar_async
+from registro import obtener_logger
+
+log = obtener_logger("ubicaciones")
+
+HABILITADO = os.getenv("UBICACIONES_VIVO", "1").lower() not in ("0", "false", "no")
+VENTANA_HORAS = int(os.getenv("UBICACIONES_VENTANA_HORAS", "168"))
+INTERVALO_SEGUNDOS = float(os.getenv("UBICACIONES_INTERVALO_SEGUNDOS", "2"))
+LOTE = int(os.getenv("UBICACIONES_LOTE", "5000"))
+RELECTURA_IDS = int(os.getenv("UBICACIONES_RELECTURA_IDS", "2000"))
+# Deltas pendientes por suscriptor; si se llena, se le reenvía el snapshot completo
+MAX_PENDIENTES = 256
+
+COLUMNAS_UBICACION = """
+    t.id,
+    t.user_id,
+    v.full_name as user_full_name,
+    t.latitude,
+    t.longitude,
+    t.location_time_millis,
+    t.tracking_date,
+    t.batery_level as battery_level,
+    t.altitude,
+    t.horizontal_accuracy,
+    t.vertical_accuracy
+"""
+
+# Última posición por vendedor hasta la marca (id <= %s), dentro de la ventana
+SQL_CARGA_INICIAL = f"""
+SELECT DISTINCT ON (t.user_id){COLUMNAS_UBICACION}
+FROM public.tracking t
+LEFT JOIN public.v_users v ON v.id = t.user_id
+WHERE t.latitude IS NOT NULL
+  AND t.longitude IS NOT NULL
+  AND t.tracking_date >= LOCALTIMESTAMP - make_interval(hours => %s)
+  AND t.id <= %s
+ORDER BY t.user_id, t.tracking_date DESC, t.location_time_millis DESC, t.id DESC
+"""
+
+SQL_NUEVAS = f"""
+SELECT{COLUMNAS_UBICACION}
+FROM public.tracking t
+LEFT JOIN public.v_users v ON v.id = t.user_id
+WHERE t.id > %s
+  AND t.latitude IS NOT NULL
+  AND t.longitude IS NOT NULL
+  AND t.tracking_date IS NOT NULL
+ORDER BY t.id
+LIMIT %s
+"""
+
+
+def _flotante(valor: Any) -> Optional[float]:
+    try:
+        return float(valor) if valor is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def formatear_ubicacion(r: Dict[str, Any]) -> Dict[str, Any]:
+    """Fila de `tracking` con el formato de /vendedores/ultima_ubicacion"""
+    tracking_date = r.get('tracking_date')
+    if hasattr(tracking_date, 'strftime'):
+        tracking_date = tracking_date.strftime('%Y-%m-%d %H:%M:%S')
+    return {
+        'user_id': r.get('user_id'),
+        'user_full_name': r.get('user_full_name') or None,
+        'latitude': _flotante(r.get('latitude')),
+        'longitude': _flotante(r.get('longitude')),
+        'location_time_millis': r.get('location_time_millis'),
+        'tracking_date': tracking_date,
+        'battery_level': _flotante(r.get('battery_level')),
+        'altitude': _flotante(r.get('altitude')),
+        'horizontal_accuracy': _flotante(r.get('horizontal_accuracy')),
+        'vertical_accuracy': _flotante(r.get('vertical_accuracy'))
+    }
+
+
+def _orden(r: Dict[str, Any]) -> tuple:
+    """Clave de "más reciente" igual al ORDER BY de la consulta (DESC deja los NULL primero), con
+    el id para desempatar: releer una fila ya aplicada nunca la hace "más reciente" que sí misma"""
+    millis = r.get('location_time_millis')
+    return (r['tracking_date'], millis is None, millis or 0, r['id'])
+
+
+class UbicacionesVivo:
+    """Snapshot {user_id: última posición} + suscriptores de deltas"""
+
+    def __init__(self):
+        self._filas: Dict[int, Dict[str, Any]] = {}  # user_id -> fila cruda (con tracking_date datetime)
+        self._formateadas: Dict[int, Dict[str, Any]] = {}
+        self.marca = 0
+        self.listo = False
+        self._reloj_db: Optional[datetime] = None
+        self._reloj_local = 0.0
+        self._suscriptores: Set[asyncio.Queue] = set()
+        self.lecturas = 0
+        self.filas_leidas = 0
+        self.errores = 0
+        self.ultima_lectura: Optional[str] = None
+
+    def _ahora_db(self) -> datetime:
+        """LOCALTIMESTAMP de la base estimado con el reloj monotónico desde la última lectura"""
+        return self._reloj_db + timedelta(seconds=time.monotonic() - self._reloj_local)
+
+    async def _sincronizar_reloj(self):
+        fila = (await consultar_async("SELECT LOCALTIMESTAMP AS ahora"))[0]
+        self._reloj_db, self._reloj_local = fila['ahora'], time.monotonic()
+
+    async def cargar(self):
+        await self._sincronizar_reloj()
+        marca = (await consultar_async("SELECT COALESCE(max(id), 0) AS marca FROM public.tracking"))[0]['marca']
+        filas = await consultar_async(SQL_CARGA_INICIAL, (VENTANA_HORAS, marca))
+        self._filas = {r['user_id']: r for r in filas}
+        self._formateadas = {u: formatear_ubicacion(r) for u, r in self._filas.items()}
+        self.marca = marca
+        self.listo = True
+        log.info("Ubicaciones en memoria: %d vendedores (marca tracking.id=%d)", len(self._filas), marca)
+
+    def aplicar(self, filas: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Incorpora filas nuevas o releídas (ordenadas por id) y devuelve las posiciones que
+        cambiaron"""
+        cambiados: Dict[int, Dict[str, Any]] = {}
+        for r in filas:
+            self.marca = max(self.marca, r['id'])
+            actual = self._filas.get(r['user_id'])
+            if actual is not None and _orden(r) <= _orden(actual):
+                continue
+            self._filas[r['user_id']] = r
+            cambiados[r['user_id']] = self._formateadas[r['user_id']] = formatear_ubicacion(r)
+        return list(cambiados.values())
+
+    def _podar(self):
+        limite = self._ahora_db() - timedelta(hours=VENTANA_HORAS)
+        for user_id in [u for u, r in self._filas.items() if r['tracking_date'] < limite]:
+            del self._filas[user_id]
+            del self._formateadas[user_id]
+
+    async def leer_nuevas(self) -> List[Dict[str, Any]]:
+        """Una lectura incremental: todas las filas con id > marca - RELECTURA_IDS, en lotes de LOTE"""
+        await self._sincronizar_reloj()
+        cambiados: Dict[int, Dict[str, Any]] = {}
+        desde = max(0, self.marca - RELECTURA_IDS)
+        while True:
+            filas = await consultar_async(SQL_NUEVAS, (desde, LOTE))
+            self.filas_leidas += len(filas)
+            for fila in self.aplicar(filas):
+                cambiados[fila['user_id']] = fila
+            if len(filas) < LOTE:
+                break
+            desde = filas[-1]['id']
+        self._podar()
+        self.lecturas += 1
+        self.ultima_lectura = datetime.now().isoformat(timespec='seconds')
+        return list(cambiados.values())
+
+    def ubicaciones(self, hours: int = 48, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Como la consulta SQL: una fila por vendedor con posición en las últimas `hours` horas,
+        ordenadas por user_id"""
+        limite = self._ahora_db() - timedelta(hours=hours)
+        resultado = [self._formateadas[u] for u in sorted(self._filas) if self._filas[u]['tracking_date'] >= limite]
+        if limit and limit > 0:
+            resultado = resultado[:limit]
+        return resultado
+
+    def cubre(self, hours: int) -> bool:
+        return self.listo and hours <= VENTANA_HORAS
+
+    # --- Suscriptores (SSE) ---
+
+    def suscribir(self) -> asyncio.Queue:
+        cola: asyncio.Queue = asyncio.Queue(maxsize=MAX_PENDIENTES)
+        self._suscriptores.add(cola)
+        return cola
+
+    def desuscribir(self, cola: asyncio.Queue):
+        self._suscriptores.discard(cola)
+
+    def publicar(self, cambios: List[Dict[str, Any]]):
+        """Encola los cambios para cada suscriptor; None en la cola = reenviar snapshot completo"""
+        for cola in self._suscriptores:
+            try:
+                cola.put_nowait(cambios)
+            except asyncio.QueueFull:
+                while not cola.empty():
+                    cola.get_nowait()
+                cola.put_nowait(None)
+
+    def estadisticas(self) -> Dict[str, Any]:
+        return {
+            "habilitado": HABILITADO,
+            "listo": self.listo,
+            "vendedores": len(self._filas),
+            "marca_tracking_id": self.marca,
+            "ventana_horas": VENTANA_HORAS,
+            "intervalo_segundos": INTERVALO_SEGUNDOS,
+            "relectura_ids": RELECTURA_IDS,
+            "suscriptores": len(self._suscriptores),
+            "lecturas": self.lecturas,
+            "filas_leidas": self.filas_leidas,
+            "errores": self.errores,
+            "ultima_lectura": self.ultima_lectura
+        }
+
+
+ubicaciones_vivo = UbicacionesVivo()
+_tarea: Optional[asyncio.Task] = None
+
+
+async def _cargar_y_seguir():
+    """Tarea de fondo de la API: carga el snapshot y lo mantiene al día"""
+    while not ubicaciones_vivo.listo:
+        try:
+            await ubicaciones_vivo.cargar()
+        except Exception as e:
+            ubicaciones_vivo.errores += 1
+            log.warning("No se pudo cargar ubicaciones en memoria, se usa la consulta SQL: %s", e)
+            await asyncio.sleep(max(INTERVALO_SEGUNDOS, 30))
+
+    while True:
+        await asyncio.sleep(INTERVALO_SEGUNDOS)
+        try:
+            cambios = await ubicaciones_vivo.leer_nuevas()
+            if cambios:
+                ubicaciones_vivo.publicar(cambios)
+        except Exception as e:
+            ubicaciones_vivo.errores += 1
+            log.warning("Error leyendo tracking nuevo: %s", e)
+
+
+def iniciar_ubicaciones():
+    """Lanza la tarea de seguimiento en el event loop actual (startup de la API)"""
+    global _tarea
+    if HABILITADO and _tarea is None:
+        _tarea = asyncio.get_running_loop().create_task(_cargar_y_seguir())
+
+
+async def detener_ubicaciones():
+    global _tarea
+    if _tarea is not None:
+        _tarea.cancel()
+        try:
+            await _tarea
+        except (asyncio.CancelledError, Exception):
+            pass
+        _tarea = None
+    ubicaciones_vivo.listo = False
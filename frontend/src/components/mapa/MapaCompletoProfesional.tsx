@@ -7,7 +7,7 @@
 import React, { useEffect, useRef, useState, useCallback } from 'react';
 import mapboxgl from 'mapbox-gl';
 import MapPlayer from './MapPlayer';
-import { getVentasPorRouteDetail } from '../../services/ventas.service';
+import { getVentasPorRouteDetail, getVentasPorRouteDetails } from '../../services/ventas.service';
 import useMapLayers from '../../hooks/useMapLayers';
 import type { MapaData, FiltrosUI, CapasVisibles, Ruta } from '../../types';
 
@@ -34,6 +34,9 @@ const MapaCompletoProfesional: React.FC<MapaCompletoProfesionalProps> = ({ mapaD
 
   const { updateLayers } = useMapLayers();
 
+  // Ephemeral ventas cache by route_detail id (shared by route batch load and per-rd fetch)
+  const ventasCacheRef = useRef<Record<number, { ts: number; data: any }>>({});
+
   // Fetch ventas for all clients in a route, cache results, and open the player
   const fetchVentasForRoute = useCallback(async (ruta: any) => {
     if (!ruta) return;
@@ -73,7 +76,18 @@ const MapaCompletoProfesional: React.FC<MapaCompletoProfesionalProps> = ({ mapaD
         // Non-fatal: focus failure should not block prefetch
         console.warn('fitBounds failed', e);
       }
-      // Load only the first cliente's ventas (progressive load on demand)
+      // Load the whole route's ventas in a single batch request
+      const routeId = Number(ruta.route_id ?? ruta.id ?? ruta.routeId);
+      if (routeId) {
+        const batch = await getVentasPorRouteDetails({ routeId }).catch(() => null);
+        if (batch && batch.ventas) {
+          const ts = Date.now();
+          Object.entries(batch.ventas).forEach(([rd, data]) => { ventasCacheRef.current[Number(rd)] = { ts, data }; });
+          setPlayerVentasMap(prev => ({ ...prev, ...batch.ventas }));
+          return;
+        }
+      }
+      // Fallback: load only the first cliente's ventas (progressive load on demand)
       const clientes = (ruta.clientes || []).filter((c: any) => c.visit_sequence != null && c.visit_sequence > 0).sort((a: any, b: any) => (a.visit_sequence || 0) - (b.visit_sequence || 0));
       const first = clientes[0];
       if (first) {
@@ -115,7 +129,6 @@ const MapaCompletoProfesional: React.FC<MapaCompletoProfesionalProps> = ({ mapaD
   }, [mapaData, fetchVentasForRoute]);
 
   // Fetch ventas for a single route_detail id with simple cache and retries/backoff
-  const ventasCacheRef = useRef<Record<number, { ts: number; data: any }>>({});
   const fetchVentasForRd = useCallback(async (rdId: number) => {
     if (!rdId) return null;
     // check ephemeral cache first (5 minutes)
@@ -39,6 +39,17 @@ const useMapaData = () => {
     if (filtros.periodo) {
       params.append('periodo', filtros.periodo);
     }
+
+    // Sólo lo visible en el mapa (opcional)
+    if (filtros.bbox) {
+      params.append('bbox', filtros.bbox);
+    }
+    if (filtros.zoom !== undefined && (filtros.bbox || filtros.clusters)) {
+      params.append('zoom', String(Math.floor(filtros.zoom)));
+    }
+    if (filtros.clusters) {
+      params.append('clusters', 'true');
+    }
     
     const queryString = params.toString();
     return queryString ? `${baseUrl}?${queryString}` : baseUrl;
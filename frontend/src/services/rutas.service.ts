@@ -6,3 +6,223 @@ export const getRutasMapa = async (params: Record<string, any> = {}) => {
   if (!res.ok) throw new Error(`HTTP ${res.status}`);
   return res.json();
 };
+
+// Plantilla de URL de /tiles/{z}/{x}/{y}.mvt con los mismos filtros que getRutasMapa, para una
+// fuente `{ type: 'vector', tiles: [urlTeselasMapa(filtros)] }` de mapbox-gl.
+// Capas: 'zonas', 'clientes_no_visitados' y 'clientes_visitados' (atributos estado, ventas, zona, ...).
+export const urlTeselasMapa = (params: Record<string, any> = {}) => {
+  const qs = new URLSearchParams(params).toString();
+  const base = new URL(`${API_BASE}/tiles/`, window.location.origin).toString();
+  return `${base}{z}/{x}/{y}.mvt${qs ? '?' + qs : ''}`;
+};
+
+// Líneas NDJSON de /mapa/rutas/stream
+export type EventoMapaStream =
+  | { tipo: 'inicio'; periodo_actual: [string, string]; periodo_anterior: [string, string] }
+  | { tipo: 'ruta'; ruta: any }
+  | { tipo: 'zonas'; zonas: any[] }
+  | { tipo: 'estadisticas'; estadisticas_mapa: Record<string, number> }
+  | { tipo: 'fin'; rutas: number }
+  | { tipo: 'error'; detail: string };
+
+// Versión streaming de getRutasMapa: llama a onEvento por cada línea a medida que llega,
+// así el mapa puede dibujar las primeras rutas antes de que termine un rango largo.
+export const streamRutasMapa = async (
+  params: Record<string, any>,
+  onEvento: (evento: EventoMapaStream) => void,
+  signal?: AbortSignal
+) => {
+  const qs = new URLSearchParams(params).toString();
+  const res = await fetch(`${API_BASE}/mapa/rutas/stream${qs ? '?' + qs : ''}`, { signal });
+  if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (value) buffer += decoder.decode(value, { stream: !done });
+    let corte = buffer.indexOf('\n');
+    while (corte >= 0) {
+      const linea = buffer.slice(0, corte).trim();
+      buffer = buffer.slice(corte + 1);
+      if (linea) {
+        const evento = JSON.parse(linea) as EventoMapaStream;
+        if (evento.tipo === 'error') throw new Error(evento.detail);
+        onEvento(evento);
+      }
+      corte = buffer.indexOf('\n');
+    }
+    if (done) break;
+  }
+};
+
+// Decodifica `ruta_polilinea` de /mapa/rutas?polilinea=true (formato de polilínea codificada,
+// precisión 1e-5) a la misma forma que ruta_linea: [lng, lat][]
+export const decodificarPolilinea = (texto: string, precision = 5): [number, number][] => {
+  const factor = 10 ** precision;
+  const puntos: [number, number][] = [];
+  let indice = 0;
+  let lat = 0;
+  let lng = 0;
+  while (indice < texto.length) {
+    const deltas = [0, 0];
+    for (let k = 0; k < 2; k++) {
+      let resultado = 0;
+      let desplazamiento = 0;
+      let byte: number;
+      do {
+        byte = texto.charCodeAt(indice++) - 63;
+        resultado |= (byte & 0x1f) << desplazamiento;
+        desplazamiento += 5;
+      } while (byte >= 0x20);
+      deltas[k] = resultado & 1 ? ~(resultado >> 1) : resultado >> 1;
+    }
+    lat += deltas[0];
+    lng += deltas[1];
+    puntos.push([lng / factor, lat / factor]);
+  }
+  return puntos;
+};
+
+// Secuencia de pasos del reproductor y línea completa de una ruta (no vienen con polilinea=true)
+export const getPasosRuta = async (routeId: number) => {
+  const res = await fetch(`${API_BASE}/rutas/${routeId}/pasos`);
+  if (!res.ok) throw new Error(`HTTP ${res.status}`);
+  return res.json();
+};
+
+// Orden de visita sugerido para los clientes planificados de una ruta, con la distancia (km) y el
+// tiempo (minutos) ahorrados frente al orden planificado
+export const getOptimizacionRuta = async (routeId: number, fijarInicio = true) => {
+  const res = await fetch(`${API_BASE}/rutas/${routeId}/optimizar?fijar_inicio=${fijarInicio}`);
+  if (!res.ok) throw new Error(`HTTP ${res.status}`);
+  return res.json();
+};
+
+// Lo mismo para todas las rutas de un día (YYYY-MM-DD), opcionalmente de un vendedor, con totales
+export const getOptimizacionRutasDia = async (fecha: string, vendedorId?: number, fijarInicio = true) => {
+  const qs = new URLSearchParams({ fecha, fijar_inicio: String(fijarInicio) });
+  if (vendedorId !== undefined) qs.set('vendedor_id', String(vendedorId));
+  const res = await fetch(`${API_BASE}/rutas/optimizar?${qs.toString()}`);
+  if (!res.ok) throw new Error(`HTTP ${res.status}`);
+  return res.json();
+};
+
+// Respuesta de /mapa/rutas?formato=columnar|msgpack: clientes por columnas y strings por diccionario
+export interface RespuestaMapaColumnar {
+  formato: 'columnar';
+  diccionarios: { estado: string[]; codigo: string[]; nombre: string[] };
+  rutas: any[];
+  zonas: any[];
+  estadisticas_mapa: Record<string, number>;
+}
+
+// Decodificador MessagePack mínimo: sólo los tipos que genera el backend (sin extensiones)
+export const decodificarMsgpack = (buffer: ArrayBuffer): any => {
+  const vista = new DataView(buffer);
+  const bytes = new Uint8Array(buffer);
+  const texto = new TextDecoder();
+  let pos = 0;
+
+  const cadena = (largo: number) => {
+    const valor = texto.decode(bytes.subarray(pos, pos + largo));
+    pos += largo;
+    return valor;
+  };
+  const arreglo = (largo: number) => {
+    const valor = new Array(largo);
+    for (let i = 0; i < largo; i++) valor[i] = leer();
+    return valor;
+  };
+  const mapa = (largo: number) => {
+    const valor: Record<string, any> = {};
+    for (let i = 0; i < largo; i++) {
+      const clave = leer();
+      valor[clave] = leer();
+    }
+    return valor;
+  };
+  const binario = (largo: number) => {
+    const valor = bytes.slice(pos, pos + largo);
+    pos += largo;
+    return valor;
+  };
+  const numero = (lector: (p: number) => number, largo: number) => {
+    const valor = lector(pos);
+    pos += largo;
+    return valor;
+  };
+
+  const leer = (): any => {
+    const tipo = bytes[pos++];
+    if (tipo <= 0x7f) return tipo;
+    if (tipo >= 0xe0) return tipo - 0x100;
+    if ((tipo & 0xf0) === 0x80) return mapa(tipo & 0x0f);
+    if ((tipo & 0xf0) === 0x90) return arreglo(tipo & 0x0f);
+    if ((tipo & 0xe0) === 0xa0) return cadena(tipo & 0x1f);
+    switch (tipo) {
+      case 0xc0: return null;
+      case 0xc2: return false;
+      case 0xc3: return true;
+      case 0xc4: return binario(numero((p) => vista.getUint8(p), 1));
+      case 0xc5: return binario(numero((p) => vista.getUint16(p), 2));
+      case 0xc6: return binario(numero((p) => vista.getUint32(p), 4));
+      case 0xca: return numero((p) => vista.getFloat32(p), 4);
+      case 0xcb: return numero((p) => vista.getFloat64(p), 8);
+      case 0xcc: return numero((p) => vista.getUint8(p), 1);
+      case 0xcd: return numero((p) => vista.getUint16(p), 2);
+      case 0xce: return numero((p) => vista.getUint32(p), 4);
+      case 0xcf: return numero((p) => Number(vista.getBigUint64(p)), 8);
+      case 0xd0: return numero((p) => vista.getInt8(p), 1);
+      case 0xd1: return numero((p) => vista.getInt16(p), 2);
+      case 0xd2: return numero((p) => vista.getInt32(p), 4);
+      case 0xd3: return numero((p) => Number(vista.getBigInt64(p)), 8);
+      case 0xd9: return cadena(numero((p) => vista.getUint8(p), 1));
+      case 0xda: return cadena(numero((p) => vista.getUint16(p), 2));
+      case 0xdb: return cadena(numero((p) => vista.getUint32(p), 4));
+      case 0xdc: return arreglo(numero((p) => vista.getUint16(p), 2));
+      case 0xdd: return arreglo(numero((p) => vista.getUint32(p), 4));
+      case 0xde: return mapa(numero((p) => vista.getUint16(p), 2));
+      case 0xdf: return mapa(numero((p) => vista.getUint32(p), 4));
+      default: throw new Error(`MessagePack: tipo 0x${tipo.toString(16)} no soportado`);
+    }
+  };
+
+  return leer();
+};
+
+// Reconstruye los clientes de cada ruta (mismos campos que la respuesta compacta) a partir de
+// las columnas y los diccionarios, para que el mapa use el resultado como getRutasMapa
+export const decodificarColumnar = (respuesta: RespuestaMapaColumnar) => {
+  if (respuesta.formato !== 'columnar') {
+    throw new Error(`Respuesta de /mapa/rutas sin formato columnar: ${String(respuesta.formato)}`);
+  }
+  const { estado, codigo, nombre } = respuesta.diccionarios;
+  const rutas = respuesta.rutas.map((ruta) => {
+    const c = ruta.clientes;
+    const clientes = c.cliente_id.map((clienteId: number, i: number) => ({
+      cliente_id: clienteId,
+      codigo: codigo[c.codigo[i]],
+      nombre: nombre[c.nombre[i]],
+      latitud: c.lat[i],
+      longitud: c.lng[i],
+      ventas: c.ventas[i],
+      visit_sequence: c.visit_sequence[i],
+      sequence: c.sequence[i],
+      estado: estado[c.estado[i]],
+      visitado: c.visit_sequence[i] !== null
+    }));
+    return { ...ruta, clientes };
+  });
+  return { rutas, zonas: respuesta.zonas, estadisticas_mapa: respuesta.estadisticas_mapa };
+};
+
+// getRutasMapa en formato columnar (binario = MessagePack), ya decodificado
+export const getRutasMapaColumnar = async (params: Record<string, any> = {}, binario = true) => {
+  const qs = new URLSearchParams({ ...params, formato: binario ? 'msgpack' : 'columnar' }).toString();
+  const res = await fetch(`${API_BASE}/mapa/rutas?${qs}`);
+  if (!res.ok) throw new Error(`HTTP ${res.status}`);
+  const datos = binario ? decodificarMsgpack(await res.arrayBuffer()) : await res.json();
+  return decodificarColumnar(datos as RespuestaMapaColumnar);
+};
@@ -1,3 +1,5 @@
+import { decodificarPolilinea } from './rutas.service';
+
 const API_BASE = import.meta.env.VITE_API_BASE || '';
 
 export const getVendedores = async () => {
@@ -13,3 +15,29 @@ export const getUltimaUbicacionVendedores = async () => {
   if (!res.ok) throw new Error(`HTTP ${res.status}`);
   return res.json();
 };
+
+// Posiciones en vivo por Server-Sent Events (reemplaza el polling de getUltimaUbicacionVendedores).
+// onSnapshot recibe todas las filas al conectar (y si el cliente se atrasó); onDelta sólo las de
+// los vendedores que se movieron. EventSource reconecta solo; devuelve la función para cerrar.
+export const suscribirUbicacionesVendedores = (
+  onSnapshot: (rows: any[]) => void,
+  onDelta: (rows: any[]) => void,
+  hours = 48
+) => {
+  const fuente = new EventSource(`${API_BASE}/vendedores/ubicaciones/stream?hours=${hours}`);
+  fuente.addEventListener('snapshot', (e) => onSnapshot(JSON.parse((e as MessageEvent).data).rows || []));
+  fuente.addEventListener('delta', (e) => onDelta(JSON.parse((e as MessageEvent).data).rows || []));
+  return () => fuente.close();
+};
+
+// Recorrido GPS submuestreado de un vendedor en un día (YYYY-MM-DD): puntos [lng, lat] con el
+// instante de cada uno en millis, listo para el reproductor del mapa
+export const getRecorridoVendedor = async (userId: number, fecha: string, params: Record<string, any> = {}) => {
+  const qs = new URLSearchParams({ ...params, fecha }).toString();
+  const res = await fetch(`${API_BASE}/vendedores/${userId}/recorrido?${qs}`);
+  if (!res.ok) throw new Error(`HTTP ${res.status}`);
+  const body = await res.json();
+  const puntos = decodificarPolilinea(body.polilinea);
+  const tiempos: number[] = (body.segundos || []).map((s: number) => body.inicio_millis + s * 1000);
+  return { ...body, puntos, tiempos };
+};
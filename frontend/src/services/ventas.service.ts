@@ -15,3 +15,22 @@ export const getVentasPorRouteDetail = async (
   if (!res.ok) throw new Error(`HTTP ${res.status}`);
   return res.json();
 };
+
+// Ventas de varios route_detail en un solo request: por ids o por route_id (toda la ruta).
+// Devuelve { route_id, ventas: { [route_detail_id]: <misma estructura que getVentasPorRouteDetail> }, cantidad }
+export const getVentasPorRouteDetails = async (
+  seleccion: { routeDetailIds?: number[]; routeId?: number },
+  onlyEventType?: number,
+  fechaInicio?: string,
+  fechaFin?: string
+) => {
+  const qs: string[] = [];
+  (seleccion.routeDetailIds || []).forEach((id) => qs.push(`route_detail_ids=${encodeURIComponent(String(id))}`));
+  if (seleccion.routeId !== undefined) qs.push(`route_id=${encodeURIComponent(String(seleccion.routeId))}`);
+  if (onlyEventType !== undefined) qs.push(`only_event_type=${encodeURIComponent(String(onlyEventType))}`);
+  if (fechaInicio) qs.push(`fecha_inicio=${encodeURIComponent(fechaInicio)}`);
+  if (fechaFin) qs.push(`fecha_fin=${encodeURIComponent(fechaFin)}`);
+  const res = await fetch(`${API_BASE}/route_details/ventas?${qs.join('&')}`);
+  if (!res.ok) throw new Error(`HTTP ${res.status}`);
+  return res.json();
+};
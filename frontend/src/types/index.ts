@@ -66,6 +66,9 @@ export interface Ruta {
   clientes: Cliente[];
   ruta_linea: [number, number][];
   secuencia_pasos: PasoRuta[];
+  // Con polilinea=true: ruta_linea y secuencia_pasos no vienen (ver decodificarPolilinea / getPasosRuta)
+  ruta_polilinea?: string;
+  puntos_linea?: number;
   total_puntos_ruta: number;
   clientes_visitados_validos: number;
   distancia_total_estimada: number;
@@ -113,10 +116,25 @@ export interface EstadisticasMapa {
   zonas_activas: number;
 }
 
+// Clientes agrupados por celda de grilla (/mapa/rutas?clusters=true&zoom=z por debajo del zoom de clientes)
+export interface ClusterClientes {
+  id: string;  // "z/cx/cy"
+  longitud: number;
+  latitud: number;
+  cantidad: number;
+  ventas: number;
+  estados: Record<string, number>;
+  bbox: [number, number, number, number];
+  cliente_id?: number;  // sólo si agrupa un único cliente
+}
+
 export interface MapaData {
   rutas: Ruta[];
   zonas: Zona[];
   estadisticas_mapa: EstadisticasMapa;
+  // Presentes en modo clusters: las rutas vienen resumidas (sin clientes ni ruta_linea)
+  clusters?: ClusterClientes[];
+  clusters_zoom?: number;
 }
 
 export interface FiltrosData {
@@ -125,6 +143,12 @@ export interface FiltrosData {
   fecha_inicio?: string;
   fecha_fin?: string;
   periodo?: string;
+  // Rectángulo visible del mapa "minLng,minLat,maxLng,maxLat" (map.getBounds().toArray().flat().join(','))
+  bbox?: string;
+  // Zoom actual: el backend ajusta el bbox a las teselas de este zoom (cache compartido entre paneos chicos)
+  zoom?: number;
+  // Con zoom: clientes agrupados en clusters por debajo del zoom de clientes individuales
+  clusters?: boolean;
 }
 
 export interface FiltrosUI {
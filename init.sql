@@ -27,10 +27,11 @@ CREATE TABLE IF NOT EXISTS subject_user (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
--- Tabla de rutas
+-- Tabla de rutas (day = fecha de la ruta: la API filtra y agrupa por esta columna)
 CREATE TABLE IF NOT EXISTS route (
     id SERIAL PRIMARY KEY,
-    creation_date DATE NOT NULL,
+    day DATE NOT NULL,
+    creation_date TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     user_id INTEGER REFERENCES users(id),
     group_id INTEGER,
     route_distance DECIMAL(10, 2),
@@ -58,6 +59,98 @@ CREATE TABLE IF NOT EXISTS route_detail (
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Zonas (coordinates: "lat,lng lat,lng ..." o "lat lng lat lng ...")
+CREATE TABLE IF NOT EXISTS zone (
+    id SERIAL PRIMARY KEY,
+    group_id INTEGER,
+    name VARCHAR(255),
+    color VARCHAR(20),
+    coordinates TEXT
+);
+
+-- Zonas de cada ruta (zone_code = zone.id como texto)
+CREATE TABLE IF NOT EXISTS route_zone_detail (
+    id SERIAL PRIMARY KEY,
+    route_id INTEGER REFERENCES route(id),
+    zone_code VARCHAR(50),
+    zone_name VARCHAR(255),
+    zone_color VARCHAR(20)
+);
+
+-- Eventos de visita (event_type_id 1 = inicio, 2 = fin)
+CREATE TABLE IF NOT EXISTS event (
+    id SERIAL PRIMARY KEY,
+    route_detail_id INTEGER REFERENCES route_detail(id),
+    event_type_id INTEGER,
+    event_date TIMESTAMP,
+    latitude DECIMAL(10, 8),
+    longitude DECIMAL(11, 8),
+    comments TEXT,
+    distance_event_customer DECIMAL(12, 2)
+);
+
+-- Facturas y sus líneas
+CREATE TABLE IF NOT EXISTS invoice (
+    id SERIAL PRIMARY KEY,
+    event_id INTEGER REFERENCES event(id),
+    "number" VARCHAR(50),
+    creation_date TIMESTAMP,
+    gross_total DECIMAL(14, 2),
+    net_total DECIMAL(14, 2),
+    vat_total DECIMAL(14, 2),
+    currency_code VARCHAR(10),
+    type VARCHAR(10)
+);
+
+CREATE TABLE IF NOT EXISTS invoice_detail (
+    id SERIAL PRIMARY KEY,
+    invoice_id INTEGER REFERENCES invoice(id),
+    product_code VARCHAR(50),
+    product_name VARCHAR(255),
+    quantity DECIMAL(12, 3),
+    unit_price DECIMAL(14, 2),
+    net_amount DECIMAL(14, 2),
+    vat_amount DECIMAL(14, 2),
+    row_number INTEGER
+);
+
+-- Posiciones GPS de los vendedores
+CREATE TABLE IF NOT EXISTS tracking (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id),
+    latitude DECIMAL(10, 8),
+    longitude DECIMAL(11, 8),
+    location_time_millis BIGINT,
+    tracking_date TIMESTAMP,
+    batery_level DECIMAL(5, 2),
+    altitude DECIMAL(10, 2),
+    horizontal_accuracy DECIMAL(10, 2),
+    vertical_accuracy DECIMAL(10, 2)
+);
+
+-- Índices de las consultas de la API (los mismos que backend/migraciones/0002, 0004 y 0005;
+-- en una base creada con este archivo `python migrar.py aplicar` sólo registra las versiones)
+CREATE INDEX IF NOT EXISTS ix_route_day_user ON route (day, user_id);
+CREATE INDEX IF NOT EXISTS ix_route_user_day ON route (user_id, day);
+CREATE INDEX IF NOT EXISTS ix_route_creation_date ON route (creation_date);
+CREATE INDEX IF NOT EXISTS ix_route_detail_route ON route_detail (route_id, visit_sequence);
+CREATE INDEX IF NOT EXISTS ix_route_detail_cliente_visitado
+    ON route_detail (subject_code, route_id) WHERE visit_sequence IS NOT NULL;
+CREATE INDEX IF NOT EXISTS ix_route_zone_detail_route ON route_zone_detail (route_id, zone_code);
+CREATE INDEX IF NOT EXISTS ix_route_zone_detail_zona ON route_zone_detail (zone_code, route_id);
+CREATE INDEX IF NOT EXISTS ix_event_route_detail_tipo ON event (route_detail_id, event_type_id, event_date);
+CREATE INDEX IF NOT EXISTS ix_event_inicio_coordenadas
+    ON event (route_detail_id, event_date, id) INCLUDE (latitude, longitude) WHERE event_type_id = 1;
+CREATE INDEX IF NOT EXISTS ix_route_detail_coordenadas ON route_detail (latitude, longitude);
+CREATE INDEX IF NOT EXISTS ix_event_inicio_lat_lng
+    ON event (latitude, longitude) INCLUDE (route_detail_id) WHERE event_type_id = 1;
+CREATE INDEX IF NOT EXISTS ix_invoice_event ON invoice (event_id, creation_date);
+CREATE INDEX IF NOT EXISTS ix_invoice_detail_invoice ON invoice_detail (invoice_id, row_number);
+CREATE INDEX IF NOT EXISTS ix_tracking_user_fecha
+    ON tracking (user_id, tracking_date DESC, location_time_millis DESC)
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL;
+CREATE INDEX IF NOT EXISTS ix_tracking_fecha_brin ON tracking USING brin (tracking_date);
+
 -- Vista para usuarios (replicando v_users de tu consulta)
 CREATE OR REPLACE VIEW v_users AS
 SELECT id, full_name, email FROM users;
@@ -70,27 +163,27 @@ INSERT INTO users (full_name, email) VALUES
 ON CONFLICT (email) DO NOTHING;
 
 INSERT INTO subject (code, name, latitude, longitude) VALUES 
-('CLI001', 'Cliente A', -34.6037, -58.3816),
-('CLI002', 'Cliente B', -34.6118, -58.3960),
-('CLI003', 'Cliente C', -34.5875, -58.3974),
-('CLI004', 'Cliente D', -34.6092, -58.3731),
-('CLI005', 'Cliente E', -34.5998, -58.3823)
+('CLI001', 'Cliente A', -25.2637, -57.5759),
+('CLI002', 'Cliente B', -25.2865, -57.6470),
+('CLI003', 'Cliente C', -25.3007, -57.6359),
+('CLI004', 'Cliente D', -25.2820, -57.5621),
+('CLI005', 'Cliente E', -25.3406, -57.5085)
 ON CONFLICT (code) DO NOTHING;
 
 INSERT INTO subject_user (subject_id, user_id) VALUES 
 (1, 1), (2, 1), (3, 2), (4, 2), (5, 3)
 ON CONFLICT DO NOTHING;
 
-INSERT INTO route (creation_date, user_id, group_id, route_distance, status) VALUES 
-('2025-09-17', 1, 1, 45.5, 'completed'),
-('2025-09-16', 2, 1, 32.8, 'completed'),
-('2025-09-15', 1, 1, 52.3, 'completed')
+INSERT INTO route (day, creation_date, user_id, group_id, route_distance, status) VALUES 
+('2025-09-17', '2025-09-17 07:30', 1, 1, 45.5, 'completed'),
+('2025-09-16', '2025-09-16 07:45', 2, 1, 32.8, 'completed'),
+('2025-09-15', '2025-09-15 08:00', 1, 1, 52.3, 'completed')
 ON CONFLICT DO NOTHING;
 
 INSERT INTO route_detail (route_id, subject_name, subject_code, latitude, longitude, invoice_amount, invoice_quantity, order_amount, order_quantity, receipt_amount, receipt_quantity, visit_positive, sequence, visit_sequence) VALUES 
-(1, 'Cliente A', 'CLI001', -34.6037, -58.3816, 1500.00, 3, 2000.00, 5, 1200.00, 2, true, 1, 1),
-(1, 'Cliente B', 'CLI002', -34.6118, -58.3960, 800.00, 2, 1200.00, 3, 600.00, 1, true, 2, 2),
-(2, 'Cliente C', 'CLI003', -34.5875, -58.3974, 2200.00, 4, 2800.00, 6, 1800.00, 3, true, 1, 1),
-(2, 'Cliente D', 'CLI004', -34.6092, -58.3731, 950.00, 2, 1100.00, 3, 700.00, 1, false, 2, 2),
-(3, 'Cliente E', 'CLI005', -34.5998, -58.3823, 1750.00, 5, 2100.00, 7, 1400.00, 4, true, 1, 1)
+(1, 'Cliente A', 'CLI001', -25.2637, -57.5759, 1500.00, 3, 2000.00, 5, 1200.00, 2, true, 1, 1),
+(1, 'Cliente B', 'CLI002', -25.2865, -57.6470, 800.00, 2, 1200.00, 3, 600.00, 1, true, 2, 2),
+(2, 'Cliente C', 'CLI003', -25.3007, -57.6359, 2200.00, 4, 2800.00, 6, 1800.00, 3, true, 1, 1),
+(2, 'Cliente D', 'CLI004', -25.2820, -57.5621, 950.00, 2, 1100.00, 3, 700.00, 1, false, 2, 2),
+(3, 'Cliente E', 'CLI005', -25.3406, -57.5085, 1750.00, 5, 2100.00, 7, 1400.00, 4, true, 1, 1)
 ON CONFLICT DO NOTHING;
\ No newline at end of file